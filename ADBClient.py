@@ -0,0 +1,257 @@
+import os, socket, struct
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+class ADBClientError(RuntimeError): pass
+
+class ADBSyncSession:
+    """
+    One `sync:` service connection. Several RECV/SEND/STAT requests can be
+    issued over the same socket, so pulling all splits of a package costs a
+    single transport handshake.
+    """
+
+    DATA_MAX = 64 * 1024
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    # -------------------- Public APIs --------------------
+
+    def stat(self, remote: str) -> Tuple[int, int, int]:
+        """Returns (mode, size, mtime). mode == 0 means the path does not exist."""
+        self._send_request(b"STAT", remote.encode("utf-8"))
+        ident, payload = self._recv_exact(4), self._recv_exact(12)
+        if ident != b"STAT":
+            raise ADBClientError(f"sync STAT: unexpected reply {ident!r}")
+        return struct.unpack("<III", payload)
+
+    def pull(self, remote: str, local: str, progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        RECV remote into local (written to a temp name, then renamed).
+        Returns the number of bytes received.
+        """
+        self._send_request(b"RECV", remote.encode("utf-8"))
+        tmp = local + ".part"
+        received = 0
+        try:
+            with open(tmp, "wb") as fh:
+                while True:
+                    ident = self._recv_exact(4)
+                    length = struct.unpack("<I", self._recv_exact(4))[0]
+                    if ident == b"DATA":
+                        fh.write(self._recv_exact(length))
+                        received += length
+                        if progress:
+                            progress(received)
+                    elif ident == b"DONE":
+                        break
+                    elif ident == b"FAIL":
+                        msg = self._recv_exact(length).decode("utf-8", "replace")
+                        raise ADBClientError(f"sync RECV {remote}: {msg}")
+                    else:
+                        raise ADBClientError(f"sync RECV {remote}: unexpected reply {ident!r}")
+            os.replace(tmp, local)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return received
+
+    def push(self, local: str, remote: str, mode: int = 0o644,
+             progress: Optional[Callable[[int], None]] = None) -> int:
+        """SEND local to remote with the given permission bits. Returns bytes sent."""
+        self._send_request(b"SEND", f"{remote},{mode}".encode("utf-8"))
+        sent = 0
+        with open(local, "rb") as fh:
+            while True:
+                chunk = fh.read(self.DATA_MAX)
+                if not chunk:
+                    break
+                self._send_request(b"DATA", chunk)
+                sent += len(chunk)
+                if progress:
+                    progress(sent)
+        mtime = int(os.path.getmtime(local))
+        self.sock.sendall(b"DONE" + struct.pack("<I", mtime))
+        ident = self._recv_exact(4)
+        length = struct.unpack("<I", self._recv_exact(4))[0]
+        if ident == b"FAIL":
+            msg = self._recv_exact(length).decode("utf-8", "replace")
+            raise ADBClientError(f"sync SEND {remote}: {msg}")
+        if ident != b"OKAY":
+            raise ADBClientError(f"sync SEND {remote}: unexpected reply {ident!r}")
+        return sent
+
+    def close(self) -> None:
+        try:
+            self.sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        except OSError:
+            pass
+        self.sock.close()
+
+    # -------------------- Internals --------------------
+
+    def _send_request(self, ident: bytes, payload: bytes) -> None:
+        self.sock.sendall(ident + struct.pack("<I", len(payload)) + payload)
+
+    def _recv_exact(self, n: int) -> bytes:
+        return ADBClient._recv_exact(self.sock, n)
+
+
+class ADBClient:
+    """
+    Pure-Python client for the adb server's smart-socket protocol.
+
+    Every request is a 4 hex digit length followed by the service name; the
+    server answers OKAY or FAIL<len><message>. Device services first bind the
+    socket with host:transport:<serial>, after which the socket belongs to
+    that service (shell:, exec:, sync:) until it is closed. Without a serial
+    the one attached device is used; like the adb CLI, several attached
+    devices are an error rather than an arbitrary pick.
+
+    The server address follows adb's own conventions (ADB_SERVER_SOCKET=tcp:host:port,
+    ANDROID_ADB_SERVER_PORT) and can be overridden so a local stand-in server
+    can be used in place of the real one.
+    """
+
+    DEFAULT_HOST = "127.0.0.1"
+    DEFAULT_PORT = 5037
+    RC_MARKER = ":patchapk-rc:"
+
+    def __init__(self, serial: Optional[str] = None, host: Optional[str] = None,
+                 port: Optional[int] = None, timeout: float = 30.0):
+        env_host, env_port = self._server_from_env()
+        self.serial = serial or os.environ.get("ANDROID_SERIAL") or None
+        self.host = host or env_host
+        self.port = port or env_port
+        self.timeout = timeout
+        self._available: Optional[bool] = None
+
+    # -------------------- Public APIs --------------------
+
+    def is_available(self, refresh: bool = False) -> bool:
+        """True if an adb server answers on host:port. The result is cached."""
+        if self._available is None or refresh:
+            try:
+                self.host_query("host:version")
+                self._available = True
+            except (OSError, ADBClientError):
+                self._available = False
+        return self._available
+
+    def host_query(self, service: str) -> str:
+        """Run a host: service that replies with a single length-prefixed payload."""
+        with self._connect() as sock:
+            self._send_service(sock, service)
+            return self._read_length_prefixed(sock).decode("utf-8", "replace")
+
+    def devices(self) -> List[Tuple[str, str]]:
+        out = self.host_query("host:devices")
+        return [tuple(line.split("\t", 1)) for line in out.splitlines() if "\t" in line]
+
+    def shell(self, command: str) -> Tuple[int, str]:
+        """
+        Run `command` through the shell: service and return (exit status, output).
+        The legacy shell: service has no exit status, so it is echoed behind a marker.
+        """
+        raw = self._read_service(f"shell:{command} ; echo {self.RC_MARKER}$?")
+        out = raw.decode("utf-8", "replace").replace("\r\n", "\n")
+        head, sep, tail = out.rpartition(self.RC_MARKER)
+        if not sep:
+            return 255, out
+        try:
+            rc = int(tail.strip() or 255)
+        except ValueError:
+            rc = 255
+        return rc, head
+
+    def exec_out(self, command: str) -> bytes:
+        """Run `command` through the exec: service (raw, binary-safe stdout)."""
+        return self._read_service(f"exec:{command}")
+
+    @contextmanager
+    def sync(self) -> Iterator[ADBSyncSession]:
+        sock = self.open_service("sync:")
+        session = ADBSyncSession(sock)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def open_service(self, service: str) -> socket.socket:
+        """Connect, bind to the device transport and start `service`. Caller owns the socket."""
+        sock = self._connect()
+        try:
+            self._send_service(sock, self._transport_service())
+            self._send_service(sock, service)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    # -------------------- Internals --------------------
+
+    @classmethod
+    def _server_from_env(cls) -> Tuple[str, int]:
+        host, port = cls.DEFAULT_HOST, cls.DEFAULT_PORT
+        spec = os.environ.get("ADB_SERVER_SOCKET", "")
+        if spec.startswith("tcp:"):
+            parts = spec[4:].rsplit(":", 1)
+            if len(parts) == 2:
+                host, port = parts[0] or host, int(parts[1])
+            else:
+                port = int(parts[0])
+        elif os.environ.get("ANDROID_ADB_SERVER_PORT", "").isdigit():
+            port = int(os.environ["ANDROID_ADB_SERVER_PORT"])
+        return host, port
+
+    def _transport_service(self) -> str:
+        if not self.serial:
+            # Resolved once: every later service of this client goes to the same device
+            attached = [serial for serial, state in self.devices() if state == "device"]
+            if len(attached) > 1:
+                raise ADBClientError("more than one device/emulator")
+            if not attached:
+                raise ADBClientError("no devices/emulators found")
+            self.serial = attached[0]
+        return f"host:transport:{self.serial}"
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _send_service(self, sock: socket.socket, service: str) -> None:
+        data = service.encode("utf-8")
+        sock.sendall(b"%04x" % len(data) + data)
+        status = self._recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            msg = self._read_length_prefixed(sock).decode("utf-8", "replace")
+            raise ADBClientError(msg or f"{service} failed")
+        raise ADBClientError(f"{service}: unexpected reply {status!r}")
+
+    def _read_length_prefixed(self, sock: socket.socket) -> bytes:
+        length = int(self._recv_exact(sock, 4), 16)
+        return self._recv_exact(sock, length)
+
+    def _read_service(self, service: str) -> bytes:
+        chunks = []
+        with self.open_service(service) as sock:
+            while True:
+                chunk = sock.recv(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            buf += chunk
+        return bytes(buf)
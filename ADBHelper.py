@@ -1,18 +1,59 @@
 import subprocess, re, os, sys
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from ADBClient import ADBClient, ADBClientError
+from DeviceSnapshot import DeviceSnapshot
+from PullCache import PullCache
+from ProcessRunner import ProcessRunner
+from Toolchain import Toolchain
 
 class ADBError(RuntimeError): pass
 
 class ADBHelper:
-   
-    def __init__(self, serial: Optional[str] = None, verbose: bool = False):
+
+    def __init__(self, serial: Optional[str] = None, verbose: bool = False, native: bool = True,
+                 pull_cache: Optional[PullCache] = None):
         self.serial = serial
         self.verbose = verbose
+        self.pull_cache = pull_cache
+        # Captured on first use and kept for this helper (one job); installs and
+        # uninstalls mark it stale. A daemon builds a helper per job, so apps
+        # installed or a device swapped between jobs are always seen.
+        self._snapshot: Optional[DeviceSnapshot] = None
+        self._stale = False
+        # Talk to the adb server directly when possible; the adb CLI is the fallback.
+        self._client = ADBClient(serial=serial) if native else None
         self._check_adb()
 
     # -------------------- Public APIs --------------------
 
+    def snapshot(self, refresh: bool = False) -> Optional[DeviceSnapshot]:
+        """
+        Packages, paths, users, ABIs and SDK level from a single shell round trip,
+        cached by this helper. None if the device could not be snapshotted.
+        """
+        if refresh or self._snapshot is None or self._stale:
+            self._stale = False
+            try:
+                snap = DeviceSnapshot.capture(lambda script: self._run_adb(["shell", script]))
+            except ADBError:
+                snap = None
+            if snap is None or not snap.packages_by_user:
+                self._snapshot = None
+                if self.verbose:
+                    print("[ADB] device snapshot unavailable, using per-call queries")
+                return None
+            self._snapshot = snap
+            if self.verbose:
+                n = len(snap.packages())
+                print(f"[ADB] snapshot: sdk={snap.sdk} abis={','.join(snap.abis)} "
+                      f"users={','.join(snap.users)} packages={n}")
+        return self._snapshot
+
     def get_packages(self, pattern: Optional[str] = None) -> List[str]:
+        snap = self.snapshot()
+        if snap is not None:
+            return snap.packages(pattern)
         out = self._run_adb(["shell", "pm", "list", "packages"])
         pkgs = []
         for line in out.splitlines():
@@ -23,6 +64,20 @@ class ADBHelper:
         return sorted(pkgs)
 
     def get_apk_paths(self, package: str, user: Optional[str] = "0") -> Tuple[str, List[str]]:
+        snap = self.snapshot()
+        if snap is not None:
+            holders = snap.users_with(package)
+            try_order = ([user] if user in holders else []) + [u for u in holders if u != user]
+            for u in try_order:
+                paths = snap.apk_paths(package, u)
+                if not paths:
+                    # Split layout unknown from the snapshot; ask pm directly
+                    u, paths = self._pm_path_for_user(package, u)
+                if paths:
+                    return u, paths
+            if not holders:
+                raise ADBError(f"Package '{package}' not found for any user: {snap.users}")
+
         if user is not None:
             resolved_user, paths = self._pm_path_for_user(package, user)
             if paths:
@@ -40,18 +95,41 @@ class ADBHelper:
         """
         Pull each remote path to dest_dir with filename '<prefix>-<basename>'.
         Returns list of local file paths.
+
+        With a pull cache, unchanged files (same path, size and device-side
+        sha256 or versionCode) are materialized from the cache instead.
         """
         os.makedirs(dest_dir, exist_ok=True)
-        local_paths = []
-        for rp in remote_paths:
-            name = f"{prefix}-{os.path.basename(rp)}"
-            dp = os.path.join(dest_dir, name)
+        targets = [(rp, os.path.join(dest_dir, f"{prefix}-{os.path.basename(rp)}")) for rp in remote_paths]
+
+        keys = {}
+        pending = targets
+        if self.pull_cache is not None:
+            prints = self._remote_fingerprints(remote_paths)
+            pending = []
+            for rp, dp in targets:
+                size, sha = prints.get(rp, (None, None))
+                key = None if size is None else PullCache.key(rp, size, sha, self._version_code_for(rp))
+                if key is not None and self.pull_cache.fetch(key, dp, size):
+                    continue
+                if key is not None:
+                    keys[rp] = (key, sha)
+                pending.append((rp, dp))
+
+        to_cache = pending
+        if pending and self._native():
+            pending = self._pull_native(pending)
+
+        for rp, dp in pending:
             cmd = self._adb_cmd(["pull", rp, dp])
             self._run(cmd, "adb pull failed")
-            local_paths.append(dp)
             if self.verbose:
                 print(f"[+] Pulled: {rp} -> {dp}")
-        return local_paths
+
+        for rp, dp in to_cache:
+            if rp in keys:
+                self.pull_cache.store(keys[rp][0], dp, keys[rp][1])
+        return [dp for _, dp in targets]
 
     def install_apk(self, apk_path: str, user: str, replace: bool = True) -> None:
         args = ["install"]
@@ -59,9 +137,20 @@ class ADBHelper:
             args.append("-r")
         args += ["--user", user, apk_path]
         cmd = self._adb_cmd(args)
+        self._stale = True
         self._run(cmd, "adb install failed")
 
     def uninstall_pkg(self, package: str, user: str) -> None:
+        self._stale = True
+        if self._native():
+            if self.verbose:
+                print(f"[ADB] shell:pm uninstall {package}")
+            try:
+                # Best-effort; exit status ignored like the CLI path below
+                self._client.shell(f"pm uninstall {package}")
+                return
+            except (OSError, ADBClientError):
+                pass
         cmd = self._adb_cmd(["uninstall", package])
         # Best-effort; don't raise on non-zero (maybe not installed for that user)
         self._run(cmd, raise_on_error=False)
@@ -79,14 +168,72 @@ class ADBHelper:
         return user, paths
 
     def _list_users(self) -> List[str]:
+        snap = self._snapshot
+        if snap is not None and snap.users:
+            return list(snap.users)
         out = self._run_adb(["shell", "pm", "list", "users"])
         return re.findall(r"UserInfo{(\d+):", out)
 
     def _check_adb(self):
+        if self._native():
+            return
+        if Toolchain.shared().which("adb") is None:
+            raise ADBError("adb not found on PATH and no adb server is reachable")
         try:
             self._run_adb(["devices"])
         except ADBError as e:
             raise ADBError("adb not available or device list inaccessible") from e
+        # `adb devices` starts the server if it wasn't running; try the native client again.
+        if self._client is not None:
+            self._client.is_available(refresh=True)
+
+    def _remote_fingerprints(self, remote_paths: List[str]) -> Dict[str, Tuple[int, Optional[str]]]:
+        """
+        {remote: (size, sha256 or None)} from one shell round trip. sha256 is
+        None on devices without sha256sum; callers then key on versionCode.
+        """
+        script = "; ".join(
+            f'echo "$(stat -c %s \'{rp}\') $(sha256sum \'{rp}\' 2>/dev/null | cut -d\' \' -f1) {rp}"'
+            for rp in remote_paths
+        )
+        try:
+            out = self._run_adb(["shell", script])
+        except ADBError:
+            return {}
+        prints = {}
+        for line in out.splitlines():
+            parts = line.split(" ", 2)
+            if len(parts) == 3 and parts[0].isdigit():
+                prints[parts[2]] = (int(parts[0]), parts[1] or None)
+        return prints
+
+    def _version_code_for(self, remote_path: str) -> Optional[int]:
+        snap = self._snapshot
+        return snap.version_code_for(remote_path) if snap is not None else None
+
+    def _native(self) -> bool:
+        return self._client is not None and self._client.is_available()
+
+    def _pull_native(self, targets: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        Pull over one sync: session. Returns the targets left for the CLI
+        (everything from the first transport error on).
+        """
+        done = 0
+        try:
+            with self._client.sync() as sync:
+                for rp, dp in targets:
+                    if self.verbose:
+                        print(f"[ADB] sync:RECV {rp}")
+                    size = sync.pull(rp, dp)
+                    done += 1
+                    if self.verbose:
+                        print(f"[+] Pulled: {rp} -> {dp} ({size} bytes)")
+        except ADBClientError as e:
+            raise ADBError(str(e)) from e
+        except OSError:
+            self._client.is_available(refresh=True)
+        return targets[done:]
 
     def _adb_cmd(self, tail: List[str]) -> List[str]:
         cmd = ["adb"]
@@ -98,6 +245,19 @@ class ADBHelper:
         return cmd
 
     def _run_adb(self, args: List[str]) -> str:
+        if args and args[0] == "shell" and self._native():
+            if self.verbose:
+                print("[ADB] shell:" + " ".join(args[1:]))
+            try:
+                rc, out = self._client.shell(" ".join(args[1:]))
+            except ADBClientError as e:
+                raise ADBError(str(e)) from e
+            except OSError:
+                self._client.is_available(refresh=True)
+            else:
+                if rc != 0:
+                    raise ADBError(out.strip() or "ADB command failed")
+                return out
         cmd = self._adb_cmd(args)
         proc = subprocess.run(cmd, capture_output=True, text=True)
         if proc.returncode != 0:
@@ -105,11 +265,11 @@ class ADBHelper:
         return proc.stdout
 
     def _run(self, cmd: List[str], err: str = "command failed", raise_on_error: bool = True) -> None:
-        proc = subprocess.run(cmd, capture_output=True, text=True)
+        proc = ProcessRunner(verbose=self.verbose).run(cmd, label="adb")
         if self.verbose:
-            if proc.stdout:
-                print(proc.stdout)
-            if proc.returncode != 0 and proc.stderr:
-                print(proc.stderr, file=sys.stderr)
-        if raise_on_error and proc.returncode != 0:
-            raise ADBError(proc.stderr.strip() or proc.stdout.strip() or err)
+            if proc["stdout"]:
+                print(proc["stdout"])
+            if proc["returncode"] != 0 and proc["stderr"]:
+                print(proc["stderr"], file=sys.stderr)
+        if raise_on_error and proc["returncode"] != 0:
+            raise ADBError(proc["stderr"].strip() or proc["stdout"].strip() or err)
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
-import os, re, sys, shutil, tempfile, subprocess, xml.etree.ElementTree as ET
-from urllib.request import urlopen, Request
+import os, re, sys, json, shutil, hashlib, tarfile, tempfile, subprocess, zipfile
 from urllib.parse import urlsplit
 from pathlib import Path
-from typing import List, Optional
-from packaging.version import parse as parse_version
-
-# If you put FridaGadget.py next to this file, this import will work.
-from FridaGadget import FridaGadget
+from typing import TYPE_CHECKING, List, Optional
+
+# Stage-specific modules (FridaGadget/requests, Downloader/urllib.request,
+# Manifest/xml.etree, concurrent.futures) are imported where they are used,
+# so `patch-apk --help` and early failures don't pay for them.
+from PullCache import PullCache
+from ProcessRunner import ProcessRunner
+from CoreBudget import CoreBudget
+from Workspace import Workspace
+from Materializer import Materializer
+from OutputRouter import OutputRouter
+from ArscMerger import ArscMerger, ArscError
+# ArscMerger has put the package on sys.path when running from a checkout
+from patch_apk.utils.native_libs import appendRawEntry
+from Toolchain import Toolchain
+from CacheBackend import CacheBackend
+from DexIndex import DexIndex, DexError
+
+if TYPE_CHECKING:
+    from Manifest import Manifest
 
 class APKError(RuntimeError): pass
 
@@ -19,35 +33,75 @@ class APK:
    
     NULL_DECODED_DRAWABLE_COLOR = "#000000ff"
 
-    def __init__(self, apk_path: str, workdir: Optional[str] = None, verbose: bool = False):
+    # Entries asset passthrough leaves out of the decoded tree and copies back raw after the build
+    PASSTHROUGH_PREFIXES = ("assets/",)
+
+    # Cleared the first time apktool rejects -j (versions before 2.7.0); None until read from the toolchain cache
+    _apktool_jobs_flag: Optional[bool] = None
+
+    def __init__(self, apk_path: str, workdir: Optional[str] = None, verbose: bool = False,
+                 asset_passthrough: bool = False, single_dex: bool = False, smali_app: bool = True):
+        """
+        asset_passthrough decodes without assets/ (apktool --no-assets); after
+        assemble(), splice_passthrough() copies the original entries into the
+        rebuilt APK without inflating or recompressing them.
+
+        single_dex disassembles only the dex that defines the Application
+        class (the primary dex when there is none); every other classesN.dex
+        stays raw in the tree and apktool b copies it byte for byte. With
+        smali_app=False (no gadget to inject, so no smali is patched) not even
+        that dex is disassembled: every dex passes through unchanged.
+        """
         self.apk_path = os.path.abspath(apk_path)
         self.verbose = verbose
+        self.asset_passthrough = asset_passthrough
+        self.single_dex = single_dex
+        self.smali_app = smali_app
+        # APKs whose assets/ entries go back into the rebuilt APK, first one wins
+        self._passthrough_sources: List[str] = []
         self._check_exists(self.apk_path)
-        self._tmpbase = tempfile.TemporaryDirectory() if workdir is None else None
-        self.workdir = workdir or self._tmpbase.name
+        # Sized from the zip central directory; raises WorkspaceError before any decoding if there is no room
+        self._tmpbase = Workspace(inputs=[self.apk_path], verbose=verbose) if workdir is None else None
+        self.workdir = workdir or self._tmpbase.path
         Path(self.workdir).mkdir(parents=True, exist_ok=True)
         self.has_been_merged = False
+        self._manifest: Optional["Manifest"] = None
+
+    def cleanup(self) -> None:
+        """Release the temporary workdir (removed in the background)."""
+        if self._tmpbase is not None:
+            self._tmpbase.cleanup()
+
+    @property
+    def manifest(self) -> "Manifest":
+        """The decoded AndroidManifest.xml, parsed on first use and shared by every patch stage."""
+        if self._manifest is None:
+            from Manifest import Manifest
+            self._manifest = Manifest(os.path.join(self.decoded, "AndroidManifest.xml"), verbose=self.verbose)
+        return self._manifest
 
     # ---------- Creation ----------
     @classmethod
-    def from_url(cls, url: str, dest: Optional[str] = None, verbose: bool = False) -> "APK":
+    def from_url(cls, url: str, dest: Optional[str] = None, verbose: bool = False,
+                 cache: bool = True, segments: int = 1) -> "APK":
         """
         Download an .apk from a URL to dest (or temp), then return an APK instance.
-        """
-        req = Request(url, headers={"User-Agent": "curl/7.79"})
-        with urlopen(req) as r:
-            data = r.read()
 
+        The download is streamed to disk, resumed via HTTP Range after a dropped
+        connection, optionally split into parallel range segments, and (with
+        cache=True) served from a local ETag/Last-Modified validated cache.
+        """
         filename = dest
         if not filename:
             name = os.path.basename(urlsplit(url).path) or "download.apk"
             filename = os.path.join(tempfile.mkdtemp(prefix="apkdl_"), name)
 
-        with open(filename, "wb") as f:
-            f.write(data)
+        from Downloader import Downloader
+        cache_dir = str(PullCache.default_root() / "downloads") if cache else None
+        size = Downloader(cache_dir=cache_dir, segments=segments, verbose=verbose).fetch(url, filename)
 
         if verbose:
-            print(f"[+] Downloaded APK: {filename} ({len(data)} bytes)")
+            print(f"[+] Downloaded APK: {filename} ({size} bytes)")
         return cls(filename, verbose=verbose)
 
     # ---------- Public APIs ----------
@@ -60,8 +114,24 @@ class APK:
         """
         self.decoded = os.path.join(self.workdir, "apk_decoded")
         args = ["d", self.apk_path, "-o", self.decoded, "-f", "--only-main-classes"]
-
-        self._apktool(args, ok_required=True)
+        if self.asset_passthrough:
+            args.append("--no-assets")
+            if not self._passthrough_sources:
+                self._passthrough_sources = [self.apk_path]
+        if self.single_dex:
+            args.append("--no-src")
+
+        # Another host may already have decoded this exact APK (opt-in, see CacheBackend)
+        remote = CacheBackend.shared(self.verbose) if CacheBackend.share_trees() else None
+        tree_key = self._tree_key(args) if remote is not None else None
+        if tree_key is None or not self._restore_tree(remote, tree_key):
+            self._apktool(args, ok_required=True)
+            if self.single_dex and self.smali_app:
+                self._manifest = None
+                self._smali_app_dex()
+            if tree_key is not None:
+                self._publish_tree(remote, tree_key)
+        self._manifest = None
         if self.verbose:
             print(f"[+] Disassembled to: {self.decoded}")
         return self.decoded
@@ -71,6 +141,9 @@ class APK:
         apktool b -> returns path to rebuilt APK.
         """
         out_apk = os.path.join(self.workdir, "rebuilt.apk") if target is None else target
+        # All manifest edits from merge/patch stages land in a single write
+        if self._manifest is not None:
+            self._manifest.flush()
         self._apktool(["b", self.decoded, "-o", out_apk, "-f"], ok_required=True)
         if self.verbose:
             print(f"[+] Rebuilt APK: {out_apk}")
@@ -78,62 +151,52 @@ class APK:
         self.apk_path = out_apk
         return out_apk
     
-    def apply_patches(self, version: Optional[str] = None, frida_gadget: bool = True, enable_user_certs: bool = True) -> str:
+    def apply_patches(self, version: Optional[str] = None, frida_gadget: bool = True, enable_user_certs: bool = True,
+                      extract_native_libs: bool = True) -> str:
+        """
+        extract_native_libs=False keeps the libraries in the APK (extractNativeLibs="false");
+        the rebuilt APK then needs store_native_libs_uncompressed() and zipalign -p.
+        """
+        native_libs = "true" if extract_native_libs else "false"
 
         apkdir = self.decoded
+        manifest = self.manifest
 
-        manifest = os.path.join(apkdir, "AndroidManifest.xml")
-        tree = ET.parse(manifest)
-        # setup namespaces
-        android_ns = self._manifest_ns(manifest)["android"]
-
-        root = tree.getroot()
-        ns = "{" + android_ns + "}"
-
-        # Update <application>
-        app_el = root.find(".//application")
-
-        if app_el is None:
+        if manifest.root.find(".//application") is None:
             raise APKError("Application does not have <application> tag")
 
         if frida_gadget:
             print("[+] Adding Frida gadget")
             # Ensure INTERNET
-            has_inet = any(el.tag == "uses-permission" and el.attrib.get(ns + "name") == "android.permission.INTERNET"
-                        for el in root)
-            if not has_inet:
-                if self.verbose:
-                    print("[+] Adding android.permission.INTERNET")
-                up = ET.Element("uses-permission")
-                up.attrib[ns + "name"] = "android.permission.INTERNET"
-                root.insert(0, up)
+            if manifest.ensure_permission("android.permission.INTERNET") and self.verbose:
+                print("[+] Adding android.permission.INTERNET")
             
-            # Add extractNativeLibs = true
-            app_el.attrib[ns + "extractNativeLibs"] = "true"
+            # The gadget is loaded from the extracted lib dir, or straight from the APK
+            manifest.set_app_attr("extractNativeLibs", native_libs)
 
             # Add gadget loader
-            existing = app_el.attrib.get(ns + "name")
+            existing = manifest.get_app_attr("name")
             if existing and existing != self.GADGET_LOADER_CLASS:
                 # Update existing class
                 self._add_loader_to_existing_application(existing, apkdir)
             else :
                 # Create new class
-                app_el.attrib[ns + "name"] = self.GADGET_LOADER_CLASS
+                manifest.set_app_attr("name", self.GADGET_LOADER_CLASS)
 
                 loader_dir = os.path.dirname(os.path.realpath(__file__))
                 loader_class = os.path.join(loader_dir, self.GADGET_LOADER_SOURCE)
                 loader_target = os.path.join(apkdir, self.GADGET_LOADER_TARGET)
                 os.makedirs(os.path.dirname(loader_target), exist_ok=True)
+                Materializer.unshare(loader_target)
                 shutil.copy(loader_class,loader_target )
                 
             # Remove testOnly if enabled
-            test_only_val = app_el.attrib.get(ns + "testOnly")
+            test_only_val = manifest.get_app_attr("testOnly")
             if test_only_val is not None and str(test_only_val).lower() == "true":
-                del app_el.attrib[ns + "testOnly"]
-
-            # Write back
-            tree.write(manifest, encoding="utf-8", xml_declaration=True)
+                manifest.remove_app_attr("testOnly")
 
+            # If you put FridaGadget.py next to this file, this import will work.
+            from FridaGadget import FridaGadget
             fg = FridaGadget()
             fg.copy_android_gadgets(apkdir, version=version)
 
@@ -141,9 +204,10 @@ class APK:
         if enable_user_certs:
             
             print("[+] Enabling user-installed CA certificates via networkSecurityConfig")
-            app_el.attrib[ns + "networkSecurityConfig"] = "@xml/network_security_config"
+            manifest.set_app_attr("networkSecurityConfig", "@xml/network_security_config")
             xml_dir = os.path.join(apkdir, "res", "xml")
             Path(xml_dir).mkdir(parents=True, exist_ok=True)
+            Materializer.unshare(os.path.join(xml_dir, "network_security_config.xml"))
             with open(os.path.join(xml_dir, "network_security_config.xml"), "wb") as fh:
                 fh.write(b'<?xml version="1.0" encoding="utf-8"?>'
                          b'<network-security-config>'
@@ -156,45 +220,71 @@ class APK:
                          b'</network-security-config>')
 
         if self.has_been_merged:
+            manifest.remove_split_requirements()
+        if self.has_been_merged or not extract_native_libs:
+            manifest.set_app_attr("extractNativeLibs", native_libs)
 
-            if ns + "isSplitRequired" in app_el.attrib:
-                del app_el.attrib[ns + "isSplitRequired"]
-            app_el.attrib[ns + "extractNativeLibs"] = "true"
-
-            # remove vending split meta-data under application
-            to_remove = []
-          
-            for md in app_el.findall("meta-data"):
-                name = md.attrib.get(ns + "name", "")
-                if name in ("com.android.vending.splits.required", "com.android.vending.splits"):
-                    to_remove.append(md)
-            for md in to_remove:
-                app_el.remove(md)
-
-            # clean manifest attributes
-            for k in (ns + "isSplitRequired", ns + "requiredSplitTypes", ns + "splitTypes"):
-                if k in root.attrib:
-                    del root.attrib[k]
-
-
-
-        # Save manifest
-        tree.write(manifest, encoding="utf-8", xml_declaration=True)
-        
+        # Written once, by assemble()
         return apkdir
 
-    def merge_with(self, others: List["APK"], disable_styles_hack: bool = False) -> str:
+    def merge_with(self, others: List["APK"], disable_styles_hack: bool = False, binary_resources: bool = True) -> str:
         """
         Combine split APKs into a single, rebuild, and return path to the combined APK.
+
+        With binary_resources the splits' resources.arsc tables are merged into
+        the base table directly and only the merged APK is decoded; the
+        per-split decode below is the fallback.
         """
         self.has_been_merged = True
-        # Decode all
-        decoded_dirs = []
-        base = self.disassemble()
+        if self.asset_passthrough:
+            self._passthrough_sources = [self.apk_path, *[apk.apk_path for apk in others]]
+            for apk in others:
+                apk.asset_passthrough = True
+        skip = self.PASSTHROUGH_PREFIXES if self.asset_passthrough else ()
+        if binary_resources:
+            merged = os.path.join(self.workdir, "merged_" + os.path.basename(self.apk_path))
+            try:
+                stats = ArscMerger.merge_apks(self.apk_path, [apk.apk_path for apk in others], merged, self.verbose,
+                                              skip_prefixes=skip)
+            except (ArscError, OSError, zipfile.BadZipFile) as e:
+                print(f"[!] Binary resource merge failed ({e}); decoding every split instead")
+            else:
+                print(f"[+] Merged {len(others)} split resource tables "
+                      f"(+{stats['configs']} configs, +{stats['entries']} entries)")
+                self.apk_path = merged
+                base = self.disassemble()
+                if not disable_styles_hack:
+                    self._hack_remove_duplicate_style_entries()
+                self._disable_apk_splitting()
+                self._raw_re_replace(os.path.join(base, "res", "values", "strings.xml"),
+                                     r'(&amp)([^;])', r'\1;\2')
+                return base
+
+        # Raw classesN.dex of the base and of feature splits would collide in the merged tree
+        self.single_dex = False
         for apk in others:
-            decoded_dirs.append(apk.disassemble())
+            apk.single_dex = False
+
+        # ABI splits and asset packs only carry lib/ and assets/: no need to decode them
+        content_only = [apk for apk in others if self._is_content_only_split(apk.apk_path)]
+        others = [apk for apk in others if apk not in content_only]
+
+        from concurrent.futures import ThreadPoolExecutor
+        # Decode the base and the splits left with code or resources concurrently; CoreBudget
+        # splits the cores between them by size
+        budget = CoreBudget.shared()
+        weights = [self._apktool_weight(["d", apk.apk_path]) for apk in [self, *others]]
+        with budget.batch(weights), ThreadPoolExecutor(max_workers=min(len(weights), budget.total)) as pool:
+            base_job = pool.submit(OutputRouter.carry(self.disassemble))
+            split_jobs = [pool.submit(OutputRouter.carry(apk.disassemble)) for apk in others]
+            base = base_job.result()
+            decoded_dirs = [job.result() for job in split_jobs]
 
         print("[+] Merging split APKs into base")
+        for apk in content_only:
+            n = self._extract_split_content(apk.apk_path, base, skip)
+            if self.verbose:
+                print(f"[+] Copied {n} lib/assets entries from {os.path.basename(apk.apk_path)} without decoding")
         self._copy_splits_into_base(decoded_dirs)
         self._fix_public_resource_ids(decoded_dirs)
         if not disable_styles_hack:
@@ -207,6 +297,85 @@ class APK:
 
         return base
 
+    def snapshot(self, name: str) -> "APK":
+        """
+        An APK sharing this one's decoded (and merged) tree copy-on-write, for
+        patching and building one variant: files are reflinked or hardlinked,
+        and every in-place write in the patch stages unshares its file first.
+        The snapshot works and builds under <workdir>/variant_<name>.
+        """
+        if self._manifest is not None:
+            self._manifest.flush()  # pending merge edits belong in every snapshot
+        workdir = os.path.join(self.workdir, f"variant_{name}")
+        clone = APK(self.apk_path, workdir=workdir, verbose=self.verbose,
+                    asset_passthrough=self.asset_passthrough, single_dex=self.single_dex,
+                    smali_app=self.smali_app)
+        clone.decoded = os.path.join(workdir, "apk_decoded")
+        how = Materializer.clone_tree(self.decoded, clone.decoded)
+        clone.has_been_merged = self.has_been_merged
+        clone._passthrough_sources = list(self._passthrough_sources)
+        clone._parent = self  # the snapshot lives in this APK's workspace: keep it from being removed
+        if self.verbose:
+            print(f"[+] Snapshot for variant {name} ({how})")
+        return clone
+
+    def store_native_libs_uncompressed(self) -> int:
+        """
+        Rewrite the rebuilt APK with every lib/**/*.so stored, so the platform
+        can map them in place (extractNativeLibs="false"). Only the libraries
+        are inflated; every other entry is copied as raw compressed bytes.
+        zipalign -p then puts the libraries on page boundaries. Returns the
+        number of libraries that were compressed.
+        """
+        with zipfile.ZipFile(self.apk_path) as zin:
+            entries = zin.infolist()
+            libs = {e.filename for e in entries if e.filename.startswith("lib/") and e.filename.endswith(".so")
+                    and e.compress_type != zipfile.ZIP_STORED}
+            if not libs:
+                return 0
+            tmp = os.path.join(self.workdir, ".__tmp_stored_libs.apk")
+            with zipfile.ZipFile(tmp, "w") as zout, open(self.apk_path, "rb") as raw:
+                for entry in entries:
+                    if entry.filename not in libs:
+                        self._append_raw_entry(zout, raw, entry)
+                        continue
+                    info = zipfile.ZipInfo(entry.filename, entry.date_time)
+                    info.external_attr = entry.external_attr
+                    info.compress_type = zipfile.ZIP_STORED
+                    with zin.open(entry) as src, zout.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+        Materializer.materialize(tmp, self.apk_path, keep_src=False)
+        if self.verbose:
+            print(f"[+] Stored {len(libs)} native libraries uncompressed")
+        return len(libs)
+
+    def splice_passthrough(self) -> int:
+        """
+        Append the assets/ entries of the decoded APKs to the rebuilt APK as
+        raw compressed bytes: no inflate, no deflate, and no copy through the
+        decoded tree. Entries the build already produced win. Call it after
+        store_native_libs_uncompressed(), which would recompress them, and
+        before zipalign. Returns the number of entries spliced.
+        """
+        if not self.asset_passthrough:
+            return 0
+        count = size = 0
+        with zipfile.ZipFile(self.apk_path, "a") as zout:
+            present = set(zout.namelist())
+            for src in self._passthrough_sources:
+                with zipfile.ZipFile(src) as zin, open(src, "rb") as raw:
+                    for entry in zin.infolist():
+                        if entry.is_dir() or entry.filename in present \
+                                or not entry.filename.startswith(self.PASSTHROUGH_PREFIXES):
+                            continue
+                        self._append_raw_entry(zout, raw, entry)
+                        present.add(entry.filename)
+                        count += 1
+                        size += entry.compress_size
+        if self.verbose:
+            print(f"[+] Spliced {count} asset entries ({size // (1024 * 1024)} MiB) into the rebuilt APK unchanged")
+        return count
+
     def zipalign(self, in_place: bool = True) -> str:
         """
         zipalign -f 4. Returns aligned path.
@@ -215,7 +384,7 @@ class APK:
         tmp = aligned if not in_place else os.path.join(self.workdir, ".__tmp_aligned.apk")
         self._run(["zipalign","-p", "-f", "4", self.apk_path, tmp], ok_required=True)
         if in_place:
-            shutil.move(tmp, self.apk_path)
+            Materializer.materialize(tmp, self.apk_path, keep_src=False)
             out = self.apk_path
         else:
             out = tmp
@@ -225,14 +394,169 @@ class APK:
 
     def _apktool(self, args: List[str], ok_required: bool = False):
         exe = "apktool.bat" if os.name == "nt" else "apktool"
-        # feed CRLF to bypass possible pause in Windows wrapper
-        cp = subprocess.run([exe, *args], input="\r\n", text=True, capture_output=True)
+        if args and args[0] in ("d", "b") and self._apktool_jobs_supported(exe):
+            # Decodes/builds share the global core budget via -j
+            label = f"apktool {args[0]} {os.path.basename(args[1])}"
+            with CoreBudget.shared().slot(label, self._apktool_weight(args), self.verbose) as threads:
+                cp = self._apktool_run(exe, [*args, "-j", str(threads)])
+            if not cp["ok"] and "-j" in (cp["stdout"] + cp["stderr"]) and "nrecognized option" in (cp["stdout"] + cp["stderr"]):
+                # apktool predates -j; stop passing it (remembered for this apktool install)
+                APK._apktool_jobs_flag = False
+                Toolchain.shared().set_flag(exe, "jobs", False)
+                cp = self._apktool_run(exe, args)
+        else:
+            cp = self._apktool_run(exe, args)
+        if self.verbose and cp["returncode"] != 0:
+            print(cp["stderr"], file=sys.stderr)
+        if ok_required and not cp["ok"]:
+            raise RuntimeError(f"apktool failed: \n\n{exe} {' '.join(args)}\n\n" + cp["stdout"] + "\n\n---\n\n" + cp["stderr"])
+
+    @classmethod
+    def _apktool_jobs_supported(cls, exe: str) -> bool:
+        if cls._apktool_jobs_flag is None:
+            cls._apktool_jobs_flag = Toolchain.shared().flag(exe, "jobs", True)
+        return cls._apktool_jobs_flag
+
+    @staticmethod
+    def _apktool_weight(args: List[str]) -> float:
+        """Core-share weight of a decode: input size in MiB (builds weigh 1)."""
+        if args[0] == "d" and os.path.isfile(args[1]):
+            return max(1.0, os.path.getsize(args[1]) / (1024 * 1024))
+        return 1.0
+
+    def _apktool_run(self, exe: str, args: List[str]) -> dict:
         if self.verbose:
-            print(f"[apktool] {exe} {' '.join(args)}\n{cp.stdout}")
-            if cp.returncode != 0:
-                print(cp.stderr, file=sys.stderr)
-        if ok_required and cp.returncode != 0:
-            raise RuntimeError(f"apktool failed: \n\n{exe}{' '.join(args)}\n\n" + cp.stdout +"\n\n---\n\n"+ cp.stderr)
+            print(f"[apktool] {exe} {' '.join(args)}")
+        # feed CRLF to bypass possible pause in Windows wrapper
+        runner = ProcessRunner(verbose=self.verbose, fatal_patterns=ProcessRunner.APKTOOL_FATAL)
+        return runner.run([exe, *args], input="\r\n", label="apktool")
+
+    # Bump when the decoded tree layout we rely on changes
+    TREE_FORMAT = 1
+
+    def _tree_key(self, args: List[str]) -> Optional[str]:
+        """Content hash of the input APK, the apktool version and the decode flags."""
+        exe = "apktool.bat" if os.name == "nt" else "apktool"
+        version = Toolchain.shared().version(exe, input="\r\n")
+        if not version:
+            return None  # an unknown apktool must not share trees with a known one
+        desc = [self.TREE_FORMAT, CacheBackend.file_sha256(self.apk_path), version,
+                [a for a in args[1:] if a not in (self.apk_path, self.decoded)],
+                self.single_dex and self.smali_app]
+        return hashlib.sha256(json.dumps(desc).encode("utf-8")).hexdigest() + ".tgz"
+
+    def _restore_tree(self, remote: CacheBackend, key: str) -> bool:
+        archive = os.path.join(self.workdir, ".__tree.tgz")
+        if not remote.get("trees", key, archive):
+            return False
+        try:
+            shutil.rmtree(self.decoded, ignore_errors=True)
+            with tarfile.open(archive, "r:gz") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(self.decoded, filter="data")
+                else:
+                    members = [m for m in tar.getmembers()
+                               if not (m.name.startswith("/") or ".." in m.name.split("/") or m.issym() or m.islnk())]
+                    tar.extractall(self.decoded, members=members)
+        except (OSError, tarfile.TarError) as e:
+            print(f"[!] Cached decoded tree unusable ({e}); decoding")
+            shutil.rmtree(self.decoded, ignore_errors=True)
+            return False
+        finally:
+            os.remove(archive)
+        print(f"[+] Reused decoded tree of {os.path.basename(self.apk_path)} from the remote cache")
+        return True
+
+    def _publish_tree(self, remote: CacheBackend, key: str) -> None:
+        """
+        Snapshot the fresh tree (copy-on-write, like snapshot()) before any
+        patch touches it; the upload thread archives and uploads it while the
+        job carries on.
+        """
+        snap = os.path.join(self.workdir, ".__tree_publish")
+        try:
+            Materializer.clone_tree(self.decoded, snap)
+        except OSError as e:
+            if self.verbose:
+                print(f"[!] Could not snapshot decoded tree: {e}")
+            shutil.rmtree(snap, ignore_errors=True)
+            return
+
+        def archive() -> Optional[str]:
+            path = snap + ".tgz"
+            try:
+                with tarfile.open(path, "w:gz", compresslevel=1) as tar:
+                    tar.add(snap, arcname=".")
+                return path
+            except OSError as e:
+                # Also when the job finished and its workspace went first
+                if self.verbose:
+                    print(f"[!] Could not archive decoded tree: {e}")
+                if os.path.exists(path):
+                    os.remove(path)
+                return None
+            finally:
+                shutil.rmtree(snap, ignore_errors=True)
+
+        remote.put_async_built("trees", key, archive)
+
+    def _smali_app_dex(self) -> None:
+        """After `apktool d --no-src`: disassemble the dex the gadget loader has to go into."""
+        dexes = DexIndex.dex_files(self.decoded)
+        if not dexes:
+            return
+        app = self.manifest.get_app_attr("name")
+        package = self.manifest.root.get("package") or ""
+        if app and app.startswith("."):
+            app = package + app
+        elif app and "." not in app:
+            app = f"{package}.{app}"
+        if not app or app == self.GADGET_LOADER_CLASS:
+            target = dexes[0]  # a new loader class must sit in the primary dex
+        else:
+            try:
+                target = DexIndex.find_class(dexes, app)
+            except DexError as e:
+                print(f"[!] Could not index dex files ({e})")
+                target = None
+            if target is None:
+                print(f"[!] {app} is not defined in any dex; disassembling all of them")
+                for dex in dexes:
+                    self._smali_dex(dex)
+                return
+        self._smali_dex(target)
+        print(f"[+] Disassembled {os.path.basename(target)} only; "
+              f"{len(dexes) - 1} of {len(dexes)} dex files pass through unchanged")
+
+    def _smali_dex(self, dex_path: str) -> None:
+        """Baksmali one raw classesN.dex of the tree into smali[_classesN]/ (apktool b prefers raw dex, so it goes)."""
+        name = os.path.basename(dex_path)[:-len(".dex")]
+        tmp_apk = os.path.join(self.workdir, f".__{name}.apk")
+        tmp_out = os.path.join(self.workdir, f".__{name}")
+        with zipfile.ZipFile(tmp_apk, "w") as zf:
+            zf.write(dex_path, "classes.dex")
+            manifest = os.path.join(self.decoded, "original", "AndroidManifest.xml")
+            if os.path.isfile(manifest):
+                zf.write(manifest, "AndroidManifest.xml")
+        try:
+            self._apktool(["d", tmp_apk, "-o", tmp_out, "-f", "--no-res", "--only-main-classes"], ok_required=True)
+            os.replace(os.path.join(tmp_out, "smali"),
+                       os.path.join(self.decoded, "smali" if name == "classes" else f"smali_{name}"))
+            os.remove(dex_path)
+        finally:
+            os.remove(tmp_apk)
+            shutil.rmtree(tmp_out, ignore_errors=True)
+
+    @staticmethod
+    def _append_raw_entry(zout: zipfile.ZipFile, raw, entry: zipfile.ZipInfo) -> None:
+        """
+        Copy entry's compressed bytes from the source file `raw` to the end of
+        zout (the package's raw-entry copier, shared with its native-libs pass).
+        """
+        try:
+            appendRawEntry(zout, raw, entry)
+        except zipfile.BadZipFile as e:
+            raise APKError(str(e))
 
     def _run(self, args: List[str], ok_required: bool = False):
         if self.verbose:
@@ -249,14 +573,53 @@ class APK:
         if not os.path.exists(p):
             raise FileNotFoundError(p)
 
-    def _manifest_ns(self, manifest_path: str) -> dict:
-        ns = {}
-        for _, n in ET.iterparse(manifest_path, events=["start-ns"]):
-            ns[n[0]] = n[1]
-        if "android" not in ns:
-            # Fallback to the default android ns when iterparse doesn't expose it
-            ns["android"] = "http://schemas.android.com/apk/res/android"
-        return ns
+    # Entries a lib/assets-only split may carry besides its content
+    CONTENT_SPLIT_EXTRA = ("AndroidManifest.xml", "resources.arsc", "stamp-cert-sha256")
+
+    @classmethod
+    def _is_content_only_split(cls, apk_path: str) -> bool:
+        """True when the split's central directory lists only lib/ and assets/ files (plus manifest/signature)."""
+        try:
+            with zipfile.ZipFile(apk_path) as zf:
+                names = zf.namelist()
+                has_content = False
+                for n in names:
+                    if n.startswith(("lib/", "assets/")):
+                        has_content = True
+                    elif not (n in cls.CONTENT_SPLIT_EXTRA or n.startswith("META-INF/") or n.endswith("/")):
+                        return False
+        except (OSError, zipfile.BadZipFile):
+            return False
+        if not has_content:
+            return False
+        if "resources.arsc" in names:
+            # Some tools emit an empty table for these splits; a real one needs decoding
+            try:
+                table = ArscMerger.from_apk(apk_path)
+            except ArscError:
+                return False
+            return not any(t["entries"] for pkg in table.packages
+                           for types in pkg["typesById"].values() for t in types)
+        return True
+
+    @staticmethod
+    def _extract_split_content(apk_path: str, dest: str, skip_prefixes: tuple = ()) -> int:
+        """Stream lib/ and assets/ entries straight from the split zip into the decoded tree."""
+        count = 0
+        root = os.path.realpath(dest)
+        with zipfile.ZipFile(apk_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.startswith(("lib/", "assets/")) \
+                        or info.filename.startswith(skip_prefixes):
+                    continue
+                target = os.path.realpath(os.path.join(root, *info.filename.split("/")))
+                if not target.startswith(root + os.sep):
+                    raise APKError(f"Refusing to extract {info.filename!r} outside {dest}")
+                Path(os.path.dirname(target)).mkdir(parents=True, exist_ok=True)
+                with zf.open(info) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                count += 1
+        return count
 
     def _copy_splits_into_base(self, splits: List[str]):
         base = self.decoded
@@ -279,6 +642,7 @@ class APK:
                     shutil.move(os.path.join(root, f), dest_file)
 
     def _fix_public_resource_ids(self, splits: List[str]):
+        import xml.etree.ElementTree as ET
         base = self.decoded
         public_xml = os.path.join(base, "res", "values", "public.xml")
         if not os.path.exists(public_xml):
@@ -364,6 +728,7 @@ class APK:
             print(f"[+] Updated {changes} dummy resource references")
 
     def _hack_remove_duplicate_style_entries(self):
+        import xml.etree.ElementTree as ET
         base = self.decoded
         styles = os.path.join(base, "res", "values", "styles.xml")
         if not os.path.exists(styles):
@@ -388,36 +753,9 @@ class APK:
             print(f"[+] Removed {len(dupes)} duplicate <item> entries from styles.xml")
 
     def _disable_apk_splitting(self):
-        base = self.decoded
-        manifest = os.path.join(base, "AndroidManifest.xml")
-        tree = ET.parse(manifest)
-        nsmap = self._manifest_ns(manifest)
-        android_ns = nsmap["android"]
-        ns = "{" + android_ns + "}"
-        root = tree.getroot()
-
-        app = root.find(".//application")
-        if app is not None:
-            if ns + "isSplitRequired" in app.attrib:
-                del app.attrib[ns + "isSplitRequired"]
-            app.attrib[ns + "extractNativeLibs"] = "true"
-
-        # remove vending split meta-data under application
-        to_remove = []
-        if app is not None:
-            for md in app.findall("meta-data"):
-                name = md.attrib.get(ns + "name", "")
-                if name in ("com.android.vending.splits.required", "com.android.vending.splits"):
-                    to_remove.append(md)
-            for md in to_remove:
-                app.remove(md)
-
-        # clean manifest attributes
-        for k in (ns + "isSplitRequired", ns + "requiredSplitTypes", ns + "splitTypes"):
-            if k in root.attrib:
-                del root.attrib[k]
-
-        tree.write(manifest, encoding="utf-8", xml_declaration=True)
+        self.manifest.remove_split_requirements()
+        if self.manifest.root.find(".//application") is not None:
+            self.manifest.set_app_attr("extractNativeLibs", "true")
 
     def _raw_re_replace(self, path: str, pattern: str, replacement: str):
         if not os.path.exists(path):
@@ -426,6 +764,7 @@ class APK:
             s = fh.read()
         ns = re.sub(pattern, replacement, s)
         if ns != s:
+            Materializer.unshare(path)
             with open(path, "w", encoding="utf-8") as fh:
                 fh.write(ns)
 
@@ -527,6 +866,7 @@ class APK:
             )
             src = src.rstrip() + new_block
 
+        Materializer.unshare(smali_path)
         with open(smali_path, "w", encoding="utf-8") as fh:
             fh.write(src)
 
@@ -545,6 +885,7 @@ class APK:
                     s = fh.read()
                 ns = s.replace("@android", "@*android")
                 if ns != s:
+                    Materializer.unshare(p)
                     with open(p, "w", encoding="utf-8") as fh:
                         fh.write(ns)
                     count += 1
@@ -0,0 +1,181 @@
+import os, re, struct, zipfile
+from typing import Dict, Iterator, List, Tuple
+
+from ArscMerger import ArscMerger, ArscError
+from Workspace import Workspace
+
+class ApkInspectError(RuntimeError): pass
+
+class ApkInspector:
+    """
+    Pre-decode inspection of pulled APKs.
+
+    Reads only the zip central directory plus two small entries (the binary
+    AndroidManifest.xml and META-INF/MANIFEST.MF), so a whole split set is
+    classified in milliseconds, before any apktool run. Each APK becomes a
+    dict:
+
+        path, package, split, kind, abis, dex_count, has_resources,
+        proguard, andresguard, entries, decoded_estimate
+
+    kind is one of base, abi, density, language, asset_pack, feature or
+    config (a config split of an unrecognised dimension).
+    """
+
+    KINDS = ("base", "abi", "density", "language", "asset_pack", "feature", "config")
+
+    ABIS = ("arm64_v8a", "armeabi_v7a", "armeabi", "x86_64", "x86", "mips64", "mips")
+    DENSITIES = ("ldpi", "mdpi", "tvdpi", "hdpi", "xhdpi", "xxhdpi", "xxxhdpi", "nodpi", "anydpi")
+    LANGUAGE_RE = re.compile(r"^[a-z]{2,3}(?:[_-][A-Za-z0-9]+)*$")
+
+    # res/ directory types aapt emits; anything else means the paths were obfuscated
+    RES_TYPES = ("anim", "animator", "color", "drawable", "font", "interpolator", "layout", "menu",
+                 "mipmap", "navigation", "raw", "transition", "values", "xml")
+
+    DIST_NS = "http://schemas.android.com/apk/distribution"
+
+    # Binary XML chunk types
+    RES_STRING_POOL_TYPE = 0x0001
+    RES_XML_START_ELEMENT_TYPE = 0x0102
+    NO_INDEX = 0xFFFFFFFF
+    TYPE_STRING, TYPE_INT_BOOLEAN = 0x03, 0x12
+
+    # ---------- Public APIs ----------
+    @classmethod
+    def inspect(cls, apk_path: str) -> dict:
+        try:
+            with zipfile.ZipFile(apk_path) as zf:
+                infos = zf.infolist()
+                names = [i.filename for i in infos]
+                manifest = cls._manifest_attrs(zf.read("AndroidManifest.xml")) \
+                    if "AndroidManifest.xml" in names else {}
+                mf = zf.getinfo("META-INF/MANIFEST.MF") if "META-INF/MANIFEST.MF" in names else None
+                # Signing manifests list every entry; only read them while they are small
+                mf_text = zf.read(mf).decode("utf-8", "replace") if mf and mf.file_size < 4 * 1024 * 1024 else ""
+        except (OSError, zipfile.BadZipFile, KeyError) as e:
+            raise ApkInspectError(f"{os.path.basename(apk_path)}: not a readable APK ({e})")
+
+        abis = sorted({n.split("/")[1] for n in names if n.startswith("lib/") and n.count("/") >= 2})
+        res_dirs = {n.split("/")[1].split("-")[0] for n in names if n.startswith("res/") and n.count("/") >= 2}
+        info = {
+            "path": apk_path,
+            "package": manifest.get("package"),
+            "split": manifest.get("split"),
+            "kind": None,
+            "abis": abis,
+            "dex_count": sum(1 for n in names if re.match(r"^classes\d*\.dex$", n)),
+            "has_resources": "resources.arsc" in names,
+            "proguard": any(n.startswith("META-INF/proguard/") for n in names) or "proguard" in mf_text.lower(),
+            "andresguard": any(n.startswith("r/") for n in names) or any(d not in cls.RES_TYPES for d in res_dirs),
+            "entries": len(names),
+            "decoded_estimate": Workspace.estimate_size([apk_path]),
+        }
+        info["kind"] = cls._classify(info, manifest, names)
+        return info
+
+    @classmethod
+    def inspect_all(cls, apk_paths: List[str]) -> List[dict]:
+        """Inspect a pulled set and check it can be merged; the base APK comes first."""
+        infos = [cls.inspect(p) for p in apk_paths]
+        bases = [i for i in infos if i["kind"] == "base"]
+        if len(bases) != 1:
+            found = ", ".join(os.path.basename(i["path"]) for i in bases) or "none"
+            raise ApkInspectError(f"Expected exactly one base APK in the pulled set, found {found}")
+        packages = {i["package"] for i in infos if i["package"]}
+        if len(packages) > 1:
+            raise ApkInspectError(f"Pulled APKs belong to different packages: {', '.join(sorted(packages))}")
+        if bases[0]["dex_count"] == 0 and not any(i["dex_count"] for i in infos):
+            raise ApkInspectError("No classes.dex in any pulled APK: nothing to patch")
+        return bases + [i for i in infos if i is not bases[0]]
+
+    @staticmethod
+    def describe(info: dict) -> str:
+        parts = [info["kind"]]
+        if info["split"]:
+            parts.append(info["split"])
+        if info["abis"]:
+            parts.append("abis=" + ",".join(info["abis"]))
+        if info["dex_count"]:
+            parts.append(f"dex={info['dex_count']}")
+        if info["proguard"] or info["andresguard"]:
+            parts.append("obfuscated")
+        parts.append(f"~{info['decoded_estimate'] // (1024 * 1024)} MiB decoded")
+        return f"{os.path.basename(info['path'])}: " + ", ".join(parts)
+
+    @classmethod
+    def xml_elements(cls, data: bytes) -> Iterator[Tuple[str, List[Tuple[str, str, object]]]]:
+        """
+        (element name, [(namespace, attribute, value)]) for each start tag of a
+        binary XML document, in document order. String values come back as str,
+        booleans as bool and anything else as the raw 32-bit data. Iteration
+        stops quietly at the first malformed chunk.
+        """
+        try:
+            _, hsize, size = struct.unpack_from("<HHI", data, 0)
+            strings: List[str] = []
+            p = hsize
+            while p + 8 <= min(size, len(data)):
+                ctype, _, csize = struct.unpack_from("<HHI", data, p)
+                if csize < 8:
+                    return
+                if ctype == cls.RES_STRING_POOL_TYPE:
+                    strings = [t for t, _ in ArscMerger._parse_pool(data, p)[0]]
+                elif ctype == cls.RES_XML_START_ELEMENT_TYPE:
+                    _, name, astart, asize, acount = struct.unpack_from("<IIHHH", data, p + 16)
+                    attrs = []
+                    for i in range(acount):
+                        ans, aname, raw, _, _, dtype, value = \
+                            struct.unpack_from("<IIIHBBI", data, p + 16 + astart + i * asize)
+                        if raw != cls.NO_INDEX:
+                            val: object = strings[raw]
+                        elif dtype == cls.TYPE_STRING:
+                            val = strings[value]
+                        elif dtype == cls.TYPE_INT_BOOLEAN:
+                            val = value != 0
+                        else:
+                            val = value
+                        attrs.append((strings[ans] if ans != cls.NO_INDEX else "", strings[aname], val))
+                    yield strings[name], attrs
+                p += csize
+        except (struct.error, IndexError, ArscError):
+            return
+
+    # ---------- Internals ----------
+    @classmethod
+    def _classify(cls, info: dict, manifest: Dict[str, object], names: List[str]) -> str:
+        split = info["split"]
+        if split is None and not manifest:
+            # Unreadable manifest: fall back to the file name the split was installed under
+            m = re.search(r"split_(.+)\.apk$", os.path.basename(info["path"]))
+            split = m.group(1) if m else None
+        if split is None:
+            return "base"
+        if manifest.get("module_type") == "asset-pack":
+            return "asset_pack"
+        if split.startswith("config."):
+            dim = split[len("config."):]
+            if dim in cls.ABIS:
+                return "abi"
+            if dim in cls.DENSITIES:
+                return "density"
+            if cls.LANGUAGE_RE.match(dim):
+                return "language"
+            return "config"
+        if not info["dex_count"] and not info["has_resources"] and \
+                all(n.startswith(("assets/", "META-INF/")) or n == "AndroidManifest.xml" for n in names):
+            return "asset_pack"
+        return "feature"
+
+    @classmethod
+    def _manifest_attrs(cls, data: bytes) -> Dict[str, object]:
+        """package/split/isFeatureSplit of <manifest> and dist:type of <dist:module>, from binary XML."""
+        attrs: Dict[str, object] = {}
+        for element, element_attrs in cls.xml_elements(data):
+            if element == "application":
+                break  # everything of interest precedes <application>
+            for ns, key, val in element_attrs:
+                if element == "manifest" and key in ("package", "split", "isFeatureSplit"):
+                    attrs[key] = val
+                elif element == "module" and ns == cls.DIST_NS and key == "type":
+                    attrs["module_type"] = val
+        return attrs
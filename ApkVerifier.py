@@ -0,0 +1,190 @@
+import os, re, struct, hashlib, zipfile, subprocess
+from typing import Dict, List
+
+from ApkInspector import ApkInspector
+
+class ApkVerifyError(RuntimeError): pass
+
+class ApkVerifier:
+    """
+    In-process checks on a final (aligned, signed) APK, run before anything
+    touches the device: a broken build otherwise only shows up when
+    `adb install` fails after the original app was already uninstalled.
+
+    Only the central directory, the local headers of stored entries, the
+    binary AndroidManifest.xml and the bytes in front of the central
+    directory are read; the dex files are scanned for the gadget loader only
+    until it is found. Large APKs verify in tens of milliseconds.
+
+    check_signer() runs apksigner, so it is kept for APKs this host did not
+    sign itself (remote result-cache hits).
+    """
+
+    ANDROID_NS = "http://schemas.android.com/apk/res/android"
+    GADGET_LIB = "libfrida-gadget.so"
+    GADGET_LOAD_STRING = b"frida-gadget"
+
+    # zipalign -p: stored entries on 4 bytes, stored shared libraries on a page
+    ALIGNMENT = 4
+    SO_ALIGNMENT = 4096
+
+    LOCAL_HEADER_SIZE = 30
+    EOCD_SIZE = 22
+    SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+    SIGNER_DIGEST_RE = re.compile(r"^Signer #\d+ certificate SHA-256 digest: ([0-9a-fA-F]{64})$", re.M)
+
+    # ---------- Public APIs ----------
+    @classmethod
+    def verify(cls, apk_path: str, frida_gadget: bool = True, enable_user_certs: bool = False,
+               extract_native_libs: bool = True) -> List[str]:
+        """
+        Raises ApkVerifyError listing every problem found. Returns the names
+        of the checks that ran, for verbose output. With extract_native_libs
+        False the manifest must say so and every library must be stored.
+        """
+        problems: List[str] = []
+        checks = ["alignment", "signing block", "manifest"]
+        try:
+            with zipfile.ZipFile(apk_path) as zf:
+                infos = zf.infolist()
+                problems += cls._check_alignment(apk_path, infos)
+                problems += cls._check_signing_block(apk_path)
+                manifest = cls._manifest(zf)
+                problems += cls._check_manifest(manifest, frida_gadget, enable_user_certs, extract_native_libs)
+                if not extract_native_libs:
+                    checks.append("uncompressed libraries")
+                    problems += [f"{i.filename} is compressed, so it can't be loaded from the APK" for i in infos
+                                 if i.filename.startswith("lib/") and i.filename.endswith(".so")
+                                 and i.compress_type != zipfile.ZIP_STORED]
+                if frida_gadget:
+                    checks += ["gadget libraries", "gadget loader"]
+                    problems += cls._check_gadget_libs(infos)
+                    problems += cls._check_gadget_loader(zf, infos)
+        except (OSError, zipfile.BadZipFile, KeyError) as e:
+            problems.append(f"unreadable APK: {e}")
+        if problems:
+            raise ApkVerifyError(f"{os.path.basename(apk_path)} failed verification:\n  - " + "\n  - ".join(problems))
+        return checks
+
+    @classmethod
+    def check_signer(cls, apk_path: str, cert_sha256: str) -> None:
+        """Raises ApkVerifyError unless apksigner accepts the APK and its only signer is cert_sha256."""
+        name = os.path.basename(apk_path)
+        try:
+            cp = subprocess.run(["apksigner", "verify", "--print-certs", apk_path], capture_output=True, text=True)
+        except OSError as e:
+            raise ApkVerifyError(f"Could not run apksigner on {name}: {e}")
+        if cp.returncode != 0:
+            raise ApkVerifyError(f"{name} failed apksigner verify: {(cp.stderr or cp.stdout).strip()}")
+        signers = {d.lower() for d in cls.SIGNER_DIGEST_RE.findall(cp.stdout)}
+        if signers != {cert_sha256.lower()}:
+            raise ApkVerifyError(f"{name} is signed by {', '.join(sorted(signers)) or 'nobody'}, "
+                                 f"not by the local key ({cert_sha256[:16]}...)")
+
+    @staticmethod
+    def keystore_cert_sha256(ks_path: str, alias: str, password: str) -> str:
+        """SHA-256 of the DER certificate under alias: what apksigner --print-certs reports for it."""
+        try:
+            cp = subprocess.run(["keytool", "-exportcert", "-keystore", ks_path, "-alias", alias,
+                                 "-storepass", password], capture_output=True)
+        except OSError as e:
+            raise ApkVerifyError(f"Could not run keytool: {e}")
+        if cp.returncode != 0 or not cp.stdout:
+            raise ApkVerifyError(f"keytool could not export '{alias}' from {ks_path}: "
+                                 f"{cp.stderr.decode(errors='replace').strip()}")
+        return hashlib.sha256(cp.stdout).hexdigest()
+
+    # ---------- Internals ----------
+    @classmethod
+    def _check_alignment(cls, apk_path: str, infos: List[zipfile.ZipInfo]) -> List[str]:
+        problems = []
+        with open(apk_path, "rb") as fh:
+            for info in infos:
+                if info.compress_type != zipfile.ZIP_STORED or info.is_dir():
+                    if info.filename == "resources.arsc":
+                        problems.append("resources.arsc is compressed (Android 11+ refuses to install it)")
+                    continue
+                # The local header's extra field can differ from the central directory's
+                fh.seek(info.header_offset + 26)
+                name_len, extra_len = struct.unpack("<HH", fh.read(4))
+                offset = info.header_offset + cls.LOCAL_HEADER_SIZE + name_len + extra_len
+                want = cls.SO_ALIGNMENT if info.filename.endswith(".so") else cls.ALIGNMENT
+                if offset % want:
+                    problems.append(f"{info.filename} is not {want}-byte aligned (data at {offset})")
+        return problems
+
+    @classmethod
+    def _check_signing_block(cls, apk_path: str) -> List[str]:
+        """v2+ signatures live in the APK Signing Block right before the central directory."""
+        with open(apk_path, "rb") as fh:
+            fh.seek(0, os.SEEK_END)
+            size = fh.tell()
+            fh.seek(max(0, size - cls.EOCD_SIZE - 0xFFFF))
+            tail = fh.read()
+            eocd = tail.rfind(b"PK\x05\x06")
+            if eocd < 0 or eocd + cls.EOCD_SIZE > len(tail):
+                return ["end of central directory not found"]
+            cd_offset, = struct.unpack_from("<I", tail, eocd + 16)
+            if cd_offset < 24:
+                return ["no APK Signing Block (the APK is not v2/v3 signed)"]
+            fh.seek(cd_offset - 16)
+            if fh.read(16) != cls.SIG_BLOCK_MAGIC:
+                return ["no APK Signing Block (the APK is not v2/v3 signed)"]
+        return []
+
+    @classmethod
+    def _manifest(cls, zf: zipfile.ZipFile) -> Dict[str, Dict[str, object]]:
+        """{"application": {attr: value}, "permissions": {name: True}} from the binary manifest."""
+        result: Dict[str, Dict[str, object]] = {"permissions": {}}
+        for element, attrs in ApkInspector.xml_elements(zf.read("AndroidManifest.xml")):
+            values = {key: val for ns, key, val in attrs if ns == cls.ANDROID_NS}
+            if element == "application":
+                result["application"] = values
+            elif element == "uses-permission" and isinstance(values.get("name"), str):
+                result["permissions"][values["name"]] = True
+        return result
+
+    @classmethod
+    def _check_manifest(cls, manifest: Dict[str, Dict[str, object]], frida_gadget: bool,
+                        enable_user_certs: bool, extract_native_libs: bool) -> List[str]:
+        app = manifest.get("application")
+        if app is None:
+            return ["AndroidManifest.xml has no <application>"]
+        problems = []
+        if frida_gadget:
+            if "android.permission.INTERNET" not in manifest["permissions"]:
+                problems.append("android.permission.INTERNET is missing")
+            if extract_native_libs and app.get("extractNativeLibs") is False:
+                problems.append("extractNativeLibs is false")
+            if not app.get("name"):
+                problems.append("<application> has no android:name, so no class loads the gadget")
+            if app.get("testOnly") is True:
+                problems.append("android:testOnly is still set")
+        if not extract_native_libs and app.get("extractNativeLibs") is not False:
+            problems.append("extractNativeLibs is not false")
+        if enable_user_certs and "networkSecurityConfig" not in app:
+            problems.append("android:networkSecurityConfig is missing")
+        return problems
+
+    @classmethod
+    def _check_gadget_libs(cls, infos: List[zipfile.ZipInfo]) -> List[str]:
+        names = {i.filename for i in infos}
+        abis = sorted({n.split("/")[1] for n in names if n.startswith("lib/") and n.count("/") >= 2})
+        if not abis:
+            return [f"no {cls.GADGET_LIB} in the APK"]
+        return [f"lib/{abi}/{cls.GADGET_LIB} is missing" for abi in abis
+                if f"lib/{abi}/{cls.GADGET_LIB}" not in names]
+
+    @classmethod
+    def _check_gadget_loader(cls, zf: zipfile.ZipFile, infos: List[zipfile.ZipInfo]) -> List[str]:
+        """Some dex must hold the "frida-gadget" string System.loadLibrary is called with."""
+        dexes = sorted((i for i in infos if i.filename.startswith("classes") and i.filename.endswith(".dex")),
+                       key=lambda i: i.filename)
+        for info in dexes:
+            with zf.open(info) as fh:
+                carry = b""
+                for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                    if cls.GADGET_LOAD_STRING in carry + chunk:
+                        return []
+                    carry = chunk[-len(cls.GADGET_LOAD_STRING):]
+        return ["no dex references frida-gadget: the loader was not compiled in"]
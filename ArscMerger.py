@@ -0,0 +1,71 @@
+import os, sys, zipfile
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from patch_apk.utils import arsc_merge
+except ImportError:
+    # Run from a checkout: the package lives under src/ next to this file
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    from patch_apk.utils import arsc_merge
+
+ArscError = arsc_merge.ArscMergeError
+
+class ArscMerger:
+    """
+    Binary resources.arsc parser/merger for split APK sets.
+
+    The split tables (density, language, ABI config splits) share the base
+    table's package, type and entry ids; they only add config variants. Their
+    packages, type specs and config chunks are folded into the base table at
+    the binary level, keeping every resource ID, so a merged APK can be
+    produced without apktool decoding each split and aapt re-encoding it.
+
+    The parser and writer are patch_apk.utils.arsc_merge's, shared with the
+    package's split merge; this class holds one parsed table.
+    """
+
+    def __init__(self, data: bytes):
+        table = arsc_merge.parseResourceTable(data)
+        self.utf8: bool = table["utf8"]
+        self.packages: List[dict] = table["packages"]
+
+    # ---------- Public APIs ----------
+    @classmethod
+    def from_apk(cls, apk_path: str) -> Optional["ArscMerger"]:
+        """Table of an APK, or None when it has no resources.arsc."""
+        with zipfile.ZipFile(apk_path) as zf:
+            try:
+                return cls(zf.read("resources.arsc"))
+            except KeyError:
+                return None
+
+    def merge(self, other: "ArscMerger") -> Dict[str, int]:
+        """Fold another table into this one. Returns counts of what was added."""
+        return arsc_merge.mergeResourceTables(self._table(), other._table())
+
+    def to_bytes(self) -> bytes:
+        return arsc_merge.writeResourceTable(self._table())
+
+    @staticmethod
+    def merge_apks(base_apk: str, split_apks: List[str], out_apk: str, verbose: bool = False,
+                   skip_prefixes: Tuple[str, ...] = ()) -> Dict[str, int]:
+        """
+        Write out_apk: base_apk plus every split's files (except those under
+        skip_prefixes), with one merged resources.arsc. Raises ArscError when
+        the tables can't be merged, or when a split carries code: a feature
+        split's classes.dex would collide with the base's, so those sets need
+        the per-split decode.
+        """
+        def report(split: str, stats: Dict[str, int]) -> None:
+            if verbose:
+                print(f"[arsc] {os.path.basename(split)}: +{stats['configs']} configs, "
+                      f"+{stats['entries']} entries, {stats['conflicts']} conflicts")
+        return arsc_merge.mergeSplitAPKsBinary(base_apk, split_apks, out_apk, skip_prefixes, report)
+
+    # ---------- Internals ----------
+    # [(text, spans)] of the string pool chunk at off, plus its UTF-8 flag
+    _parse_pool = staticmethod(arsc_merge._parseStringPool)
+
+    def _table(self) -> dict:
+        # The dict form arsc_merge works on; packages are shared, not copied
+        return {"utf8": self.utf8, "packages": self.packages}
@@ -0,0 +1,496 @@
+import os, json, time, shutil, hashlib, secrets, contextlib, threading, collections, http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PullCache import PullCache
+from Materializer import Materializer
+from OutputRouter import OutputRouter
+from Workspace import Workspace
+
+class WorkerError(RuntimeError): pass
+class WorkerUnavailableError(WorkerError): pass
+
+class BuildWorker:
+    """
+    Build worker: runs the apktool-heavy part of a patch (decode, split merge,
+    patches, build) for a coordinator that keeps the device, signing and
+    install to itself. Several workers, on other hosts or on localhost with
+    different ports, spread large apps over more cores and memory.
+
+    Inputs travel as content-addressed blobs (<cache root>/worker-blobs/<sha256>):
+    the coordinator asks which it lacks, uploads only those, then submits the
+    job; re-patching an app the worker has seen uploads nothing. The rebuilt
+    (unaligned, unsigned) APK is stored the same way and downloaded by hash.
+    Blobs are evicted least recently used past PATCHAPK_WORKER_BLOBS_MB
+    (default 4096); a running job's inputs are pinned and never evicted.
+
+    API (requests carry X-PatchApk-Token when PATCHAPK_WORKER_TOKEN is set):
+        HEAD /blobs/<sha256>    200 if present
+        PUT  /blobs/<sha256>    upload; rejected unless the body hashes to <sha256>
+        GET  /blobs/<sha256>    download
+        POST /jobs              {"inputs": [{"name", "sha256"}], "options": {...}} (base first);
+                                blocks until built -> {"output", "size", "elapsed"},
+                                409 {"missing": [...]} when an input blob is gone
+        GET  /status            {"jobs", "running"}
+    """
+
+    DEFAULT_PORT = 7701
+    DEFAULT_JOBS = 1
+    DEFAULT_BLOBS_MB = 4096
+    TOKEN_HEADER = "X-PatchApk-Token"
+    CHUNK = 1024 * 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, jobs: Optional[int] = None,
+                 root: Optional[str] = None, verbose: bool = False):
+        env = os.environ.get("PATCHAPK_WORKER_JOBS", "")
+        self.jobs = max(1, jobs or (int(env) if env.isdigit() else 0) or self.DEFAULT_JOBS)
+        self.host, self.port = host, port
+        self.root = Path(root) if root else PullCache.default_root() / "worker-blobs"
+        env = os.environ.get("PATCHAPK_WORKER_BLOBS_MB", "")
+        self.max_bytes = (int(env) if env.isdigit() else self.DEFAULT_BLOBS_MB) * 1024 * 1024
+        self.token = os.environ.get("PATCHAPK_WORKER_TOKEN") or None
+        self.verbose = verbose
+        self.running = 0
+        self._slots = threading.BoundedSemaphore(self.jobs)
+        self._lock = threading.Lock()
+        self._pinned: "collections.Counter[str]" = collections.Counter()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    # ---------- Public APIs ----------
+    def serve(self) -> None:
+        if self.host not in ("127.0.0.1", "localhost", "::1") and not self.token:
+            raise WorkerError("Set PATCHAPK_WORKER_TOKEN before serving on a non-loopback address")
+        server = ThreadingHTTPServer((self.host, self.port), _WorkerHandler)
+        server.daemon_threads = True
+        server.worker = self
+        print(f"[+] patch-apk build worker on {self.host}:{self.port} ({self.jobs} concurrent jobs)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    @classmethod
+    def rebuild(cls, apk_paths: List[str], options: Dict[str, object], verbose: bool = False):
+        """
+        Decode (merging splits), patch and build apk_paths, base first. Returns
+        the APK whose apk_path is the rebuilt, unaligned and unsigned APK; the
+        coordinator's local path and remote jobs both go through here.
+
+        options: gadget_version, frida_gadget, enable_user_certs,
+        disable_styles_hack, decode_splits, uncompressed_native_libs,
+        asset_passthrough, smali_all_dex
+        """
+        return cls.build(cls.decode(apk_paths, options, verbose), options)
+
+    @classmethod
+    def rebuild_variants(cls, apk_paths: List[str], options: Dict[str, object],
+                         variants: Dict[str, Dict[str, object]], verbose: bool = False) -> Dict[str, object]:
+        """
+        Decode and merge once, then patch and build every variant (its own
+        options over `options`) on a copy-on-write snapshot of the tree,
+        concurrently. Returns {name: APK}. Only the patch options
+        (gadget_version, frida_gadget, enable_user_certs,
+        uncompressed_native_libs) may differ between variants.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from CoreBudget import CoreBudget
+        # The shared tree needs the Application's smali if any variant injects the gadget
+        gadget = any({**options, **v}.get("frida_gadget") for v in variants.values())
+        base = cls.decode(apk_paths, {**options, "frida_gadget": gadget}, verbose)
+        snapshots = {name: base.snapshot(name) for name in variants}
+        budget = CoreBudget.shared()
+        with budget.batch([1.0] * len(snapshots)), \
+                ThreadPoolExecutor(max_workers=max(1, min(len(snapshots), budget.total))) as pool:
+            jobs = {name: pool.submit(OutputRouter.carry(cls.build), apk, {**options, **variants[name]})
+                    for name, apk in snapshots.items()}
+            return {name: job.result() for name, job in jobs.items()}
+
+    @staticmethod
+    def decode(apk_paths: List[str], options: Dict[str, object], verbose: bool = False):
+        """The decoded (and merged) base APK, ready for patching."""
+        from APK import APK
+        flags = {"asset_passthrough": bool(options.get("asset_passthrough")),
+                 "single_dex": not options.get("smali_all_dex"),
+                 "smali_app": bool(options.get("frida_gadget"))}
+        base = APK(apk_paths[0], verbose=verbose, **flags)
+        if len(apk_paths) == 1:
+            base.disassemble()
+        else:
+            others = [APK(p, verbose=verbose, **flags) for p in apk_paths[1:]]
+            base.merge_with(others, disable_styles_hack=bool(options.get("disable_styles_hack")),
+                            binary_resources=not options.get("decode_splits"))
+            for apk in others:
+                apk.cleanup()
+        return base
+
+    @staticmethod
+    def build(base, options: Dict[str, object]):
+        """Patch a decoded APK and build it; base.apk_path is then the rebuilt APK."""
+        base.apply_patches(version=options.get("gadget_version"),
+                           enable_user_certs=bool(options.get("enable_user_certs")),
+                           frida_gadget=bool(options.get("frida_gadget")),
+                           extract_native_libs=not options.get("uncompressed_native_libs"))
+        base.assemble()
+        if options.get("uncompressed_native_libs"):
+            base.store_native_libs_uncompressed()
+        base.splice_passthrough()
+        return base
+
+    @classmethod
+    def file_sha256(cls, path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(cls.CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    # ---------- Internals ----------
+    def _blob(self, sha: str) -> Path:
+        return self.root / sha
+
+    def _receive(self, sha: str, stream, length: int) -> bool:
+        """Store an upload; False (and nothing stored) if it doesn't hash to sha."""
+        tmp = self.root / f".{sha}.{threading.get_ident()}.tmp"
+        h = hashlib.sha256()
+        with open(tmp, "wb") as fh:
+            while length > 0:
+                chunk = stream.read(min(self.CHUNK, length))
+                if not chunk:
+                    break
+                h.update(chunk)
+                fh.write(chunk)
+                length -= len(chunk)
+        if length or h.hexdigest() != sha:
+            tmp.unlink()
+            return False
+        os.replace(tmp, self._blob(sha))
+        self._evict()
+        return True
+
+    def _run_job(self, inputs: List[dict], options: Dict[str, object]) -> dict:
+        shas = [i["sha256"] for i in inputs]
+        with self._slots:
+            # Checked and pinned under the eviction lock, once the job has its
+            # slot: an input can't disappear between this check and the build
+            with self._lock:
+                missing = [sha for sha in shas if not self._blob(sha).is_file()]
+                if missing:
+                    return {"missing": missing}
+                self._pinned.update(shas)
+                self.running += 1
+            started = time.monotonic()
+            ws = base = None
+            try:
+                ws = Workspace(inputs=[str(self._blob(sha)) for sha in shas], prefix="patchapk_worker_",
+                               tmpfs=False, verbose=self.verbose)
+                paths = []
+                # Keep the split names: the merge and split classification look at them
+                for i, name in zip(inputs, self._input_names(inputs)):
+                    dest = os.path.join(ws.path, name)
+                    Materializer.materialize(str(self._blob(i["sha256"])), dest)
+                    os.utime(self._blob(i["sha256"]))
+                    paths.append(dest)
+                with contextlib.ExitStack() as held:
+                    if options.get("frida_gadget"):
+                        from FridaGadget import FridaGadget
+                        # Pinned until the build has copied the gadgets out
+                        held.enter_context(FridaGadget(verbose=self.verbose).obtained(options.get("gadget_version")))
+                    base = self.rebuild(paths, options, self.verbose)
+                sha = self.file_sha256(base.apk_path)
+                Materializer.materialize(base.apk_path, str(self._blob(sha)), keep_src=False)
+                self._evict(keep=sha)
+                return {"output": sha, "size": self._blob(sha).stat().st_size,
+                        "elapsed": round(time.monotonic() - started, 3)}
+            finally:
+                if base is not None:
+                    base.cleanup()
+                if ws is not None:
+                    ws.cleanup()
+                with self._lock:
+                    self._pinned -= collections.Counter(shas)
+                    self.running -= 1
+
+    @staticmethod
+    def _input_names(inputs: List[dict]) -> List[str]:
+        """File names to stage the inputs under; ValueError unless each is a distinct plain name."""
+        names = [os.path.basename(i["name"]) if isinstance(i.get("name"), str) else "" for i in inputs]
+        if any(name in ("", ".", "..") or "\0" in name for name in names):
+            raise ValueError("inputs need file names")
+        if len(set(names)) != len(names):
+            raise ValueError("input names must be unique")
+        return names
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        with self._lock:
+            entries = []
+            for p in self.root.iterdir():
+                if p.name.startswith("."):
+                    continue
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                if p.name == keep or p.name in self._pinned:
+                    continue
+                try:
+                    p.unlink()
+                except OSError:
+                    continue
+                total -= size
+                if self.verbose:
+                    print(f"[worker] Evicted blob {p.name[:12]} ({size // (1024 * 1024)} MiB)")
+
+
+class WorkerPool:
+    """
+    Coordinator side: hands rebuilds to the least busy reachable worker.
+    Shared per process, so concurrent daemon jobs balance across workers.
+    A worker that can't be reached is skipped for RETRY_AFTER seconds; when
+    none can be, WorkerUnavailableError lets the caller build locally.
+    """
+
+    RETRY_AFTER = 60
+
+    _shared: Dict[Tuple[str, ...], "WorkerPool"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, addresses: List[str], verbose: bool = False):
+        self.workers = []
+        for addr in addresses:
+            host, _, port = addr.strip().rpartition(":")
+            if not host or not port.isdigit():
+                raise WorkerError(f"Bad worker address '{addr}' (expected host:port)")
+            self.workers.append({"host": host, "port": int(port), "busy": 0, "down_until": 0.0})
+        self.token = os.environ.get("PATCHAPK_WORKER_TOKEN") or None
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, addresses: List[str], verbose: bool = False) -> "WorkerPool":
+        key = tuple(a.strip() for a in addresses)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = WorkerPool(list(key), verbose)
+            pool = cls._shared[key]
+        pool.verbose = pool.verbose or verbose
+        return pool
+
+    # ---------- Public APIs ----------
+    def rebuild(self, apk_paths: List[str], options: Dict[str, object], dest: str) -> str:
+        """Build apk_paths (base first) on a worker and download the result to dest."""
+        inputs = [{"name": os.path.basename(p), "sha256": BuildWorker.file_sha256(p), "path": p} for p in apk_paths]
+        tried = set()
+        while True:
+            worker = self._pick(tried)
+            if worker is None:
+                raise WorkerUnavailableError("No build worker reachable")
+            tried.add(id(worker))
+            name = f"{worker['host']}:{worker['port']}"
+            try:
+                result = self._run_on(worker, inputs, options)
+                self._download(worker, result["output"], dest)
+            except (OSError, http.client.HTTPException) as e:
+                print(f"[!] Build worker {name} unreachable ({e})")
+                worker["down_until"] = time.monotonic() + self.RETRY_AFTER
+                continue
+            finally:
+                with self._lock:
+                    worker["busy"] -= 1
+            print(f"[+] Rebuilt on worker {name} in {result['elapsed']:.1f}s")
+            return dest
+
+    # ---------- Internals ----------
+    def _pick(self, tried: set) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [w for w in self.workers if id(w) not in tried and w["down_until"] <= now]
+            if not candidates:
+                return None
+            worker = min(candidates, key=lambda w: w["busy"])
+            worker["busy"] += 1
+            return worker
+
+    def _run_on(self, worker: dict, inputs: List[dict], options: Dict[str, object]) -> dict:
+        self._upload_missing(worker, inputs)
+        body = {"inputs": [{"name": i["name"], "sha256": i["sha256"]} for i in inputs], "options": options}
+        for attempt in range(2):
+            status, result = self._json(worker, "POST", "/jobs", body)
+            if status == 409 and attempt == 0:
+                # Evicted between upload and submit: send them again
+                self._upload_missing(worker, [i for i in inputs if i["sha256"] in result.get("missing", [])])
+                continue
+            if status != 200:
+                raise WorkerError(f"Build failed on {worker['host']}:{worker['port']}: "
+                                  f"{result.get('error', f'HTTP {status}')}")
+            return result
+        raise WorkerError("Worker kept losing the uploaded inputs")
+
+    def _upload_missing(self, worker: dict, inputs: List[dict]) -> None:
+        seen = set()
+        for i in inputs:
+            if i["sha256"] in seen:
+                continue
+            seen.add(i["sha256"])
+            conn = self._connect(worker)
+            try:
+                conn.request("HEAD", f"/blobs/{i['sha256']}", headers=self._headers())
+                resp = conn.getresponse()
+                resp.read()
+            finally:
+                conn.close()
+            if resp.status == 200:
+                continue
+            size = os.path.getsize(i["path"])
+            if self.verbose:
+                print(f"[*] Uploading {i['name']} ({size // (1024 * 1024)} MiB) to {worker['host']}:{worker['port']}")
+            conn = self._connect(worker)
+            try:
+                with open(i["path"], "rb") as fh:
+                    conn.request("PUT", f"/blobs/{i['sha256']}", body=fh,
+                                 headers={**self._headers(), "Content-Length": str(size)})
+                    resp = conn.getresponse()
+                    resp.read()
+            finally:
+                conn.close()
+            if resp.status != 201:
+                raise WorkerError(f"Upload of {i['name']} rejected (HTTP {resp.status})")
+
+    def _download(self, worker: dict, sha: str, dest: str) -> None:
+        conn = self._connect(worker)
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        try:
+            conn.request("GET", f"/blobs/{sha}", headers=self._headers())
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise WorkerError(f"Rebuilt APK {sha[:12]} not available (HTTP {resp.status})")
+            h = hashlib.sha256()
+            with open(tmp, "wb") as fh:
+                for chunk in iter(lambda: resp.read(BuildWorker.CHUNK), b""):
+                    h.update(chunk)
+                    fh.write(chunk)
+            if h.hexdigest() != sha:
+                raise WorkerError(f"Rebuilt APK from {worker['host']}:{worker['port']} is corrupt")
+            os.replace(tmp, dest)
+        finally:
+            conn.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _json(self, worker: dict, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, dict]:
+        conn = self._connect(worker)
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                         headers={**self._headers(), "Content-Type": "application/json"})
+            resp = conn.getresponse()
+            return resp.status, json.loads(resp.read() or b"{}")
+        finally:
+            conn.close()
+
+    def _connect(self, worker: dict) -> http.client.HTTPConnection:
+        # No timeout: a job blocks for as long as the build takes
+        return http.client.HTTPConnection(worker["host"], worker["port"], timeout=None)
+
+    def _headers(self) -> Dict[str, str]:
+        return {BuildWorker.TOKEN_HEADER: self.token} if self.token else {}
+
+
+class _WorkerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def do_HEAD(self):
+        sha = self._blob_sha()
+        if sha is not None:
+            self.send_response(200 if self.server.worker._blob(sha).is_file() else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def do_PUT(self):
+        sha = self._blob_sha()
+        if sha is None:
+            return
+        ok = self.server.worker._receive(sha, self.rfile, int(self.headers.get("Content-Length", "0")))
+        self._json(201 if ok else 400, {} if ok else {"error": "content does not match its hash"})
+
+    def do_GET(self):
+        worker: BuildWorker = self.server.worker
+        if self.path == "/status":
+            if self._authorized():
+                self._json(200, {"jobs": worker.jobs, "running": worker.running})
+            return
+        sha = self._blob_sha()
+        if sha is None:
+            return
+        blob = worker._blob(sha)
+        try:
+            fh = open(blob, "rb")
+        except OSError:
+            return self._json(404, {"error": "no such blob"})
+        with fh:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.android.package-archive")
+            self.send_header("Content-Length", str(os.fstat(fh.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(fh, self.wfile, BuildWorker.CHUNK)
+
+    def do_POST(self):
+        worker: BuildWorker = self.server.worker
+        if not self._authorized():
+            return
+        if self.path.rstrip("/") != "/jobs":
+            return self._json(404, {"error": "not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+            inputs, options = body["inputs"], body.get("options", {})
+            if not inputs or not all(self._is_sha(i.get("sha256", "")) for i in inputs):
+                raise ValueError("inputs need sha256 hashes")
+            worker._input_names(inputs)
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            return self._json(400, {"error": f"bad job: {e}"})
+        try:
+            result = worker._run_job(inputs, options)
+        except Exception as e:
+            print(f"[worker] job failed: {e}")
+            return self._json(500, {"error": str(e)})
+        self._json(409 if "missing" in result else 200, result)
+
+    def _blob_sha(self) -> Optional[str]:
+        if not self._authorized():
+            return None
+        parts = [p for p in self.path.split("/") if p]
+        if len(parts) != 2 or parts[0] != "blobs" or not self._is_sha(parts[1]):
+            self._json(404, {"error": "not found"})
+            return None
+        return parts[1]
+
+    @staticmethod
+    def _is_sha(value: str) -> bool:
+        return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+    def _authorized(self) -> bool:
+        token = self.server.worker.token
+        if token is None:
+            return True
+        if secrets.compare_digest(self.headers.get(BuildWorker.TOKEN_HEADER, ""), token):
+            return True
+        self._json(403, {"error": "bad or missing token"})
+        return False
+
+    def _json(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
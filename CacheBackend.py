@@ -0,0 +1,464 @@
+import os, re, json, time, queue, atexit, shutil, hashlib, secrets, threading, http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from PullCache import PullCache
+from Materializer import Materializer
+
+class CacheBackendError(RuntimeError): pass
+
+class CacheBackend:
+    """
+    Shared cache that several hosts read and fill, next to the per-host
+    caches (ResultCache, FridaGadget, decoded trees in APK.disassemble).
+
+    Configured with PATCHAPK_REMOTE_CACHE:
+        /shared/dir or file:///shared/dir   LocalDirCacheBackend (NFS, SMB, ...)
+        http://host:port[/prefix]           HttpCacheBackend (see CacheServer)
+
+    Objects live under a namespace (trees, gadgets, results) and a key, and
+    carry the SHA-256 of their content: every download is hashed while it is
+    written and dropped on a mismatch. A failing backend only costs the
+    lookup; it never fails the patch job.
+
+    Gadgets are checked against GitHub's release digests and results against
+    the local signing key before use, but a decoded tree can't be checked:
+    it is built into the signed APK as is. Trees are therefore only shared
+    with PATCHAPK_REMOTE_CACHE_TREES=1, for stores whose writers are trusted.
+
+    put_async() is write-behind: the file is staged (reflink or hardlink, so
+    the caller may delete it right away) and uploaded by one background
+    thread. At exit the process waits up to PATCHAPK_REMOTE_CACHE_DRAIN
+    seconds (default 120) for pending uploads.
+    """
+
+    NAMESPACES = ("trees", "gadgets", "results")
+    KEY_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,199}$")
+    CHUNK = 1024 * 1024
+    DEFAULT_DRAIN = 120
+
+    _shared: Optional["CacheBackend"] = None
+    _shared_url: Optional[str] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self._queue: "queue.Queue[Tuple[str, str, Union[str, Callable[[], Optional[str]]]]]" = queue.Queue()
+        self._uploader: Optional[threading.Thread] = None
+        self._staging = PullCache.default_root() / "remote-staging"
+
+    @classmethod
+    def shared(cls, verbose: bool = False) -> Optional["CacheBackend"]:
+        """The backend PATCHAPK_REMOTE_CACHE names, or None when it is unset."""
+        url = os.environ.get("PATCHAPK_REMOTE_CACHE") or None
+        with cls._shared_lock:
+            if url != cls._shared_url:
+                cls._shared, cls._shared_url = (cls.from_url(url) if url else None), url
+            if cls._shared is not None:
+                cls._shared.verbose = cls._shared.verbose or verbose
+            return cls._shared
+
+    @staticmethod
+    def share_trees() -> bool:
+        return os.environ.get("PATCHAPK_REMOTE_CACHE_TREES", "") == "1"
+
+    @staticmethod
+    def from_url(url: str) -> "CacheBackend":
+        parts = urlsplit(url)
+        if parts.scheme in ("http", "https"):
+            return HttpCacheBackend(url)
+        if parts.scheme == "file":
+            return LocalDirCacheBackend(parts.path)
+        if parts.scheme and len(parts.scheme) > 1:
+            raise CacheBackendError(f"Unsupported remote cache URL '{url}'")
+        return LocalDirCacheBackend(url)
+
+    # ---------- Public APIs ----------
+    def get(self, namespace: str, key: str, dest: str) -> bool:
+        """Download into dest (atomically). False on a miss, a corrupt object or an unreachable backend."""
+        self._check(namespace, key)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.remote"
+        started = time.monotonic()
+        try:
+            expected = self._get(namespace, key, tmp)
+            if expected is None:
+                return False
+            actual = self.file_sha256(tmp)
+            if actual != expected:
+                print(f"[!] Remote cache object {namespace}/{key} is corrupt (sha256 {actual[:12]}, "
+                      f"expected {expected[:12]}); ignoring it")
+                return False
+            os.replace(tmp, dest)
+        except (OSError, http.client.HTTPException, CacheBackendError) as e:
+            if self.verbose:
+                print(f"[!] Remote cache lookup {namespace}/{key} failed: {e}")
+            return False
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if self.verbose:
+            print(f"[+] Remote cache hit: {namespace}/{key} "
+                  f"({os.path.getsize(dest) // (1024 * 1024)} MiB in {time.monotonic() - started:.1f}s)")
+        return True
+
+    def put(self, namespace: str, key: str, src: str) -> None:
+        self._check(namespace, key)
+        if self._exists(namespace, key):
+            return
+        self._put(namespace, key, src, self.file_sha256(src))
+
+    def put_async(self, namespace: str, key: str, src: str, owned: bool = False) -> None:
+        """
+        Queue an upload and return. src must not be modified in place
+        afterwards; owned=True hands the file over (it is moved, then removed).
+        """
+        self._check(namespace, key)
+        self._staging.mkdir(parents=True, exist_ok=True)
+        staged = str(self._staging / f"{namespace}.{key}.{os.getpid()}.{secrets.token_hex(4)}")
+        try:
+            Materializer.materialize(src, staged, keep_src=not owned)
+        except OSError as e:
+            if self.verbose:
+                print(f"[!] Could not stage {namespace}/{key} for upload: {e}")
+            return
+        self._enqueue(namespace, key, staged)
+
+    def put_async_built(self, namespace: str, key: str, build: Callable[[], Optional[str]]) -> None:
+        """
+        put_async() for a file that is expensive to produce: the upload thread
+        calls build(), which returns a path it hands over (or None to skip).
+        """
+        self._check(namespace, key)
+        self._enqueue(namespace, key, build)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued uploads; True if none are left."""
+        if timeout is None:
+            env = os.environ.get("PATCHAPK_REMOTE_CACHE_DRAIN", "")
+            timeout = int(env) if env.isdigit() else self.DEFAULT_DRAIN
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                print(f"[!] {self._queue.unfinished_tasks} remote cache upload(s) abandoned")
+                return False
+            time.sleep(0.1)
+        return True
+
+    @classmethod
+    def file_sha256(cls, path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(cls.CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    # ---------- Internals ----------
+    def _get(self, namespace: str, key: str, dest: str) -> Optional[str]:
+        """Write the object to dest and return its recorded SHA-256, or None on a miss."""
+        raise NotImplementedError
+
+    def _put(self, namespace: str, key: str, src: str, sha: str) -> None:
+        raise NotImplementedError
+
+    def _exists(self, namespace: str, key: str) -> bool:
+        raise NotImplementedError
+
+    def _check(self, namespace: str, key: str) -> None:
+        if namespace not in self.NAMESPACES or not self.KEY_RE.match(key):
+            raise CacheBackendError(f"Bad remote cache object name {namespace}/{key}")
+
+    def _enqueue(self, namespace: str, key: str, staged: Union[str, Callable[[], Optional[str]]]) -> None:
+        with self._shared_lock:
+            if self._uploader is None:
+                self._uploader = threading.Thread(target=self._upload_loop, name="patchapk-remote-cache",
+                                                  daemon=True)
+                self._uploader.start()
+                atexit.register(self.drain)
+        self._queue.put((namespace, key, staged))
+
+    def _upload_loop(self) -> None:
+        while True:
+            namespace, key, staged = self._queue.get()
+            started = time.monotonic()
+            try:
+                if callable(staged):
+                    staged = staged()
+                    if staged is None:
+                        continue
+                self.put(namespace, key, staged)
+                if self.verbose:
+                    print(f"[+] Uploaded {namespace}/{key} to the remote cache in {time.monotonic() - started:.1f}s")
+            except (OSError, http.client.HTTPException, CacheBackendError) as e:
+                print(f"[!] Remote cache upload {namespace}/{key} failed: {e}")
+            finally:
+                if isinstance(staged, str):
+                    try:
+                        os.remove(staged)
+                    except OSError:
+                        pass
+                self._queue.task_done()
+
+
+class LocalDirCacheBackend(CacheBackend):
+    """
+    Directory backend: <root>/<namespace>/<key> and <key>.sha256, written by
+    rename. Objects are evicted least recently used (a download refreshes
+    the mtime) once the directory outgrows PATCHAPK_REMOTE_CACHE_MB (default
+    16384); every host writing to a shared directory applies its own cap.
+    """
+
+    DEFAULT_MAX_MB = 16384
+
+    def __init__(self, root: str, verbose: bool = False, max_bytes: Optional[int] = None):
+        super().__init__(verbose)
+        self.root = Path(root).expanduser()
+        env = os.environ.get("PATCHAPK_REMOTE_CACHE_MB", "")
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            (int(env) if env.isdigit() else self.DEFAULT_MAX_MB) * 1024 * 1024
+        self._lock = threading.Lock()
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Drop least-recently-used objects, across namespaces, until the store fits its cap."""
+        with self._lock:
+            entries = []
+            for namespace in self.NAMESPACES:
+                try:
+                    children = list((self.root / namespace).iterdir())
+                except OSError:
+                    continue
+                for p in children:
+                    if p.name.startswith(".") or p.name.endswith(".sha256"):
+                        continue
+                    try:
+                        st = p.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                if p == keep:
+                    continue
+                # The digest goes first: readers treat an object without one as absent
+                for victim in (p.with_name(f"{p.name}.sha256"), p):
+                    try:
+                        victim.unlink()
+                    except OSError:
+                        pass
+                total -= size
+                if self.verbose:
+                    print(f"[+] Evicted {p.parent.name}/{p.name} from the remote cache "
+                          f"({size // (1024 * 1024)} MiB)")
+
+    def _get(self, namespace: str, key: str, dest: str) -> Optional[str]:
+        obj = self.root / namespace / key
+        try:
+            expected = (self.root / namespace / f"{key}.sha256").read_text(encoding="ascii").strip()
+        except OSError:
+            return None
+        # Never link: dest may be modified, and the share may be another filesystem anyway
+        Materializer.materialize(str(obj), dest, allow_link=False)
+        os.utime(obj)
+        return expected
+
+    def _put(self, namespace: str, key: str, src: str, sha: str) -> None:
+        folder = self.root / namespace
+        folder.mkdir(parents=True, exist_ok=True)
+        tmp = folder / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        Materializer.materialize(src, str(tmp), allow_link=False)
+        os.replace(tmp, folder / key)
+        # The digest goes last: readers treat an object without one as absent
+        (folder / f".{key}.sha256.tmp").write_text(sha, encoding="ascii")
+        os.replace(folder / f".{key}.sha256.tmp", folder / f"{key}.sha256")
+        self.evict(keep=folder / key)
+
+    def _exists(self, namespace: str, key: str) -> bool:
+        return (self.root / namespace / f"{key}.sha256").is_file()
+
+
+class HttpCacheBackend(CacheBackend):
+    """
+    GET/HEAD/PUT <url>/<namespace>/<key>. The digest travels in
+    X-Content-SHA256 both ways; PATCHAPK_REMOTE_CACHE_TOKEN, when set, is sent
+    as a bearer token.
+    """
+
+    DIGEST_HEADER = "X-Content-SHA256"
+    TIMEOUT = 30
+
+    def __init__(self, url: str, verbose: bool = False):
+        super().__init__(verbose)
+        parts = urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host, self.port = parts.hostname, parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.token = os.environ.get("PATCHAPK_REMOTE_CACHE_TOKEN") or None
+
+    def _get(self, namespace: str, key: str, dest: str) -> Optional[str]:
+        conn = self._connect()
+        try:
+            conn.request("GET", self._path(namespace, key), headers=self._headers())
+            resp = conn.getresponse()
+            if resp.status == 404:
+                resp.read()
+                return None
+            if resp.status != 200:
+                raise CacheBackendError(f"HTTP {resp.status}")
+            expected = resp.getheader(self.DIGEST_HEADER)
+            if not expected:
+                raise CacheBackendError(f"no {self.DIGEST_HEADER} header")
+            with open(dest, "wb") as fh:
+                shutil.copyfileobj(resp, fh, self.CHUNK)
+            return expected.lower()
+        finally:
+            conn.close()
+
+    def _put(self, namespace: str, key: str, src: str, sha: str) -> None:
+        conn = self._connect(timeout=None)
+        try:
+            with open(src, "rb") as fh:
+                conn.request("PUT", self._path(namespace, key), body=fh,
+                             headers={**self._headers(), self.DIGEST_HEADER: sha,
+                                      "Content-Length": str(os.path.getsize(src))})
+                resp = conn.getresponse()
+                resp.read()
+            if resp.status not in (200, 201, 204):
+                raise CacheBackendError(f"HTTP {resp.status}")
+        finally:
+            conn.close()
+
+    def _exists(self, namespace: str, key: str) -> bool:
+        conn = self._connect()
+        try:
+            conn.request("HEAD", self._path(namespace, key), headers=self._headers())
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status == 200
+        finally:
+            conn.close()
+
+    def _connect(self, timeout: Optional[float] = TIMEOUT) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout)
+
+    def _path(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}/{namespace}/{key}"
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+
+class CacheServer:
+    """
+    Minimal server for HttpCacheBackend, on top of a LocalDirCacheBackend
+    directory (<cache root>/remote-store by default), which it evicts the same
+    way. Uploads are stored only if they hash to their X-Content-SHA256. Good for a team share or for
+    trying the protocol on localhost; PATCHAPK_REMOTE_CACHE_TOKEN is required
+    on non-loopback addresses.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 7702, root: Optional[str] = None, verbose: bool = False):
+        self.host, self.port = host, port
+        self.store = LocalDirCacheBackend(root or str(PullCache.default_root() / "remote-store"), verbose=verbose)
+        self.token = os.environ.get("PATCHAPK_REMOTE_CACHE_TOKEN") or None
+        self.verbose = verbose
+
+    # ---------- Public APIs ----------
+    def serve(self) -> None:
+        if self.host not in ("127.0.0.1", "localhost", "::1") and not self.token:
+            raise CacheBackendError("Set PATCHAPK_REMOTE_CACHE_TOKEN before serving on a non-loopback address")
+        server = ThreadingHTTPServer((self.host, self.port), _CacheHandler)
+        server.daemon_threads = True
+        server.cache = self
+        print(f"[+] patch-apk cache server on {self.host}:{self.port} ({self.store.root})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class _CacheHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def do_HEAD(self):
+        name = self._object()
+        if name is not None:
+            self._reply(200 if self.server.cache.store._exists(*name) else 404)
+
+    def do_GET(self):
+        name = self._object()
+        if name is None:
+            return
+        store: LocalDirCacheBackend = self.server.cache.store
+        namespace, key = name
+        try:
+            sha = (store.root / namespace / f"{key}.sha256").read_text(encoding="ascii").strip()
+            fh = open(store.root / namespace / key, "rb")
+        except OSError:
+            return self._reply(404)
+        try:
+            os.utime(store.root / namespace / key)  # LRU: a download makes the object the newest
+        except OSError:
+            pass
+        with fh:
+            self.send_response(200)
+            self.send_header(HttpCacheBackend.DIGEST_HEADER, sha)
+            self.send_header("Content-Length", str(os.fstat(fh.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(fh, self.wfile, CacheBackend.CHUNK)
+
+    def do_PUT(self):
+        name = self._object()
+        if name is None:
+            return
+        store: LocalDirCacheBackend = self.server.cache.store
+        expected = (self.headers.get(HttpCacheBackend.DIGEST_HEADER) or "").lower()
+        length = int(self.headers.get("Content-Length", "0"))
+        folder = store.root / name[0]
+        folder.mkdir(parents=True, exist_ok=True)
+        tmp = folder / f".upload.{threading.get_ident()}.tmp"
+        h = hashlib.sha256()
+        try:
+            with open(tmp, "wb") as fh:
+                while length > 0:
+                    chunk = self.rfile.read(min(CacheBackend.CHUNK, length))
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    fh.write(chunk)
+                    length -= len(chunk)
+            if length or h.hexdigest() != expected:
+                return self._reply(400, {"error": "content does not match its X-Content-SHA256"})
+            store._put(*name, str(tmp), expected)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self._reply(201)
+
+    def _object(self) -> Optional[Tuple[str, str]]:
+        token = self.server.cache.token
+        if token is not None and not secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+            self._reply(403, {"error": "bad or missing token"})
+            return None
+        parts = [p for p in self.path.split("/") if p]
+        if len(parts) < 2 or parts[-2] not in CacheBackend.NAMESPACES or not CacheBackend.KEY_RE.match(parts[-1]) \
+                or parts[-1].endswith(".sha256"):
+            self._reply(404)
+            return None
+        return parts[-2], parts[-1]
+
+    def _reply(self, status: int, payload: Optional[dict] = None) -> None:
+        data = json.dumps(payload).encode("utf-8") if payload else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data and self.command != "HEAD":
+            self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        if self.server.cache.verbose:
+            super().log_message(format, *args)
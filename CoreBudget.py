@@ -0,0 +1,101 @@
+import os, threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence
+
+class CoreBudget:
+    """
+    Process-wide CPU core budget for apktool invocations.
+
+    Each decode/build takes a slot and is granted a share of the budget, which
+    becomes its `-j <threads>` value: a lone job gets every core, concurrent
+    jobs split them (weighted, e.g. by APK size) instead of each JVM spawning
+    cpu_count() smali threads. A job waits while the budget is exhausted.
+
+    The budget defaults to os.cpu_count() and can be set with PATCHAPK_CORES.
+    """
+
+    _shared: Optional["CoreBudget"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, total: Optional[int] = None, verbose: bool = False):
+        env = os.environ.get("PATCHAPK_CORES", "")
+        self.total = max(1, total or (int(env) if env.isdigit() else 0) or os.cpu_count() or 1)
+        self.verbose = verbose
+        self._free = self.total
+        self._in_flight = 0
+        self._active_weight = 0.0
+        self._waiting_weight = 0.0
+        self._waiting_jobs = 0
+        # Announced-but-not-started jobs, one {"jobs", "weight"} entry per open batch()
+        self._batches: List[dict] = []
+        self._cond = threading.Condition()
+
+    @classmethod
+    def shared(cls) -> "CoreBudget":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = CoreBudget()
+            return cls._shared
+
+    # ---------- Public APIs ----------
+    @contextmanager
+    def batch(self, weights: Sequence[float]) -> Iterator[None]:
+        """
+        Announce jobs about to be started together, so the first one to start
+        does not take every core before the others have asked.
+        """
+        entry = {"jobs": len(weights), "weight": float(sum(weights))}
+        with self._cond:
+            self._batches.append(entry)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._batches.remove(entry)
+                self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, label: str = "apktool", weight: float = 1.0, verbose: bool = False) -> Iterator[int]:
+        """Reserve cores for one job; yields the thread count to pass as -j."""
+        threads = self.acquire(label, weight, verbose)
+        try:
+            yield threads
+        finally:
+            self.release(threads, weight)
+
+    def acquire(self, label: str = "apktool", weight: float = 1.0, verbose: bool = False) -> int:
+        weight = max(float(weight), 1e-9)
+        with self._cond:
+            # A job announced through batch() stops counting as planned once it asks
+            for entry in self._batches:
+                if entry["jobs"] > 0:
+                    entry["jobs"] -= 1
+                    entry["weight"] = max(0.0, entry["weight"] - weight)
+                    break
+            self._waiting_weight += weight
+            self._waiting_jobs += 1
+            while self._free < 1:
+                self._cond.wait()
+            self._waiting_weight -= weight
+            self._waiting_jobs -= 1
+            planned_weight = sum(e["weight"] for e in self._batches)
+            planned_jobs = sum(e["jobs"] for e in self._batches)
+            demand = self._active_weight + self._waiting_weight + planned_weight + weight
+            share = int(round(self.total * weight / demand))
+            # Leave at least one core for every other job that is waiting or announced
+            reserve = min(self._free - 1, self._waiting_jobs + planned_jobs)
+            threads = max(1, min(self._free - reserve, share))
+            self._free -= threads
+            self._in_flight += 1
+            self._active_weight += weight
+            if self.verbose or verbose:
+                print(f"[cores] {label}: -j {threads} ({self._in_flight} in flight, "
+                      f"{self._free}/{self.total} cores free)")
+            return threads
+
+    def release(self, threads: int, weight: float = 1.0) -> None:
+        with self._cond:
+            self._free += threads
+            self._in_flight -= 1
+            self._active_weight = max(0.0, self._active_weight - max(float(weight), 1e-9))
+            self._cond.notify_all()
@@ -0,0 +1,136 @@
+import os, re, sys
+from typing import Callable, Dict, List, Optional
+
+try:
+    from patch_apk.utils import device_snapshot
+except ImportError:
+    # Run from a checkout: the package lives under src/ next to this file
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+    from patch_apk.utils import device_snapshot
+
+class DeviceSnapshot:
+    """
+    Everything patch-apk needs to know about a device, collected in a single
+    shell invocation: users, ABI list, SDK level and, per user, the installed
+    packages with their APK paths, versionCode and uid.
+
+    Package matching, user fallback and path lookup are then answered from memory.
+    """
+
+    # The package's script: one round trip, package directories under
+    # /data/app listed so split APK paths are known without a `pm path` per
+    # package, and an end marker that tells a complete run from a cut-short one.
+    SECTION = device_snapshot.SNAPSHOT_SECTION
+    SCRIPT = device_snapshot.SNAPSHOT_SCRIPT
+
+    def __init__(self):
+        self.sdk: Optional[int] = None
+        self.abis: List[str] = []
+        self.users: List[str] = []
+        # user -> package -> {"path", "version_code", "uid"}
+        self.packages_by_user: Dict[str, Dict[str, dict]] = {}
+        # package directory -> APK file names in it
+        self.dirs: Dict[str, List[str]] = {}
+        # The script's end marker was seen
+        self.complete = False
+
+    # ---------- Creation ----------
+    @classmethod
+    def capture(cls, run_shell: Callable[[str], str]) -> Optional["DeviceSnapshot"]:
+        """
+        run_shell executes a device shell command line and returns its stdout.
+        None if the output stops before the script's end marker.
+        """
+        snap = cls.parse(run_shell(cls.SCRIPT))
+        return snap if snap.complete else None
+
+    @classmethod
+    def parse(cls, text: str) -> "DeviceSnapshot":
+        snap = cls()
+        section, arg = None, None
+        for raw in text.splitlines():
+            line = raw.strip()
+            if not line:
+                continue
+            if line.startswith(cls.SECTION + " "):
+                parts = line.split(" ", 2)
+                section = parts[1]
+                arg = parts[2] if len(parts) > 2 else None
+                if section == "packages":
+                    snap.packages_by_user.setdefault(arg, {})
+                elif section == "dir":
+                    snap.dirs.setdefault(arg, [])
+                elif section == "end":
+                    snap.complete = True
+                continue
+            if section == "sdk" and line.isdigit():
+                snap.sdk = int(line)
+            elif section == "abis":
+                snap.abis = [a for a in line.split(",") if a]
+            elif section == "users":
+                snap.users += re.findall(r"UserInfo{(\d+):", line)
+            elif section == "packages" and line.startswith("package:"):
+                name, info = cls._parse_package_line(line[8:])
+                if name:
+                    snap.packages_by_user[arg][name] = info
+            elif section == "dir" and line.endswith(".apk"):
+                snap.dirs[arg].append(line)
+        return snap
+
+    # ---------- Queries ----------
+    def packages(self, pattern: Optional[str] = None, user: Optional[str] = None) -> List[str]:
+        users = [user] if user is not None else list(self.packages_by_user)
+        names = set()
+        for u in users:
+            for name in self.packages_by_user.get(u, {}):
+                if pattern is None or pattern.lower() in name.lower():
+                    names.add(name)
+        return sorted(names)
+
+    def users_with(self, package: str) -> List[str]:
+        return [u for u, pkgs in self.packages_by_user.items() if package in pkgs]
+
+    def info(self, package: str, user: str) -> Optional[dict]:
+        return self.packages_by_user.get(user, {}).get(package)
+
+    def apk_paths(self, package: str, user: str) -> List[str]:
+        """
+        base.apk first, then splits. Empty if the package is not installed for
+        that user, or if its split layout is unknown (caller should ask `pm path`).
+        """
+        info = self.info(package, user)
+        if info is None:
+            return []
+        base = info["path"]
+        d, _, fname = base.rpartition("/")
+        if d not in self.dirs:
+            # Not under /data/app (system app): single APK unless proven otherwise
+            return [base] if not base.startswith("/data/app/") else []
+        splits = sorted(f for f in self.dirs[d] if f != fname)
+        return [base] + [f"{d}/{f}" for f in splits]
+
+    def version_code_for(self, remote_path: str) -> Optional[int]:
+        """versionCode of the package whose directory holds remote_path."""
+        d = remote_path.rpartition("/")[0]
+        for pkgs in self.packages_by_user.values():
+            for info in pkgs.values():
+                if info["path"].rpartition("/")[0] == d:
+                    return info["version_code"]
+        return None
+
+    # ---------- Internals ----------
+    @staticmethod
+    def _parse_package_line(rest: str):
+        # "<path>=<name> versionCode:<n> uid:<n>"; path may itself contain '='
+        tokens = rest.split()
+        if not tokens:
+            return None, None
+        path, _, name = tokens[0].rpartition("=")
+        info = {"path": path, "version_code": None, "uid": None}
+        for tok in tokens[1:]:
+            key, _, val = tok.partition(":")
+            if key == "versionCode" and val.isdigit():
+                info["version_code"] = int(val)
+            elif key == "uid" and val.isdigit():
+                info["uid"] = int(val)
+        return name, info
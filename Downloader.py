@@ -0,0 +1,252 @@
+import os, json, hashlib, shutil, threading
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError, URLError
+from typing import Dict, List, Optional, Tuple
+
+class DownloadError(RuntimeError): pass
+
+class Downloader:
+    """
+    Streaming HTTP(S) downloader for large APKs.
+
+    - Streams to disk in chunks; memory use does not grow with file size.
+    - Resumes an interrupted download (<dest>.part) with an HTTP Range request,
+      guarded by If-Range so a changed remote file restarts from zero.
+    - Optionally splits the transfer into parallel range segments when the
+      server advertises Accept-Ranges and a Content-Length.
+    - With a cache_dir, keeps completed downloads keyed by URL and validated
+      against the server's ETag / Last-Modified, so repeat URLs are not
+      downloaded again. The cache is evicted least-recently-used first past
+      PATCHAPK_DOWNLOAD_CACHE_MB (default 4096).
+    """
+
+    CHUNK = 1024 * 1024
+    MIN_SEGMENT = 8 * 1024 * 1024
+    DEFAULT_CACHE_MB = 4096
+
+    def __init__(self, cache_dir: Optional[str] = None, segments: int = 1, retries: int = 3,
+                 timeout: float = 60, user_agent: str = "curl/7.79", max_cache_bytes: Optional[int] = None,
+                 verbose: bool = False):
+        self.cache_dir = cache_dir
+        env = os.environ.get("PATCHAPK_DOWNLOAD_CACHE_MB", "")
+        self.max_cache_bytes = max_cache_bytes if max_cache_bytes is not None else \
+            (int(env) if env.isdigit() else self.DEFAULT_CACHE_MB) * 1024 * 1024
+        self.segments = max(1, segments)
+        self.retries = retries
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.verbose = verbose
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # ---------- Public APIs ----------
+    def fetch(self, url: str, dest: str) -> int:
+        """Download url to dest. Returns the size of dest in bytes."""
+        meta = self._probe(url)
+
+        cached = self._cache_lookup(url, meta)
+        if cached:
+            self._materialize(cached, dest)
+            if self.verbose:
+                print(f"[+] Download cache hit: {url}")
+            return os.path.getsize(dest)
+
+        part = dest + ".part"
+        state = part + ".json"
+        size = meta.get("size")
+        ranges = meta.get("ranges") and size is not None
+
+        if ranges and self.segments > 1 and size >= 2 * self.MIN_SEGMENT:
+            self._fetch_segmented(url, part, size, meta)
+        else:
+            offset = 0
+            if ranges and os.path.exists(part) and self._load_json(state).get("validator") == meta.get("validator"):
+                offset = os.path.getsize(part)
+                if self.verbose and offset:
+                    print(f"[+] Resuming download at {offset} bytes")
+            self._dump_json(state, {"validator": meta.get("validator")})
+            self._fetch_stream(url, part, offset, size, meta)
+
+        if size is not None and os.path.getsize(part) != size:
+            raise DownloadError(f"Incomplete download of {url}: {os.path.getsize(part)}/{size} bytes")
+        os.replace(part, dest)
+        if os.path.exists(state):
+            os.remove(state)
+        self._cache_store(url, meta, dest)
+        return os.path.getsize(dest)
+
+    # ---------- Internals ----------
+    def _request(self, url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None):
+        h = {"User-Agent": self.user_agent}
+        h.update(headers or {})
+        return urlopen(Request(url, headers=h, method=method), timeout=self.timeout)
+
+    def _probe(self, url: str) -> dict:
+        """HEAD the URL for size, range support and validators. Empty dict if HEAD isn't allowed."""
+        try:
+            with self._request(url, "HEAD") as r:
+                headers = r.headers
+        except (HTTPError, URLError):
+            return {}
+        length = headers.get("Content-Length")
+        etag = headers.get("ETag")
+        modified = headers.get("Last-Modified")
+        return {
+            "size": int(length) if length and length.isdigit() else None,
+            "ranges": headers.get("Accept-Ranges", "").lower() == "bytes",
+            "etag": etag,
+            "last_modified": modified,
+            # Weak ETags are not valid for If-Range; fall back to Last-Modified
+            "validator": etag if etag and not etag.startswith("W/") else modified,
+        }
+
+    def _fetch_stream(self, url: str, part: str, offset: int, size: Optional[int], meta: dict):
+        attempt = 0
+        while True:
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if meta.get("validator"):
+                    headers["If-Range"] = meta["validator"]
+            try:
+                with self._request(url, headers=headers) as r:
+                    if offset and r.status != 206:
+                        # Server ignored the range (or the file changed): restart
+                        offset = 0
+                    with open(part, "ab" if offset else "wb") as fh:
+                        while True:
+                            chunk = r.read(self.CHUNK)
+                            if not chunk:
+                                break
+                            fh.write(chunk)
+                            offset += len(chunk)
+                if size is None or offset >= size:
+                    return
+                raise DownloadError("connection closed early")
+            except (URLError, OSError, DownloadError) as e:
+                attempt += 1
+                if attempt > self.retries or not meta.get("ranges"):
+                    raise DownloadError(f"Download of {url} failed: {e}") from e
+                if self.verbose:
+                    print(f"[!] Download interrupted at {offset} bytes, retrying ({attempt}/{self.retries})")
+
+    def _fetch_segmented(self, url: str, part: str, size: int, meta: dict):
+        count = min(self.segments, size // self.MIN_SEGMENT)
+        step = -(-size // count)
+        bounds = [(i * step, min(size, (i + 1) * step) - 1) for i in range(count)]
+        with open(part, "wb") as fh:
+            fh.truncate(size)
+        if self.verbose:
+            print(f"[+] Downloading in {count} parallel segments")
+
+        errors: List[BaseException] = []
+
+        def worker(start: int, end: int):
+            pos, attempt = start, 0
+            with open(part, "r+b") as fh:
+                while pos <= end:
+                    headers = {"Range": f"bytes={pos}-{end}"}
+                    if meta.get("validator"):
+                        headers["If-Range"] = meta["validator"]
+                    try:
+                        with self._request(url, headers=headers) as r:
+                            if r.status != 206:
+                                errors.append(DownloadError("server did not honour range request"))
+                                return
+                            fh.seek(pos)
+                            while pos <= end:
+                                chunk = r.read(min(self.CHUNK, end - pos + 1))
+                                if not chunk:
+                                    break
+                                fh.write(chunk)
+                                pos += len(chunk)
+                        if pos <= end:
+                            raise DownloadError("connection closed early")
+                    except (URLError, OSError, DownloadError) as e:
+                        attempt += 1
+                        if attempt > self.retries:
+                            errors.append(e)
+                            return
+
+        threads = [threading.Thread(target=worker, args=b, daemon=True) for b in bounds]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise DownloadError(f"Segmented download of {url} failed: {errors[0]}")
+
+    def _cache_paths(self, url: str) -> Tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".apk"), os.path.join(self.cache_dir, key + ".json")
+
+    def _cache_lookup(self, url: str, meta: dict) -> Optional[str]:
+        if not self.cache_dir or not (meta.get("etag") or meta.get("last_modified")):
+            return None
+        data, info = self._cache_paths(url)
+        stored = self._load_json(info)
+        if not stored or not os.path.exists(data):
+            return None
+        if stored.get("etag") != meta.get("etag") or stored.get("last_modified") != meta.get("last_modified"):
+            return None
+        if meta.get("size") is not None and os.path.getsize(data) != meta["size"]:
+            return None
+        os.utime(data)  # recency for eviction
+        return data
+
+    def _cache_store(self, url: str, meta: dict, path: str):
+        if not self.cache_dir or not (meta.get("etag") or meta.get("last_modified")):
+            return
+        data, info = self._cache_paths(url)
+        self._materialize(path, data)
+        self._dump_json(info, {"url": url, "etag": meta.get("etag"),
+                               "last_modified": meta.get("last_modified")})
+        self._cache_evict()
+
+    def _cache_evict(self):
+        """Drop least-recently-used downloads until the cache fits max_cache_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".apk"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            for victim in (path, path[:-len(".apk")] + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+            if self.verbose:
+                print(f"[cache] Evicted download {os.path.basename(path)} ({size // (1024 * 1024)} MiB)")
+
+    @staticmethod
+    def _materialize(src: str, dest: str):
+        tmp = dest + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+    @staticmethod
+    def _load_json(path: str) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _dump_json(path: str, data: dict):
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
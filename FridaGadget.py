@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
 from __future__ import annotations
+import os
 import re
 import gzip
+import json
 import lzma
 import shutil
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import time
 
-import requests
+from Materializer import Materializer
+from PullCache import PullCache
+from CacheBackend import CacheBackend
 
 
 class FridaGadget:
+    """
+    Downloads Android Frida gadgets into a cache shared by every patch job:
+
+    <cache root>/gadgets/<tag>/<abi>/libfrida-gadget.so
+    <cache root>/gadgets/index.json         latest resolved tag + per-tag last use
+    <cache root>/gadgets/.<tag>.lock        held exclusively while a tag is filled
+    <cache root>/gadgets/.<tag>.pin.lock    held shared by every job using the tag
+
+    Files are written to a temp name and renamed into place, so a crashed or
+    concurrent job never leaves a half-written .so behind. Tags beyond
+    PATCHAPK_GADGET_CACHE_TAGS (default 4) are evicted least recently used
+    first, skipping any tag being filled or pinned: obtained() pins its tag
+    until the job that asked for it is done copying it out.
+
+    With PATCHAPK_REMOTE_CACHE set, release assets are shared as downloaded
+    and only used if they hash to the digest GitHub publishes for the asset:
+    the backend's own digest can't vouch for native code that ends up in
+    every patched app. Assets without a published digest are not shared.
+    """
 
     LATEST_URL = "https://api.github.com/repos/frida/frida/releases/latest"
     TAG_URL_TPL = "https://api.github.com/repos/frida/frida/releases/tags/{tag}"
@@ -25,6 +49,12 @@ class FridaGadget:
         r"^frida-gadget-[0-9.]+-android-(arm64|arm|x86_64|x86)\.so(\.(xz|gz))?$"
     )
 
+    DEFAULT_MAX_TAGS = 4
+    # Release metadata is kept per process: tags never change, "latest" is re-read after this
+    LATEST_TTL = 600
+
+    _releases: Dict[Optional[str], Tuple[float, Dict]] = {}
+
     ARCH_TO_ABI = {
         "arm": "armeabi-v7a",
         "arm64": "arm64-v8a",
@@ -32,26 +62,46 @@ class FridaGadget:
         "x86_64": "x86_64",
     }
 
-    def __init__(self, user_agent: str = "patch-apk", verbose : bool = False):
+    def __init__(self, user_agent: str = "patch-apk", verbose : bool = False, cache_root: Optional[str] = None):
         self.verbose = verbose
-        self.session = requests.Session()
-        self.session.headers.update({
-            "Accept": "application/vnd.github+json",
-            "User-Agent": user_agent,
-        })
-        # Cache root under the script directory
-        self.cache_root = Path(__file__).resolve().parent / ".gadgetCache"
+        self.user_agent = user_agent
+        self._session = None
+        # Outside the install tree: site-packages may be read-only and is shared by every user
+        self.cache_root = Path(cache_root) if cache_root else PullCache.default_root() / "gadgets"
+        env = os.environ.get("PATCHAPK_GADGET_CACHE_TAGS", "")
+        self.max_tags = int(env) if env.isdigit() and int(env) > 0 else self.DEFAULT_MAX_TAGS
+
+    @property
+    def session(self):
+        """requests.Session, imported and built on first network use (a warm cache never needs it)."""
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update({
+                "Accept": "application/vnd.github+json",
+                "User-Agent": self.user_agent,
+            })
+        return self._session
 
     # ---------- Public API ----------
     
 
-    def obtain_gadgets(self, version: Optional[str] = None) -> tuple[str, List[str]]:
+    def obtain_gadgets(self, version: Optional[str] = None) -> str:
         """
         Ensure Android Frida Gadget .so files are cached at:
         <cache_root>/<tag>/<abi>/libfrida-gadget.so
 
-        Returns:
-        (tag, abis_ready)
+        Returns the tag. Nothing keeps it cached afterwards; a job that copies
+        the gadgets out later should use obtained() instead.
+        """
+        with self.obtained(version) as tag:
+            return tag
+
+    @contextmanager
+    def obtained(self, version: Optional[str] = None) -> Iterator[str]:
+        """
+        obtain_gadgets(), with the tag pinned against eviction by other jobs
+        until the block exits. Yields the tag.
         """
         release = self.fetch_release(version=version)
         tag = release.get("tag_name") or "unknown"
@@ -60,10 +110,6 @@ class FridaGadget:
             print(f"[+] Downloading gadget version {tag}")
 
         cache_dir = self.cache_root / tag
-        cache_dir.mkdir(parents=True, exist_ok=True)
-
-        # Which ABIs are already cached?
-        cached_abis = self._cached_abis(cache_dir)
 
         # Assets for Android only
         wanted_assets = [
@@ -73,32 +119,58 @@ class FridaGadget:
         if not wanted_assets:
             raise RuntimeError(f"No Android frida-gadget assets found in release {tag}.")
 
-        # Download any missing ABIs into cache
-        for asset in wanted_assets:
-            name = asset["name"]
-            url = asset["browser_download_url"]
-            arch = self._extract_arch(name)          # arm / arm64 / x86 / x86_64
-            abi = self.ARCH_TO_ABI[arch]             # armeabi-v7a / arm64-v8a / x86 / x86_64
-
-            cache_so = cache_dir / abi / "libfrida-gadget.so"
-            if abi not in cached_abis or not cache_so.exists():
-                if self.verbose:
-                    print(f"[+] Downloading gadget {url}")
-                cache_so.parent.mkdir(parents=True, exist_ok=True)
-
-                tmp_download = cache_so.parent / name     # store the archive in same abi dir
-                self._download_stream(url, tmp_download)
-
-                # Decompress/move into the canonical libfrida-gadget.so in cache
-                self._to_final_so(tmp_download, cache_so, True)
-
-        # Refresh list of ABIs now present
-        abis_ready = self._cached_abis(cache_dir)
-        if self.verbose:
-            for abi in sorted(abis_ready):
-                print(f"[+] Cached: {cache_dir / abi / 'libfrida-gadget.so'}")
-
-        return tag
+        # Other hosts may already have fetched this tag (PATCHAPK_REMOTE_CACHE)
+        remote = CacheBackend.shared(self.verbose)
+
+        # Pinned for the whole job: eviction skips a tag any job holds. One
+        # job fills a tag at a time; the others wait and then find it cached.
+        with self._locked(f"{tag}.pin", shared=True):
+            with self._locked(tag):
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                # Which ABIs are already cached?
+                cached_abis = self._cached_abis(cache_dir)
+
+                # Download any missing ABIs into cache
+                for asset in wanted_assets:
+                    name = asset["name"]
+                    url = asset["browser_download_url"]
+                    arch = self._extract_arch(name)          # arm / arm64 / x86 / x86_64
+                    abi = self.ARCH_TO_ABI[arch]             # armeabi-v7a / arm64-v8a / x86 / x86_64
+
+                    cache_so = cache_dir / abi / "libfrida-gadget.so"
+                    if abi not in cached_abis or not cache_so.exists():
+                        cache_so.parent.mkdir(parents=True, exist_ok=True)
+                        digest = self._asset_sha256(asset)
+                        share = remote is not None and digest is not None
+
+                        # Store the archive in the same abi dir, under a name no other job uses
+                        tmp_download = cache_so.parent / f".{os.getpid()}.{name}"
+                        try:
+                            if not (share and remote.get("gadgets", name, str(tmp_download))
+                                    and self._has_digest(tmp_download, digest, "the remote cache")):
+                                if self.verbose:
+                                    print(f"[+] Downloading gadget {url}")
+                                self._download_stream(url, tmp_download)
+                                if digest is not None and not self._has_digest(tmp_download, digest, "GitHub"):
+                                    raise RuntimeError(f"{name} does not match the digest of release {tag}")
+                                if share:
+                                    remote.put_async("gadgets", name, str(tmp_download))
+                            # Decompress/move into the canonical libfrida-gadget.so in cache
+                            self._to_final_so(tmp_download, cache_so, True)
+                        finally:
+                            tmp_download.unlink(missing_ok=True)
+
+                # Refresh list of ABIs now present
+                abis_ready = self._cached_abis(cache_dir)
+
+                # Recorded before the fill lock goes, so the tag never looks unused
+                self._touch(tag, latest=version is None)
+
+            self.evict(keep=tag)
+            if self.verbose:
+                for abi in sorted(abis_ready):
+                    print(f"[+] Cached: {cache_dir / abi / 'libfrida-gadget.so'}")
+            yield tag
 
 
     def copy_android_gadgets(
@@ -138,12 +210,11 @@ class FridaGadget:
             if not tag_dir:
                 raise RuntimeError(f"No cached gadgets for version/tag '{version}' under {cache_root}")
         else:
-            # pick the most recently modified tag dir
-            tag_dirs = [p for p in cache_root.iterdir() if p.is_dir()]
-            if not tag_dirs:
+            # The tag obtain_gadgets last resolved as "latest"; mtimes race between parallel jobs
+            latest = self._read_index().get("latest")
+            if not latest or not (cache_root / latest).is_dir():
                 raise RuntimeError(f"No cached gadget versions found under {cache_root}")
-            tag_dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-            tag_dir = tag_dirs[0]
+            tag_dir = cache_root / latest
 
         if self.verbose:
             print(f"[+] Using cached gadget tag: {tag_dir.name}")
@@ -151,20 +222,23 @@ class FridaGadget:
         # --- iterate ABIs under tag dir and copy ---
         copied: List[Path] = []
         any_found = False
-        for abi_dir in sorted([d for d in tag_dir.iterdir() if d.is_dir()]):
-            src_so = abi_dir / "libfrida-gadget.so"
-            if not src_so.exists():
-                continue
-            any_found = True
-
-            dest_so_dir = dest_root / "lib" / abi_dir.name
-            dest_so_dir.mkdir(parents=True, exist_ok=True)
-            dest_so = dest_so_dir / "libfrida-gadget.so"
-
-            shutil.copyfile(src_so, dest_so)
-            copied.append(dest_so)
-            if self.verbose:
-                print(f"[+] Copied: {src_so} -> {dest_so}")
+        # Pinned while its files are copied out, for callers that didn't pin it themselves
+        with self._locked(f"{tag_dir.name}.pin", shared=True):
+            for abi_dir in sorted([d for d in tag_dir.iterdir() if d.is_dir()]):
+                src_so = abi_dir / "libfrida-gadget.so"
+                if not src_so.exists():
+                    continue
+                any_found = True
+
+                dest_so_dir = dest_root / "lib" / abi_dir.name
+                dest_so_dir.mkdir(parents=True, exist_ok=True)
+                dest_so = dest_so_dir / "libfrida-gadget.so"
+
+                how = Materializer.materialize(str(src_so), str(dest_so))
+                copied.append(dest_so)
+                if self.verbose:
+                    print(f"[+] Copied ({how}): {src_so} -> {dest_so}")
+        self._touch(tag_dir.name)
 
         if not any_found:
             raise RuntimeError(f"No cached libfrida-gadget.so found under {tag_dir}")
@@ -172,6 +246,41 @@ class FridaGadget:
         return copied
 
 
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Remove least recently used tags beyond max_tags. Tags being filled or
+        pinned by any job, and `keep`, are left alone. Returns the evicted tags.
+        """
+        with self._locked("index"):
+            index = self._read_index()
+            tags = index.get("tags", {})
+            # Directories the index doesn't know about (older layouts) count as oldest
+            for d in self.cache_root.iterdir():
+                if d.is_dir() and d.name not in tags:
+                    tags[d.name] = {"last_used": 0}
+            excess = len(tags) - self.max_tags
+            evicted: List[str] = []
+            for tag in sorted(tags, key=lambda t: tags[t].get("last_used", 0)):
+                if excess <= 0:
+                    break
+                if tag == keep:
+                    continue
+                with self._locked(tag, blocking=False) as filling, \
+                        self._locked(f"{tag}.pin", blocking=False) as pinned:
+                    if not (filling and pinned):
+                        continue
+                    shutil.rmtree(self.cache_root / tag, ignore_errors=True)
+                del tags[tag]
+                evicted.append(tag)
+                excess -= 1
+            if index.get("latest") in evicted:
+                index.pop("latest")
+            index["tags"] = tags
+            self._write_index(index)
+        if self.verbose and evicted:
+            print(f"[+] Evicted cached gadget tags: {', '.join(evicted)}")
+        return evicted
+
     def fetch_release_latest(self) -> Dict:
         r = self.session.get(self.LATEST_URL, timeout=30)
         r.raise_for_status()
@@ -184,19 +293,106 @@ class FridaGadget:
         return r.json()
 
     def fetch_release(self, version: Optional[str] = None) -> Dict:
-        return self.fetch_release_latest() if version is None else self.fetch_release_tag(version)
+        cached = self._releases.get(version)
+        if cached is not None and (version is not None or time.monotonic() - cached[0] < self.LATEST_TTL):
+            return cached[1]
+        release = self.fetch_release_latest() if version is None else self.fetch_release_tag(version)
+        self._releases[version] = (time.monotonic(), release)
+        return release
 
     # ---------- Internals ----------
 
     def _is_android_gadget(self, name: str) -> bool:
         return bool(self.ANDROID_GADGET_RE.match(name))
 
+    @staticmethod
+    def _asset_sha256(asset: Dict) -> Optional[str]:
+        """The asset's SHA-256 as GitHub publishes it ("digest": "sha256:<hex>"), if it does."""
+        algo, _, value = (asset.get("digest") or "").partition(":")
+        return value.lower() if algo == "sha256" and re.fullmatch(r"[0-9a-fA-F]{64}", value) else None
+
+    def _has_digest(self, path: Path, digest: str, source: str) -> bool:
+        """True if path hashes to digest; otherwise it is deleted."""
+        actual = CacheBackend.file_sha256(str(path))
+        if actual != digest:
+            print(f"[!] Gadget download from {source} has sha256 {actual[:12]}, "
+                  f"the release says {digest[:12]}; not using it")
+            path.unlink(missing_ok=True)
+            return False
+        return True
+
     def _extract_arch(self, filename: str) -> str:
         m = self.ANDROID_GADGET_RE.match(filename)
         if not m:
             raise ValueError(f"Unsupported gadget filename: {filename}")
         return m.group(1)
 
+    @contextmanager
+    def _locked(self, name: str, blocking: bool = True, shared: bool = False) -> Iterator[bool]:
+        """
+        Inter-process lock on <cache root>/.<name>.lock; yields False if
+        non-blocking and busy. msvcrt has no shared locks, so a shared lock is
+        a no-op on Windows (pins then don't hold off eviction there).
+        """
+        self.cache_root.mkdir(parents=True, exist_ok=True)
+        if shared and os.name == "nt":
+            yield True
+            return
+        with open(self.cache_root / f".{name}.lock", "a+b") as fh:
+            try:
+                if os.name == "nt":
+                    import msvcrt
+                    fh.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+                            break
+                        except OSError:
+                            if not blocking:
+                                raise
+                            time.sleep(0.2)
+                else:
+                    import fcntl
+                    fcntl.flock(fh.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                                | (0 if blocking else fcntl.LOCK_NB))
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                if os.name == "nt":
+                    import msvcrt
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def _read_index(self) -> Dict:
+        try:
+            with open(self.cache_root / "index.json", "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict) -> None:
+        path = self.cache_root / "index.json"
+        tmp = path.with_name(f".index.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(index, fh, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _touch(self, tag: str, latest: bool = False) -> None:
+        """Record a use of tag (and, when it was resolved from the latest release, that it is latest)."""
+        with self._locked("index"):
+            index = self._read_index()
+            index.setdefault("tags", {})[tag] = {"last_used": time.time()}
+            if latest:
+                index["latest"] = tag
+            self._write_index(index)
+
     def _download_stream(self, url: str, dest: Path) -> None:
         with self.session.get(url, stream=True, timeout=60) as r:
             r.raise_for_status()
@@ -206,27 +402,26 @@ class FridaGadget:
                         f.write(chunk)
 
     def _to_final_so(self, src: Path, final_so: Path, do_decompress: bool) -> Path:
+        # Written under a temp name and renamed, so a readable final_so is always complete
         name = src.name
-        if do_decompress and name.endswith(".xz"):
-            with lzma.open(src, "rb") as f_in, open(final_so, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            src.unlink(missing_ok=True)
-            return final_so
-        if do_decompress and name.endswith(".gz"):
-            with gzip.open(src, "rb") as f_in, open(final_so, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            src.unlink(missing_ok=True)
-            return final_so
-
-        # Already a .so (or decompression disabled): move/copy to final name
-        if name.endswith(".so"):
-            if src != final_so:
-                if final_so.exists():
-                    final_so.unlink()
-                src.replace(final_so)
-            return final_so
-
-        shutil.copyfile(src, final_so)
+        tmp_so = final_so.with_name(f".{final_so.name}.{os.getpid()}.tmp")
+        try:
+            if do_decompress and name.endswith(".xz"):
+                with lzma.open(src, "rb") as f_in, open(tmp_so, "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                src.unlink(missing_ok=True)
+            elif do_decompress and name.endswith(".gz"):
+                with gzip.open(src, "rb") as f_in, open(tmp_so, "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                src.unlink(missing_ok=True)
+            elif name.endswith(".so"):
+                # Already a .so (or decompression disabled): move to final name
+                src.replace(tmp_so)
+            else:
+                shutil.copyfile(src, tmp_so)
+            os.replace(tmp_so, final_so)
+        finally:
+            tmp_so.unlink(missing_ok=True)
         return final_so
 
     def _cached_abis(self, cache_dir: Path) -> List[str]:
@@ -255,6 +450,7 @@ if __name__ == "__main__":
     ap.add_argument("--no-decompress", action="store_true", help="Keep .xz/.gz archives in cache (dest still gets .so)")
     args = ap.parse_args()
 
+    import requests
     try:
         fg = FridaGadget()
         files = fg.copy_android_gadgets(
@@ -0,0 +1,101 @@
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+from Materializer import Materializer
+
+class ManifestError(RuntimeError): pass
+
+class Manifest:
+    """
+    Decoded AndroidManifest.xml, parsed once and written once.
+
+    Every patch stage (split removal, INTERNET, extractNativeLibs, loader
+    class, testOnly, networkSecurityConfig) edits the same in-memory tree;
+    nothing touches the file until flush(), which the build step calls
+    before apktool b. Namespaces are collected during the single parse.
+    """
+
+    ANDROID_NS = "http://schemas.android.com/apk/res/android"
+    SPLIT_META_DATA = ("com.android.vending.splits.required", "com.android.vending.splits")
+
+    def __init__(self, path: str, verbose: bool = False):
+        self.path = path
+        self.verbose = verbose
+        self.namespaces: Dict[str, str] = {}
+        self.edits: List[str] = []
+        # One pass yields both the tree and the namespace declarations
+        it = ET.iterparse(path, events=("start-ns",))
+        for _, (prefix, uri) in it:
+            self.namespaces.setdefault(prefix, uri)
+        self.tree = ET.ElementTree(it.root)
+        self.namespaces.setdefault("android", self.ANDROID_NS)
+        for prefix, uri in self.namespaces.items():
+            ET.register_namespace(prefix, uri)
+        self.ns = "{" + self.namespaces["android"] + "}"
+
+    # ---------- Accessors ----------
+    @property
+    def root(self) -> ET.Element:
+        return self.tree.getroot()
+
+    @property
+    def application(self) -> ET.Element:
+        app = self.root.find(".//application")
+        if app is None:
+            raise ManifestError("Application does not have <application> tag")
+        return app
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.edits)
+
+    def get_app_attr(self, name: str) -> Optional[str]:
+        return self.application.attrib.get(self.ns + name)
+
+    # ---------- Edits ----------
+    def set_app_attr(self, name: str, value: str) -> None:
+        if self.application.attrib.get(self.ns + name) != value:
+            self.application.attrib[self.ns + name] = value
+            self._record(f"application {name}={value}")
+
+    def remove_app_attr(self, name: str) -> None:
+        if self.application.attrib.pop(self.ns + name, None) is not None:
+            self._record(f"application -{name}")
+
+    def ensure_permission(self, permission: str) -> bool:
+        """Add <uses-permission>; False when it was already declared."""
+        if any(el.tag == "uses-permission" and el.attrib.get(self.ns + "name") == permission for el in self.root):
+            return False
+        el = ET.Element("uses-permission")
+        el.attrib[self.ns + "name"] = permission
+        self.root.insert(0, el)
+        self._record(f"uses-permission {permission}")
+        return True
+
+    def remove_split_requirements(self) -> None:
+        """Drop everything that makes the installer insist on the original splits."""
+        app = self.root.find(".//application")
+        if app is not None:
+            self.remove_app_attr("isSplitRequired")
+            for md in [md for md in app.findall("meta-data") if md.attrib.get(self.ns + "name") in self.SPLIT_META_DATA]:
+                app.remove(md)
+                self._record(f"meta-data -{md.attrib.get(self.ns + 'name')}")
+        for k in ("isSplitRequired", "requiredSplitTypes", "splitTypes"):
+            if self.root.attrib.pop(self.ns + k, None) is not None:
+                self._record(f"manifest -{k}")
+
+    # ---------- Writing ----------
+    def flush(self) -> bool:
+        """Write the manifest if anything changed since the last flush."""
+        if not self.edits:
+            return False
+        # The file may be hardlinked into a variant snapshot (APK.snapshot)
+        Materializer.unshare(self.path)
+        self.tree.write(self.path, encoding="utf-8", xml_declaration=True)
+        if self.verbose:
+            print(f"[+] AndroidManifest.xml: {len(self.edits)} edits written ({', '.join(self.edits)})")
+        self.edits = []
+        return True
+
+    def _record(self, edit: str) -> None:
+        self.edits.append(edit)
@@ -0,0 +1,76 @@
+import sys, threading
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+class OutputRouter:
+    """
+    sys.stdout/sys.stderr replacement that hands a job thread's writes to
+    that job (line by line) and passes every other thread's through.
+
+    A sink is per thread: threads a job starts itself (decode and variant
+    pools, subprocess readers) take it along by running their target
+    through carry(), or their output would reach the daemon's console.
+    """
+
+    _local = threading.local()
+    _installed = False
+
+    def __init__(self, target):
+        self._target = target
+
+    # ---------- Public APIs ----------
+    @classmethod
+    def install(cls) -> None:
+        if not cls._installed:
+            sys.stdout, sys.stderr = cls(sys.stdout), cls(sys.stderr)
+            cls._installed = True
+
+    @classmethod
+    def attach(cls, sink: Callable[[str], None]) -> None:
+        cls._local.sink, cls._local.pending = sink, ""
+
+    @classmethod
+    def detach(cls) -> None:
+        sink = cls._sink()
+        if sink is not None and cls._local.pending:
+            sink(cls._local.pending)
+        cls._local.sink = None
+
+    @classmethod
+    def carry(cls, fn: Callable[..., T]) -> Callable[..., T]:
+        """fn, wrapped to print wherever the calling thread prints when it runs on another thread."""
+        sink = cls._sink()
+        if sink is None:
+            return fn
+
+        def run(*args, **kwargs):
+            cls.attach(sink)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                cls.detach()
+        return run
+
+    def write(self, text: str) -> int:
+        sink = self._sink()
+        if sink is None:
+            return self._target.write(text)
+        buf = self._local.pending + text
+        head, sep, tail = buf.rpartition("\n")
+        if sep:
+            sink(head + sep)
+        self._local.pending = tail
+        return len(text)
+
+    def flush(self) -> None:
+        if self._sink() is None:
+            self._target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    # ---------- Internals ----------
+    @classmethod
+    def _sink(cls) -> Optional[Callable[[str], None]]:
+        return getattr(cls._local, "sink", None)
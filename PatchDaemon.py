@@ -0,0 +1,324 @@
+import os, sys, json, time, queue, socket, secrets, threading, socketserver, http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from PullCache import PullCache
+from OutputRouter import OutputRouter
+
+class DaemonError(RuntimeError): pass
+
+class PatchDaemon:
+    """
+    Long-running patch service. Jobs are patch-apk command lines, submitted
+    over a local HTTP API (a Unix socket by default, 127.0.0.1:<port> with
+    --daemon-port) and run in-process, so everything warm stays warm between
+    jobs: imports, the toolchain cache, Frida release metadata and the
+    signing key fingerprint. The device snapshot is re-read by every job.
+
+    At most `jobs` run at once (PATCHAPK_DAEMON_JOBS, default 2); the rest
+    wait in a FIFO queue, and apktool runs still share one CoreBudget.
+    Every line a job prints is streamed back to the client with its offset
+    from the job start, followed by a final event with the exit code and the
+    queue/run timings. A finished job is forgotten once its events have
+    been streamed, or FINISHED_TTL seconds after it ended if nobody asks.
+
+    API (each request carries the X-PatchApk-Token from <cache root>/daemon.token):
+        POST /jobs              {"argv": [...], "cwd": "..."} -> {"id": n}
+        GET  /jobs              job states
+        GET  /jobs/<id>/events  NDJSON events until the job ends
+        GET  /status            queue and worker counts
+    """
+
+    DEFAULT_JOBS = 2
+    TOKEN_HEADER = "X-PatchApk-Token"
+    FINISHED_TTL = 600
+
+    def __init__(self, runner: Callable[[List[str], str], None], on_error: Callable[[BaseException], int],
+                 jobs: Optional[int] = None, socket_path: Optional[str] = None, port: Optional[int] = None,
+                 verbose: bool = False):
+        """
+        runner(argv, cwd) runs one job and raises on failure; on_error maps
+        the exception to an exit code (and prints it, which the job streams).
+        """
+        env = os.environ.get("PATCHAPK_DAEMON_JOBS", "")
+        self.jobs = max(1, jobs or (int(env) if env.isdigit() else 0) or self.DEFAULT_JOBS)
+        self.runner = runner
+        self.on_error = on_error
+        self.port = port
+        self.socket_path = None if port else (socket_path or self.default_socket())
+        self.verbose = verbose
+        self._jobs: Dict[int, dict] = {}
+        self._queue: "queue.Queue[dict]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._finished = {"ok": 0, "failed": 0}
+        self._token = secrets.token_hex(16)
+
+    @staticmethod
+    def default_socket() -> str:
+        return str(PullCache.default_root() / "daemon.sock")
+
+    @staticmethod
+    def token_path() -> str:
+        return str(PullCache.default_root() / "daemon.token")
+
+    # ---------- Public APIs ----------
+    def serve(self) -> None:
+        server = self._bind()
+        # Only this user may submit jobs: the token file is private to them
+        os.makedirs(os.path.dirname(self.token_path()), exist_ok=True)
+        fd = os.open(self.token_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fh:
+            fh.write(self._token)
+
+        OutputRouter.install()
+        for i in range(self.jobs):
+            threading.Thread(target=self._worker, name=f"patchapk-job-{i}", daemon=True).start()
+        where = self.socket_path or f"http://127.0.0.1:{self.port}"
+        print(f"[+] patch-apk daemon listening on {where} ({self.jobs} concurrent jobs)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for path in filter(None, (self.socket_path, self.token_path())):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def submit(self, argv: List[str], cwd: str) -> dict:
+        self._prune()
+        with self._lock:
+            job = {"id": self._next_id, "argv": list(argv), "cwd": cwd, "state": "queued",
+                   "exit_code": None, "submitted": time.time(), "started": None, "finished": None,
+                   "events": [], "cond": threading.Condition()}
+            self._jobs[job["id"]] = job
+            self._next_id += 1
+        self._queue.put(job)
+        return job
+
+    def status(self) -> dict:
+        with self._lock:
+            states = [j["state"] for j in self._jobs.values()]
+            return {"workers": self.jobs, **{s: states.count(s) for s in ("queued", "running")}, **self._finished}
+
+    # ---------- Internals ----------
+    def _bind(self):
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.socket_path)
+                    raise DaemonError(f"A daemon is already listening on {self.socket_path}")
+                except OSError:
+                    os.remove(self.socket_path)  # left behind by a daemon that died
+                finally:
+                    probe.close()
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            server = _UnixHTTPServer(self.socket_path, _Handler)
+            os.chmod(self.socket_path, 0o600)
+        else:
+            server = ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+            server.daemon_threads = True
+        server.daemon = self
+        return server
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            job["state"], job["started"] = "running", time.time()
+            OutputRouter.attach(lambda text, job=job: self._emit(job, {"type": "output", "text": text}))
+            code = 0
+            try:
+                self.runner(job["argv"], job["cwd"])
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except BaseException as e:
+                code = self.on_error(e)
+            finally:
+                OutputRouter.detach()
+            job["exit_code"], job["finished"] = code, time.time()
+            job["state"] = "ok" if code == 0 else "failed"
+            with self._lock:
+                self._finished[job["state"]] += 1
+            self._emit(job, {"type": "done", "exit_code": code,
+                             "queued": round(job["started"] - job["submitted"], 3),
+                             "elapsed": round(job["finished"] - job["started"], 3)})
+            if self.verbose:
+                print(f"[daemon] job {job['id']} {job['state']} in {job['finished'] - job['started']:.1f}s")
+
+    def _emit(self, job: dict, event: dict) -> None:
+        started = job["started"] or time.time()
+        event["t"] = round(time.time() - started, 3)
+        with job["cond"]:
+            job["events"].append(event)
+            job["cond"].notify_all()
+
+    def _events(self, job: dict):
+        i = 0
+        while True:
+            with job["cond"]:
+                while i >= len(job["events"]):
+                    job["cond"].wait()
+                batch = job["events"][i:]
+            i += len(batch)
+            for event in batch:
+                yield event
+                if event["type"] == "done":
+                    self._forget(job)
+                    return
+
+    def _forget(self, job: dict) -> None:
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+
+    def _prune(self) -> None:
+        """Drop finished jobs whose events nobody streamed within FINISHED_TTL."""
+        cutoff = time.time() - self.FINISHED_TTL
+        with self._lock:
+            for job_id in [j["id"] for j in self._jobs.values() if j["finished"] and j["finished"] < cutoff]:
+                del self._jobs[job_id]
+
+
+class PatchDaemonClient:
+    """Thin client: submits a command line to a running daemon and replays its output."""
+
+    def __init__(self, socket_path: Optional[str] = None, port: Optional[int] = None):
+        self.port = port
+        self.socket_path = None if port else (socket_path or PatchDaemon.default_socket())
+
+    # ---------- Public APIs ----------
+    def available(self) -> bool:
+        try:
+            self._request("GET", "/status")
+            return True
+        except (OSError, DaemonError, http.client.HTTPException):
+            return False
+
+    def run(self, argv: List[str], cwd: str) -> int:
+        job = self._request("POST", "/jobs", {"argv": argv, "cwd": cwd})
+        conn = self._connect()
+        try:
+            conn.request("GET", f"/jobs/{job['id']}/events", headers=self._headers())
+            resp = conn.getresponse()
+            for line in resp:
+                event = json.loads(line)
+                if event["type"] == "output":
+                    sys.stdout.write(event["text"])
+                    sys.stdout.flush()
+                elif event["type"] == "done":
+                    print(f"[*] Daemon job {job['id']}: exit {event['exit_code']}, "
+                          f"queued {event['queued']:.1f}s, ran {event['elapsed']:.1f}s")
+                    return event["exit_code"]
+        finally:
+            conn.close()
+        raise DaemonError("Connection to the daemon closed before the job finished")
+
+    # ---------- Internals ----------
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.socket_path:
+            return _UnixHTTPConnection(self.socket_path)
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=None)
+
+    def _headers(self) -> Dict[str, str]:
+        try:
+            with open(PatchDaemon.token_path(), "r", encoding="utf-8") as fh:
+                token = fh.read().strip()
+        except OSError:
+            raise DaemonError("No daemon token found; is the daemon running?")
+        return {PatchDaemon.TOKEN_HEADER: token, "Content-Type": "application/json"}
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        conn = self._connect()
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=self._headers())
+            resp = conn.getresponse()
+            data = json.loads(resp.read() or b"{}")
+            if resp.status >= 400:
+                raise DaemonError(data.get("error", f"HTTP {resp.status}"))
+            return data
+        finally:
+            conn.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def do_GET(self):
+        daemon: PatchDaemon = self.server.daemon
+        if not self._authorized():
+            return
+        parts = [p for p in self.path.split("/") if p]
+        if parts == ["status"]:
+            return self._json(200, daemon.status())
+        if parts == ["jobs"]:
+            with daemon._lock:
+                jobs = [{k: j[k] for k in ("id", "argv", "state", "exit_code")} for j in daemon._jobs.values()]
+            return self._json(200, {"jobs": jobs})
+        if len(parts) == 3 and parts[0] == "jobs" and parts[1].isdigit() and parts[2] == "events":
+            job = daemon._jobs.get(int(parts[1]))
+            if job is None:
+                return self._json(404, {"error": "no such job"})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            try:
+                for event in daemon._events(job):
+                    self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+            except OSError:
+                pass  # client went away; the job carries on
+            return
+        self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        daemon: PatchDaemon = self.server.daemon
+        if not self._authorized():
+            return
+        if self.path.rstrip("/") != "/jobs":
+            return self._json(404, {"error": "not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+            argv, cwd = body["argv"], body.get("cwd") or os.getcwd()
+            if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                raise ValueError("argv must be a list of strings")
+        except (ValueError, KeyError) as e:
+            return self._json(400, {"error": f"bad job: {e}"})
+        job = daemon.submit(argv, cwd)
+        self._json(202, {"id": job["id"]})
+
+    def _authorized(self) -> bool:
+        if secrets.compare_digest(self.headers.get(PatchDaemon.TOKEN_HEADER, ""), self.server.daemon._token):
+            return True
+        self._json(403, {"error": "bad or missing token"})
+        return False
+
+    def _json(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        return "local"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost", timeout=None)
+        self._path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
@@ -0,0 +1,112 @@
+import re, sys, subprocess, threading
+from collections import deque
+from typing import Callable, Deque, List, Optional, Pattern, Sequence, Tuple
+
+from OutputRouter import OutputRouter
+
+class ProcessRunner:
+    """
+    Run a tool while streaming its output instead of buffering all of it.
+
+    stdout and stderr are read line by line on background threads into
+    bounded ring buffers, so memory stays flat however chatty the tool is;
+    the buffers' tails are what end up in error reports. Known apktool stage
+    lines are turned into progress callbacks, and a process printing one of the fatal patterns is killed early instead of
+    being left to run to completion.
+    """
+
+    TAIL_LINES = 200
+    MAX_LINE = 4096
+
+    # apktool: "I: Decoding file-resources...", "I: Building apk file..." etc.
+    APKTOOL_STAGE_RE = re.compile(r"^I: ((?:Decoding|Baksmaling|Building|Smaling|Copying|Loading)\b.*?)\.*$")
+
+    APKTOOL_FATAL = (
+        re.compile(r"java\.lang\.OutOfMemoryError"),
+        re.compile(r"Could not (?:find or load main class|reserve enough space)"),
+    )
+
+    def __init__(self, verbose: bool = False,
+                 on_progress: Optional[Callable[[str, str, Optional[int]], None]] = None,
+                 fatal_patterns: Sequence[Pattern] = (), tail_lines: int = TAIL_LINES):
+        self.verbose = verbose
+        self.on_progress = on_progress if on_progress is not None else self.print_progress
+        self.fatal_patterns = list(fatal_patterns)
+        self.tail_lines = tail_lines
+        self._status_line = False
+
+    # ---------- Public APIs ----------
+    def run(self, cmd: List[str], input: Optional[str] = None, label: Optional[str] = None) -> dict:
+        """
+        Returns {"returncode", "stdout", "stderr", "ok", "cancelled"} where
+        stdout/stderr hold at most the last `tail_lines` lines of each stream.
+        """
+        label = label or cmd[0]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, errors="replace", bufsize=1)
+        out: Deque[str] = deque(maxlen=self.tail_lines)
+        err: Deque[str] = deque(maxlen=self.tail_lines)
+        fatal: List[str] = []
+
+        readers = [threading.Thread(target=OutputRouter.carry(self._pump), args=(proc, stream, buf, label, fatal), daemon=True)
+                   for stream, buf in ((proc.stdout, out), (proc.stderr, err))]
+        for t in readers:
+            t.start()
+        if input is not None:
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except OSError:
+                pass
+        for t in readers:
+            t.join()
+        returncode = proc.wait()
+        self._end_progress()
+
+        cancelled = bool(fatal)
+        return {
+            "returncode": returncode,
+            "stdout": "\n".join(out),
+            "stderr": "\n".join(list(err) + fatal),
+            "ok": returncode == 0 and not cancelled,
+            "cancelled": cancelled,
+        }
+
+    @classmethod
+    def parse_progress(cls, line: str) -> Optional[Tuple[str, Optional[int]]]:
+        """(stage, percent) for recognised progress lines, else None. apktool only reports stages (percent None)."""
+        m = cls.APKTOOL_STAGE_RE.match(line)
+        return (m.group(1), None) if m else None
+
+    def print_progress(self, label: str, stage: str, percent: Optional[int]) -> None:
+        """Default progress sink: one in-place status line on a terminal, plain lines when verbose."""
+        text = f"[{label}] {stage}" + (f" ({percent}%)" if percent is not None else "")
+        if self.verbose:
+            print("    " + text)
+        elif sys.stdout.isatty():
+            sys.stdout.write("\r\033[K" + text[:120])
+            sys.stdout.flush()
+            self._status_line = True
+
+    # ---------- Internals ----------
+    def _end_progress(self) -> None:
+        if self._status_line:
+            sys.stdout.write("\r\033[K")
+            sys.stdout.flush()
+            self._status_line = False
+
+    def _pump(self, proc: subprocess.Popen, stream, buf: Deque[str], label: str, fatal: List[str]) -> None:
+        for line in stream:
+            line = line.rstrip("\r\n")[:self.MAX_LINE]
+            buf.append(line)
+            progress = self.parse_progress(line)
+            if progress:
+                self.on_progress(label, *progress)
+            if not fatal:
+                for pat in self.fatal_patterns:
+                    if pat.search(line):
+                        fatal.append(f"[cancelled: output matched {pat.pattern!r}]")
+                        proc.kill()
+                        break
+        stream.close()
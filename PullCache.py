@@ -0,0 +1,126 @@
+import os, hashlib, shutil, threading
+from pathlib import Path
+from typing import Optional
+
+class PullCache:
+    """
+    Local cache of APKs pulled from a device.
+
+    Entries are keyed by remote path, size and a device-side fingerprint: the
+    `sha256sum` computed on the device, or the package versionCode when the
+    device has no sha256sum. Hashing on the device is far cheaper than pulling
+    a large base.apk over USB again.
+
+    Entries are evicted least-recently-used first once the cache grows past
+    its size cap (PATCHAPK_PULL_CACHE_MB, default 4096); a hit refreshes the
+    entry's mtime.
+
+    Layout: <root>/<key>.apk
+    """
+
+    DEFAULT_MAX_MB = 4096
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None, verbose: bool = False):
+        self.root = Path(root) if root else self.default_root() / "pulls"
+        env = os.environ.get("PATCHAPK_PULL_CACHE_MB", "")
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            (int(env) if env.isdigit() else self.DEFAULT_MAX_MB) * 1024 * 1024
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def default_root() -> Path:
+        """PATCHAPK_CACHE_DIR, else $XDG_CACHE_HOME/patch-apk, else ~/.cache/patch-apk."""
+        env = os.environ.get("PATCHAPK_CACHE_DIR")
+        if env:
+            return Path(env).expanduser()
+        xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return Path(xdg) / "patch-apk"
+
+    # ---------- Public APIs ----------
+    @staticmethod
+    def key(remote_path: str, size: int, sha256: Optional[str] = None,
+            version_code: Optional[int] = None) -> Optional[str]:
+        """None when there is no fingerprint to trust (neither hash nor versionCode)."""
+        if sha256:
+            fingerprint = "sha256:" + sha256.lower()
+        elif version_code is not None:
+            fingerprint = f"vc:{version_code}"
+        else:
+            return None
+        return hashlib.sha256(f"{remote_path}|{size}|{fingerprint}".encode("utf-8")).hexdigest()
+
+    def fetch(self, key: str, dest: str, size: int) -> bool:
+        """Materialize a cached entry at dest. Returns False on a miss."""
+        entry = self.root / f"{key}.apk"
+        try:
+            if entry.stat().st_size != size:
+                entry.unlink()
+                return False
+        except FileNotFoundError:
+            return False
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(entry, dest)
+        except OSError:
+            shutil.copyfile(entry, dest)
+        os.utime(entry)  # recency for eviction
+        if self.verbose:
+            print(f"[+] Pull cache hit: {os.path.basename(dest)}")
+        return True
+
+    def store(self, key: str, src: str, sha256: Optional[str] = None) -> bool:
+        """
+        Add a freshly pulled file. When the device reported a sha256 the local
+        copy is checked against it so a bad transfer is never cached.
+        """
+        if sha256 and self._sha256(src) != sha256.lower():
+            if self.verbose:
+                print(f"[!] Pull cache: hash mismatch for {src}, not caching")
+            return False
+        entry = self.root / f"{key}.apk"
+        tmp = self.root / f".{key}.{os.getpid()}.tmp"
+        try:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, entry)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self.evict()
+        return True
+
+    def evict(self) -> None:
+        """Drop least-recently-used entries until the cache fits its size cap."""
+        with self._lock:
+            entries = []
+            for p in self.root.glob("*.apk"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+                total -= size
+                if self.verbose:
+                    print(f"[cache] Evicted pulled {p.name} ({size // (1024 * 1024)} MiB)")
+
+    # ---------- Internals ----------
+    @staticmethod
+    def _sha256(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
@@ -0,0 +1,136 @@
+import os, json, hashlib, threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from PullCache import PullCache
+from Materializer import Materializer
+from ApkVerifier import ApkVerifyError
+
+class ResultCache:
+    """
+    Cache of final (patched, aligned, signed) APKs.
+
+    The key covers everything that determines the output: the SHA-256 of
+    every input split, the patch options, the Frida gadget tag, the apktool
+    version and the signing key fingerprint. Re-patching the same app build
+    with the same options (after a device wipe, or for another device) then
+    goes straight to install.
+
+    Entries are evicted least-recently-used first once the cache grows past
+    its size cap (PATCHAPK_RESULT_CACHE_MB, default 2048). A hit refreshes
+    the entry's mtime, which is what the eviction order uses.
+
+    With PATCHAPK_REMOTE_CACHE set, local misses are looked up in the shared
+    backend and new results are uploaded to it in the background. A remote
+    hit is only used once the caller's check accepts it: any host that can
+    write to the backend could otherwise have this one install its APK.
+
+    Layout: <root>/<key>.apk and <root>/<key>.json (the key's inputs, for humans)
+    """
+
+    FORMAT = 1
+    DEFAULT_MAX_MB = 2048
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None, verbose: bool = False):
+        self.root = Path(root) if root else PullCache.default_root() / "results"
+        env = os.environ.get("PATCHAPK_RESULT_CACHE_MB", "")
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            (int(env) if env.isdigit() else self.DEFAULT_MAX_MB) * 1024 * 1024
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    # ---------- Public APIs ----------
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @classmethod
+    def key(cls, inputs: Iterable[str], options: Dict[str, object]) -> tuple:
+        """(key, description). Inputs are hashed by content, so their file names don't matter."""
+        desc = {
+            "format": cls.FORMAT,
+            "inputs": sorted(cls.file_sha256(p) for p in inputs),
+            "options": {k: options[k] for k in sorted(options)},
+        }
+        blob = json.dumps(desc, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest(), desc
+
+    def fetch(self, key: str, dest: str, verify_remote: Optional[Callable[[str], None]] = None) -> bool:
+        """
+        Materialize a cached result at dest. Returns False on a miss. The
+        remote backend is only consulted with verify_remote, which must raise
+        ApkVerifyError (or OSError) for a downloaded APK it doesn't trust.
+        """
+        entry = self.root / f"{key}.apk"
+        try:
+            os.utime(entry)  # LRU: a hit makes the entry the newest
+        except OSError:
+            if verify_remote is None:
+                return False
+            # http.client/ssl are only loaded once a run actually needs the remote
+            from CacheBackend import CacheBackend
+            remote = CacheBackend.shared(self.verbose)
+            tmp = self.root / f".{key}.{os.getpid()}.{threading.get_ident()}.remote"
+            if remote is None or not remote.get("results", key, str(tmp)):
+                return False
+            try:
+                verify_remote(str(tmp))
+                os.replace(tmp, entry)
+            except (ApkVerifyError, OSError) as e:
+                print(f"[!] Ignoring result {key[:12]} from the remote cache: {e}")
+                return False
+            finally:
+                tmp.unlink(missing_ok=True)
+        # Reflink or copy: a hardlink would let later in-place edits of dest reach the cache
+        Materializer.materialize(str(entry), dest, allow_link=False)
+        if self.verbose:
+            print(f"[+] Result cache hit: {entry.name}")
+        return True
+
+    def store(self, key: str, apk_path: str, desc: Optional[dict] = None) -> None:
+        entry = self.root / f"{key}.apk"
+        tmp = self.root / f".{key}.{os.getpid()}.tmp"
+        try:
+            Materializer.materialize(apk_path, str(tmp), allow_link=False)
+            os.replace(tmp, entry)
+            if desc is not None:
+                (self.root / f"{key}.json").write_text(json.dumps(desc, indent=1, sort_keys=True), encoding="utf-8")
+        except OSError as e:
+            if tmp.exists():
+                tmp.unlink()
+            if self.verbose:
+                print(f"[!] Could not store result in cache: {e}")
+            return
+        from CacheBackend import CacheBackend
+        remote = CacheBackend.shared(self.verbose)
+        if remote is not None:
+            remote.put_async("results", key, str(entry))
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop least-recently-used entries until the cache fits its size cap."""
+        with self._lock:
+            entries = []
+            for p in self.root.glob("*.apk"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                for victim in (p, p.with_suffix(".json")):
+                    try:
+                        victim.unlink()
+                    except OSError:
+                        pass
+                total -= size
+                if self.verbose:
+                    print(f"[cache] Evicted {p.name} ({size // (1024 * 1024)} MiB)")
@@ -0,0 +1,142 @@
+import os, re, json, shutil, subprocess, threading
+from typing import Dict, List, Optional, Sequence
+
+from PullCache import PullCache
+
+class Toolchain:
+    """
+    Persistent record of the external tools a run needs.
+
+    Each binary is fingerprinted by its resolved path, size and mtime (plus
+    the jar next to a wrapper script, e.g. apktool + apktool.jar), and the
+    facts learned about it are stored under that fingerprint: the detected
+    version, the probe syntax that produced it, and capability flags such as
+    whether apktool accepts -j. Upgrading or replacing a tool changes its
+    fingerprint, so stale facts are never reused; otherwise repeat runs
+    resolve the toolchain without launching a JVM.
+
+    Stored in <cache root>/toolchain.json.
+    """
+
+    VERSION_PROBES = (["version"], ["v"], ["-version"], ["-v"], ["--version"])
+    VERSION_RE = re.compile(r"\d+(?:\.\d+)+")
+
+    _shared: Optional["Toolchain"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: Optional[str] = None, verbose: bool = False):
+        self.path = path or str(PullCache.default_root() / "toolchain.json")
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        # {"tools": {path: {"fingerprint", "version", "probe", "flags"}}}
+        self._tools: Dict[str, dict] = self._load().get("tools", {})
+
+    @classmethod
+    def shared(cls) -> "Toolchain":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = Toolchain()
+            return cls._shared
+
+    # ---------- Public APIs ----------
+    def which(self, name: str) -> Optional[str]:
+        """
+        Resolved (symlink-free) path of a tool on PATH. Looked up every time:
+        a PATH scan is cheap, and a tool installed or removed while a daemon
+        runs must be seen. Only the facts about the binary are cached.
+        """
+        found = shutil.which(name)
+        return os.path.realpath(found) if found else None
+
+    def missing(self, names: Sequence[str]) -> List[str]:
+        return [n for n in names if self.which(n) is None]
+
+    def version(self, name: str, probes: Sequence[List[str]] = VERSION_PROBES,
+                input: Optional[str] = None) -> Optional[str]:
+        """
+        Version string of a tool. A cached result is returned without running
+        the tool; otherwise the probes are tried in order and the first one
+        whose output starts with a version number is remembered.
+        """
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        if entry.get("version"):
+            return entry["version"]
+        for probe in probes:
+            try:
+                cp = subprocess.run([self.which(name), *probe], input=input, capture_output=True,
+                                    text=True, errors="replace", timeout=60)
+            except (OSError, subprocess.SubprocessError):
+                continue
+            first = (cp.stdout.strip().splitlines() or [""])[0].strip()
+            m = self.VERSION_RE.match(first)
+            if cp.returncode == 0 and m:
+                if self.verbose:
+                    print(f"[toolchain] {name} {m.group(0)} (probe: {' '.join(probe)})")
+                self._update(name, version=m.group(0), probe=list(probe))
+                return m.group(0)
+        return None
+
+    def flag(self, name: str, key: str, default=None):
+        entry = self._entry(name)
+        return entry.get("flags", {}).get(key, default) if entry is not None else default
+
+    def set_flag(self, name: str, key: str, value) -> None:
+        entry = self._entry(name)
+        if entry is not None and entry.get("flags", {}).get(key) != value:
+            self._update(name, flags={**entry.get("flags", {}), key: value})
+
+    # ---------- Internals ----------
+    def _fingerprint(self, path: str) -> Optional[dict]:
+        files = [path]
+        # Wrapper scripts (apktool, apktool.bat) run a jar next to them
+        stem = os.path.splitext(os.path.basename(path))[0]
+        jar = os.path.join(os.path.dirname(path), stem + ".jar")
+        if os.path.isfile(jar):
+            files.append(jar)
+        try:
+            stats = [os.stat(f) for f in files]
+        except OSError:
+            return None
+        return {"files": files, "sizes": [s.st_size for s in stats], "mtimes": [s.st_mtime_ns for s in stats]}
+
+    def _entry(self, name: str) -> Optional[dict]:
+        path = self.which(name)
+        if path is None:
+            return None
+        fp = self._fingerprint(path)
+        if fp is None:
+            return None
+        with self._lock:
+            entry = self._tools.get(path)
+            if entry is None or entry.get("fingerprint") != fp:
+                entry = {"fingerprint": fp}
+                self._tools[path] = entry
+            return entry
+
+    def _update(self, name: str, **fields) -> None:
+        path = self.which(name)
+        if path is None:
+            return
+        with self._lock:
+            self._tools.setdefault(path, {}).update(fields)
+            self._save()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"tools": self._tools}, fh, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
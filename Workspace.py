@@ -0,0 +1,168 @@
+import os, sys, atexit, shutil, subprocess, tempfile, threading, weakref, zipfile, uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+class WorkspaceError(RuntimeError): pass
+
+class Workspace:
+    """
+    Scratch directory for decoding/rebuilding an APK.
+
+    - Sized up front from the zip central directory (uncompressed entry sizes,
+      scaled for smali/XML expansion) without extracting anything.
+    - Placed on tmpfs (/dev/shm, $XDG_RUNTIME_DIR) when the estimate fits,
+      otherwise on TMPDIR; fails fast when neither has room.
+    - Removed in a background thread: the tree is renamed to a trash name
+      (instant) and deleted while the process carries on. Removals still
+      running at interpreter exit are handed to a detached process, and any
+      trash left behind anyway is swept by the next Workspace.
+
+    Bytes promised to live workspaces are tracked per location so concurrent
+    workspaces don't all claim the same free space.
+    """
+
+    PREFIX = "patchapk_"
+    TRASH_PREFIX = ".patchapk-trash-"
+
+    # Decoded size relative to the uncompressed entry size
+    EXPANSION = {".dex": 4.0, ".xml": 3.0, ".arsc": 3.0}
+    # apktool b output (build/ intermediates + rebuilt APK) relative to the input
+    BUILD_FACTOR = 1.5
+    # Keep this fraction of a filesystem free
+    HEADROOM = 0.10
+
+    _reserved: Dict[str, int] = {}
+    _lock = threading.Lock()
+    _cleaners: List[Tuple[threading.Thread, str]] = []
+    _live: "weakref.WeakSet[Workspace]" = weakref.WeakSet()
+
+    def __init__(self, inputs: Iterable[str] = (), prefix: str = PREFIX, tmpfs: bool = True,
+                 base: Optional[str] = None, verbose: bool = False):
+        self.verbose = verbose
+        self.estimate = self.estimate_size(inputs)
+        self.base = self._choose_base(self.estimate, tmpfs, base)
+        self._sweep_trash(self.base)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.base)
+        # Like TemporaryDirectory: removed when garbage-collected if never cleaned up explicitly
+        self._finalizer = weakref.finalize(self, self._dispose, self.base, self.estimate, self.path, True)
+        self._live.add(self)
+        if self.verbose:
+            print(f"[+] Workspace {self.path} (estimated {self.estimate // (1024 * 1024)} MiB)")
+
+    # ---------- Public APIs ----------
+    @classmethod
+    def estimate_size(cls, apk_paths: Iterable[str]) -> int:
+        """Bytes needed to decode and rebuild apk_paths, from their central directories."""
+        total = 0
+        for p in apk_paths:
+            try:
+                with zipfile.ZipFile(p) as zf:
+                    for info in zf.infolist():
+                        ext = os.path.splitext(info.filename)[1].lower()
+                        total += int(info.file_size * cls.EXPANSION.get(ext, 1.0))
+            except (OSError, zipfile.BadZipFile):
+                pass
+            if os.path.isfile(p):
+                total += int(os.path.getsize(p) * cls.BUILD_FACTOR)
+        return total
+
+    def cleanup(self, background: bool = True) -> None:
+        if self._finalizer.detach() is not None:
+            self._dispose(self.base, self.estimate, self.path, background)
+
+    @classmethod
+    def wait_for_cleanup(cls, timeout: Optional[float] = None) -> None:
+        """Block until background removals finish (e.g. in a long-running service)."""
+        for t, _ in list(cls._cleaners):
+            t.join(timeout)
+        cls._cleaners = [(t, p) for t, p in cls._cleaners if t.is_alive()]
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+    # ---------- Internals ----------
+    @classmethod
+    def _tmpfs_candidates(cls) -> List[str]:
+        cands = []
+        runtime = os.environ.get("XDG_RUNTIME_DIR")
+        if runtime:
+            cands.append(runtime)
+        if sys.platform.startswith("linux"):
+            cands.append("/dev/shm")
+        return [c for c in cands if os.path.isdir(c) and os.access(c, os.W_OK)]
+
+    def _choose_base(self, needed: int, tmpfs: bool, base: Optional[str]) -> str:
+        candidates = [base] if base else (self._tmpfs_candidates() if tmpfs else []) + [tempfile.gettempdir()]
+        report = []
+        for cand in candidates:
+            avail = self._available(cand)
+            report.append(f"{cand}: {avail // (1024 * 1024)} MiB free")
+            if needed <= avail:
+                self._reserve(cand, needed)
+                return cand
+        raise WorkspaceError(
+            f"Not enough disk space to decode: need ~{needed // (1024 * 1024)} MiB ({'; '.join(report)}). "
+            "Free some space or point TMPDIR at a larger filesystem."
+        )
+
+    @classmethod
+    def _available(cls, path: str) -> int:
+        usage = shutil.disk_usage(path)
+        with cls._lock:
+            reserved = cls._reserved.get(path, 0)
+        return max(0, int(usage.free - usage.total * cls.HEADROOM) - reserved)
+
+    @classmethod
+    def _reserve(cls, path: str, size: int) -> None:
+        with cls._lock:
+            cls._reserved[path] = cls._reserved.get(path, 0) + size
+
+    @classmethod
+    def _release(cls, path: str, size: int) -> None:
+        with cls._lock:
+            cls._reserved[path] = max(0, cls._reserved.get(path, 0) - size)
+
+    @classmethod
+    def _dispose(cls, base: str, estimate: int, path: str, background: bool) -> None:
+        cls._release(base, estimate)
+        if not os.path.exists(path):
+            return
+        if not background:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        trash = os.path.join(os.path.dirname(path), cls.TRASH_PREFIX + uuid.uuid4().hex)
+        try:
+            os.rename(path, trash)
+        except OSError:
+            trash = path
+        cls._remove_in_background(trash)
+
+    @classmethod
+    def _remove_in_background(cls, path: str) -> None:
+        t = threading.Thread(target=shutil.rmtree, args=(path, True), daemon=True)
+        t.start()
+        cls._cleaners.append((t, path))
+
+    @classmethod
+    def _at_exit(cls) -> None:
+        for ws in list(cls._live):
+            ws.cleanup()
+        for t, path in cls._cleaners:
+            if t.is_alive() and os.path.exists(path):
+                subprocess.Popen([sys.executable, "-c", "import shutil, sys; shutil.rmtree(sys.argv[1], True)", path],
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 start_new_session=True)
+
+    @classmethod
+    def _sweep_trash(cls, base: str) -> None:
+        try:
+            names = [n for n in os.listdir(base) if n.startswith(cls.TRASH_PREFIX)]
+        except OSError:
+            return
+        for n in names:
+            cls._remove_in_background(os.path.join(base, n))
+
+
+atexit.register(Workspace._at_exit)
@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
-import argparse, os, sys, tempfile, shutil, subprocess
+import argparse, contextlib, functools, os, re, sys, subprocess, time, traceback
 from pathlib import Path
 
-from APK import APK
 from ADBHelper import ADBHelper, ADBError
-
-from termcolor import colored # pip3 install termcolor
-from FridaGadget import FridaGadget
+from PullCache import PullCache
+from Workspace import Workspace, WorkspaceError
+from Materializer import Materializer
+from Toolchain import Toolchain
+from ResultCache import ResultCache
+from ApkInspector import ApkInspector, ApkInspectError
+from ApkVerifier import ApkVerifier, ApkVerifyError
+
+# BuildWorker.DEFAULT_PORT: BuildWorker (http.server) is only imported to serve or build
+DEFAULT_WORKER_PORT = 7701
+
+def colored(text: str, color: str) -> str:
+    # termcolor is only needed once something is printed in colour, not for --help
+    from termcolor import colored as _colored # pip3 install termcolor
+    return _colored(text, color)
 
 def abort(msg):
     print(colored(msg, "red"))
@@ -15,13 +26,15 @@ def abort(msg):
 def warningPrint(msg):
     print(colored(msg, "yellow"))
 
-def sign_with_apksigner(apk_path: str, verbose: bool = False):
+DEBUG_KS_NAME  = "patchapk.jks"
+DEBUG_KS_ALIAS = "patchapk"
+DEBUG_KS_PASS  = "patchapk"
 
-    DEBUG_KS_NAME  = "patchapk.jks"
-    DEBUG_KS_ALIAS = "patchapk"
-    DEBUG_KS_PASS  = "patchapk" 
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    ks_path = os.path.join(script_dir, DEBUG_KS_NAME)
+def keystore_path() -> str:
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), DEBUG_KS_NAME)
+
+def sign_with_apksigner(apk_path: str, verbose: bool = False):
+    ks_path = keystore_path()
     cmd = [
         "apksigner", "sign",
         "--ks", ks_path,
@@ -41,7 +54,165 @@ def sign_with_apksigner(apk_path: str, verbose: bool = False):
     
     
 
-def choose_package(adb: ADBHelper, pattern: str, verbose: bool = False) -> str:
+def result_cache_options(args, gadget_version) -> dict:
+    """Everything besides the input APKs that changes the bytes of the final APK."""
+    apktool = "apktool.bat" if os.name == "nt" else "apktool"
+    ks_path = keystore_path()
+    ks_stat = os.stat(ks_path) if os.path.isfile(ks_path) else None
+    return {
+        "frida_gadget": None if args.no_gadget else gadget_version,
+        "enable_user_certs": args.enable_user_certs,
+        "disable_styles_hack": args.disable_styles_hack,
+        "decode_splits": args.decode_splits,
+        "uncompressed_native_libs": args.uncompressed_native_libs,
+        "asset_passthrough": args.asset_passthrough,
+        "smali_all_dex": args.smali_all_dex,
+        "apktool": Toolchain.shared().version(apktool, input=chr(13) + chr(10)),
+        "signing_key": _key_sha256(ks_path, ks_stat.st_mtime_ns, ks_stat.st_size) if ks_stat else None,
+    }
+
+def build_options(args, gadget_version) -> dict:
+    """What BuildWorker.rebuild needs, locally or on a remote worker; --extract-only applies no patches."""
+    return {
+        "gadget_version": gadget_version,
+        "frida_gadget": not args.no_gadget and not args.extract_only,
+        "enable_user_certs": args.enable_user_certs and not args.extract_only,
+        "disable_styles_hack": args.disable_styles_hack,
+        "decode_splits": args.decode_splits,
+        "uncompressed_native_libs": args.uncompressed_native_libs,
+        "asset_passthrough": args.asset_passthrough,
+        "smali_all_dex": args.smali_all_dex,
+    }
+
+@functools.lru_cache(maxsize=4)
+def _key_sha256(path: str, mtime_ns: int, size: int) -> str:
+    # Hashed once per keystore version: a daemon signs many APKs with the same key
+    return ResultCache.file_sha256(path)
+
+@functools.lru_cache(maxsize=4)
+def _key_cert_sha256(path: str, mtime_ns: int, size: int) -> str:
+    return ApkVerifier.keystore_cert_sha256(path, DEBUG_KS_ALIAS, DEBUG_KS_PASS)
+
+def remote_result_check(args):
+    """
+    Check for a result fetched from the remote cache: it must pass the
+    verification a local build gets and be signed with the local keystore.
+    """
+    def check(apk_path: str) -> None:
+        ApkVerifier.verify(apk_path, frida_gadget=not args.no_gadget, enable_user_certs=args.enable_user_certs,
+                           extract_native_libs=not args.uncompressed_native_libs)
+        ks_stat = os.stat(keystore_path())
+        ApkVerifier.check_signer(apk_path, _key_cert_sha256(keystore_path(), ks_stat.st_mtime_ns, ks_stat.st_size))
+    return check
+
+def save_target(args, pkg: str, cwd: str = None, variant: str = None) -> str:
+    """
+    --save-apk (relative to the caller's directory) or <pkg>.apk, with
+    -<variant> before the extension; parent directories are created.
+    """
+    target = os.path.join(cwd or os.getcwd(), args.save_apk if args.save_apk else f"{pkg}.apk")
+    if variant:
+        stem, ext = os.path.splitext(target)
+        target = f"{stem}-{variant}{ext or '.apk'}"
+    Path(os.path.dirname(target)).mkdir(parents=True, exist_ok=True)
+    return target
+
+# --variant NAME:OPTS tokens -> (args attribute, value)
+VARIANT_FLAGS = {
+    "gadget": ("no_gadget", False),
+    "no-gadget": ("no_gadget", True),
+    "user-certs": ("enable_user_certs", True),
+    "no-user-certs": ("enable_user_certs", False),
+    "uncompressed-native-libs": ("uncompressed_native_libs", True),
+    "extract-native-libs": ("uncompressed_native_libs", False),
+}
+
+def variant_spec(text: str) -> tuple:
+    """argparse type for --variant: "NAME:opt,opt,gadget-version=X" -> (name, {args attribute: value})."""
+    name, _, spec = text.partition(":")
+    if not re.match(r"^[A-Za-z0-9._-]+$", name):
+        raise argparse.ArgumentTypeError(f"bad variant name '{name}' (letters, digits, '.', '_', '-')")
+    overrides = {}
+    for token in filter(None, (t.strip() for t in spec.split(","))):
+        key, _, value = token.partition("=")
+        if key == "gadget-version" and value:
+            overrides.update(gadget_version=value, no_gadget=False)
+        elif token in VARIANT_FLAGS:
+            attr, val = VARIANT_FLAGS[token]
+            overrides[attr] = val
+        else:
+            raise argparse.ArgumentTypeError(
+                f"unknown variant option '{token}' (gadget-version=X, {', '.join(VARIANT_FLAGS)})")
+    return name, overrides
+
+def align_sign_verify(base, args) -> str:
+    """zipalign, sign and verify a rebuilt APK in place; returns its path."""
+    base.zipalign(in_place=True)
+    final_apk = base.apk_path
+
+    print(f"[+] Signing {os.path.basename(final_apk)} with apksigner")
+    sign_with_apksigner(final_apk, verbose=args.verbose)
+
+    # Catch a broken build here rather than after the original app is uninstalled
+    started = time.monotonic()
+    checks = ApkVerifier.verify(final_apk, frida_gadget=not args.no_gadget,
+                                enable_user_certs=args.enable_user_certs,
+                                extract_native_libs=not args.uncompressed_native_libs)
+    if args.verbose:
+        print(f"[+] Verified {', '.join(checks)} in {(time.monotonic() - started) * 1000:.0f} ms")
+    return final_apk
+
+def build_variants(args, pkg: str, local_apks, tmp: str, held: contextlib.ExitStack, cwd: str = None) -> None:
+    """
+    --variant: decode and merge once, then patch, build, sign and save every
+    variant from its own copy-on-write snapshot of the tree. Variants found
+    in the result cache are not built at all. Gadget tags stay pinned until
+    `held` (the job's stack) is closed.
+    """
+    from BuildWorker import BuildWorker
+    from FridaGadget import FridaGadget
+    variants = {name: argparse.Namespace(**{**vars(args), **overrides}) for name, overrides in args.variant}
+    tags = {}
+    for vargs in variants.values():
+        if not vargs.no_gadget and vargs.gadget_version not in tags:
+            tags[vargs.gadget_version] = held.enter_context(
+                FridaGadget(verbose=args.verbose).obtained(vargs.gadget_version))
+
+    result_cache = None if args.no_result_cache else ResultCache(verbose=args.verbose)
+    finished, pending = {}, {}
+    for name, vargs in variants.items():
+        tag = None if vargs.no_gadget else tags[vargs.gadget_version]
+        final_apk = os.path.join(tmp, f"{pkg}-{name}.apk")
+        key = desc = None
+        if result_cache is not None:
+            key, desc = ResultCache.key(local_apks, result_cache_options(vargs, tag))
+            if result_cache.fetch(key, final_apk, verify_remote=remote_result_check(vargs)):
+                print(f"[+] Variant {name}: using cached patched APK")
+                finished[name] = final_apk
+                continue
+        pending[name] = (vargs, tag, key, desc)
+
+    if pending:
+        infos = ApkInspector.inspect_all(local_apks)
+        if infos[0]["proguard"] or infos[0]["andresguard"]:
+            warningPrint("[!] Detected ProGuard/AndResGuard, decompile/recompile may not succeed.")
+        print(f"[*] Building {len(pending)} variant(s) from one decode: {', '.join(pending)}")
+        built = BuildWorker.rebuild_variants([info["path"] for info in infos], build_options(args, None),
+                                             {name: build_options(vargs, tag)
+                                              for name, (vargs, tag, _, _) in pending.items()},
+                                             verbose=args.verbose)
+        for name, apk in built.items():
+            vargs, _, key, desc = pending[name]
+            finished[name] = align_sign_verify(apk, vargs)
+            if result_cache is not None:
+                result_cache.store(key, finished[name], desc)
+
+    for name in variants:
+        target = save_target(args, pkg, cwd, variant=name)
+        Materializer.materialize(finished[name], target)
+        print(f"[+] Saved variant {name}: {colored(target, 'green')}")
+
+def choose_package(adb: ADBHelper, pattern: str, verbose: bool = False, interactive: bool = True) -> str:
     matches = adb.get_packages(pattern)
     if not matches:
         raise abort(f"No packages found matching '{pattern}'")
@@ -49,6 +220,9 @@ def choose_package(adb: ADBHelper, pattern: str, verbose: bool = False) -> str:
     if len(matches) == 1:
         return matches[0]
 
+    if not interactive:
+        raise ADBError(f"'{pattern}' matches several packages: {', '.join(matches)}")
+
     # Multiple matches: show menu, ask user to choose by number
     print("[*] Multiple matching packages found. Select the package to patch:")
     for i, name in enumerate(matches, start=1):
@@ -72,9 +246,9 @@ def choose_package(adb: ADBHelper, pattern: str, verbose: bool = False) -> str:
         print("Invalid choice. Please enter a number from the list, or 'q' to cancel.")
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Pull, merge/patch, add gadget, build, align, sign, install.")
-    ap.add_argument("pkg_pattern", help="Package name or substring")
+    ap.add_argument("pkg_pattern", nargs="?", help="Package name or substring")
     ap.add_argument("--serial", help="adb -s <serial>")
     ap.add_argument("--user", default="0", help="Preferred user id (fallback to others if not found)")
     ap.add_argument("--gadget-version", default=None, help="Frida Gadget version (None = latest)")
@@ -86,13 +260,160 @@ def main():
                     help="Only extract, merge and rebuild")
     ap.add_argument("--disable-styles-hack", action="store_true", default=False,
                     help="Skip duplicate <style><item> removal (merge step)")
+    ap.add_argument("--decode-splits", action="store_true", default=False,
+                    help="Decode every split with apktool instead of merging resources.arsc tables directly")
+    ap.add_argument("--uncompressed-native-libs", action="store_true", default=False,
+                    help="Keep extractNativeLibs=false: store lib/**/*.so uncompressed and page-aligned "
+                         "so they load straight from the APK (faster installs, no extracted copies)")
+    ap.add_argument("--asset-passthrough", action="store_true", default=False,
+                    help="Decode without assets/ and copy the original entries into the rebuilt APK as-is "
+                         "(much less I/O for asset-heavy apps)")
+    ap.add_argument("--smali-all-dex", action="store_true", default=False,
+                    help="Disassemble every classesN.dex instead of only the one defining the Application class")
+    ap.add_argument("--variant", action="append", type=variant_spec, default=[], metavar="NAME:OPTS",
+                    help="Build a named variant from a shared decode (repeatable), e.g. "
+                         "nogadget:no-gadget, certs:user-certs, g16:gadget-version=16.7.19; "
+                         "variants are saved as <pkg>-NAME.apk and not installed")
     ap.add_argument("--no-install", action="store_true", help="Do not install to device at the end")
     ap.add_argument("--save-apk", help="Copy final APK to this path")
+    ap.add_argument("--no-pull-cache", action="store_true", default=False,
+                    help="Always pull APKs from the device, ignoring the local pull cache")
+    ap.add_argument("--no-result-cache", action="store_true", default=False,
+                    help="Always rebuild, ignoring previously patched APKs with identical inputs")
+    ap.add_argument("--serve", action="store_true", default=False,
+                    help="Run as a long-lived patch daemon that keeps toolchain, device and key state warm")
+    ap.add_argument("--daemon", action="store_true", default=False,
+                    help="Hand this run to a running daemon (falls back to a local run if none is up)")
+    ap.add_argument("--daemon-socket", default=None, help="Daemon Unix socket (default: <cache dir>/daemon.sock)")
+    ap.add_argument("--daemon-port", type=int, default=None,
+                    help="Serve/connect on 127.0.0.1:<port> instead of a Unix socket")
+    ap.add_argument("--daemon-jobs", type=int, default=None,
+                    help="Concurrent jobs when serving (default: PATCHAPK_DAEMON_JOBS or 2)")
+    ap.add_argument("--workers", default=None,
+                    help="Comma-separated host:port build workers for decode/merge/build "
+                         "(default: PATCHAPK_WORKERS; local build if none is reachable)")
+    ap.add_argument("--worker", action="store_true", default=False,
+                    help="Run as a build worker for other patch-apk coordinators")
+    ap.add_argument("--worker-bind", default=f"127.0.0.1:{DEFAULT_WORKER_PORT}",
+                    help="host:port the build worker listens on (non-loopback needs PATCHAPK_WORKER_TOKEN)")
+    ap.add_argument("--worker-jobs", type=int, default=None,
+                    help="Concurrent builds per worker (default: PATCHAPK_WORKER_JOBS or 1)")
+    ap.add_argument("--serve-cache", metavar="HOST:PORT", default=None,
+                    help="Serve a shared cache for PATCHAPK_REMOTE_CACHE=http://HOST:PORT "
+                         "(decoded trees, gadgets, patched APKs)")
     ap.add_argument("-v", "--verbose", action="store_true")
-    args = ap.parse_args()
+    return ap
+
+def check_variants(ap: argparse.ArgumentParser, args) -> None:
+    names = [name for name, _ in args.variant]
+    if len(set(names)) != len(names):
+        ap.error("variant names must be unique")
+    if args.variant and args.extract_only:
+        ap.error("--variant can't be combined with --extract-only")
+
+def loaded_error(module: str, name: str) -> tuple:
+    """
+    The error class `name` of `module` if it has been imported, else an empty
+    tuple (which isinstance and except never match): an error can't come
+    from a module that was never loaded, and importing it here would cost
+    every run its http.client/ssl imports.
+    """
+    mod = sys.modules.get(module)
+    return (getattr(mod, name),) if mod is not None else ()
+
+def error_exit_code(e: BaseException) -> int:
+    """Print a pipeline error and return the process exit code for it."""
+    if isinstance(e, ADBError):
+        print(f"[ADB ERROR] {e}", file=sys.stderr)
+        return 2
+    if isinstance(e, WorkspaceError):
+        print(f"[WORKSPACE ERROR] {e}", file=sys.stderr)
+        return 4
+    if isinstance(e, ApkInspectError):
+        print(f"[APK ERROR] {e}", file=sys.stderr)
+        return 5
+    if isinstance(e, ApkVerifyError):
+        print(f"[VERIFY ERROR] {e}", file=sys.stderr)
+        return 6
+    if isinstance(e, loaded_error("BuildWorker", "WorkerError")):
+        print(f"[WORKER ERROR] {e}", file=sys.stderr)
+        return 7
+    if isinstance(e, loaded_error("CacheBackend", "CacheBackendError")):
+        print(f"[CACHE ERROR] {e}", file=sys.stderr)
+        return 8
+    if isinstance(e, subprocess.CalledProcessError):
+        print(f"[PROC ERROR] {e}", file=sys.stderr)
+        return 3
+    if isinstance(e, KeyboardInterrupt):
+        return 130
+    traceback.print_exception(type(e), e, e.__traceback__)
+    return 1
+
+def main(argv=None) -> int:
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    if args.serve:
+        from PatchDaemon import PatchDaemon
+        def run_job(job_argv, cwd):
+            job_args = build_parser().parse_args(job_argv)
+            if job_args.serve or job_args.daemon or job_args.worker or job_args.serve_cache:
+                abort("--serve/--daemon/--worker/--serve-cache can't be used inside a daemon job")
+            if not job_args.pkg_pattern:
+                abort("A package pattern is required")
+            check_variants(build_parser(), job_args)
+            run(job_args, cwd=cwd, interactive=False)
+        PatchDaemon(run_job, error_exit_code, jobs=args.daemon_jobs, socket_path=args.daemon_socket,
+                    port=args.daemon_port, verbose=args.verbose).serve()
+        return 0
+
+    if args.serve_cache:
+        from CacheBackend import CacheServer
+        host, _, port = args.serve_cache.rpartition(":")
+        if not host or not port.isdigit():
+            ap.error("--serve-cache expects host:port")
+        CacheServer(host, int(port), verbose=args.verbose).serve()
+        return 0
+
+    if args.worker:
+        from BuildWorker import BuildWorker
+        host, _, port = args.worker_bind.rpartition(":")
+        if not host or not port.isdigit():
+            ap.error("--worker-bind expects host:port")
+        BuildWorker(host, int(port), jobs=args.worker_jobs, verbose=args.verbose).serve()
+        return 0
+
+    if not args.pkg_pattern:
+        ap.error("the following arguments are required: pkg_pattern")
+    check_variants(ap, args)
+
+    if args.daemon:
+        from PatchDaemon import PatchDaemonClient
+        client = PatchDaemonClient(socket_path=args.daemon_socket, port=args.daemon_port)
+        if client.available():
+            job_argv = [a for a in argv if a != "--daemon"]
+            return client.run(job_argv, os.getcwd())
+        warningPrint("[!] No patch-apk daemon is running; patching locally.")
+
+    run(args)
+    return 0
+
+def run(args, cwd: str = None, interactive: bool = True):
+    """One pull/patch/sign/install run. cwd is where relative output paths resolve."""
+    # Pipeline modules are loaded only once there is work to do
+    from APK import APK
+    from BuildWorker import BuildWorker, WorkerPool, WorkerUnavailableError
+    from FridaGadget import FridaGadget
+
+    if args.verbose:
+        # Cached per apktool install: no JVM launch after the first run
+        apktool = "apktool.bat" if os.name == "nt" else "apktool"
+        print(f"[*] apktool {Toolchain.shared().version(apktool, input=chr(13) + chr(10)) or 'version unknown'}")
 
-    adb = ADBHelper(serial=args.serial, verbose=args.verbose)
-    pkg = choose_package(adb, args.pkg_pattern, verbose=args.verbose)
+    pull_cache = None if args.no_pull_cache else PullCache(verbose=args.verbose)
+    adb = ADBHelper(serial=args.serial, verbose=args.verbose, pull_cache=pull_cache)
+    pkg = choose_package(adb, args.pkg_pattern, verbose=args.verbose, interactive=interactive)
 
     print(f"[+] Using package: {colored(pkg, 'green')}")
 
@@ -101,18 +422,23 @@ def main():
     if not apk_paths:
         raise ADBError(f"No APK paths found for {pkg}")
     
-    if not args.extract_only:
-        print("[+] Fetching Frida gadgets")
-        gadget_version = FridaGadget(verbose = args.verbose).obtain_gadgets(args.gadget_version)
-        if not args.gadget_version:
-            warningPrint(f"No Frida Gadget version specified; using latest available ({gadget_version}).")
-            warningPrint("Specify --gadget-version 16.7.19 for compatibility with objection")
-
-    if args.verbose:
-        print(f"[*] Resolved user: {resolved_user}")
-        print(f"[*] APK paths: {apk_paths}")
-
-    with tempfile.TemporaryDirectory(prefix="patchapk_") as tmp:
+    # Pulled APKs are only read sequentially, so keep them off tmpfs; each APK
+    # gets its own sized workspace for decoding. `held` keeps the gadget tag
+    # pinned in the shared cache until the job is done with it.
+    with Workspace(prefix="patchapk_", tmpfs=False, verbose=args.verbose) as ws, contextlib.ExitStack() as held:
+        gadget_version = None
+        if not args.extract_only and not args.variant:
+            print("[+] Fetching Frida gadgets")
+            gadget_version = held.enter_context(FridaGadget(verbose=args.verbose).obtained(args.gadget_version))
+            if not args.gadget_version:
+                warningPrint(f"No Frida Gadget version specified; using latest available ({gadget_version}).")
+                warningPrint("Specify --gadget-version 16.7.19 for compatibility with objection")
+
+        if args.verbose:
+            print(f"[*] Resolved user: {resolved_user}")
+            print(f"[*] APK paths: {apk_paths}")
+
+        tmp = ws.path
         # Pull split(s) via ADBHelper
         local_apks = adb.pull_files(apk_paths, tmp, pkg)
 
@@ -121,59 +447,75 @@ def main():
         for p in local_apks:
             print(f"    - {os.path.basename(p)}")
 
-        if len(local_apks) == 1:
-            print("[*] Single APK detected")
-            base = APK(local_apks[0], verbose=args.verbose)
-        else:
-            print(f"[*] Split APK set detected ({len(local_apks)})")
-            apks = [APK(p, verbose=args.verbose) for p in local_apks]
-
-            # Find base APK (heuristic: filename containing "base", else first)
-            base = next((p for p in apks if "base.apk" in p.apk_path), apks[0])
-            others = [p for p in apks if p != base]
-            base.merge_with(others, disable_styles_hack=args.disable_styles_hack)
-
+        if args.variant:
+            build_variants(args, pkg, local_apks, tmp, held, cwd)
+            print("[*] Variants are saved, not installed")
+            return
 
-        if len(local_apks) == 1:
-            # If there's only one APK, and extract-only is requested, just copy it and exit
+        # A previous run with identical inputs and options already produced this APK
+        result_cache, cache_key, cache_desc, cached = None, None, None, False
+        if not args.extract_only and not args.no_result_cache:
+            result_cache = ResultCache(verbose=args.verbose)
+            cache_key, cache_desc = ResultCache.key(local_apks, result_cache_options(args, gadget_version))
+            final_apk = os.path.join(tmp, f"{pkg}-patched.apk")
+            cached = result_cache.fetch(cache_key, final_apk, verify_remote=remote_result_check(args))
+            if cached:
+                print("[+] Using cached patched APK (same inputs and options)")
+
+        if not cached:
+            # Classify the set from the zip central directories before any apktool run
+            infos = ApkInspector.inspect_all(local_apks)
+            if args.verbose:
+                for info in infos:
+                    print(f"    {ApkInspector.describe(info)}")
+            if infos[0]["proguard"] or infos[0]["andresguard"]:
+                warningPrint("[!] Detected ProGuard/AndResGuard, decompile/recompile may not succeed.")
+
+            if len(local_apks) == 1:
+                # If there's only one APK, and extract-only is requested, just copy it and exit
+                if args.extract_only:
+                    target = save_target(args, pkg, cwd)
+                    # The pulled file may share an inode with the pull cache: never hardlink it out
+                    Materializer.materialize(local_apks[0], target, allow_link=False)
+                    print(f"[+] Saved APK: {colored(target, 'green')}")
+                    return
+                print("[*] Single APK detected")
+            else:
+                print(f"[*] Split APK set detected ({len(local_apks)})")
+
+            # Decode (merging splits), patch and build, on a build worker when configured
+            options = build_options(args, gadget_version)
+            ordered = [info["path"] for info in infos]
+            base = None
+            workers = args.workers or os.environ.get("PATCHAPK_WORKERS")
+            if workers:
+                try:
+                    rebuilt = WorkerPool.shared(workers.split(","), verbose=args.verbose).rebuild(
+                        ordered, options, os.path.join(tmp, f"{pkg}-rebuilt.apk"))
+                    base = APK(rebuilt, verbose=args.verbose)
+                except WorkerUnavailableError as e:
+                    warningPrint(f"[!] {e}; building locally")
+            if base is None:
+                base = BuildWorker.rebuild(ordered, options, verbose=args.verbose)
+
+            # If extract-only, save and exit
             if args.extract_only:
-                target = args.save_apk if args.save_apk else f"{pkg}.apk"
-                Path(os.path.dirname(target) or ".").mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(local_apks[0], target)
+                target = save_target(args, pkg, cwd)
+                # The rebuilt APK lives in a workspace that is about to be removed
+                Materializer.materialize(base.apk_path, target, keep_src=False)
                 print(f"[+] Saved APK: {colored(target, 'green')}")
                 return
-        
-            # Otherwise, disassemble it for patching
-            base.disassemble()
-
-        # Apply patches
-        base.apply_patches(version=gadget_version,
-                            enable_user_certs=args.enable_user_certs,
-                            frida_gadget=not args.no_gadget)
-        # Build final APK
-        base.assemble()
-
-        # If extract-only, save and exit
-        if args.extract_only:
-            target = args.save_apk if args.save_apk else f"{pkg}.apk"
-            Path(os.path.dirname(target) or ".").mkdir(parents=True, exist_ok=True)
-            shutil.copyfile(final_apk, target)
-            print(f"[+] Saved APK: {colored(target, 'green')}")
-            return
 
-        # Prep apk for installation
-        base.zipalign(in_place=True)
-        final_apk = base.apk_path
+            final_apk = align_sign_verify(base, args)
 
-        # Sign
-        print("[+] Signing with apksigner")
-        sign_with_apksigner(final_apk, verbose=args.verbose)
+            if result_cache is not None:
+                result_cache.store(cache_key, final_apk, cache_desc)
 
         # Save copy if requested
         if args.save_apk or args.no_install:
-            target = args.save_apk if args.save_apk else f"{pkg}.apk"
-            Path(os.path.dirname(target) or ".").mkdir(parents=True, exist_ok=True)
-            shutil.copyfile(final_apk, target)
+            target = save_target(args, pkg, cwd)
+            # final_apk is a workspace file nobody else writes to, so a hardlink is safe
+            Materializer.materialize(final_apk, target)
             print(f"[+] Saved APK: {colored(target, 'green')}")
 
 
@@ -186,15 +528,14 @@ def main():
             print(f"[+] Installing patched version (user {resolved_user})")
             adb.install_apk(final_apk, user=resolved_user, replace=True)
 
+    if args.verbose:
+        print(f"[*] File materialization: {Materializer.summary()}")
+
 
 if __name__ == "__main__":
     try:
-        main()
-    except ADBError as e:
-        print(f"[ADB ERROR] {e}", file=sys.stderr)
-        sys.exit(2)
-    except subprocess.CalledProcessError as e:
-        print(f"[PROC ERROR] {e}", file=sys.stderr)
-        sys.exit(3)
-    except KeyboardInterrupt:
-        sys.exit(130)
+        sys.exit(main())
+    except (ADBError, WorkspaceError, ApkInspectError, ApkVerifyError, subprocess.CalledProcessError,
+            KeyboardInterrupt) + loaded_error("BuildWorker", "WorkerError") \
+            + loaded_error("CacheBackend", "CacheBackendError") as e:
+        sys.exit(error_exit_code(e))
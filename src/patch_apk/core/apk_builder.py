@@ -2,7 +2,6 @@
 APK building module responsible for rebuilding modified APK files.
 """
 import os
-import shutil
 
 # core imports
 from .apk_tool import APKTool
@@ -11,6 +10,8 @@ from .apk_tool import APKTool
 
 from patch_apk.utils.cli_tools import verbosePrint, abort, assertSubprocessSuccessfulRun
 from patch_apk.utils.fix_private_resources import fixPrivateResources
+from patch_apk.utils.materialize import materializeFile
+from patch_apk.utils.android_manifest import flushManifest
 
 
 class APKBuilder:
@@ -18,6 +19,9 @@ class APKBuilder:
 
     @staticmethod
     def build(baseapkdir):
+        # Write the manifest edits queued by the merge/patch steps in one go
+        flushManifest(baseapkdir)
+
         # Fix private resources preventing builds (apktool wontfix: https://github.com/iBotPeaches/Apktool/issues/2761)
         fixPrivateResources(baseapkdir)
 
@@ -33,7 +37,7 @@ class APKBuilder:
         verbosePrint("[+] Zip aligning new APK.")
         assertSubprocessSuccessfulRun(["zipalign", "-f", "4", "-p", os.path.join(baseapkdir, "dist", baseapkfilename),
             os.path.join(baseapkdir, "dist", baseapkfilename[:-4] + "-aligned.apk")])
-        shutil.move(os.path.join(baseapkdir, "dist", baseapkfilename[:-4] + "-aligned.apk"), os.path.join(baseapkdir, "dist", baseapkfilename))
+        materializeFile(os.path.join(baseapkdir, "dist", baseapkfilename[:-4] + "-aligned.apk"), os.path.join(baseapkdir, "dist", baseapkfilename), keepSource=False)
 
         # Sign the new APK
         verbosePrint("[+] Signing new APK.")
@@ -1,9 +1,7 @@
 ''' ApkTool related functions '''
 
-import subprocess
 import os
-from progress.bar import Bar
-from packaging.version import parse as parse_version
+import zipfile
 
 # util imports 
 
@@ -11,9 +9,12 @@ from patch_apk.utils.raw_re_replace import rawREReplace
 from patch_apk.utils.disable_apk_split import disableApkSplitting
 from patch_apk.utils.remove_duplicate_style import hackRemoveDuplicateStyleEntries
 from patch_apk.utils.fix_resource_id import fixPublicResourceIDs
-from patch_apk.utils.cli_tools import abort, verbosePrint, warningPrint
-from patch_apk.utils.apk_detect_proguard import detectProGuard
-from patch_apk.utils.copy_split_apks import copySplitApkFiles
+from patch_apk.utils.cli_tools import abort, getArgs, verbosePrint, warningPrint, stageSummary
+from patch_apk.utils.copy_split_apks import copySplitApkFiles, isContentOnlySplit, extractSplitContent
+from patch_apk.utils.stream_runner import runStreaming, APKTOOL_FATAL_PATTERNS
+from patch_apk.utils.core_budget import coreSlot
+from patch_apk.utils.toolchain import getToolVersion, getToolFlag, setToolFlag
+from patch_apk.utils.arsc_merge import mergeSplitAPKsBinary, ArscMergeError
 
 
 # core imports
@@ -44,40 +45,47 @@ class APKTool:
     '''
 
 
+    # Cleared the first time apktool rejects -j (versions before 2.7.0); None until read from the toolchain cache
+    jobsFlagSupported = None
+
     @staticmethod
     def runApkTool(params):
-        exe = "apktool.bat" if os.name == "nt" else "apktool"
+        exe = APKTool.executable()
         # Feed "\r\n" so apktool.bat's `pause` won’t block on Windows.
-        cp = subprocess.run(
-            [exe, *params],
-            input="\r\n",        # Should be harmless on linux
-            text=True,
-            capture_output=True,
-            check=False,
-        )
-        # Return a simple, uniform dict
-        return {
-            "returncode": cp.returncode,
-            "stdout": cp.stdout,
-            "stderr": cp.stderr,
-            "ok": (cp.returncode == 0),
-        }
+        # Output is streamed (bounded tail kept) and the JVM is killed early on fatal errors.
+        # Returns a simple, uniform dict: returncode, stdout, stderr, ok, cancelled
+        def run(args):
+            return runStreaming([exe, *args], input="\r\n", label="apktool",
+                                fatalPatterns=APKTOOL_FATAL_PATTERNS)
+
+        # Decodes and builds draw their smali/baksmali thread count from the shared core budget
+        if APKTool.jobsFlagSupported is None:
+            APKTool.jobsFlagSupported = getToolFlag(exe, "jobs", True)
+        if len(params) > 1 and params[0] in ("d", "b") and APKTool.jobsFlagSupported:
+            target = [p for p in params[1:] if not p.startswith("-")]
+            with coreSlot("apktool " + params[0] + " " + os.path.basename(target[0] if target else "")) as threads:
+                result = run([*params, "-j", str(threads)])
+            output = result["stdout"] + result["stderr"]
+            if not result["ok"] and "nrecognized option" in output and "-j" in output:
+                APKTool.jobsFlagSupported = False
+                setToolFlag(exe, "jobs", False)
+                result = run(params)
+            return result
+        return run(params)
 
     @staticmethod
     def getApktoolVersion():
+        # Probed once per apktool install; later runs read it from the toolchain cache
+        from packaging.version import parse as parse_version
         commands = [["version"], ["v"], ["-version"], ["-v"]]    
-        for cmd in commands:
-            try:
-                result = APKTool.runApkTool(cmd)
+        version_str = getToolVersion(APKTool.executable(), commands, APKTool.runApkTool)
+        if version_str is None:
+            raise Exception("Error: Failed to get apktool version.")
+        return parse_version(version_str)
 
-                if result["returncode"] != 0:
-                    continue
-                version_output = result["stdout"].strip().split("\n")[0].strip()
-                version_str = version_output.split("-")[0].strip()
-                return parse_version(version_str)
-            except Exception as e:
-                continue
-        raise Exception("Error: Failed to get apktool version.")
+    @staticmethod
+    def executable():
+        return "apktool.bat" if os.name == "nt" else "apktool"
 
 
 
@@ -85,6 +93,7 @@ class APKTool:
     def combineSplitAPKs(pkgname, localapks, tmppath, disableStylesHack, extract_only):
 
         from .apk_builder import APKBuilder
+        from progress.bar import Bar
         
         warningPrint("[!] App bundle/split APK detected, rebuilding as a single APK.")
         
@@ -92,6 +101,23 @@ class APKTool:
         baseapkdir = os.path.join(tmppath, pkgname + "-base")
         baseapkfilename = pkgname + "-base.apk"
         splitapkpaths = []
+        # buildTargetAPK puts the base APK (found from its manifest) first
+        baseapk = localapks[0]
+
+        # Merge the splits' resource tables directly and decode only the merged APK
+        if not getArgs().decode_splits:
+            if APKTool.combineSplitAPKsBinary(pkgname, localapks, tmppath, baseapkdir, baseapkfilename):
+                if not disableStylesHack:
+                    hackRemoveDuplicateStyleEntries(baseapkdir)
+                disableApkSplitting(baseapkdir)
+                verbosePrint("[+] Fixing any improperly escaped ampersands.")
+                rawREReplace(os.path.join(baseapkdir, "res", "values", "strings.xml"), r'(&amp)([^;])', r'\1;\2')
+                APKBuilder.build(baseapkdir)
+                return os.path.join(baseapkdir, "dist", baseapkfilename)
+
+        # ABI splits and asset packs only carry lib/ and assets/: copy those without decoding
+        contentapks = [p for p in localapks if p != baseapk and isContentOnlySplit(p)]
+        localapks = [p for p in localapks if p not in contentapks]
 
         bar = Bar('[+] Disassembling split APKs', max=len(localapks))
         verboseOutput = ""
@@ -99,18 +125,15 @@ class APKTool:
         for apkpath in localapks:
             verboseOutput += "\nExtracted: " + apkpath
             bar.next()
-            apkdir = apkpath[:-4]
+            # The base is decoded where the rest of the rebuild expects it, whatever it was pulled as
+            apkdir = baseapkdir if apkpath == baseapk else apkpath[:-4]
             ret = APKTool.runApkTool(["d", apkpath, "-o", apkdir])
             if ret["returncode"] != 0:
                 abort("\nError: Failed to run 'apktool d " + apkpath + " -o " + apkdir + "'.\nRun with --debug-output for more information.")
             
             # Record the destination paths of all but the base APK
-            if not apkpath.endswith("base.apk"):
+            if apkpath != baseapk:
                 splitapkpaths.append(apkdir)
-            
-            # Check for ProGuard/AndResGuard - this might b0rk decompile/recompile
-            if detectProGuard(apkdir):
-                warningPrint("[!] WARNING: Detected ProGuard/AndResGuard, decompile/recompile may not succeed.\n")
         
         bar.finish()
 
@@ -119,6 +142,10 @@ class APKTool:
         # Walk the extracted APK directories and copy files and directories to the base APK
         print("[+] Rebuilding as a single APK")
         copySplitApkFiles(baseapkdir, splitapkpaths)
+        for apkpath in contentapks:
+            verbosePrint("[+] Copying lib/assets from " + os.path.basename(apkpath) + " without decoding.")
+            extractSplitContent(apkpath, baseapkdir)
+        stageSummary("Copy split content")
         
         # Fix public resource identifiers
         fixPublicResourceIDs(baseapkdir, splitapkpaths)
@@ -139,4 +166,23 @@ class APKTool:
         
         # Return the new APK path
         return os.path.join(baseapkdir, "dist", baseapkfilename)
-    
+
+    @staticmethod
+    def combineSplitAPKsBinary(pkgname, localapks, tmppath, baseapkdir, baseapkfilename):
+        # buildTargetAPK puts the base APK (found from its manifest) first
+        baseapk = localapks[0]
+        # Written under the base APK's name so apktool b names the output the same way
+        mergedapk = os.path.join(tmppath, "merged", baseapkfilename)
+        os.makedirs(os.path.dirname(mergedapk), exist_ok=True)
+        try:
+            mergeSplitAPKsBinary(baseapk, [p for p in localapks if p != baseapk], mergedapk)
+        except (ArscMergeError, OSError, zipfile.BadZipFile) as e:
+            warningPrint("[!] Binary resource merge failed (" + str(e) + "), decoding every split instead.")
+            return False
+
+        print("[+] Merged " + str(len(localapks) - 1) + " split resource tables, disassembling the merged APK")
+        ret = APKTool.runApkTool(["d", mergedapk, "-o", baseapkdir, "-f"])
+        if ret["returncode"] != 0:
+            abort("\nError: Failed to run 'apktool d " + mergedapk + " -o " + baseapkdir + "'.\nRun with --debug-output for more information.")
+        os.remove(mergedapk)
+        return True
@@ -1,28 +1,32 @@
 """
 Main entry point for the patch-apk tool.
 """
+import atexit
 import os
-import shutil
-import subprocess
-import tempfile
-
-#   core imports
-
-from patch_apk.core.apk_tool import APKTool
 
 #   utility imports
 
-from patch_apk.utils.cli_tools import getArgs, warningPrint, assertSubprocessSuccessfulRun
-from patch_apk.utils.dependencies import checkDependencies 
-from patch_apk.utils.frida_objection import fixAPKBeforeObjection, patchingWithObjection
-from patch_apk.utils.get_target_apk import getTargetAPK
-from patch_apk.utils.get_apk_paths import getAPKPathsForPackage
-from patch_apk.utils.verify_package_name import verifyPackageName
+from patch_apk.utils.cli_tools import getArgs
 
 def main():
     # Grab argz
     args = getArgs()
 
+    # Everything else is imported after argument parsing so --help and usage errors stay fast
+    from patch_apk.core.apk_tool import APKTool
+    from patch_apk.utils.cli_tools import warningPrint, verbosePrint, assertSubprocessSuccessfulRun
+    from patch_apk.utils.dependencies import checkDependencies
+    from patch_apk.utils.frida_objection import fixAPKBeforeObjection, patchingWithObjection
+    from patch_apk.utils.get_target_apk import pullTargetAPKs, buildTargetAPK
+    from patch_apk.utils.materialize import materializeFile, materializeSummary
+    from patch_apk.utils.native_libs import storeNativeLibsUncompressed
+    from patch_apk.utils.get_apk_paths import getAPKPathsForPackage, getRemoteAPKSizes
+    from patch_apk.utils.result_cache import resultCacheKey, fetchCachedResult, storeResult
+    from patch_apk.utils.toolchain import findTool
+    from patch_apk.utils.verify_apk import verifyAPK
+    from patch_apk.utils.verify_package_name import verifyPackageName
+    from patch_apk.utils.workspace import createWorkspace, removeWorkspace, finishWorkspaceRemoval, APK_SIZE_FACTOR
+
     # Check that dependencies are available
     checkDependencies(args.extract_only)
 
@@ -36,29 +40,63 @@ def main():
     # Get the APK path(s) from the device
     current_user, apkpaths = getAPKPathsForPackage(pkgname)
     
-    # Create a temp directory to work from
-    with tempfile.TemporaryDirectory() as tmppath:
-        # Get the APK to patch. Combine app bundles/split APKs into a single APK.
-        apkfile = getTargetAPK(pkgname, apkpaths, tmppath, args.disable_styles_hack, args.extract_only)
+    # Create a workspace sized from the remote APK sizes (tmpfs when it fits)
+    tmppath = createWorkspace(int(sum(getRemoteAPKSizes(apkpaths)) * APK_SIZE_FACTOR))
+    atexit.register(finishWorkspaceRemoval)
+    try:
+        # Pull the APK(s) from the device
+        localapks = pullTargetAPKs(pkgname, apkpaths, tmppath)
+
+        # A previous run with identical inputs and options already produced the patched APK
+        cacheKey, cacheDesc, cached = None, None, False
+        # --save-apk wants the unpatched combined APK, which a cache hit never produces
+        if not args.extract_only and args.save_apk is None and not args.no_result_cache:
+            objection = findTool("objection")
+            cacheKey, cacheDesc = resultCacheKey(localapks, {
+                "enable_user_certs": not args.no_enable_user_certs,
+                "disable_styles_hack": args.disable_styles_hack,
+                "decode_splits": args.decode_splits,
+                "uncompressed_native_libs": args.uncompressed_native_libs,
+                "frida_gadget": "16.7.19",
+                "apktool": apktoolVersion,
+                # objection patches and signs: its install stands in for the signing identity
+                "objection": [objection, os.path.getsize(objection), os.path.getmtime(objection)] if objection else None,
+            })
+            apkfile = os.path.join(tmppath, pkgname + "-patched.apk")
+            cached = fetchCachedResult(cacheKey, apkfile, not args.no_enable_user_certs, not args.uncompressed_native_libs)
+            if cached:
+                print("[+] Using cached patched APK (same inputs and options)")
+
+        if not cached:
+            # Get the APK to patch. Combine app bundles/split APKs into a single APK.
+            apkfile = buildTargetAPK(pkgname, localapks, tmppath, args.disable_styles_hack, args.extract_only)
         
-        # Save the APK if requested
-        if args.save_apk is not None or args.extract_only:
-            targetName = args.save_apk if args.save_apk is not None else pkgname + ".apk" # type: ignore
-            print("[+] Saving a copy of the APK to " + targetName)
-            shutil.copy(apkfile, targetName)
+            # Save the APK if requested
+            if args.save_apk is not None or args.extract_only:
+                targetName = args.save_apk if args.save_apk is not None else pkgname + ".apk" # type: ignore
+                print("[+] Saving a copy of the APK to " + targetName)
+                # With --extract-only the workspace copy is no longer needed, so it can be moved
+                materializeFile(apkfile, targetName, keepSource=not args.extract_only)
 
-            if args.extract_only:
-                os.remove(apkfile)
-                return
+                if args.extract_only:
+                    verbosePrint("[+] File materialization: " + materializeSummary())
+                    return
 
-        # Before patching with objection, add INTERNET permission if not already present, and set extractNativeLibs to true
-        fixAPKBeforeObjection(apkfile, not args.no_enable_user_certs)
+            # Before patching with objection, add INTERNET permission if not already present, and set extractNativeLibs to true
+            fixAPKBeforeObjection(apkfile, not args.no_enable_user_certs, not args.uncompressed_native_libs)
+            
+            # Patch the APK with objection
+            patchingWithObjection(apkfile)
         
-        # Patch the APK with objection
-        patchingWithObjection(apkfile)
-    
-        os.remove(apkfile)
-        shutil.move(apkfile[:-4] + ".objection.apk", apkfile)
+            materializeFile(apkfile[:-4] + ".objection.apk", apkfile, keepSource=False)
+            if args.uncompressed_native_libs:
+                storeNativeLibsUncompressed(apkfile)
+
+            # Catch a broken build here rather than after the original app is uninstalled
+            verifyAPK(apkfile, not args.no_enable_user_certs, not args.uncompressed_native_libs)
+
+            if cacheKey is not None:
+                storeResult(cacheKey, apkfile, cacheDesc)
         
         # Uninstall the original package from the device
         print(f"[+] Uninstalling the original package from the device. (user: {current_user})")
@@ -70,7 +108,11 @@ def main():
 
         
         # Done
+        verbosePrint("[+] File materialization: " + materializeSummary())
         print("[+] Done")
+    finally:
+        # Removed in the background so exit isn't held up by a huge decoded tree
+        removeWorkspace(tmppath)
 
 
 if __name__ == '__main__':
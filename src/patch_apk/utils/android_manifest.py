@@ -0,0 +1,87 @@
+import os
+import xml.etree.ElementTree
+from patch_apk.utils.cli_tools import verbosePrint
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+SPLIT_META_DATA = ("com.android.vending.splits.required", "com.android.vending.splits")
+
+# Decoded manifests by APK directory, parsed once and shared by every patch step until flushed
+_manifests = {}
+
+
+####################
+# Load (or reuse) the AndroidManifest.xml of a decoded APK directory. Edits
+# made through the helpers below stay in memory until flushManifest(), which
+# runs right before apktool b, so a run parses and writes the manifest once.
+####################
+def loadManifest(apkdir):
+    path = os.path.join(apkdir, "AndroidManifest.xml")
+    if path in _manifests:
+        return _manifests[path]
+
+    # One pass yields both the tree and the namespace declarations
+    namespaces = {}
+    it = xml.etree.ElementTree.iterparse(path, events=["start-ns"])
+    for _, (prefix, uri) in it:
+        namespaces.setdefault(prefix, uri)
+    namespaces.setdefault("android", ANDROID_NS)
+    for prefix in namespaces:
+        xml.etree.ElementTree.register_namespace(prefix, namespaces[prefix])
+
+    manifest = {
+        "path": path,
+        "tree": xml.etree.ElementTree.ElementTree(it.root),
+        "namespaces": namespaces,
+        "ns": "{" + namespaces["android"] + "}",
+        "edits": [],
+    }
+    _manifests[path] = manifest
+    return manifest
+
+
+def flushManifest(apkdir):
+    manifest = _manifests.pop(os.path.join(apkdir, "AndroidManifest.xml"), None)
+    if manifest is None or not manifest["edits"]:
+        return False
+    manifest["tree"].write(manifest["path"], encoding="utf-8", xml_declaration=True)
+    verbosePrint("[+] Wrote AndroidManifest.xml (" + str(len(manifest["edits"])) + " edits: " + ", ".join(manifest["edits"]) + ")")
+    return True
+
+
+def getApplicationElement(manifest):
+    return manifest["tree"].find(".//application")
+
+
+def ensurePermission(manifest, permission):
+    ns = manifest["ns"]
+    root = manifest["tree"].getroot()
+    for el in root:
+        if el.tag == "uses-permission" and el.attrib.get(ns + "name") == permission:
+            return False
+    el = xml.etree.ElementTree.Element("uses-permission")
+    el.attrib[ns + "name"] = permission
+    root.insert(0, el)
+    manifest["edits"].append("uses-permission " + permission)
+    return True
+
+
+def setApplicationAttribute(manifest, name, value):
+    appEl = getApplicationElement(manifest)
+    if appEl is not None and appEl.attrib.get(manifest["ns"] + name) != value:
+        appEl.attrib[manifest["ns"] + name] = value
+        manifest["edits"].append("application " + name + "=" + value)
+
+
+def removeSplitRequirements(manifest):
+    ns = manifest["ns"]
+    root = manifest["tree"].getroot()
+    appEl = getApplicationElement(manifest)
+    if appEl is not None:
+        if appEl.attrib.pop(ns + "isSplitRequired", None) is not None:
+            manifest["edits"].append("application -isSplitRequired")
+        for el in [el for el in appEl.findall("meta-data") if el.attrib.get(ns + "name") in SPLIT_META_DATA]:
+            appEl.remove(el)
+            manifest["edits"].append("meta-data -" + el.attrib[ns + "name"])
+    for name in ("isSplitRequired", "requiredSplitTypes", "splitTypes"):
+        if root.attrib.pop(ns + name, None) is not None:
+            manifest["edits"].append("manifest -" + name)
@@ -1,15 +1,25 @@
-import os
-
 ####################
-# Attempt to detect ProGuard/AndResGuard.
+# Attempt to detect ProGuard/AndResGuard from an open APK zip, before decoding.
 ####################
-def detectProGuard(extractedPath):
-    if os.path.exists(os.path.join(extractedPath, "original", "META-INF", "proguard")):
+# res/ directory types aapt emits; anything else means the paths were obfuscated
+RES_TYPES = ("anim", "animator", "color", "drawable", "font", "interpolator", "layout", "menu",
+             "mipmap", "navigation", "raw", "transition", "values", "xml")
+
+
+def detectProGuard(zf):
+    names = zf.namelist()
+    if any(n.startswith("META-INF/proguard/") for n in names):
         return True
-    if os.path.exists(os.path.join(extractedPath, "original", "META-INF", "MANIFEST.MF")):
-        fh = open(os.path.join(extractedPath, "original", "META-INF", "MANIFEST.MF"))
-        d = fh.read()
-        fh.close()
-        if "proguard" in d.lower():
+    if "META-INF/MANIFEST.MF" in names:
+        # Signing manifests list every entry; only read them while they are small
+        info = zf.getinfo("META-INF/MANIFEST.MF")
+        if info.file_size < 4 * 1024 * 1024 and b"proguard" in zf.read(info).lower():
             return True
-    return False
\ No newline at end of file
+    return detectAndResGuard(names)
+
+
+def detectAndResGuard(names):
+    if any(n.startswith("r/") for n in names):
+        return True
+    resDirs = {n.split("/")[1].split("-")[0] for n in names if n.startswith("res/") and n.count("/") >= 2}
+    return any(d not in RES_TYPES for d in resDirs)
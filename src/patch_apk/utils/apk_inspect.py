@@ -0,0 +1,163 @@
+import os
+import re
+import struct
+import zipfile
+from patch_apk.utils.apk_detect_proguard import detectProGuard
+from patch_apk.utils.arsc_merge import _parseStringPool
+from patch_apk.utils.workspace import estimateDecodedSize
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_START_ELEMENT_TYPE = 0x0102
+NO_INDEX = 0xFFFFFFFF
+TYPE_STRING = 0x03
+TYPE_INT_BOOLEAN = 0x12
+
+DIST_NS = "http://schemas.android.com/apk/distribution"
+
+ABIS = ("arm64_v8a", "armeabi_v7a", "armeabi", "x86_64", "x86", "mips64", "mips")
+DENSITIES = ("ldpi", "mdpi", "tvdpi", "hdpi", "xhdpi", "xxhdpi", "xxxhdpi", "nodpi", "anydpi")
+LANGUAGE_RE = re.compile(r"^[a-z]{2,3}(?:[_-][A-Za-z0-9]+)*$")
+
+
+class APKInspectError(Exception):
+    pass
+
+
+####################
+# Classify a pulled APK from its zip central directory and binary
+# AndroidManifest.xml only, before anything is decoded. Returns a dict:
+#   path, package, split, kind, abis, dexCount, hasResources, proguard,
+#   entries, decodedEstimate
+# kind is base, abi, density, language, asset_pack, feature or config.
+####################
+def inspectAPK(apkpath):
+    try:
+        with zipfile.ZipFile(apkpath) as zf:
+            names = zf.namelist()
+            manifest = _manifestAttributes(zf.read("AndroidManifest.xml")) if "AndroidManifest.xml" in names else {}
+            proguard = detectProGuard(zf)
+    except (OSError, zipfile.BadZipFile, KeyError) as e:
+        raise APKInspectError(os.path.basename(apkpath) + ": not a readable APK (" + str(e) + ")")
+
+    info = {
+        "path": apkpath,
+        "package": manifest.get("package"),
+        "split": manifest.get("split"),
+        "kind": None,
+        "abis": sorted({n.split("/")[1] for n in names if n.startswith("lib/") and n.count("/") >= 2}),
+        "dexCount": sum(1 for n in names if re.match(r"^classes\d*\.dex$", n)),
+        "hasResources": "resources.arsc" in names,
+        "proguard": proguard,
+        "entries": len(names),
+        "decodedEstimate": estimateDecodedSize([apkpath]),
+    }
+    info["kind"] = _classify(info, manifest, names)
+    return info
+
+
+####################
+# Inspect a pulled set and check it can be merged before any apktool run.
+# The base APK is returned first.
+####################
+def inspectAPKs(apkpaths):
+    infos = [inspectAPK(p) for p in apkpaths]
+    bases = [i for i in infos if i["kind"] == "base"]
+    if len(bases) != 1:
+        found = ", ".join(os.path.basename(i["path"]) for i in bases) or "none"
+        raise APKInspectError("Expected exactly one base APK in the pulled set, found " + found)
+    packages = {i["package"] for i in infos if i["package"]}
+    if len(packages) > 1:
+        raise APKInspectError("Pulled APKs belong to different packages: " + ", ".join(sorted(packages)))
+    if not any(i["dexCount"] for i in infos):
+        raise APKInspectError("No classes.dex in any pulled APK: nothing to patch")
+    return bases + [i for i in infos if i is not bases[0]]
+
+
+def describeAPK(info):
+    parts = [info["kind"]]
+    if info["split"]:
+        parts.append(info["split"])
+    if info["abis"]:
+        parts.append("abis=" + ",".join(info["abis"]))
+    if info["dexCount"]:
+        parts.append("dex=" + str(info["dexCount"]))
+    if info["proguard"]:
+        parts.append("obfuscated")
+    parts.append("~" + str(info["decodedEstimate"] // (1024 * 1024)) + " MiB decoded")
+    return os.path.basename(info["path"]) + ": " + ", ".join(parts)
+
+
+def _classify(info, manifest, names):
+    split = info["split"]
+    if split is None and not manifest:
+        # Unreadable manifest: fall back to the file name the split was installed under
+        m = re.search(r"split_(.+)\.apk$", os.path.basename(info["path"]))
+        split = m.group(1) if m else None
+    if split is None:
+        return "base"
+    if manifest.get("moduleType") == "asset-pack":
+        return "asset_pack"
+    if split.startswith("config."):
+        dim = split[len("config."):]
+        if dim in ABIS:
+            return "abi"
+        if dim in DENSITIES:
+            return "density"
+        if LANGUAGE_RE.match(dim):
+            return "language"
+        return "config"
+    if not info["dexCount"] and not info["hasResources"] and \
+            all(n.startswith(("assets/", "META-INF/")) or n == "AndroidManifest.xml" for n in names):
+        return "asset_pack"
+    return "feature"
+
+
+####################
+# package/split/isFeatureSplit of <manifest> and dist:type of <dist:module>,
+# read from the binary XML without decoding the rest of the document.
+####################
+def _manifestAttributes(data):
+    attrs = {}
+    for element, elementAttrs in manifestElements(data):
+        if element == "application":
+            break  # everything of interest precedes <application>
+        for ns, key, value in elementAttrs:
+            if element == "manifest" and key in ("package", "split", "isFeatureSplit"):
+                attrs[key] = value
+            elif element == "module" and ns == DIST_NS and key == "type":
+                attrs["moduleType"] = value
+    return attrs
+
+
+####################
+# (element, [(namespace, attribute, value)]) for each start tag of a binary
+# XML document, in document order. Strings come back as str, booleans as
+# bool and anything else as the raw 32-bit data. Stops at a malformed chunk.
+####################
+def manifestElements(data):
+    try:
+        _, headerSize, size = struct.unpack_from("<HHI", data, 0)
+        strings = []
+        p = headerSize
+        while p + 8 <= min(size, len(data)):
+            chunkType, _, chunkSize = struct.unpack_from("<HHI", data, p)
+            if chunkSize < 8:
+                return
+            if chunkType == RES_STRING_POOL_TYPE:
+                strings = [t for t, _ in _parseStringPool(data, p)[0]]
+            elif chunkType == RES_XML_START_ELEMENT_TYPE:
+                _, name, attrStart, attrSize, attrCount = struct.unpack_from("<IIHHH", data, p + 16)
+                attrs = []
+                for i in range(attrCount):
+                    ns, key, raw, _, _, dataType, value = struct.unpack_from("<IIIHBBI", data, p + 16 + attrStart + i * attrSize)
+                    if raw != NO_INDEX:
+                        value = strings[raw]
+                    elif dataType == TYPE_STRING:
+                        value = strings[value]
+                    elif dataType == TYPE_INT_BOOLEAN:
+                        value = value != 0
+                    attrs.append((strings[ns] if ns != NO_INDEX else "", strings[key], value))
+                yield strings[name], attrs
+            p += chunkSize
+    except (struct.error, IndexError):
+        return
@@ -0,0 +1,468 @@
+import os
+import re
+import shutil
+import struct
+import zipfile
+from patch_apk.utils.cli_tools import verbosePrint
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+RES_TABLE_TYPE_SPEC_TYPE = 0x0202
+
+UTF8_FLAG = 1 << 8
+SPAN_END = 0xFFFFFFFF
+NO_ENTRY = 0xFFFFFFFF
+
+FLAG_COMPLEX = 0x0001
+FLAG_COMPACT = 0x0008
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+TYPE_STRING = 0x03
+
+# Never carried over from a split into the merged APK
+SPLIT_SKIP = ("AndroidManifest.xml", "resources.arsc", "stamp-cert-sha256")
+DEX_RE = re.compile(r"^classes\d*\.dex$")
+
+
+class ArscMergeError(RuntimeError):
+    pass
+
+
+####################
+# Merge split APKs into one APK without decoding them: the splits'
+# resources.arsc packages, type specs and config chunks are folded into the
+# base table at the binary level (resource IDs are kept), and every split's
+# files except those under skipPrefixes are copied next to the base APK's.
+# report(splitapk, stats) is called for each merged split table. Returns the
+# summed counts plus the merged table's "size". Raises ArscMergeError when
+# the tables can't be merged, or when a split carries code (a feature split's
+# classes.dex would collide with the base's), so the caller can fall back to
+# decoding each split.
+####################
+def mergeSplitAPKsBinary(baseapk, splitapks, outapk, skipPrefixes=(), report=None):
+    if report is None:
+        report = _reportSplit
+    for splitapk in splitapks:
+        with zipfile.ZipFile(splitapk) as zf:
+            dexfiles = [n for n in zf.namelist() if DEX_RE.match(n)]
+        if dexfiles:
+            raise ArscMergeError(os.path.basename(splitapk) + " carries code (" + ", ".join(dexfiles) + ")")
+    table = readResourceTable(baseapk)
+    if table is None:
+        raise ArscMergeError(os.path.basename(baseapk) + " has no resources.arsc")
+    totals = {"packages": 0, "configs": 0, "entries": 0, "conflicts": 0}
+    for splitapk in splitapks:
+        other = readResourceTable(splitapk)
+        if other is None:
+            continue
+        stats = mergeResourceTables(table, other)
+        for k, v in stats.items():
+            totals[k] += v
+        report(splitapk, stats)
+    merged = writeResourceTable(table)
+
+    seen = set(["resources.arsc"])
+    with zipfile.ZipFile(outapk, "w") as zout:
+        info = zipfile.ZipInfo("resources.arsc", (1980, 1, 1, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_STORED
+        zout.writestr(info, merged)
+        for i, apkpath in enumerate([baseapk] + list(splitapks)):
+            with zipfile.ZipFile(apkpath) as zin:
+                for entry in zin.infolist():
+                    name = entry.filename
+                    if name in seen or _isSignatureFile(name) or (i > 0 and name in SPLIT_SKIP) \
+                            or name.startswith(tuple(skipPrefixes)):
+                        continue
+                    seen.add(name)
+                    _copyZipEntry(zin, entry, zout)
+    totals["size"] = len(merged)
+    return totals
+
+
+def _reportSplit(splitapk, stats):
+    verbosePrint("[+] " + os.path.basename(splitapk) + ": +" + str(stats["configs"]) + " configs, +" +
+                 str(stats["entries"]) + " entries, " + str(stats["conflicts"]) + " conflicts")
+
+
+def readResourceTable(apkpath):
+    with zipfile.ZipFile(apkpath) as zf:
+        try:
+            data = zf.read("resources.arsc")
+        except KeyError:
+            return None
+    return parseResourceTable(data)
+
+
+####################
+# Parse a resources.arsc into {"utf8", "packages"}. Pool indices are resolved
+# to text (global values as (text, spans) tuples) so tables can be mixed.
+####################
+def parseResourceTable(data):
+    table = {"utf8": True, "packages": []}
+    try:
+        chunkType, headerSize, size = struct.unpack_from("<HHI", data, 0)
+        if chunkType != RES_TABLE_TYPE:
+            raise ArscMergeError("not a resource table")
+        p = headerSize
+        values = []
+        while p < min(size, len(data)):
+            chunkType, _, chunkSize = struct.unpack_from("<HHI", data, p)
+            if chunkSize < 8 or p + chunkSize > len(data):
+                raise ArscMergeError("truncated chunk at 0x%x" % p)
+            if chunkType == RES_STRING_POOL_TYPE:
+                values, table["utf8"] = _parseStringPool(data, p)
+            elif chunkType == RES_TABLE_PACKAGE_TYPE:
+                table["packages"].append(_parsePackage(data, p, values))
+            p += chunkSize
+    except (struct.error, IndexError) as e:
+        raise ArscMergeError("malformed resources.arsc: " + str(e))
+    return table
+
+
+####################
+# Fold the other table into table. Returns counts of what was added.
+####################
+def mergeResourceTables(table, other):
+    stats = {"packages": 0, "configs": 0, "entries": 0, "conflicts": 0}
+    for pkg in other["packages"]:
+        mine = next((p for p in table["packages"] if p["id"] == pkg["id"]), None)
+        if mine is None:
+            table["packages"].append(pkg)
+            stats["packages"] += 1
+        else:
+            _mergePackage(mine, pkg, stats)
+    return stats
+
+
+def writeResourceTable(table):
+    values = []
+    for pkg in table["packages"]:
+        for typeId in sorted(pkg["typesById"]):
+            for t in pkg["typesById"][typeId]:
+                for idx in sorted(t["entries"]):
+                    values.extend(_entryStrings(t["entries"][idx]))
+    order, index = _layoutStringPool(values)
+    pool = _writeStringPool(order, index, table["utf8"])
+    body = b"".join(_writePackage(pkg, index, table["utf8"]) for pkg in table["packages"])
+    return struct.pack("<HHII", RES_TABLE_TYPE, 12, 12 + len(pool) + len(body), len(table["packages"])) + pool + body
+
+
+def _mergePackage(mine, other, stats):
+    # Resource IDs are kept, so type ids must mean the same type in both tables
+    for i, name in enumerate(other["types"]):
+        if i < len(mine["types"]):
+            if mine["types"][i] != name:
+                raise ArscMergeError("type 0x%02x is %r in base but %r in split" % (i + 1, mine["types"][i], name))
+        else:
+            mine["types"].append(name)
+
+    for typeId, flags in other["specs"].items():
+        current = mine["specs"].setdefault(typeId, [])
+        if len(current) < len(flags):
+            current.extend([0] * (len(flags) - len(current)))
+        for i, f in enumerate(flags):
+            current[i] |= f
+
+    for typeId, types in other["typesById"].items():
+        mineTypes = mine["typesById"].setdefault(typeId, [])
+        for t in types:
+            key = _configKey(t["config"])
+            match = next((m for m in mineTypes if _configKey(m["config"]) == key), None)
+            if match is None:
+                mineTypes.append(t)
+                stats["configs"] += 1
+                stats["entries"] += len(t["entries"])
+                continue
+            for idx, e in t["entries"].items():
+                if idx not in match["entries"]:
+                    match["entries"][idx] = e
+                    stats["entries"] += 1
+                elif match["entries"][idx] != e:
+                    stats["conflicts"] += 1
+
+    for chunk in other["rawAfter"]:
+        if chunk not in mine["rawAfter"] and chunk not in mine["rawBefore"]:
+            mine["rawAfter"].append(chunk)
+
+
+def _configKey(config):
+    # Same config written by tools with different ResTable_config sizes
+    return config[4:].rstrip(b"\0")
+
+
+def _entryStrings(e):
+    if "items" in e:
+        return [d for _, t, d in e["items"] if t == TYPE_STRING]
+    t, d = e["value"]
+    return [d] if t == TYPE_STRING else []
+
+
+def _parseStringPool(data, off):
+    _, headerSize, _ = struct.unpack_from("<HHI", data, off)
+    count, styleCount, flags, stringsStart, stylesStart = struct.unpack_from("<IIIII", data, off + 8)
+    utf8 = bool(flags & UTF8_FLAG)
+    offsets = struct.unpack_from("<%dI" % count, data, off + headerSize)
+    styleOffsets = struct.unpack_from("<%dI" % styleCount, data, off + headerSize + 4 * count)
+    texts = [_decodeString(data, off + stringsStart + o, utf8) for o in offsets]
+
+    styles = []
+    for o in styleOffsets:
+        spans = []
+        q = off + stylesStart + o
+        while True:
+            name, = struct.unpack_from("<I", data, q)
+            if name == SPAN_END:
+                break
+            first, last = struct.unpack_from("<II", data, q + 4)
+            spans.append((texts[name], first, last))
+            q += 12
+        styles.append(tuple(spans))
+    return [(t, styles[i] if i < len(styles) else ()) for i, t in enumerate(texts)], utf8
+
+
+def _decodeString(data, p, utf8):
+    if utf8:
+        for _ in range(2):  # UTF-16 length, then byte length
+            n = data[p]
+            if n & 0x80:
+                n = ((n & 0x7F) << 8) | data[p + 1]
+                p += 2
+            else:
+                p += 1
+        return data[p:p + n].decode("utf-8", "surrogateescape")
+    n, = struct.unpack_from("<H", data, p)
+    p += 2
+    if n & 0x8000:
+        n = ((n & 0x7FFF) << 16) | struct.unpack_from("<H", data, p)[0]
+        p += 2
+    return data[p:p + 2 * n].decode("utf-16-le", "surrogatepass")
+
+
+def _parsePackage(data, off, values):
+    _, headerSize, size = struct.unpack_from("<HHI", data, off)
+    packageId, = struct.unpack_from("<I", data, off + 8)
+    name = data[off + 12:off + 268].decode("utf-16-le", "ignore").split("\0", 1)[0]
+    typeStrings, _, keyStrings, _ = struct.unpack_from("<IIII", data, off + 268)
+    typeIdOffset = struct.unpack_from("<I", data, off + 284)[0] if headerSize >= 288 else None
+    types = [t for t, _ in _parseStringPool(data, off + typeStrings)[0]]
+    keys = [k for k, _ in _parseStringPool(data, off + keyStrings)[0]]
+
+    pkg = {"id": packageId, "name": name, "headerSize": headerSize, "typeIdOffset": typeIdOffset,
+           "types": types, "specs": {}, "typesById": {}, "rawBefore": [], "rawAfter": []}
+    p = off + headerSize
+    end = off + size
+    while p < end:
+        chunkType, chunkHeaderSize, chunkSize = struct.unpack_from("<HHI", data, p)
+        if chunkSize < 8 or p + chunkSize > end:
+            raise ArscMergeError("truncated chunk at 0x%x in package %s" % (p, name))
+        if p in (off + typeStrings, off + keyStrings):
+            pass
+        elif chunkType == RES_TABLE_TYPE_SPEC_TYPE:
+            typeId, _, _, count = struct.unpack_from("<BBHI", data, p + 8)
+            pkg["specs"][typeId] = list(struct.unpack_from("<%dI" % count, data, p + chunkHeaderSize))
+        elif chunkType == RES_TABLE_TYPE_TYPE:
+            t = _parseType(data, p, keys, values)
+            pkg["typesById"].setdefault(t["id"], []).append(t)
+        else:
+            # Library/overlayable/staged-alias chunks carry no pool indices
+            (pkg["rawAfter"] if pkg["specs"] else pkg["rawBefore"]).append(data[p:p + chunkSize])
+        p += chunkSize
+    return pkg
+
+
+def _parseType(data, p, keys, values):
+    _, headerSize, _ = struct.unpack_from("<HHI", data, p)
+    typeId, typeFlags, _, count, entriesStart = struct.unpack_from("<BBHII", data, p + 8)
+    configSize, = struct.unpack_from("<I", data, p + 20)
+    config = bytes(data[p + 20:p + 20 + configSize])
+
+    slots = []
+    if typeFlags & TYPE_FLAG_SPARSE:
+        for i in range(count):
+            idx, o = struct.unpack_from("<HH", data, p + headerSize + 4 * i)
+            slots.append((idx, o * 4))
+    elif typeFlags & TYPE_FLAG_OFFSET16:
+        for idx, o in enumerate(struct.unpack_from("<%dH" % count, data, p + headerSize)):
+            if o != 0xFFFF:
+                slots.append((idx, o * 4))
+    else:
+        for idx, o in enumerate(struct.unpack_from("<%dI" % count, data, p + headerSize)):
+            if o != NO_ENTRY:
+                slots.append((idx, o))
+
+    entries = {idx: _parseEntry(data, p + entriesStart + o, keys, values) for idx, o in slots}
+    return {"id": typeId, "config": config, "entries": entries, "sparse": bool(typeFlags & TYPE_FLAG_SPARSE)}
+
+
+def _parseEntry(data, q, keys, values):
+    size, flags = struct.unpack_from("<HH", data, q)
+    if flags & FLAG_COMPACT:
+        # Compact entry: the key index sits in the size field, the data type in the high flag byte
+        d, = struct.unpack_from("<I", data, q + 4)
+        dataType = flags >> 8
+        return {"flags": flags & 0xFF & ~FLAG_COMPACT, "key": keys[size],
+                "value": (dataType, values[d] if dataType == TYPE_STRING else d)}
+    key, = struct.unpack_from("<I", data, q + 4)
+    if flags & FLAG_COMPLEX:
+        parent, n = struct.unpack_from("<II", data, q + 8)
+        items = []
+        r = q + size
+        for _ in range(n):
+            name, valueSize, _, dataType, d = struct.unpack_from("<IHBBI", data, r)
+            items.append((name, dataType, values[d] if dataType == TYPE_STRING else d))
+            r += 4 + valueSize
+        return {"flags": flags & ~FLAG_COMPLEX, "key": keys[key], "parent": parent, "items": items}
+    _, _, dataType, d = struct.unpack_from("<HBBI", data, q + size)
+    return {"flags": flags, "key": keys[key], "value": (dataType, values[d] if dataType == TYPE_STRING else d)}
+
+
+def _layoutStringPool(values):
+    # Styled strings must come first: style i belongs to string i
+    styled = []
+    plain = []
+    seen = set()
+    for v in values:
+        if v not in seen:
+            seen.add(v)
+            (styled if v[1] else plain).append(v)
+    for _, spans in styled:
+        for tag, _, _ in spans:
+            if (tag, ()) not in seen:
+                seen.add((tag, ()))
+                plain.append((tag, ()))
+    order = styled + plain
+    return order, {v: i for i, v in enumerate(order)}
+
+
+def _writeStringPool(order, index, utf8):
+    offsets = []
+    strings = bytearray()
+    for text, _ in order:
+        offsets.append(len(strings))
+        strings += _encodeString(text, utf8)
+    strings += b"\0" * (-len(strings) % 4)
+
+    styled = [v for v in order if v[1]]
+    styleOffsets = []
+    styles = bytearray()
+    for _, spans in styled:
+        styleOffsets.append(len(styles))
+        for tag, first, last in spans:
+            styles += struct.pack("<III", index[(tag, ())], first, last)
+        styles += struct.pack("<I", SPAN_END)
+    if styled:
+        styles += struct.pack("<II", SPAN_END, SPAN_END)
+
+    stringsStart = 28 + 4 * (len(order) + len(styled))
+    stylesStart = stringsStart + len(strings) if styled else 0
+    header = struct.pack("<HHIIIIII", RES_STRING_POOL_TYPE, 28, stringsStart + len(strings) + len(styles),
+                         len(order), len(styled), UTF8_FLAG if utf8 else 0, stringsStart, stylesStart)
+    return (header + struct.pack("<%dI" % len(offsets), *offsets) + struct.pack("<%dI" % len(styleOffsets), *styleOffsets)
+            + bytes(strings) + bytes(styles))
+
+
+def _encodeString(text, utf8):
+    units = len(text.encode("utf-16-le", "surrogatepass")) // 2
+    if utf8:
+        try:
+            raw = text.encode("utf-8", "surrogateescape")
+        except UnicodeEncodeError:
+            raw = text.encode("utf-8", "surrogatepass")
+        if len(raw) > 0x7FFF:
+            raise ArscMergeError("string too long for a UTF-8 string pool")
+        return _utf8Length(units) + _utf8Length(len(raw)) + raw + b"\0"
+    raw = text.encode("utf-16-le", "surrogatepass")
+    if units > 0x7FFF:
+        head = struct.pack("<HH", 0x8000 | (units >> 16), units & 0xFFFF)
+    else:
+        head = struct.pack("<H", units)
+    return head + raw + b"\0\0"
+
+
+def _utf8Length(n):
+    return bytes([0x80 | (n >> 8), n & 0xFF]) if n > 0x7F else bytes([n])
+
+
+def _writePackage(pkg, index, utf8):
+    keys = []
+    for typeId in sorted(pkg["typesById"]):
+        for t in pkg["typesById"][typeId]:
+            keys.extend((t["entries"][idx]["key"], ()) for idx in sorted(t["entries"]))
+    keyOrder, keyIndex = _layoutStringPool(keys)
+    keyPool = _writeStringPool(keyOrder, keyIndex, utf8)
+    typeOrder = [(t, ()) for t in pkg["types"]]
+    # Type names are positional (id - 1), never deduplicated
+    typePool = _writeStringPool(typeOrder, {v: i for i, v in enumerate(typeOrder)}, utf8)
+
+    body = bytearray(b"".join(pkg["rawBefore"]))
+    for typeId in sorted(set(pkg["specs"]) | set(pkg["typesById"])):
+        types = pkg["typesById"].get(typeId, [])
+        flags = pkg["specs"].get(typeId, [])
+        count = max([len(flags)] + [max(t["entries"], default=-1) + 1 for t in types])
+        flags = flags + [0] * (count - len(flags))
+        body += struct.pack("<HHIBBHI%dI" % count, RES_TABLE_TYPE_SPEC_TYPE, 16, 16 + 4 * count,
+                            typeId, 0, len(types), count, *flags)
+        for t in types:
+            body += _writeType(t, count, keyIndex, index)
+    body += b"".join(pkg["rawAfter"])
+
+    headerSize = pkg["headerSize"]
+    header = struct.pack("<HHII", RES_TABLE_PACKAGE_TYPE, headerSize,
+                         headerSize + len(typePool) + len(keyPool) + len(body), pkg["id"])
+    header += pkg["name"].encode("utf-16-le")[:254].ljust(256, b"\0")
+    header += struct.pack("<IIII", headerSize, len(typeOrder), headerSize + len(typePool), len(keyOrder))
+    if pkg["typeIdOffset"] is not None:
+        header += struct.pack("<I", pkg["typeIdOffset"])
+    header = header.ljust(headerSize, b"\0")
+    return header + typePool + keyPool + bytes(body)
+
+
+def _writeType(t, count, keyIndex, index):
+    config = t["config"] + b"\0" * (-len(t["config"]) % 4)
+    headerSize = 20 + len(config)
+    data = bytearray()
+    offsets = {}
+    for idx in sorted(t["entries"]):
+        offsets[idx] = len(data)
+        data += _writeEntry(t["entries"][idx], keyIndex, index)
+
+    if t["sparse"] and len(data) // 4 <= 0xFFFF:
+        table = b"".join(struct.pack("<HH", idx, offsets[idx] // 4) for idx in sorted(offsets))
+        typeFlags = TYPE_FLAG_SPARSE
+        n = len(offsets)
+    else:
+        table = struct.pack("<%dI" % count, *[offsets.get(i, NO_ENTRY) for i in range(count)])
+        typeFlags = 0
+        n = count
+    entriesStart = headerSize + len(table)
+    header = struct.pack("<HHIBBHII", RES_TABLE_TYPE_TYPE, headerSize, entriesStart + len(data),
+                         t["id"], typeFlags, 0, n, entriesStart)
+    return header + config + table + bytes(data)
+
+
+def _writeEntry(e, keyIndex, index):
+    key = keyIndex[(e["key"], ())]
+    if "items" in e:
+        out = struct.pack("<HHIII", 16, e["flags"] | FLAG_COMPLEX, key, e["parent"], len(e["items"]))
+        for name, dataType, d in e["items"]:
+            out += struct.pack("<IHBBI", name, 8, 0, dataType, index[d] if dataType == TYPE_STRING else d)
+        return out
+    dataType, d = e["value"]
+    return struct.pack("<HHIHBBI", 8, e["flags"], key, 8, 0, dataType, index[d] if dataType == TYPE_STRING else d)
+
+
+def _isSignatureFile(name):
+    if not name.startswith("META-INF/") or name.count("/") != 1:
+        return False
+    return name == "META-INF/MANIFEST.MF" or name.rsplit(".", 1)[-1] in ("SF", "RSA", "DSA", "EC")
+
+
+def _copyZipEntry(zin, entry, zout):
+    # Keep each entry's compression: apktool records stored entries as doNotCompress
+    info = zipfile.ZipInfo(entry.filename, entry.date_time)
+    info.compress_type = entry.compress_type
+    info.external_attr = entry.external_attr
+    with zin.open(entry) as src, zout.open(info, "w") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
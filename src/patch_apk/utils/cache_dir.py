@@ -0,0 +1,14 @@
+import os
+
+
+####################
+# Root of patch-apk's persistent caches: PATCHAPK_CACHE_DIR, else
+# $XDG_CACHE_HOME/patch-apk, else ~/.cache/patch-apk.
+####################
+def getCacheDir(*subdirs):
+    root = os.environ.get("PATCHAPK_CACHE_DIR")
+    if root:
+        root = os.path.expanduser(root)
+    else:
+        root = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "patch-apk")
+    return os.path.join(root, *subdirs)
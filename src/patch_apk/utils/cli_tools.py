@@ -3,9 +3,13 @@ Command-line interface argument handling.
 """
 
 import argparse
+import logging
 import sys
-from termcolor import colored
 import subprocess
+import threading
+
+# Between DEBUG (--debug-output) and INFO: what -v shows
+VERBOSE = 15
 
 def getArgs():
     # Only parse args once
@@ -18,7 +22,11 @@ def getArgs():
         parser.add_argument("--save-apk", help="Save a copy of the APK (or single APK) prior to patching for use with other tools. APK will be saved under the given name.")
         parser.add_argument("--extract-only", help="Disable including objection and pushing modified APK to device.", action="store_true")
         parser.add_argument("--disable-styles-hack", help="Disable the styles hack that removes duplicate entries from res/values/styles.xml.", action="store_true")
+        parser.add_argument("--decode-splits", help="Decode every split APK with apktool instead of merging their resources.arsc tables directly.", action="store_true")
+        parser.add_argument("--uncompressed-native-libs", help="Keep extractNativeLibs=false: store lib/**/*.so uncompressed and page-aligned so they load straight from the APK (faster installs, no extracted copies).", action="store_true")
+        parser.add_argument("--no-result-cache", help="Always rebuild the patched APK instead of reusing one built earlier from identical inputs and options.", action="store_true")
         parser.add_argument("--debug-output", help="Enable debug output.", action="store_true")
+        parser.add_argument("--log-file", help="Write the full debug log to this file (buffered), whatever the console verbosity.")
         parser.add_argument("-v", "--verbose", help="Enable verbose output.", action="store_true")
         parser.add_argument("pkgname", help="The name, or partial name, of the package to patch (e.g. com.foo.bar).")
         
@@ -28,26 +36,104 @@ def getArgs():
     # Return the parsed command line args
     return getArgs.parsed_args
 
+def colored(text, color):
+    # termcolor is imported on the first coloured print, not for --help or argument errors
+    from termcolor import colored as termcolorColored
+    return termcolorColored(text, color)
+
+
 def abort(msg):
-    print(colored(msg, "red"))
+    getLogger().error(msg)
     sys.exit(1)
 
 
-def verbosePrint(msg):
-    if getArgs().verbose:
-        for line in msg.split("\n"):
-            print(colored("    " + line, "light_grey"))
+####################
+# Logging. Console output follows -v/--debug-output; --log-file additionally
+# gets every debug record through a buffered writer. Messages take
+# %-style arguments that are only formatted when a record is emitted, so
+# debug calls in hot loops cost a level check when nobody is listening.
+####################
+_logger = None
+_counters = {}
+_countersLock = threading.Lock()
 
 
-def dbgPrint(msg):
-    if getArgs().debug_output:
-        print(msg)
+class _ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        msg = record.getMessage()
+        if record.levelno == VERBOSE:
+            return colored("\n".join("    " + line for line in msg.split("\n")), "light_grey")
+        if record.levelno >= logging.ERROR:
+            return colored(msg, "red")
+        if record.levelno >= logging.WARNING:
+            return colored(msg, "yellow")
+        return msg
+
+
+def setupLogging(verbose, debug, logFile=None):
+    global _logger
+    logger = logging.getLogger("patch_apk")
+    logger.handlers.clear()
+    logger.propagate = False
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.DEBUG if debug else VERBOSE if verbose else logging.INFO)
+    console.setFormatter(_ConsoleFormatter())
+    logger.addHandler(console)
+    level = console.level
+
+    if logFile:
+        from logging.handlers import MemoryHandler
+        fileHandler = logging.FileHandler(logFile, mode="w", encoding="utf-8")
+        fileHandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        # Records are written in batches; logging's exit hook flushes the rest
+        buffered = MemoryHandler(4096, flushLevel=logging.ERROR, target=fileHandler)
+        buffered.setLevel(logging.DEBUG)
+        logger.addHandler(buffered)
+        level = logging.DEBUG
+
+    logging.addLevelName(VERBOSE, "VERBOSE")
+    logger.setLevel(level)
+    _logger = logger
+    return logger
+
+
+def getLogger():
+    if _logger is None:
+        args = getArgs()
+        setupLogging(args.verbose, args.debug_output, args.log_file)
+    return _logger
+
+
+def verbosePrint(msg, *args):
+    getLogger().log(VERBOSE, msg, *args)
+
+
+def dbgPrint(msg, *args):
+    getLogger().debug(msg, *args)
+
+
+####################
+# Per-stage counters for hot loops: count events instead of printing one
+# line each, then report the totals once with stageSummary().
+####################
+def countEvent(stage, event, n=1):
+    with _countersLock:
+        events = _counters.setdefault(stage, {})
+        events[event] = events.get(event, 0) + n
+
+
+def stageSummary(stage):
+    with _countersLock:
+        events = _counters.pop(stage, {})
+    if events:
+        verbosePrint("[+] %s: %s", stage, ", ".join(str(n) + " " + event for event, n in events.items()))
 
 ####################
 # Warning print
 ####################
 def warningPrint(msg):
-    print(colored(msg, "yellow"))
+    getLogger().warning(msg)
 
 
 
@@ -1,7 +1,12 @@
 import os
-from patch_apk.utils.cli_tools import dbgPrint
+import zipfile
+from patch_apk.utils.cli_tools import dbgPrint, abort, countEvent, stageSummary
+from patch_apk.utils.arsc_merge import readResourceTable, ArscMergeError
 import shutil
 
+# Entries a lib/assets-only split may carry besides its content
+CONTENT_SPLIT_EXTRA = ("AndroidManifest.xml", "resources.arsc", "stamp-cert-sha256")
+
 def copySplitApkFiles(baseapkdir, splitapkpaths):
     for apkdir in splitapkpaths:
         for (root, dirs, files) in os.walk(apkdir):
@@ -12,8 +17,9 @@ def copySplitApkFiles(baseapkdir, splitapkpaths):
                     # Translate directory path to base APK path and create the directory if it doesn't exist
                     p = baseapkdir + os.path.join(root, d)[len(apkdir):]
                     if not os.path.exists(p):
-                        dbgPrint("[+] Creating directory in base APK: " + p[len(baseapkdir):])
+                        dbgPrint("[+] Creating directory in base APK: %s", p[len(baseapkdir):])
                         os.mkdir(p)
+                        countEvent("Copy split files", "directories created")
                 
                 # Copy files into the base APK
                 for f in files:
@@ -27,7 +33,55 @@ def copySplitApkFiles(baseapkdir, splitapkpaths):
                     # Copy files into the base APK, except for XML files in the res directory
                     if f.lower().endswith(".xml") and p.startswith(os.path.join(baseapkdir, "res")):
                         continue
-                    dbgPrint("[+] Moving file to base APK: " + p[len(baseapkdir):])
+                    dbgPrint("[+] Moving file to base APK: %s", p[len(baseapkdir):])
                     shutil.move(os.path.join(root, f), p)
+                    countEvent("Copy split files", "files moved")
+    stageSummary("Copy split files")
+
+
+####################
+# True for splits that only carry lib/ and/or assets/ (ABI config splits,
+# install-time asset packs), judged from the zip central directory alone.
+# These don't need decoding: their files are streamed into the base tree.
+####################
+def isContentOnlySplit(apkpath):
+    try:
+        with zipfile.ZipFile(apkpath) as zf:
+            names = zf.namelist()
+    except (OSError, zipfile.BadZipFile):
+        return False
+    hasContent = False
+    for name in names:
+        if name.startswith("lib/") or name.startswith("assets/"):
+            hasContent = True
+        elif not (name in CONTENT_SPLIT_EXTRA or name.startswith("META-INF/") or name.endswith("/")):
+            return False
+    if not hasContent:
+        return False
+    if "resources.arsc" in names:
+        # Some tools emit an empty table for these splits; a real one needs decoding
+        try:
+            table = readResourceTable(apkpath)
+        except ArscMergeError:
+            return False
+        for pkg in table["packages"]:
+            for types in pkg["typesById"].values():
+                if any(t["entries"] for t in types):
+                    return False
+    return True
 
 
+def extractSplitContent(apkpath, baseapkdir):
+    root = os.path.realpath(baseapkdir)
+    with zipfile.ZipFile(apkpath) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not (info.filename.startswith("lib/") or info.filename.startswith("assets/")):
+                continue
+            p = os.path.realpath(os.path.join(root, *info.filename.split("/")))
+            if not p.startswith(root + os.sep):
+                abort("Error: Refusing to extract " + info.filename + " outside of " + baseapkdir)
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            dbgPrint("[+] Extracting file to base APK: %s", p[len(root):])
+            with zf.open(info) as src, open(p, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            countEvent("Copy split content", "files extracted")
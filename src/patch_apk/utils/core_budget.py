@@ -0,0 +1,45 @@
+import os
+import threading
+from contextlib import contextmanager
+from patch_apk.utils.cli_tools import verbosePrint
+
+####################
+# Process-wide CPU core budget shared by every apktool decode/build. Each job
+# gets a slot and an equal share of the free cores as its `-j` value, so a
+# single job uses every core and concurrent jobs don't oversubscribe the CPU.
+# PATCHAPK_CORES overrides the budget (default: os.cpu_count()).
+####################
+_budgetCond = threading.Condition()
+_budgetState = {"total": None, "free": None, "inFlight": 0, "waiting": 0}
+
+
+def _budgetTotal():
+    if _budgetState["total"] is None:
+        env = os.environ.get("PATCHAPK_CORES", "")
+        _budgetState["total"] = max(1, (int(env) if env.isdigit() else 0) or os.cpu_count() or 1)
+        _budgetState["free"] = _budgetState["total"]
+    return _budgetState["total"]
+
+
+@contextmanager
+def coreSlot(label):
+    with _budgetCond:
+        total = _budgetTotal()
+        _budgetState["waiting"] += 1
+        while _budgetState["free"] < 1:
+            _budgetCond.wait()
+        _budgetState["waiting"] -= 1
+        share = total // (_budgetState["inFlight"] + _budgetState["waiting"] + 1)
+        # Leave one core for each job still waiting behind this one
+        threads = max(1, min(_budgetState["free"] - min(_budgetState["free"] - 1, _budgetState["waiting"]), share))
+        _budgetState["free"] -= threads
+        _budgetState["inFlight"] += 1
+        verbosePrint("[+] " + label + ": -j " + str(threads) + " (" + str(_budgetState["inFlight"]) + " in flight, " +
+                     str(_budgetState["free"]) + "/" + str(total) + " cores free)")
+    try:
+        yield threads
+    finally:
+        with _budgetCond:
+            _budgetState["free"] += threads
+            _budgetState["inFlight"] -= 1
+            _budgetCond.notify_all()
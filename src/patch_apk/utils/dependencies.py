@@ -1,7 +1,7 @@
 import subprocess
 import os
-import shutil
 from patch_apk.utils.cli_tools import abort
+from patch_apk.utils.toolchain import findTool
 
 def checkDependencies(extract_only):
     deps = ["adb", "apktool", "aapt"]
@@ -11,7 +11,8 @@ def checkDependencies(extract_only):
 
     missing = []
     for dep in deps:
-        if shutil.which(dep) is None:
+        # Resolved paths are remembered per PATH in the toolchain cache
+        if findTool(dep) is None:
             missing.append(dep)
     if len(missing) > 0:
         abort("Error, missing dependencies, ensure the following commands are available on the PATH: " + (", ".join(missing)))
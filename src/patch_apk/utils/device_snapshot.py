@@ -0,0 +1,109 @@
+import os
+import re
+import subprocess
+from patch_apk.utils.cli_tools import verbosePrint
+
+SNAPSHOT_SECTION = "@@patchapk"
+
+# Users, ABIs, SDK level, per-user packages and the APK files of every /data/app
+# package directory, all from a single `adb shell` invocation. The script's exit
+# status is that of whichever command ran last, so a complete snapshot is told
+# apart from a truncated one by the end marker, not by the exit code.
+SNAPSHOT_SCRIPT = (
+    "U=$(pm list users | sed -n 's/.*UserInfo{\\([0-9]*\\):.*/\\1/p'); "
+    "echo " + SNAPSHOT_SECTION + " sdk; getprop ro.build.version.sdk; "
+    "echo " + SNAPSHOT_SECTION + " abis; getprop ro.product.cpu.abilist; "
+    "echo " + SNAPSHOT_SECTION + " users; pm list users; "
+    "for u in $U; do "
+    "echo " + SNAPSHOT_SECTION + " packages $u; "
+    "pm list packages -f -U --show-versioncode --user $u 2>/dev/null || pm list packages -f --user $u; "
+    "done; "
+    "for d in $(for u in $U; do pm list packages -f --user $u; done "
+    "| sed -n 's#^package:\\(/data/app/.*\\)/base\\.apk=.*#\\1#p' | sort -u); do "
+    "echo " + SNAPSHOT_SECTION + " dir $d; ls $d; "
+    "done; "
+    "echo " + SNAPSHOT_SECTION + " end"
+)
+
+# Snapshots taken this run, by device serial (None: adb's default device)
+_snapshots = {}
+
+
+####################
+# Snapshot a device once per run; serial defaults to ANDROID_SERIAL, which the
+# plain `adb` calls follow too. Returns None if the snapshot failed or was cut
+# short, in which case callers fall back to their per-call adb queries.
+####################
+def getDeviceSnapshot(serial=None):
+    serial = serial or os.environ.get("ANDROID_SERIAL") or None
+    if serial not in _snapshots:
+        cmd = ["adb"] + (["-s", serial] if serial else []) + ["shell", SNAPSHOT_SCRIPT]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        snapshot = parseDeviceSnapshot(proc.stdout.decode("utf-8", errors="replace"))
+        if not snapshot["complete"] or not snapshot["packages"]:
+            snapshot = None
+        if snapshot is not None:
+            verbosePrint("[+] Device snapshot: sdk " + str(snapshot["sdk"]) + ", ABIs " + ",".join(snapshot["abis"]) +
+                         ", users " + ",".join(snapshot["users"]))
+        _snapshots[serial] = snapshot
+    return _snapshots[serial]
+
+
+def parseDeviceSnapshot(text):
+    snapshot = {"sdk": None, "abis": [], "users": [], "packages": {}, "dirs": {}, "complete": False}
+    section, arg = None, None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(SNAPSHOT_SECTION + " "):
+            parts = line.split(" ", 2)
+            section, arg = parts[1], (parts[2] if len(parts) > 2 else None)
+            if section == "packages":
+                snapshot["packages"].setdefault(arg, {})
+            elif section == "dir":
+                snapshot["dirs"].setdefault(arg, [])
+            elif section == "end":
+                snapshot["complete"] = True
+        elif section == "sdk" and line.isdigit():
+            snapshot["sdk"] = int(line)
+        elif section == "abis":
+            snapshot["abis"] = [a for a in line.split(",") if a]
+        elif section == "users":
+            snapshot["users"] += re.findall(r"UserInfo{(\d+):", line)
+        elif section == "packages" and line.startswith("package:"):
+            # "package:<path>=<name> versionCode:<n> uid:<n>", path may contain '='
+            tokens = line[8:].split()
+            path, _, name = tokens[0].rpartition("=")
+            info = {"path": path, "version_code": None}
+            for tok in tokens[1:]:
+                if tok.startswith("versionCode:") and tok[12:].isdigit():
+                    info["version_code"] = int(tok[12:])
+            snapshot["packages"][arg][name] = info
+        elif section == "dir" and line.endswith(".apk"):
+            snapshot["dirs"][arg].append(line)
+    return snapshot
+
+
+def snapshotPackages(snapshot, pattern):
+    names = set()
+    for pkgs in snapshot["packages"].values():
+        for name in pkgs:
+            if pattern.lower() in name.lower():
+                names.add(name)
+    return sorted(names)
+
+
+####################
+# APK paths (base first, then splits) for a package/user. Empty if not installed
+# for that user or if the split layout is unknown from the snapshot.
+####################
+def snapshotAPKPaths(snapshot, pkgname, user):
+    info = snapshot["packages"].get(user, {}).get(pkgname)
+    if info is None:
+        return []
+    base = info["path"]
+    d, _, fname = base.rpartition("/")
+    if d not in snapshot["dirs"]:
+        return [base] if not base.startswith("/data/app/") else []
+    return [base] + [d + "/" + f for f in sorted(snapshot["dirs"][d]) if f != fname]
@@ -1,7 +1,8 @@
 import os
 import xml.etree.ElementTree
-from patch_apk.utils.cli_tools import verbosePrint, dbgPrint
+from patch_apk.utils.cli_tools import verbosePrint, dbgPrint, countEvent, stageSummary
 from patch_apk.config.constants import NULL_DECODED_DRAWABLE_COLOR
+from patch_apk.utils.android_manifest import loadManifest
 
 
 def fixPublicResourceIDs(baseapkdir, splitapkpaths):
@@ -54,20 +55,17 @@ def fixPublicResourceIDs(baseapkdir, splitapkpaths):
     # Step 4) Find all references to APKTOOL_DUMMY_XXX resources within other XML resource files
     #         in the base APK and update them to refer to the true resource name.
     updated = 0
+    # Registers the manifest's namespace prefixes (once) so rewritten XML keeps them
+    loadManifest(baseapkdir)
     for (root, dirs, files) in os.walk(os.path.join(baseapkdir, "res")):
         for f in files:
             if f.lower().endswith(".xml"):
                 try:
                     # Load the XML
                     xmlPath = os.path.join(root, f)
-                    dbgPrint("[~] Parsing " + xmlPath)
+                    dbgPrint("[~] Parsing %s", xmlPath)
                     tree = xml.etree.ElementTree.parse(xmlPath)
-                    
-                    # Register the namespaces and get the prefix for the "android" namespace
-                    namespaces = dict([node for _,node in xml.etree.ElementTree.iterparse(os.path.join(baseapkdir, "AndroidManifest.xml"), events=["start-ns"])])
-                    for ns in namespaces:
-                        xml.etree.ElementTree.register_namespace(ns, namespaces[ns])
-                    ns = "{" + namespaces["android"] + "}" # type: ignore
+                    countEvent("Fix resource IDs", "XML files parsed")
                     
                     # Update references to APKTOOL_DUMMY_XXX resources
                     changed = False
@@ -85,11 +83,11 @@ def fixPublicResourceIDs(baseapkdir, splitapkpaths):
                                 changed = True
                             
                             if changed:
-                                dbgPrint("[~] Patching dummy apktool attribute \"" + attr + "\" value \"" + val + "\"" + (" -> \"" + el.attrib[attr] + "\"" if val != el.attrib[attr] else "") + " (" + str(updated) + ")")
+                                dbgPrint("[~] Patching dummy apktool attribute \"%s\" value \"%s\" -> \"%s\" (%d)", attr, val, el.attrib[attr], updated)
                             
                             # Fix for untracked bug where drawables are decoded without drawable values (@null)
                             if f == "drawables.xml" and attr == "name" and el.text is None:
-                                dbgPrint("[~] Patching null decoded drawable \"" + el.attrib[attr] + "\" (" + str(updated) + ")")
+                                dbgPrint("[~] Patching null decoded drawable \"%s\" (%d)", el.attrib[attr], updated)
                                 el.text = NULL_DECODED_DRAWABLE_COLOR
                         
                         # Check for references to APKTOOL_DUMMY_XXX resources in the element text
@@ -98,12 +96,14 @@ def fixPublicResourceIDs(baseapkdir, splitapkpaths):
                             el.text = val.split("/")[0] + "/" + dummyNameToRealName[val.split("/")[1]]
                             updated += 1
                             changed = True
-                            dbgPrint("[~] Patching dummy apktool element \"" + el.get('name', el.tag) + "\" value \"" + val + (" -> \"" + el.text + "\"" if val != el.text else "") + str(updated) + ")")
+                            dbgPrint("[~] Patching dummy apktool element \"%s\" value \"%s\" -> \"%s\" (%d)", el.get('name', el.tag), val, el.text, updated)
                     
                     # Save the file if it was updated
                     if changed:
-                        dbgPrint("[+] Writing patched " + f)
+                        dbgPrint("[+] Writing patched %s", f)
                         tree.write(os.path.join(root, f), encoding="utf-8", xml_declaration=True)
+                        countEvent("Fix resource IDs", "XML files rewritten")
                 except xml.etree.ElementTree.ParseError:
                     print("[-] XML parse error in " + os.path.join(root, f) + ", skipping.")
-    verbosePrint("[+] Updated " + str(updated) + " references to dummy resource names in the base APK.")
\ No newline at end of file
+    stageSummary("Fix resource IDs")
+    verbosePrint("[+] Updated %d references to dummy resource names in the base APK.", updated)
\ No newline at end of file
@@ -1,7 +1,4 @@
 import os
-import tempfile
-import shutil
-import xml.etree.ElementTree
 import subprocess
 
 # core imports
@@ -12,51 +9,38 @@ from patch_apk.core.apk_tool import APKTool
 
 from patch_apk.utils.cli_tools import abort, assertSubprocessSuccessfulRun, warningPrint
 from patch_apk.utils.remove_duplicate_class import remove_duplicate_classes
+from patch_apk.utils.materialize import materializeFile
+from patch_apk.utils.android_manifest import loadManifest, flushManifest, ensurePermission, getApplicationElement, setApplicationAttribute
+from patch_apk.utils.workspace import createWorkspace, removeWorkspace, estimateDecodedSize
 
-def fixAPKBeforeObjection(apkfile, fix_network_security_config):
+def fixAPKBeforeObjection(apkfile, fix_network_security_config, extract_native_libs=True):
     print("[+] Prepping AndroidManifest.xml")
-    with tempfile.TemporaryDirectory() as tmppath:
+    tmppath = createWorkspace(estimateDecodedSize([apkfile]))
+    try:
         apkdir = os.path.join(tmppath, "apk")
         ret = APKTool.runApkTool(["d", "--only-main-classes", apkfile, "-o", apkdir,])
         if ret["returncode"] != 0:
             abort("Error: Failed to run 'apktool d " + apkfile + " -o " + apkdir + "'.\nRun with --debug-output for more information.")
         
-        # Load AndroidManifest.xml
-        manifestPath = os.path.join(apkdir, "AndroidManifest.xml")
-        tree = xml.etree.ElementTree.parse(manifestPath)
-        
-        # Register the namespaces and get the prefix for the "android" namespace
-        namespaces = dict([node for _,node in xml.etree.ElementTree.iterparse(manifestPath, events=["start-ns"])])
-        for ns in namespaces:
-            xml.etree.ElementTree.register_namespace(ns, namespaces[ns])
-        ns = "{" + namespaces["android"] + "}"
+        # Load AndroidManifest.xml (parsed once, written once before the rebuild)
+        manifest = loadManifest(apkdir)
         
         # Ensure INTERNET permission is present
-        hasInternetPermission = False
-        for el in tree.getroot():
-            if el.tag == "uses-permission" and ns + "name" in el.attrib:
-                if el.attrib[ns + "name"] == "android.permission.INTERNET":
-                    hasInternetPermission = True
-                    break
-        if not hasInternetPermission:
+        if ensurePermission(manifest, "android.permission.INTERNET"):
             print("[+] Adding android.permission.INTERNET to AndroidManifest.xml")
-            usesPermissionEl = xml.etree.ElementTree.Element("uses-permission")
-            usesPermissionEl.attrib[ns + "name"] = "android.permission.INTERNET"
-            tree.getroot().insert(0, usesPermissionEl)
         
-        # Set extractNativeLibs to true
-        appEl = tree.find(".//application")
-        if appEl is not None:
-            print("[+] \tSetting extractNativeLibs to true")
-            appEl.attrib[ns + "extractNativeLibs"] = "true"
+        # Set extractNativeLibs (false keeps the libraries in the APK, see storeNativeLibsUncompressed)
+        if getApplicationElement(manifest) is not None:
+            value = "true" if extract_native_libs else "false"
+            print("[+] \tSetting extractNativeLibs to " + value)
+            setApplicationAttribute(manifest, "extractNativeLibs", value)
 
 
         if fix_network_security_config:
             print("[+] \tEnabling support for user-installed CA certificates.")
 
             # Add networkSecurityConfig
-            for el in tree.findall("application"):
-                el.attrib[ns + "networkSecurityConfig"] = "@xml/network_security_config"
+            setApplicationAttribute(manifest, "networkSecurityConfig", "@xml/network_security_config")
 
             # Create a network security config file
             fh = open(os.path.join(apkdir, "res", "xml", "network_security_config.xml"), "wb")
@@ -64,7 +48,7 @@ def fixAPKBeforeObjection(apkfile, fix_network_security_config):
             fh.close()
         
         # Save the updated AndroidManifest.xml
-        tree.write(manifestPath, encoding="utf-8", xml_declaration=True)
+        flushManifest(apkdir)
         # Remove problematic duplicate classes
         try:
             remove_duplicate_classes(apkdir)
@@ -80,9 +64,11 @@ def fixAPKBeforeObjection(apkfile, fix_network_security_config):
         # Move rebuilt APK back to original location
         rebuilt_apk = os.path.join(apkdir, "dist", os.path.basename(apkfile))
         if os.path.exists(rebuilt_apk):
-            shutil.move(rebuilt_apk, apkfile)
+            materializeFile(rebuilt_apk, apkfile, keepSource=False)
         else:
             abort("Error: Rebuilt APK not found.")
+    finally:
+        removeWorkspace(tmppath)
             
             
 def patchingWithObjection(apkfile):
@@ -2,10 +2,27 @@ import subprocess
 import os
 import re
 from patch_apk.utils.cli_tools import abort, verbosePrint, warningPrint
+from patch_apk.utils.device_snapshot import getDeviceSnapshot, snapshotAPKPaths
 
 def getAPKPathsForPackage(pkgname, current_user = "0", users_to_try = None):
     print(f"[+] Retrieving APK path(s) for package: {pkgname} for user {current_user}")
     paths = []
+
+    # Answer from the device snapshot (one round trip for the whole run) when possible
+    snapshot = getDeviceSnapshot()
+    if snapshot is not None and users_to_try is None:
+        holders = [u for u in snapshot["packages"] if pkgname in snapshot["packages"][u]]
+        if current_user not in holders and len(holders) > 0:
+            warningPrint(f"[!] Package not found for user {current_user}, using user {holders[0]}")
+            current_user = holders[0]
+        paths = snapshotAPKPaths(snapshot, pkgname, current_user)
+        if len(paths) > 0:
+            for path in paths:
+                verbosePrint("[+] APK path: " + path)
+            return current_user, paths
+        # Split layout unknown from the snapshot, fall through to pm with the known users
+        users_to_try = list(snapshot["users"])
+
     proc = subprocess.run(["adb", "shell", "pm", "path", "--user", current_user, pkgname], stdout=subprocess.PIPE)
     if proc.returncode != 0:
         if not users_to_try:
@@ -32,4 +49,13 @@ def getAPKPathsForPackage(pkgname, current_user = "0", users_to_try = None):
             verbosePrint("[+] APK path: " + line)
             paths.append(line)
 
-    return current_user, paths
\ No newline at end of file
+    return current_user, paths
+
+
+####################
+# Sizes in bytes of the given device paths, in one adb round trip (0 if unknown).
+####################
+def getRemoteAPKSizes(apkpaths):
+    proc = subprocess.run(["adb", "shell", "stat", "-c", "%s", *apkpaths], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    sizes = [int(line) for line in proc.stdout.decode("utf-8").split() if line.isdigit()]
+    return sizes if len(sizes) == len(apkpaths) else [0] * len(apkpaths)
@@ -1,9 +1,15 @@
 import os
-from patch_apk.utils.cli_tools import verbosePrint, assertSubprocessSuccessfulRun
-from progress.bar import Bar
+from patch_apk.utils.cli_tools import abort, verbosePrint, warningPrint, assertSubprocessSuccessfulRun
+from patch_apk.utils.apk_inspect import APKInspectError, inspectAPKs, describeAPK
 from patch_apk.core.apk_tool import APKTool
+from patch_apk.utils.workspace import checkWorkspaceSpace
 
 def getTargetAPK(pkgname, apkpaths, tmppath, disableStylesHack, extract_only):
+    return buildTargetAPK(pkgname, pullTargetAPKs(pkgname, apkpaths, tmppath), tmppath, disableStylesHack, extract_only)
+
+
+def pullTargetAPKs(pkgname, apkpaths, tmppath):
+    from progress.bar import Bar
     # Pull the APKs from the device
 
     bar = Bar('[+] Pulling APK file(s) from device', max=len(apkpaths))
@@ -20,6 +26,23 @@ def getTargetAPK(pkgname, apkpaths, tmppath, disableStylesHack, extract_only):
     
     bar.finish()
     verbosePrint(verboseOutput.rstrip())
+    return localapks
+
+
+def buildTargetAPK(pkgname, localapks, tmppath, disableStylesHack, extract_only):
+    # Classify the pulled APKs from their zip central directories before any apktool run
+    try:
+        infos = inspectAPKs(localapks)
+    except APKInspectError as e:
+        abort("Error: " + str(e))
+    for info in infos:
+        verbosePrint("[+] " + describeAPK(info))
+    if infos[0]["proguard"]:
+        warningPrint("[!] WARNING: Detected ProGuard/AndResGuard, decompile/recompile may not succeed.\n")
+    localapks = [info["path"] for info in infos]
+
+    # Bail out before any decoding if the workspace can't hold the decoded tree(s)
+    checkWorkspaceSpace(tmppath, localapks)
 
     # Return the target APK path
     if len(localapks) == 1:
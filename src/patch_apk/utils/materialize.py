@@ -0,0 +1,80 @@
+import os
+import shutil
+import sys
+import threading
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int), Linux
+
+_materializeStats = {"reflink": 0, "hardlink": 0, "rename": 0, "copy": 0}
+_materializeLock = threading.Lock()
+
+
+####################
+# Put src at dst as cheaply as possible.
+#   keepSource=True:  FICLONE reflink -> hardlink (if allowLink) -> byte copy
+#   keepSource=False: rename -> reflink + unlink -> byte copy + unlink
+# Returns the mechanism used; bytes per mechanism are tallied for reporting.
+####################
+def materializeFile(src, dst, keepSource=True, allowLink=True):
+    size = os.path.getsize(src)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return "rename"
+
+    if not keepSource:
+        try:
+            os.replace(src, dst)
+            return _countMaterialized("rename", size)
+        except OSError:
+            pass
+
+    tmp = dst + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    try:
+        how = _reflink(src, tmp)
+        if how is None and keepSource and allowLink:
+            try:
+                os.link(src, tmp)
+                how = "hardlink"
+            except OSError:
+                how = None
+        if how is None:
+            shutil.copyfile(src, tmp)
+            shutil.copymode(src, tmp)
+            how = "copy"
+        os.replace(tmp, dst)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    if not keepSource:
+        os.remove(src)
+    return _countMaterialized(how, size)
+
+
+def materializeSummary():
+    with _materializeLock:
+        stats = dict(_materializeStats)
+    mib = lambda n: "%.1f MiB" % (n / (1024 * 1024))
+    return (mib(stats["copy"]) + " copied, " + mib(stats["reflink"]) + " reflinked, " +
+            mib(stats["hardlink"]) + " hardlinked, " + mib(stats["rename"]) + " renamed")
+
+
+def _countMaterialized(how, size):
+    with _materializeLock:
+        _materializeStats[how] += size
+    return how
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith("linux"):
+        return None
+    import fcntl
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return None
+    shutil.copymode(src, dst)
+    return "reflink"
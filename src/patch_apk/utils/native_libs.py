@@ -0,0 +1,80 @@
+import os
+import shutil
+import struct
+import zipfile
+from patch_apk.utils.cli_tools import assertSubprocessSuccessfulRun, verbosePrint
+from patch_apk.utils.materialize import materializeFile
+
+
+####################
+# --uncompressed-native-libs: rewrite the patched APK with every lib/**/*.so
+# stored, page-align the libraries with zipalign -p and sign again, so the
+# platform maps them straight from the APK (extractNativeLibs="false")
+# instead of extracting a copy at install. Only the libraries are inflated;
+# every other entry is copied as raw compressed bytes.
+####################
+def storeNativeLibsUncompressed(apkfile):
+    with zipfile.ZipFile(apkfile) as zin:
+        entries = zin.infolist()
+        libs = set(e.filename for e in entries if e.filename.startswith("lib/") and e.filename.endswith(".so") and e.compress_type != zipfile.ZIP_STORED)
+        if not libs:
+            return 0
+        storedapk = apkfile[:-4] + "-stored.apk"
+        with zipfile.ZipFile(storedapk, "w") as zout, open(apkfile, "rb") as raw:
+            for entry in entries:
+                # The old signature no longer matches once the archive changes
+                if entry.filename.startswith("META-INF/") and entry.filename.count("/") == 1 and \
+                        (entry.filename == "META-INF/MANIFEST.MF" or entry.filename.rsplit(".", 1)[-1] in ("SF", "RSA", "DSA", "EC")):
+                    continue
+                if entry.filename not in libs:
+                    appendRawEntry(zout, raw, entry)
+                    continue
+                info = zipfile.ZipInfo(entry.filename, entry.date_time)
+                info.external_attr = entry.external_attr
+                info.compress_type = zipfile.ZIP_STORED
+                with zin.open(entry) as src, zout.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+    verbosePrint("[+] Stored " + str(len(libs)) + " native libraries uncompressed.")
+
+    # Page-align the libraries, then sign the way objection signed the patched APK
+    assertSubprocessSuccessfulRun(["zipalign", "-f", "-p", "4", storedapk, apkfile])
+    os.remove(storedapk)
+    assertSubprocessSuccessfulRun(["objection", "signapk", apkfile])
+    if os.path.exists(apkfile[:-4] + ".objection.apk"):
+        materializeFile(apkfile[:-4] + ".objection.apk", apkfile, keepSource=False)
+    return len(libs)
+
+
+####################
+# Copy entry's compressed bytes from the source file raw to the end of zout.
+# zipfile has no raw-copy API, so the local header is written here and the
+# entry registered for the central directory zout writes on close.
+####################
+def appendRawEntry(zout, raw, entry):
+    if entry.flag_bits & 0x1:
+        raise zipfile.BadZipFile(entry.filename + " is encrypted")
+    raw.seek(entry.header_offset + 26)
+    nameLen, extraLen = struct.unpack("<HH", raw.read(4))
+    raw.seek(entry.header_offset + 30 + nameLen + extraLen)
+
+    info = zipfile.ZipInfo(entry.filename, entry.date_time)
+    info.compress_type = entry.compress_type
+    info.external_attr = entry.external_attr
+    info.create_system = entry.create_system
+    info.CRC, info.compress_size, info.file_size = entry.CRC, entry.compress_size, entry.file_size
+    # Keep UTF-8 names; sizes are in the header, so no data descriptor
+    info.flag_bits = entry.flag_bits & 0x800
+    info.header_offset = zout.start_dir
+    zout.fp.seek(zout.start_dir)
+    zout.fp.write(info.FileHeader())
+    remaining = entry.compress_size
+    while remaining:
+        chunk = raw.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise zipfile.BadZipFile(entry.filename + " is truncated")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout._didModify = True
@@ -4,7 +4,6 @@ File operation utilities.
 from patch_apk.utils.cli_tools import abort, dbgPrint
 import os
 import re
-import xml.etree.ElementTree
 from patch_apk.utils.cli_tools import verbosePrint
 
 
@@ -0,0 +1,265 @@
+import atexit
+import hashlib
+import http.client
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from patch_apk.utils.cache_dir import getCacheDir
+from patch_apk.utils.cli_tools import verbosePrint, warningPrint
+from patch_apk.utils.materialize import materializeFile
+
+####################
+# Shared cache backend that several hosts read and fill, configured with
+# PATCHAPK_REMOTE_CACHE:
+#   /shared/dir or file:///shared/dir  <dir>/<namespace>/<key> + <key>.sha256
+#   http://host:port[/prefix]          GET/HEAD/PUT <prefix>/<namespace>/<key>,
+#                                      digest in X-Content-SHA256
+# (the same layout and protocol as the standalone patch-apk --serve-cache).
+#
+# Every download is hashed and dropped on a digest mismatch, and a failing
+# backend only costs the lookup. Uploads are write-behind: the file is staged
+# and sent by a background thread; the process waits at exit for up to
+# PATCHAPK_REMOTE_CACHE_DRAIN seconds (default 120). A directory backend is
+# evicted least recently used past PATCHAPK_REMOTE_CACHE_MB (default 16384).
+####################
+REMOTE_NAMESPACES = ("trees", "gadgets", "results")
+REMOTE_KEY_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,199}$")
+DIGEST_HEADER = "X-Content-SHA256"
+DEFAULT_DRAIN = 120
+DEFAULT_REMOTE_CACHE_MB = 16384
+
+_uploads = queue.Queue()
+_uploader = []
+_uploaderLock = threading.Lock()
+
+
+def remoteCacheConfigured():
+    return bool(os.environ.get("PATCHAPK_REMOTE_CACHE"))
+
+
+####################
+# Download namespace/key into dest; False on a miss, a corrupt object or an
+# unreachable backend.
+####################
+def remoteCacheGet(namespace, key, dest):
+    url = os.environ.get("PATCHAPK_REMOTE_CACHE")
+    if not url or not _validName(namespace, key):
+        return False
+    tmp = dest + "." + str(os.getpid()) + ".remote"
+    try:
+        expected = _get(url, namespace, key, tmp)
+        if expected is None:
+            return False
+        if _fileSha256(tmp) != expected:
+            warningPrint("[!] Remote cache object " + namespace + "/" + key + " is corrupt; ignoring it")
+            return False
+        os.replace(tmp, dest)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        verbosePrint("[!] Remote cache lookup %s/%s failed: %s", namespace, key, e)
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    verbosePrint("[+] Remote cache hit: %s/%s", namespace, key)
+    return True
+
+
+####################
+# Queue an upload of src and return; src must not be modified in place
+# afterwards.
+####################
+def remoteCachePutAsync(namespace, key, src):
+    url = os.environ.get("PATCHAPK_REMOTE_CACHE")
+    if not url or not _validName(namespace, key):
+        return
+    staging = getCacheDir("remote-staging")
+    staged = os.path.join(staging, namespace + "." + key + "." + uuid.uuid4().hex[:8])
+    try:
+        os.makedirs(staging, exist_ok=True)
+        materializeFile(src, staged)
+    except OSError as e:
+        verbosePrint("[!] Could not stage %s/%s for upload: %s", namespace, key, e)
+        return
+    with _uploaderLock:
+        if not _uploader:
+            t = threading.Thread(target=_uploadLoop, name="patchapk-remote-cache", daemon=True)
+            t.start()
+            _uploader.append(t)
+            atexit.register(_drainUploads)
+    _uploads.put((url, namespace, key, staged))
+
+
+def _uploadLoop():
+    while True:
+        url, namespace, key, staged = _uploads.get()
+        try:
+            if not _exists(url, namespace, key):
+                _put(url, namespace, key, staged, _fileSha256(staged))
+                verbosePrint("[+] Uploaded %s/%s to the remote cache", namespace, key)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            warningPrint("[!] Remote cache upload " + namespace + "/" + key + " failed: " + str(e))
+        finally:
+            try:
+                os.remove(staged)
+            except OSError:
+                pass
+            _uploads.task_done()
+
+
+def _drainUploads():
+    env = os.environ.get("PATCHAPK_REMOTE_CACHE_DRAIN", "")
+    deadline = time.monotonic() + (int(env) if env.isdigit() else DEFAULT_DRAIN)
+    while _uploads.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            warningPrint("[!] " + str(_uploads.unfinished_tasks) + " remote cache upload(s) abandoned")
+            return
+        time.sleep(0.1)
+
+
+####################
+# Backend operations, by URL scheme.
+####################
+def _get(url, namespace, key, dest):
+    if not _isHttp(url):
+        folder = os.path.join(_dirRoot(url), namespace)
+        try:
+            with open(os.path.join(folder, key + ".sha256"), "r", encoding="ascii") as fh:
+                expected = fh.read().strip()
+        except OSError:
+            return None
+        materializeFile(os.path.join(folder, key), dest, allowLink=False)
+        os.utime(os.path.join(folder, key))
+        return expected
+    conn = _connect(url)
+    try:
+        conn.request("GET", _httpPath(url, namespace, key), headers=_headers())
+        resp = conn.getresponse()
+        if resp.status == 404:
+            resp.read()
+            return None
+        expected = resp.getheader(DIGEST_HEADER)
+        if resp.status != 200 or not expected:
+            raise ValueError("HTTP " + str(resp.status))
+        with open(dest, "wb") as fh:
+            shutil.copyfileobj(resp, fh, 1024 * 1024)
+        return expected.lower()
+    finally:
+        conn.close()
+
+
+def _put(url, namespace, key, src, sha):
+    if not _isHttp(url):
+        folder = os.path.join(_dirRoot(url), namespace)
+        os.makedirs(folder, exist_ok=True)
+        tmp = os.path.join(folder, "." + key + "." + str(os.getpid()) + ".tmp")
+        materializeFile(src, tmp, allowLink=False)
+        os.replace(tmp, os.path.join(folder, key))
+        # The digest goes last: readers treat an object without one as absent
+        with open(tmp, "w", encoding="ascii") as fh:
+            fh.write(sha)
+        os.replace(tmp, os.path.join(folder, key + ".sha256"))
+        _evictDir(_dirRoot(url), keep=os.path.join(folder, key))
+        return
+    conn = _connect(url, timeout=None)
+    try:
+        with open(src, "rb") as fh:
+            conn.request("PUT", _httpPath(url, namespace, key), body=fh,
+                         headers=dict(_headers(), **{DIGEST_HEADER: sha, "Content-Length": str(os.path.getsize(src))}))
+            resp = conn.getresponse()
+            resp.read()
+        if resp.status not in (200, 201, 204):
+            raise ValueError("HTTP " + str(resp.status))
+    finally:
+        conn.close()
+
+
+def _exists(url, namespace, key):
+    if not _isHttp(url):
+        return os.path.isfile(os.path.join(_dirRoot(url), namespace, key + ".sha256"))
+    conn = _connect(url)
+    try:
+        conn.request("HEAD", _httpPath(url, namespace, key), headers=_headers())
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status == 200
+    finally:
+        conn.close()
+
+
+####################
+# Drop least-recently-used objects of a directory backend, across
+# namespaces, until it fits its size cap.
+####################
+def _evictDir(root, keep=None):
+    env = os.environ.get("PATCHAPK_REMOTE_CACHE_MB", "")
+    maxBytes = (int(env) if env.isdigit() else DEFAULT_REMOTE_CACHE_MB) * 1024 * 1024
+    entries = []
+    for namespace in REMOTE_NAMESPACES:
+        folder = os.path.join(root, namespace)
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith(".") or name.endswith(".sha256"):
+                continue
+            try:
+                st = os.stat(os.path.join(folder, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, os.path.join(folder, name)))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        if path == keep:
+            continue
+        # The digest goes first: readers treat an object without one as absent
+        for victim in (path + ".sha256", path):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total -= size
+        verbosePrint("[+] Evicted %s from the remote cache", os.path.relpath(path, root))
+
+
+def _isHttp(url):
+    return urlsplit(url).scheme in ("http", "https")
+
+
+def _dirRoot(url):
+    parts = urlsplit(url)
+    return os.path.expanduser(parts.path if parts.scheme == "file" else url)
+
+
+def _connect(url, timeout=30):
+    parts = urlsplit(url)
+    cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=timeout)
+
+
+def _httpPath(url, namespace, key):
+    return urlsplit(url).path.rstrip("/") + "/" + namespace + "/" + key
+
+
+def _headers():
+    token = os.environ.get("PATCHAPK_REMOTE_CACHE_TOKEN")
+    return {"Authorization": "Bearer " + token} if token else {}
+
+
+def _validName(namespace, key):
+    return namespace in REMOTE_NAMESPACES and REMOTE_KEY_RE.match(key) is not None
+
+
+def _fileSha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
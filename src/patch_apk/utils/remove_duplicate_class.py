@@ -1,6 +1,6 @@
 import os
-import patch_apk.utils.remove_duplicate_class
 import shutil
+from patch_apk.utils.cli_tools import dbgPrint, warningPrint
 
 def remove_duplicate_classes(apkdir):
     """
@@ -49,9 +49,9 @@ def remove_duplicate_classes(apkdir):
                     try:
                         os.remove(full_path)
                         duplicates_removed += 1
-                        print(f"[+] Removed duplicate: {rel_path}")
+                        dbgPrint("[+] Removed duplicate: %s", rel_path)
                     except Exception as e:
-                        print(f"[!] Failed to remove {rel_path}: {e}")
+                        warningPrint(f"[!] Failed to remove {rel_path}: {e}")
     
     # Clean up empty directories
     for root, dirs, files in os.walk(smali_assets, topdown=False):
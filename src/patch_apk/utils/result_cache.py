@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+from patch_apk.utils.cache_dir import getCacheDir
+from patch_apk.utils.cli_tools import verbosePrint, warningPrint
+from patch_apk.utils.materialize import materializeFile
+from patch_apk.utils.remote_cache import remoteCacheConfigured, remoteCacheGet, remoteCachePutAsync
+from patch_apk.utils.verify_apk import apkProblems, signerDigests
+
+####################
+# Cache of final patched APKs (<cache dir>/results/<key>.apk).
+#
+# The key covers everything that determines the output: the SHA-256 of every
+# pulled APK plus the patch options, the apktool version and the objection
+# install that patches and signs the APK. Re-patching the same app build with
+# the same options goes straight to install. Entries are evicted least
+# recently used first once the cache outgrows PATCHAPK_RESULT_CACHE_MB
+# (default 2048); a hit refreshes the entry's mtime. Local misses fall back
+# to the shared PATCHAPK_REMOTE_CACHE, and new results are uploaded to it.
+#
+# A remote hit is only used if it passes verifyAPK's checks and is signed by
+# a certificate this host's objection signed with before (recorded in
+# <cache dir>/results/signers as results are stored): anyone who can write
+# to the backend could otherwise have this host install their APK.
+####################
+RESULT_CACHE_FORMAT = 1
+DEFAULT_RESULT_CACHE_MB = 2048
+
+
+def resultCacheKey(apkpaths, options):
+    desc = {
+        "format": RESULT_CACHE_FORMAT,
+        "inputs": sorted(_fileSha256(p) for p in apkpaths),
+        "options": {k: options[k] for k in sorted(options)},
+    }
+    blob = json.dumps(desc, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest(), desc
+
+
+####################
+# Materialize a cached result at dest; returns False on a miss. The flags
+# are verifyAPK's, checked on a result fetched from the remote cache.
+####################
+def fetchCachedResult(key, dest, enableUserCerts=True, extractNativeLibs=True):
+    entry = os.path.join(getCacheDir("results"), key + ".apk")
+    try:
+        os.utime(entry)
+    except OSError:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = entry + "." + str(os.getpid()) + ".fetched"
+        try:
+            if not remoteCacheGet("results", key, tmp):
+                return False
+            problems = apkProblems(tmp, enableUserCerts, extractNativeLibs)
+            signers = signerDigests(tmp)
+            if not signers or not signers <= _localSigners():
+                problems.append("not signed with a key this host signs with")
+            if problems:
+                warningPrint("[!] Ignoring result " + key[:12] + " from the remote cache:\n  - " + "\n  - ".join(problems))
+                return False
+            os.replace(tmp, entry)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    # Reflink or copy: a hardlink would let later in-place edits of dest reach the cache
+    materializeFile(entry, dest, allowLink=False)
+    verbosePrint("[+] Result cache hit: " + key + ".apk")
+    return True
+
+
+def storeResult(key, apkfile, desc=None):
+    root = getCacheDir("results")
+    entry = os.path.join(root, key + ".apk")
+    tmp = os.path.join(root, "." + key + "." + str(os.getpid()) + ".tmp")
+    try:
+        os.makedirs(root, exist_ok=True)
+        materializeFile(apkfile, tmp, allowLink=False)
+        os.replace(tmp, entry)
+        if desc is not None:
+            with open(os.path.join(root, key + ".json"), "w", encoding="utf-8") as fh:
+                json.dump(desc, fh, indent=1, sort_keys=True)
+    except OSError as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        verbosePrint("[!] Could not store result in cache: " + str(e))
+        return
+    if remoteCacheConfigured():
+        _recordLocalSigners(entry)
+    remoteCachePutAsync("results", key, entry)
+    evictResults()
+
+
+####################
+# Drop least-recently-used entries until the cache fits its size cap.
+####################
+def evictResults():
+    root = getCacheDir("results")
+    env = os.environ.get("PATCHAPK_RESULT_CACHE_MB", "")
+    maxBytes = (int(env) if env.isdigit() else DEFAULT_RESULT_CACHE_MB) * 1024 * 1024
+    entries = []
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        if not name.endswith(".apk"):
+            continue
+        try:
+            st = os.stat(os.path.join(root, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    for _, size, name in sorted(entries):
+        if total <= maxBytes:
+            break
+        for victim in (name, name[:-4] + ".json"):
+            try:
+                os.remove(os.path.join(root, victim))
+            except OSError:
+                pass
+        total -= size
+        verbosePrint("[+] Evicted cached result " + name)
+
+
+def _localSigners():
+    try:
+        with open(getCacheDir("results", "signers"), "r", encoding="ascii") as fh:
+            return {line.strip() for line in fh if line.strip()}
+    except OSError:
+        return set()
+
+
+def _recordLocalSigners(apkfile):
+    known = _localSigners()
+    new = signerDigests(apkfile) - known
+    if new:
+        with open(getCacheDir("results", "signers"), "a", encoding="ascii") as fh:
+            fh.write("".join(d + "\n" for d in sorted(new)))
+
+
+def _fileSha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,82 @@
+import re
+import subprocess
+import threading
+from collections import deque
+from patch_apk.utils.cli_tools import verbosePrint
+
+# Lines of stdout/stderr kept per stream for error reports
+TAIL_LINES = 200
+MAX_LINE = 4096
+
+# apktool: "I: Decoding file-resources...", "I: Building apk file..." etc.
+APKTOOL_STAGE_RE = re.compile(r"^I: ((?:Decoding|Baksmaling|Building|Smaling|Copying|Loading)\b.*?)\.*$")
+
+APKTOOL_FATAL_PATTERNS = [
+    re.compile(r"java\.lang\.OutOfMemoryError"),
+    re.compile(r"Could not (?:find or load main class|reserve enough space)"),
+]
+
+
+####################
+# Run a command, reading its output incrementally into bounded ring buffers
+# instead of buffering everything until exit. Recognised progress lines are
+# reported as they arrive, and the process is killed as soon as a fatal
+# pattern is printed. Returns the same dict shape as APKTool.runApkTool, with
+# stdout/stderr holding the last TAIL_LINES lines of each stream.
+####################
+def runStreaming(args, input=None, label=None, fatalPatterns=(), onProgress=None):
+    label = label or args[0]
+    onProgress = onProgress or _verboseProgress
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace", bufsize=1)
+    out = deque(maxlen=TAIL_LINES)
+    err = deque(maxlen=TAIL_LINES)
+    fatal = []
+
+    def pump(stream, buf):
+        for line in stream:
+            line = line.rstrip("\r\n")[:MAX_LINE]
+            buf.append(line)
+            progress = parseProgressLine(line)
+            if progress is not None:
+                onProgress(label, progress[0], progress[1])
+            if len(fatal) == 0:
+                for pattern in fatalPatterns:
+                    if pattern.search(line):
+                        fatal.append("[cancelled: output matched " + repr(pattern.pattern) + "]")
+                        proc.kill()
+                        break
+        stream.close()
+
+    readers = [threading.Thread(target=pump, args=(proc.stdout, out), daemon=True),
+               threading.Thread(target=pump, args=(proc.stderr, err), daemon=True)]
+    for t in readers:
+        t.start()
+    if input is not None:
+        try:
+            proc.stdin.write(input)
+            proc.stdin.close()
+        except OSError:
+            pass
+    for t in readers:
+        t.join()
+    returncode = proc.wait()
+
+    return {
+        "returncode": returncode,
+        "stdout": "\n".join(out),
+        "stderr": "\n".join(list(err) + fatal),
+        "ok": returncode == 0 and len(fatal) == 0,
+        "cancelled": len(fatal) > 0,
+    }
+
+
+def parseProgressLine(line):
+    m = APKTOOL_STAGE_RE.match(line)
+    if m:
+        return m.group(1), None
+    return None
+
+
+def _verboseProgress(label, stage, percent):
+    verbosePrint("[" + label + "] " + stage + (" (" + str(percent) + "%)" if percent is not None else ""))
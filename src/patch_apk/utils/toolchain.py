@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+from patch_apk.utils.cache_dir import getCacheDir
+
+####################
+# Persistent toolchain cache (<cache dir>/toolchain.json).
+#
+# Each tool is fingerprinted by its resolved path, size and mtime (plus the
+# jar next to a wrapper script, e.g. apktool + apktool.jar). The detected
+# version, the probe syntax that produced it and capability flags (such as
+# apktool -j support) are stored under that fingerprint, so repeat runs
+# resolve the toolchain without launching a JVM. Replacing or upgrading a
+# tool changes its fingerprint and the facts are probed again.
+####################
+_cache = None
+
+
+####################
+# Resolved path of a tool on PATH, looked up every time (a PATH scan is
+# cheap, and a newly installed tool must be picked up); only the facts about
+# the binary are cached.
+####################
+def findTool(name):
+    found = shutil.which(name)
+    return os.path.realpath(found) if found else None
+
+
+####################
+# Version of a tool: the cached value when the tool hasn't changed, else the
+# first probe (e.g. ["version"], ["-v"]) whose output starts with a version.
+# run(probe) must return a dict with "returncode" and "stdout".
+####################
+def getToolVersion(name, probes, run):
+    entry = _toolEntry(name)
+    if entry is None:
+        return None
+    if entry.get("version"):
+        return entry["version"]
+    for probe in probes:
+        try:
+            result = run(probe)
+        except Exception:
+            continue
+        if result["returncode"] != 0 or not result["stdout"].strip():
+            continue
+        version = result["stdout"].strip().split("\n")[0].strip().split("-")[0].strip()
+        if version[:1].isdigit():
+            entry["version"] = version
+            entry["probe"] = list(probe)
+            _saveCache()
+            return version
+    return None
+
+
+def getToolFlag(name, flag, default=None):
+    entry = _toolEntry(name)
+    return default if entry is None else entry.get("flags", {}).get(flag, default)
+
+
+def setToolFlag(name, flag, value):
+    entry = _toolEntry(name)
+    if entry is not None and entry.get("flags", {}).get(flag) != value:
+        entry.setdefault("flags", {})[flag] = value
+        _saveCache()
+
+
+def _toolEntry(name):
+    path = findTool(name)
+    if path is None:
+        return None
+    files = [path]
+    # Wrapper scripts (apktool, apktool.bat) run a jar next to them
+    jar = os.path.join(os.path.dirname(path), os.path.splitext(os.path.basename(path))[0] + ".jar")
+    if os.path.isfile(jar):
+        files.append(jar)
+    try:
+        stats = [os.stat(f) for f in files]
+    except OSError:
+        return None
+    fingerprint = {"files": files, "sizes": [st.st_size for st in stats], "mtimes": [st.st_mtime_ns for st in stats]}
+    tools = _loadCache()["tools"]
+    if path not in tools or tools[path].get("fingerprint") != fingerprint:
+        tools[path] = {"fingerprint": fingerprint}
+    return tools[path]
+
+
+def _loadCache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(getCacheDir("toolchain.json"), "r", encoding="utf-8") as fh:
+                _cache = json.load(fh)
+        except (OSError, ValueError):
+            _cache = {}
+        if not isinstance(_cache, dict):
+            _cache = {}
+        _cache.pop("which", None)
+        _cache.setdefault("tools", {})
+    return _cache
+
+
+def _saveCache():
+    path = getCacheDir("toolchain.json")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(_cache, fh, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError:
+        pass
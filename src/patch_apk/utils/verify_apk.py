@@ -0,0 +1,145 @@
+import os
+import re
+import struct
+import subprocess
+import time
+import zipfile
+from patch_apk.utils.apk_inspect import manifestElements
+from patch_apk.utils.cli_tools import abort, verbosePrint
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+GADGET_LIB = "libfrida-gadget.so"
+GADGET_LOAD_STRING = b"frida-gadget"
+LOCAL_HEADER_SIZE = 30
+EOCD_SIZE = 22
+SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+SIGNER_DIGEST_RE = re.compile(r"^Signer #\d+ certificate SHA-256 digest: ([0-9a-fA-F]{64})$", re.M)
+
+
+####################
+# Check the objection-patched APK before anything touches the device: a
+# broken build otherwise only shows up when `adb install` fails after the
+# original app was already uninstalled. Reads the central directory, the
+# local headers of stored entries, the binary manifest and the bytes in
+# front of the central directory; dex files are scanned only until the
+# gadget loader is found.
+####################
+def verifyAPK(apkfile, enableUserCerts, extractNativeLibs=True):
+    started = time.monotonic()
+    problems = apkProblems(apkfile, enableUserCerts, extractNativeLibs)
+    if problems:
+        abort("Error: " + os.path.basename(apkfile) + " failed verification:\n  - " + "\n  - ".join(problems))
+    verbosePrint("[+] Verified the patched APK in " + str(int((time.monotonic() - started) * 1000)) + " ms")
+
+
+def apkProblems(apkfile, enableUserCerts, extractNativeLibs=True):
+    problems = []
+    try:
+        with zipfile.ZipFile(apkfile) as zf:
+            infos = zf.infolist()
+            app, permissions = _readManifest(zf)
+            problems += _checkAlignment(apkfile, infos, app)
+            if not extractNativeLibs:
+                problems += [i.filename + " is compressed, so it can't be loaded from the APK" for i in infos
+                             if i.filename.startswith("lib/") and i.filename.endswith(".so") and i.compress_type != zipfile.ZIP_STORED]
+            problems += _checkSignature(apkfile, infos)
+            problems += _checkManifest(app, permissions, enableUserCerts, extractNativeLibs)
+            problems += _checkGadget(zf, infos)
+    except (OSError, zipfile.BadZipFile, KeyError) as e:
+        problems.append("unreadable APK: " + str(e))
+    return problems
+
+
+####################
+# SHA-256 digests of the APK's signer certificates, as apksigner reports
+# them; empty when apksigner is missing or rejects the APK.
+####################
+def signerDigests(apkfile):
+    try:
+        cp = subprocess.run(["apksigner", "verify", "--print-certs", apkfile], capture_output=True, text=True)
+    except OSError:
+        return set()
+    if cp.returncode != 0:
+        return set()
+    return {d.lower() for d in SIGNER_DIGEST_RE.findall(cp.stdout)}
+
+
+def _readManifest(zf):
+    app = None
+    permissions = set()
+    for element, attrs in manifestElements(zf.read("AndroidManifest.xml")):
+        values = {key: value for ns, key, value in attrs if ns == ANDROID_NS}
+        if element == "application":
+            app = values
+        elif element == "uses-permission" and isinstance(values.get("name"), str):
+            permissions.add(values["name"])
+    return app, permissions
+
+
+def _checkAlignment(apkfile, infos, app):
+    # Uncompressed libraries only need a page boundary when they are loaded in place
+    pageAlignLibs = app is not None and app.get("extractNativeLibs") is False
+    problems = []
+    with open(apkfile, "rb") as fh:
+        for info in infos:
+            if info.compress_type != zipfile.ZIP_STORED or info.is_dir():
+                if info.filename == "resources.arsc":
+                    problems.append("resources.arsc is compressed (Android 11+ refuses to install it)")
+                continue
+            # The local header's extra field can differ from the central directory's
+            fh.seek(info.header_offset + 26)
+            nameLen, extraLen = struct.unpack("<HH", fh.read(4))
+            offset = info.header_offset + LOCAL_HEADER_SIZE + nameLen + extraLen
+            want = 4096 if pageAlignLibs and info.filename.endswith(".so") else 4
+            if offset % want:
+                problems.append(info.filename + " is not " + str(want) + "-byte aligned (data at " + str(offset) + ")")
+    return problems
+
+
+def _checkSignature(apkfile, infos):
+    # objection signs with apksigner (v2 block) or, in older releases, jarsigner (v1)
+    if any(i.filename.startswith("META-INF/") and i.filename.endswith(".SF") for i in infos):
+        return []
+    with open(apkfile, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        fh.seek(max(0, size - EOCD_SIZE - 0xFFFF))
+        tail = fh.read()
+        eocd = tail.rfind(b"PK\x05\x06")
+        if eocd < 0 or eocd + EOCD_SIZE > len(tail):
+            return ["end of central directory not found"]
+        cdOffset, = struct.unpack_from("<I", tail, eocd + 16)
+        if cdOffset >= 24:
+            fh.seek(cdOffset - 16)
+            if fh.read(16) == SIG_BLOCK_MAGIC:
+                return []
+    return ["the APK is not signed"]
+
+
+def _checkManifest(app, permissions, enableUserCerts, extractNativeLibs):
+    if app is None:
+        return ["AndroidManifest.xml has no <application>"]
+    problems = []
+    if "android.permission.INTERNET" not in permissions:
+        problems.append("android.permission.INTERNET is missing")
+    if extractNativeLibs and app.get("extractNativeLibs") is False:
+        problems.append("extractNativeLibs is false")
+    if not extractNativeLibs and app.get("extractNativeLibs") is not False:
+        problems.append("extractNativeLibs is not false")
+    if enableUserCerts and "networkSecurityConfig" not in app:
+        problems.append("android:networkSecurityConfig is missing")
+    return problems
+
+
+def _checkGadget(zf, infos):
+    # objection only adds the gadget for the connected device's ABI
+    if not any(i.filename.startswith("lib/") and i.filename.endswith("/" + GADGET_LIB) for i in infos):
+        return ["no " + GADGET_LIB + " in the APK"]
+    for info in sorted((i for i in infos if i.filename.startswith("classes") and i.filename.endswith(".dex")), key=lambda i: i.filename):
+        with zf.open(info) as fh:
+            carry = b""
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                if GADGET_LOAD_STRING in carry + chunk:
+                    return []
+                carry = chunk[-len(GADGET_LOAD_STRING):]
+    return ["no dex references frida-gadget: objection did not inject the loader"]
@@ -1,19 +1,24 @@
 import subprocess
 from patch_apk.utils.cli_tools import abort, warningPrint
+from patch_apk.utils.device_snapshot import getDeviceSnapshot, snapshotPackages
 import os
 
 def verifyPackageName(pkgname):
     # Get a list of installed packages matching the given name
     packages = []
-    proc = subprocess.run(["adb", "shell", "pm", "list", "packages"], stdout=subprocess.PIPE)
-    if proc.returncode != 0:
-        abort("Error: Failed to run 'adb shell pm list packages'.")
-    out = proc.stdout.decode("utf-8")
-    for line in out.split(os.linesep):
-        if line.startswith("package:"):
-            line = line[8:].strip()
-            if pkgname.lower() in line.lower():
-                packages.append(line)
+    snapshot = getDeviceSnapshot()
+    if snapshot is not None:
+        packages = snapshotPackages(snapshot, pkgname)
+    else:
+        proc = subprocess.run(["adb", "shell", "pm", "list", "packages"], stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            abort("Error: Failed to run 'adb shell pm list packages'.")
+        out = proc.stdout.decode("utf-8")
+        for line in out.split(os.linesep):
+            if line.startswith("package:"):
+                line = line[8:].strip()
+                if pkgname.lower() in line.lower():
+                    packages.append(line)
     
     # Bail out if no matching packages were found
     if len(packages) == 0:
@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+import zipfile
+from patch_apk.utils.cli_tools import abort, verbosePrint
+
+# Decoded size relative to the uncompressed zip entry size
+DECODE_EXPANSION = {".dex": 4.0, ".xml": 3.0, ".arsc": 3.0}
+# Decoded tree + rebuilt output per byte of APK when only the APK size is known
+APK_SIZE_FACTOR = 4.0
+# apktool b intermediates + rebuilt APK relative to the input APK
+BUILD_FACTOR = 1.5
+# Fraction of a filesystem that is kept free
+HEADROOM = 0.10
+TRASH_PREFIX = ".patchapk-trash-"
+
+_cleaners = []
+
+
+####################
+# Bytes needed to decode and rebuild the given APKs, from the uncompressed sizes
+# in their zip central directories (nothing is extracted).
+####################
+def estimateDecodedSize(apkpaths):
+    total = 0
+    for apkpath in apkpaths:
+        try:
+            with zipfile.ZipFile(apkpath) as zf:
+                for info in zf.infolist():
+                    ext = os.path.splitext(info.filename)[1].lower()
+                    total += int(info.file_size * DECODE_EXPANSION.get(ext, 1.0))
+        except (OSError, zipfile.BadZipFile):
+            pass
+        if os.path.isfile(apkpath):
+            total += int(os.path.getsize(apkpath) * BUILD_FACTOR)
+    return total
+
+
+def _availableSpace(path):
+    usage = shutil.disk_usage(path)
+    return max(0, int(usage.free - usage.total * HEADROOM))
+
+
+def _tmpfsCandidates():
+    candidates = []
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        candidates.append(os.environ["XDG_RUNTIME_DIR"])
+    if sys.platform.startswith("linux"):
+        candidates.append("/dev/shm")
+    return [c for c in candidates if os.path.isdir(c) and os.access(c, os.W_OK)]
+
+
+####################
+# Create a workspace directory for an estimated size in bytes: on tmpfs when it
+# fits, otherwise under TMPDIR. Aborts before any work if neither has room.
+####################
+def createWorkspace(estimate, prefix="patchapk_"):
+    report = []
+    for base in _tmpfsCandidates() + [tempfile.gettempdir()]:
+        available = _availableSpace(base)
+        report.append(base + ": " + str(available // (1024 * 1024)) + " MiB free")
+        if estimate <= available:
+            _sweepTrash(base)
+            path = tempfile.mkdtemp(prefix=prefix, dir=base)
+            verbosePrint("[+] Workspace " + path + " (estimated " + str(estimate // (1024 * 1024)) + " MiB)")
+            return path
+    abort("Error: Not enough disk space to decode: need ~" + str(estimate // (1024 * 1024)) + " MiB (" + "; ".join(report) + ").")
+
+
+####################
+# Fail fast, before decoding, if the workspace cannot hold the decoded APKs.
+####################
+def checkWorkspaceSpace(path, apkpaths):
+    needed = estimateDecodedSize(apkpaths)
+    available = _availableSpace(path)
+    verbosePrint("[+] Decoding needs ~" + str(needed // (1024 * 1024)) + " MiB, " + str(available // (1024 * 1024)) + " MiB available.")
+    if needed > available:
+        abort("Error: Not enough space in " + path + " to decode: need ~" + str(needed // (1024 * 1024)) + " MiB, " +
+              str(available // (1024 * 1024)) + " MiB available.")
+
+
+####################
+# Remove a workspace without blocking: rename it to a trash name and delete it on
+# a background thread. Removals still running at exit are handed to a detached
+# process; leftovers are swept by the next createWorkspace.
+####################
+def removeWorkspace(path):
+    if not os.path.exists(path):
+        return
+    trash = os.path.join(os.path.dirname(path), TRASH_PREFIX + uuid.uuid4().hex)
+    try:
+        os.rename(path, trash)
+    except OSError:
+        trash = path
+    _removeInBackground(trash)
+
+
+def finishWorkspaceRemoval():
+    for thread, path in _cleaners:
+        if thread.is_alive() and os.path.exists(path):
+            subprocess.Popen([sys.executable, "-c", "import shutil, sys; shutil.rmtree(sys.argv[1], True)", path],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+
+
+def _removeInBackground(path):
+    thread = threading.Thread(target=shutil.rmtree, args=(path, True), daemon=True)
+    thread.start()
+    _cleaners.append((thread, path))
+
+
+def _sweepTrash(base):
+    try:
+        names = [n for n in os.listdir(base) if n.startswith(TRASH_PREFIX)]
+    except OSError:
+        return
+    for name in names:
+        _removeInBackground(os.path.join(base, name))
@@ -0,0 +1,17 @@
+import os, sys
+
+import pytest
+
+# The top-level modules are scripts' siblings, not an installed package; the
+# patch_apk package lives under src/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(autouse=True)
+def quiet_package_logging():
+    # patch_apk logs through a logger that otherwise configures itself from sys.argv
+    from patch_apk.utils import cli_tools
+    cli_tools.setupLogging(False, False, None)
@@ -0,0 +1,203 @@
+import os, socket, struct, threading
+
+import pytest
+
+from ADBClient import ADBClient, ADBClientError
+
+
+class FakeAdbServer:
+    """
+    Stand-in adb server: answers host:version and host:devices, binds any transport, runs
+    shell: commands from a canned table (honouring the rc echo) and serves
+    sync: STAT/RECV/SEND against an in-memory file system.
+    """
+
+    def __init__(self, shell=None, files=None, devices=("emulator-5554",)):
+        self.shell = shell or {}
+        self.devices = list(devices)
+        self.files = dict(files or {})
+        self.services = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                while True:
+                    service = self._read(conn, int(self._read(conn, 4), 16)).decode()
+                    self.services.append(service)
+                    if service == "host:version":
+                        conn.sendall(b"OKAY0004" + b"0029")
+                        return
+                    if service == "host:devices":
+                        body = "".join(f"{d}\tdevice\n" for d in self.devices).encode()
+                        conn.sendall(b"OKAY" + b"%04x" % len(body) + body)
+                        return
+                    if service.startswith("host:transport"):
+                        conn.sendall(b"OKAY")
+                        continue
+                    if service.startswith("shell:"):
+                        return self._shell(conn, service[len("shell:"):])
+                    if service == "sync:":
+                        conn.sendall(b"OKAY")
+                        return self._sync(conn)
+                    msg = b"unknown service"
+                    conn.sendall(b"FAIL" + b"%04x" % len(msg) + msg)
+                    return
+            except ConnectionError:
+                return
+
+    def _shell(self, conn, command):
+        cmd, _, _ = command.partition(" ; echo ")
+        if cmd not in self.shell:
+            conn.sendall(b"OKAY" + b"sh: not found\r\n" + ADBClient.RC_MARKER.encode() + b"127\r\n")
+            return
+        out, rc = self.shell[cmd]
+        body = out.replace("\n", "\r\n").encode()
+        if rc is not None:
+            body += ADBClient.RC_MARKER.encode() + b"%d\r\n" % rc
+        conn.sendall(b"OKAY" + body)
+
+    def _sync(self, conn):
+        while True:
+            ident = self._read(conn, 4)
+            length = struct.unpack("<I", self._read(conn, 4))[0]
+            if ident == b"QUIT":
+                return
+            arg = self._read(conn, length).decode()
+            if ident == b"STAT":
+                data = self.files.get(arg)
+                conn.sendall(b"STAT" + struct.pack("<III", 0o100644 if data is not None else 0,
+                                                   len(data or b""), 1700000000 if data is not None else 0))
+            elif ident == b"RECV":
+                data = self.files.get(arg)
+                if data is None:
+                    msg = b"No such file or directory"
+                    conn.sendall(b"FAIL" + struct.pack("<I", len(msg)) + msg)
+                    continue
+                for i in range(0, len(data), 1000):
+                    chunk = data[i:i + 1000]
+                    conn.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                conn.sendall(b"DONE" + struct.pack("<I", 0))
+            elif ident == b"SEND":
+                path = arg.rsplit(",", 1)[0]
+                buf = bytearray()
+                while True:
+                    frame = self._read(conn, 4)
+                    n = struct.unpack("<I", self._read(conn, 4))[0]
+                    if frame == b"DONE":
+                        break
+                    buf += self._read(conn, n)
+                self.files[path] = bytes(buf)
+                conn.sendall(b"OKAY" + struct.pack("<I", 0))
+
+    @staticmethod
+    def _read(conn, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed")
+            buf += chunk
+        return bytes(buf)
+
+
+@pytest.fixture
+def server():
+    srv = FakeAdbServer(
+        shell={
+            "pm path com.example": ("package:/data/app/com.example/base.apk\n", 0),
+            "false": ("", 1),
+            "killed": ("partial output\n", None),
+        },
+        files={"/data/app/com.example/base.apk": os.urandom(150 * 1024)},
+    )
+    yield srv
+    srv.close()
+
+
+def client(server, serial=None):
+    return ADBClient(serial=serial, host="127.0.0.1", port=server.port, timeout=5)
+
+
+def test_server_from_env(monkeypatch):
+    monkeypatch.setenv("ADB_SERVER_SOCKET", "tcp:10.0.0.2:5555")
+    assert ADBClient()._server_from_env() == ("10.0.0.2", 5555)
+    monkeypatch.delenv("ADB_SERVER_SOCKET")
+    monkeypatch.setenv("ANDROID_ADB_SERVER_PORT", "5038")
+    assert ADBClient().port == 5038
+
+
+def test_is_available(server):
+    assert client(server).is_available()
+    assert not ADBClient(host="127.0.0.1", port=1, timeout=1).is_available()
+
+
+def test_shell_recovers_exit_status(server):
+    adb = client(server, serial="emulator-5554")
+    assert adb.shell("pm path com.example") == (0, "package:/data/app/com.example/base.apk\n")
+    assert adb.shell("false") == (1, "")
+    assert adb.shell("missing")[0] == 127
+    assert "host:transport:emulator-5554" in server.services
+
+
+def test_device_is_picked_only_when_unambiguous(server, monkeypatch):
+    monkeypatch.delenv("ANDROID_SERIAL", raising=False)
+    adb = client(server)
+    assert adb.shell("false")[0] == 1
+    assert adb.serial == "emulator-5554"
+    assert server.services[:2] == ["host:devices", "host:transport:emulator-5554"]
+
+    server.devices.append("R58M123ABC")
+    with pytest.raises(ADBClientError, match="more than one device"):
+        client(server).shell("false")
+    monkeypatch.setenv("ANDROID_SERIAL", "R58M123ABC")
+    assert client(server).shell("false")[0] == 1
+    assert server.services[-2] == "host:transport:R58M123ABC"
+
+    server.devices.clear()
+    monkeypatch.delenv("ANDROID_SERIAL")
+    with pytest.raises(ADBClientError, match="no devices"):
+        client(server).shell("false")
+
+
+def test_shell_without_marker_is_failure(server):
+    # The shell died before the echo: no status to trust
+    assert client(server).shell("killed") == (255, "partial output\n")
+
+
+def test_unknown_service_raises(server):
+    with pytest.raises(ADBClientError, match="unknown service"):
+        client(server).exec_out("nothing")
+
+
+def test_sync_stat_pull_push(server, tmp_path):
+    remote = "/data/app/com.example/base.apk"
+    local = tmp_path / "base.apk"
+    seen = []
+    with client(server).sync() as sync:
+        mode, size, mtime = sync.stat(remote)
+        assert mode and size == len(server.files[remote]) and mtime
+        assert sync.stat("/nope") == (0, 0, 0)
+        assert sync.pull(remote, str(local), progress=seen.append) == size
+        with pytest.raises(ADBClientError, match="No such file"):
+            sync.pull("/nope", str(tmp_path / "nope"))
+        assert sync.push(str(local), "/data/local/tmp/copy.apk") == size
+    assert local.read_bytes() == server.files[remote]
+    assert server.files["/data/local/tmp/copy.apk"] == server.files[remote]
+    assert seen[-1] == size and seen == sorted(seen)
+    assert not (tmp_path / "nope").exists() and not (tmp_path / "nope.part").exists()
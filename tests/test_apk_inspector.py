@@ -0,0 +1,130 @@
+import struct, zipfile
+
+import pytest
+
+from ApkInspector import ApkInspector, ApkInspectError
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+
+
+def string_pool(strings):
+    """UTF-16 string pool chunk, hand-packed."""
+    data = b"".join(struct.pack("<H", len(s)) + s.encode("utf-16-le") + b"\0\0" for s in strings)
+    data += b"\0" * (-len(data) % 4)
+    offsets, p = [], 0
+    for s in strings:
+        offsets.append(p)
+        p += 4 + 2 * len(s)
+    start = 28 + 4 * len(strings)
+    return struct.pack("<HHIIIIII", 0x0001, 28, start + len(data), len(strings), 0, 0, start, 0) \
+        + struct.pack(f"<{len(strings)}I", *offsets) + data
+
+
+def binary_xml(elements):
+    """
+    elements: [(name, [(namespace, attribute, value)])] as start tags of a
+    binary XML document; values are str, bool or int (a resource reference).
+    """
+    strings = []
+
+    def idx(s):
+        if s not in strings:
+            strings.append(s)
+        return strings.index(s)
+
+    chunks = b""
+    for name, attrs in elements:
+        body = struct.pack("<IIHHHHHH", 0xFFFFFFFF, idx(name), 20, 20, len(attrs), 0, 0, 0)
+        for ns, key, value in attrs:
+            if isinstance(value, bool):
+                raw, dtype, data = 0xFFFFFFFF, 0x12, 0xFFFFFFFF if value else 0
+            elif isinstance(value, int):
+                raw, dtype, data = 0xFFFFFFFF, 0x01, value
+            else:
+                raw, dtype, data = idx(value), 0x03, idx(value)
+            body += struct.pack("<IIIHBBI", idx(ns) if ns else 0xFFFFFFFF, idx(key), raw, 8, 0, dtype, data)
+        chunks += struct.pack("<HHIII", 0x0102, 16, 16 + len(body), 1, 0xFFFFFFFF) + body
+    pool = string_pool(strings)
+    return struct.pack("<HHI", 0x0003, 8, 8 + len(pool) + len(chunks)) + pool + chunks
+
+
+def manifest(split=None, package="com.app", module_type=None):
+    attrs = [("", "package", package)] + ([("", "split", split)] if split else [])
+    elements = [("manifest", attrs)]
+    if module_type:
+        elements.append(("module", [("http://schemas.android.com/apk/distribution", "type", module_type)]))
+    elements.append(("application", [(ANDROID_NS, "label", "App")]))
+    return binary_xml(elements)
+
+
+def build_apk(path, entries):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+@pytest.fixture
+def split_set(tmp_path):
+    apks = {
+        "base": {"AndroidManifest.xml": manifest(), "classes.dex": b"dex", "resources.arsc": b"",
+                 "res/layout/main.xml": b""},
+        "abi": {"AndroidManifest.xml": manifest("config.arm64_v8a"), "lib/arm64-v8a/libapp.so": b"so"},
+        "density": {"AndroidManifest.xml": manifest("config.xxhdpi"), "resources.arsc": b""},
+        "language": {"AndroidManifest.xml": manifest("config.pt_BR"), "resources.arsc": b""},
+        "config": {"AndroidManifest.xml": manifest("config.night_mode"), "resources.arsc": b""},
+        "asset_pack": {"AndroidManifest.xml": manifest("textures", module_type="asset-pack"),
+                       "assets/textures/a.ktx": b"ktx"},
+        "feature": {"AndroidManifest.xml": manifest("camera"), "classes.dex": b"dex", "resources.arsc": b""},
+    }
+    return {kind: build_apk(tmp_path / f"{kind}.apk", entries) for kind, entries in apks.items()}
+
+
+def test_classifies_each_kind(split_set):
+    for kind, path in split_set.items():
+        info = ApkInspector.inspect(path)
+        assert info["kind"] == kind, path
+        assert info["package"] == "com.app"
+    assert ApkInspector.inspect(split_set["abi"])["abis"] == ["arm64-v8a"]
+    assert ApkInspector.inspect(split_set["base"])["dex_count"] == 1
+
+
+def test_asset_pack_without_dist_module(tmp_path):
+    path = build_apk(tmp_path / "pack.apk", {"AndroidManifest.xml": manifest("levels"),
+                                            "assets/levels/1.bin": b"", "META-INF/MANIFEST.MF": b""})
+    assert ApkInspector.inspect(path)["kind"] == "asset_pack"
+
+
+def test_unreadable_manifest_falls_back_to_the_file_name(tmp_path):
+    path = build_apk(tmp_path / "split_config.xhdpi.apk", {"AndroidManifest.xml": b"\0garbage"})
+    assert ApkInspector.inspect(path)["kind"] == "density"
+    with pytest.raises(ApkInspectError, match="not a readable APK"):
+        ApkInspector.inspect(str(tmp_path / "split_config.xhdpi.apk") + ".missing")
+
+
+def test_inspect_all_puts_the_base_first(split_set):
+    paths = [split_set["abi"], split_set["density"], split_set["base"]]
+    assert [i["kind"] for i in ApkInspector.inspect_all(paths)] == ["base", "abi", "density"]
+    with pytest.raises(ApkInspectError, match="exactly one base"):
+        ApkInspector.inspect_all([split_set["abi"], split_set["density"]])
+
+
+def test_inspect_all_rejects_mixed_packages(split_set, tmp_path):
+    other = build_apk(tmp_path / "other.apk", {"AndroidManifest.xml": manifest("config.fr", package="com.other")})
+    with pytest.raises(ApkInspectError, match="different packages"):
+        ApkInspector.inspect_all([split_set["base"], other])
+
+
+@pytest.mark.parametrize("entries,proguard,andresguard", [
+    ({}, False, False),
+    ({"META-INF/proguard/rules.pro": b"-keep class *"}, True, False),
+    ({"META-INF/MANIFEST.MF": b"Created-By: ProGuard 7.3\n"}, True, False),
+    ({"r/a/b.xml": b""}, False, True),
+    ({"res/zz/b.xml": b""}, False, True),
+])
+def test_obfuscation_detection(tmp_path, entries, proguard, andresguard):
+    path = build_apk(tmp_path / "app.apk", {"AndroidManifest.xml": manifest(), "classes.dex": b"dex",
+                                           "res/values-fr/strings.xml": b"", **entries})
+    info = ApkInspector.inspect(path)
+    assert (info["proguard"], info["andresguard"]) == (proguard, andresguard)
+    assert ("obfuscated" in ApkInspector.describe(info)) == (proguard or andresguard)
@@ -0,0 +1,141 @@
+import struct, zipfile
+
+import pytest
+
+from ApkVerifier import ApkVerifier, ApkVerifyError
+from test_apk_inspector import ANDROID_NS, binary_xml
+
+
+def patched_manifest(internet=True, name="com.app.App", test_only=None, extract_native_libs=None,
+                     network_security_config=False):
+    app = [(ANDROID_NS, "label", "App")]
+    if name:
+        app.append((ANDROID_NS, "name", name))
+    if test_only is not None:
+        app.append((ANDROID_NS, "testOnly", test_only))
+    if extract_native_libs is not None:
+        app.append((ANDROID_NS, "extractNativeLibs", extract_native_libs))
+    if network_security_config:
+        app.append((ANDROID_NS, "networkSecurityConfig", 0x7F140001))
+    elements = [("manifest", [("", "package", "com.app")])]
+    if internet:
+        elements.append(("uses-permission", [(ANDROID_NS, "name", "android.permission.INTERNET")]))
+    elements.append(("application", app))
+    return binary_xml(elements)
+
+
+def write_apk(path, entries, aligned=True, signed=True):
+    """
+    entries: {name: (bytes, stored)}. Stored entries are padded through the
+    local extra field the way zipalign -p does; signed puts a (fake) APK
+    Signing Block in front of the central directory.
+    """
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, (data, stored) in entries.items():
+            info = zipfile.ZipInfo(name, (2020, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            if stored:
+                want = 4096 if name.endswith(".so") else 4
+                start = zf.fp.tell() + 30 + len(name.encode())
+                pad = -start % want if aligned else (1 if start % want == 0 else 0)
+                info.extra = b"\0" * pad
+            zf.writestr(info, data)
+    if signed:
+        with open(path, "rb") as fh:
+            raw = bytearray(fh.read())
+        eocd = raw.rfind(b"PK\x05\x06")
+        cd_offset, = struct.unpack_from("<I", raw, eocd + 16)
+        block = struct.pack("<Q", 24) + b"\0" * 8 + ApkVerifier.SIG_BLOCK_MAGIC
+        struct.pack_into("<I", raw, eocd + 16, cd_offset + len(block))
+        raw[cd_offset:cd_offset] = block
+        with open(path, "wb") as fh:
+            fh.write(raw)
+    return str(path)
+
+
+def good_entries(**manifest_kw):
+    return {
+        "AndroidManifest.xml": (patched_manifest(**manifest_kw), False),
+        "classes.dex": (b"dex\n035\0" + b"\0" * 100, False),
+        "classes2.dex": (b"dex\n035\0 ... Ljava/lang/System;->loadLibrary frida-gadget ...", False),
+        "resources.arsc": (b"\2\0\x0c\0" + b"\0" * 61, True),
+        "res/raw/sound.ogg": (b"OggS" * 3, True),
+        "lib/arm64-v8a/libapp.so": (b"\x7fELF" + b"\0" * 300, False),
+        "lib/arm64-v8a/libfrida-gadget.so": (b"\x7fELF" + b"\1" * 300, False),
+    }
+
+
+def problems(path, **kw):
+    with pytest.raises(ApkVerifyError) as e:
+        ApkVerifier.verify(path, **kw)
+    return str(e.value)
+
+
+def test_good_apk(tmp_path):
+    path = write_apk(tmp_path / "good.apk", good_entries())
+    assert ApkVerifier.verify(path) == ["alignment", "signing block", "manifest",
+                                        "gadget libraries", "gadget loader"]
+
+
+def test_good_apk_with_libraries_in_place(tmp_path):
+    entries = good_entries(extract_native_libs=False, network_security_config=True)
+    for name in ("lib/arm64-v8a/libapp.so", "lib/arm64-v8a/libfrida-gadget.so"):
+        entries[name] = (entries[name][0], True)
+    path = write_apk(tmp_path / "good.apk", entries)
+    assert "uncompressed libraries" in ApkVerifier.verify(path, enable_user_certs=True, extract_native_libs=False)
+
+
+def test_misaligned(tmp_path):
+    entries = good_entries(extract_native_libs=False)
+    entries["lib/arm64-v8a/libapp.so"] = (entries["lib/arm64-v8a/libapp.so"][0], True)
+    text = problems(write_apk(tmp_path / "bad.apk", entries, aligned=False), extract_native_libs=False)
+    assert "resources.arsc is not 4-byte aligned" in text
+    assert "lib/arm64-v8a/libapp.so is not 4096-byte aligned" in text
+    assert "lib/arm64-v8a/libfrida-gadget.so is compressed" in text
+
+    entries = good_entries()
+    entries["resources.arsc"] = (entries["resources.arsc"][0], False)
+    assert "resources.arsc is compressed" in problems(write_apk(tmp_path / "deflated.apk", entries))
+
+
+def test_unsigned(tmp_path):
+    text = problems(write_apk(tmp_path / "unsigned.apk", good_entries(), signed=False))
+    assert "no APK Signing Block" in text
+    assert "aligned" not in text
+
+
+def test_manifest(tmp_path):
+    path = write_apk(tmp_path / "bad.apk", good_entries(internet=False, name=None, test_only=True,
+                                                       extract_native_libs=False))
+    text = problems(path, enable_user_certs=True)
+    for problem in ("android.permission.INTERNET is missing", "extractNativeLibs is false",
+                    "<application> has no android:name", "android:testOnly is still set",
+                    "android:networkSecurityConfig is missing"):
+        assert problem in text
+    # Without the gadget only the requested options are checked
+    assert problems(path, frida_gadget=False, enable_user_certs=True).count("\n  - ") == 1
+
+    entries = good_entries()
+    entries["AndroidManifest.xml"] = (binary_xml([("manifest", [("", "package", "com.app")])]), False)
+    assert "has no <application>" in problems(write_apk(tmp_path / "noapp.apk", entries))
+
+
+def test_gadget_and_loader(tmp_path):
+    entries = good_entries()
+    entries["lib/x86_64/libapp.so"] = (b"\x7fELF", False)
+    entries["classes2.dex"] = (b"dex\n035\0" + b"\0" * 100, False)
+    text = problems(write_apk(tmp_path / "bad.apk", entries))
+    assert "lib/x86_64/libfrida-gadget.so is missing" in text
+    assert "lib/arm64-v8a/libfrida-gadget.so" not in text
+    assert "no dex references frida-gadget" in text
+    assert ApkVerifier.verify(write_apk(tmp_path / "plain.apk", entries), frida_gadget=False)
+
+    del entries["lib/x86_64/libapp.so"], entries["lib/arm64-v8a/libapp.so"], \
+        entries["lib/arm64-v8a/libfrida-gadget.so"]
+    assert "no libfrida-gadget.so in the APK" in problems(write_apk(tmp_path / "nolib.apk", entries))
+
+
+def test_unreadable(tmp_path):
+    path = tmp_path / "junk.apk"
+    path.write_bytes(b"not a zip")
+    assert "unreadable APK" in problems(str(path))
@@ -0,0 +1,289 @@
+import os, struct, zipfile
+
+import pytest
+
+from ArscMerger import ArscMerger, ArscError
+from patch_apk.utils import arsc_merge
+
+# Hand-packed resources.arsc chunks, independent of ArscMerger's writer.
+
+STRING, INT_DEC = 0x03, 0x10
+TYPES = ["drawable", "string", "style"]
+
+
+def _len8(n):
+    return bytes([0x80 | (n >> 8), n & 0xFF]) if n > 0x7F else bytes([n])
+
+
+def pool(strings, styles=(), utf8=True):
+    data, offsets = bytearray(), []
+    for s in strings:
+        offsets.append(len(data))
+        if utf8:
+            raw = s.encode("utf-8")
+            data += _len8(len(s.encode("utf-16-le")) // 2) + _len8(len(raw)) + raw + b"\0"
+        else:
+            raw = s.encode("utf-16-le")
+            data += struct.pack("<H", len(raw) // 2) + raw + b"\0\0"
+    data += b"\0" * (-len(data) % 4)
+    spans, span_offsets = bytearray(), []
+    for style in styles:
+        span_offsets.append(len(spans))
+        for name, first, last in style:
+            spans += struct.pack("<III", name, first, last)
+        spans += struct.pack("<I", 0xFFFFFFFF)
+    if styles:
+        spans += struct.pack("<II", 0xFFFFFFFF, 0xFFFFFFFF)
+    strings_start = 28 + 4 * (len(offsets) + len(span_offsets))
+    header = struct.pack("<HHIIIIII", 0x0001, 28, strings_start + len(data) + len(spans), len(strings),
+                         len(styles), 0x100 if utf8 else 0, strings_start,
+                         strings_start + len(data) if styles else 0)
+    return (header + struct.pack(f"<{len(offsets)}I", *offsets)
+            + struct.pack(f"<{len(span_offsets)}I", *span_offsets) + bytes(data) + bytes(spans))
+
+
+def config(language=b"", density=0):
+    cfg = bytearray(64)
+    struct.pack_into("<I", cfg, 0, 64)
+    cfg[8:8 + len(language)] = language
+    struct.pack_into("<H", cfg, 14, density)
+    return bytes(cfg)
+
+
+def simple(key, dtype, data):
+    return struct.pack("<HHIHBBI", 8, 0, key, 8, 0, dtype, data)
+
+
+def bag(key, parent, items):
+    return struct.pack("<HHIII", 16, 1, key, parent, len(items)) + \
+        b"".join(struct.pack("<IHBBI", name, 8, 0, dtype, d) for name, dtype, d in items)
+
+
+def spec(tid, flags):
+    return struct.pack(f"<HHIBBHI{len(flags)}I", 0x0202, 16, 16 + 4 * len(flags), tid, 0, 0, len(flags), *flags)
+
+
+def type_chunk(tid, cfg, entries, count, layout="dense"):
+    data, offsets = bytearray(), {}
+    for idx in sorted(entries):
+        offsets[idx] = len(data)
+        data += entries[idx]
+    if layout == "sparse":
+        table, flags, n = b"".join(struct.pack("<HH", i, offsets[i] // 4) for i in sorted(entries)), 0x01, len(entries)
+    elif layout == "offset16":
+        table = struct.pack(f"<{count}H", *[offsets[i] // 4 if i in offsets else 0xFFFF for i in range(count)])
+        table += b"\0" * (-len(table) % 4)
+        flags, n = 0x02, count
+    else:
+        table = struct.pack(f"<{count}I", *[offsets.get(i, 0xFFFFFFFF) for i in range(count)])
+        flags, n = 0, count
+    hsize = 20 + len(cfg)
+    start = hsize + len(table)
+    return struct.pack("<HHIBBHII", 0x0201, hsize, start + len(data), tid, flags, 0, n, start) + cfg + table + bytes(data)
+
+
+def package(chunks, keys, pkg_id=0x7F, types=TYPES, utf8=True):
+    type_pool, key_pool = pool(types, utf8=utf8), pool(keys, utf8=utf8)
+    body = b"".join(chunks)
+    header = struct.pack("<HHII", 0x0200, 288, 288 + len(type_pool) + len(key_pool) + len(body), pkg_id)
+    header += "com.example".encode("utf-16-le").ljust(256, b"\0")
+    header += struct.pack("<IIIII", 288, len(types), 288 + len(type_pool), len(keys), 0)
+    return header + type_pool + key_pool + body
+
+
+def table(values, packages, styles=(), utf8=True):
+    body = pool(values, styles, utf8) + b"".join(packages)
+    return struct.pack("<HHII", 0x0002, 12, 12 + len(body), len(packages)) + body
+
+
+def base_table(utf8=True):
+    values = ["Bold text", "res/drawable/icon.png", "Example", "Titre", "b"]
+    keys = ["icon", "app_name", "title", "AppTheme"]
+    chunks = [
+        spec(1, [0x100]),
+        type_chunk(1, config(), {0: simple(0, STRING, 1)}, 1),
+        spec(2, [0, 0x4]),
+        type_chunk(2, config(), {0: simple(1, STRING, 2), 1: simple(2, STRING, 0)}, 2),
+        type_chunk(2, config(b"fr"), {1: simple(2, STRING, 3)}, 2, layout="sparse"),
+        spec(3, [0]),
+        type_chunk(3, config(), {0: bag(3, 0x01030005, [(0x01010000, INT_DEC, 5), (0x7F020000, STRING, 2)])}, 1),
+    ]
+    return table(values, [package(chunks, keys, utf8=utf8)], styles=[[(4, 0, 3)]], utf8=utf8)
+
+
+def density_split():
+    chunks = [spec(1, [0x100]),
+              type_chunk(1, config(density=320), {0: simple(0, STRING, 0)}, 1, layout="offset16")]
+    return table(["res/drawable-xhdpi-v4/icon.png"], [package(chunks, ["icon"])])
+
+
+def language_split():
+    chunks = [spec(2, [0, 0x4]),
+              type_chunk(2, config(b"de"), {0: simple(0, STRING, 0), 1: simple(1, STRING, 1)}, 2)]
+    return table(["Beispiel", "Titel"], [package(chunks, ["app_name", "title"])])
+
+
+def by_config(pkg, tid):
+    """{language, density or "" (default config): entries} of a type."""
+    out = {}
+    for t in pkg["typesById"][tid]:
+        language = t["config"][8:10].rstrip(b"\0").decode()
+        out[language or struct.unpack_from("<H", t["config"], 14)[0] or ""] = t["entries"]
+    return out
+
+
+@pytest.mark.parametrize("utf8", [True, False])
+def test_parse(utf8):
+    t = ArscMerger(base_table(utf8))
+    assert t.utf8 == utf8
+    pkg, = t.packages
+    assert (pkg["id"], pkg["name"], pkg["types"]) == (0x7F, "com.example", TYPES)
+    assert pkg["specs"] == {1: [0x100], 2: [0, 0x4], 3: [0]}
+    strings = by_config(pkg, 2)
+    assert strings[""][0] == {"flags": 0, "key": "app_name", "value": (STRING, ("Example", ()))}
+    assert strings[""][1]["value"] == (STRING, ("Bold text", (("b", 0, 3),)))
+    assert list(strings["fr"]) == [1] and strings["fr"][1]["value"] == (STRING, ("Titre", ()))
+    style, = pkg["typesById"][3]
+    assert style["entries"][0] == {"flags": 0, "key": "AppTheme", "parent": 0x01030005,
+                                   "items": [(0x01010000, INT_DEC, 5), (0x7F020000, STRING, ("Example", ()))]}
+
+
+@pytest.mark.parametrize("utf8", [True, False])
+def test_write_round_trip(utf8):
+    t = ArscMerger(base_table(utf8))
+    out = t.to_bytes()
+    again = ArscMerger(out)
+    assert again.utf8 == utf8
+    assert again.packages == t.packages
+    assert again.to_bytes() == out
+
+
+def test_parse_rejects_garbage():
+    with pytest.raises(ArscError):
+        ArscMerger(b"\x03\x00\x08\x00\x10\x00\x00\x00" + b"\0" * 8)
+    with pytest.raises(ArscError):
+        ArscMerger(base_table()[:400])
+
+
+def test_merge_config_splits():
+    t = ArscMerger(base_table())
+    assert t.merge(ArscMerger(density_split())) == {"packages": 0, "configs": 1, "entries": 1, "conflicts": 0}
+    assert t.merge(ArscMerger(language_split())) == {"packages": 0, "configs": 1, "entries": 2, "conflicts": 0}
+    pkg, = ArscMerger(t.to_bytes()).packages
+    drawables = by_config(pkg, 1)
+    assert drawables[320][0]["value"] == (STRING, ("res/drawable-xhdpi-v4/icon.png", ()))
+    assert drawables[""][0]["value"] == (STRING, ("res/drawable/icon.png", ()))
+    strings = by_config(pkg, 2)
+    assert set(strings) == {"", "fr", "de"}
+    assert strings["de"][0] == {"flags": 0, "key": "app_name", "value": (STRING, ("Beispiel", ()))}
+    assert strings[""][1]["value"] == (STRING, ("Bold text", (("b", 0, 3),)))
+
+
+def test_merge_adds_entries_and_counts_conflicts():
+    t = ArscMerger(base_table())
+    chunks = [spec(2, [0, 0x4, 0]),
+              type_chunk(2, config(), {0: simple(0, STRING, 0), 2: simple(1, STRING, 1)}, 3)]
+    stats = t.merge(ArscMerger(table(["Other", "New"], [package(chunks, ["app_name", "extra"])])))
+    assert stats == {"packages": 0, "configs": 0, "entries": 1, "conflicts": 1}
+    pkg, = ArscMerger(t.to_bytes()).packages
+    assert pkg["specs"][2] == [0, 0x4, 0]
+    default = by_config(pkg, 2)[""]
+    assert default[0]["value"] == (STRING, ("Example", ()))  # the base wins
+    assert default[2] == {"flags": 0, "key": "extra", "value": (STRING, ("New", ()))}
+
+
+def test_merge_keeps_other_packages():
+    t = ArscMerger(base_table())
+    chunks = [spec(1, [0]), type_chunk(1, config(), {0: simple(0, STRING, 0)}, 1)]
+    assert t.merge(ArscMerger(table(["x"], [package(chunks, ["k"], pkg_id=0x80)])))["packages"] == 1
+    assert [p["id"] for p in ArscMerger(t.to_bytes()).packages] == [0x7F, 0x80]
+
+
+def test_merge_rejects_mismatched_types():
+    chunks = [spec(1, [0]), type_chunk(1, config(), {0: simple(0, STRING, 0)}, 1)]
+    split = ArscMerger(table(["x"], [package(chunks, ["k"], types=["string"])]))
+    with pytest.raises(ArscError, match="type 0x01"):
+        ArscMerger(base_table()).merge(split)
+
+
+def write_apk(path, entries):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data, stored in entries:
+            zf.writestr(zipfile.ZipInfo(name, (2020, 1, 1, 0, 0, 0)), data,
+                        compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    return str(path)
+
+
+@pytest.fixture
+def apk_set(tmp_path):
+    base = write_apk(tmp_path / "base.apk", [
+        ("AndroidManifest.xml", b"base manifest", False),
+        ("classes.dex", b"dex\n035\0base", False),
+        ("resources.arsc", base_table(), True),
+        ("res/drawable/icon.png", b"png", True),
+        ("assets/data.bin", b"asset", False),
+        ("META-INF/MANIFEST.MF", b"Manifest-Version: 1.0\n", False),
+        ("META-INF/CERT.RSA", b"sig", False),
+    ])
+    density = write_apk(tmp_path / "split_config.xhdpi.apk", [
+        ("AndroidManifest.xml", b"split manifest", False),
+        ("resources.arsc", density_split(), True),
+        ("res/drawable-xhdpi-v4/icon.png", b"png2", True),
+        ("META-INF/CERT.SF", b"sig", False),
+    ])
+    abi = write_apk(tmp_path / "split_config.arm64_v8a.apk", [
+        ("AndroidManifest.xml", b"split manifest", False),
+        ("lib/arm64-v8a/libapp.so", b"\x7fELF" + b"\0" * 64, True),
+    ])
+    return base, [density, abi]
+
+
+def test_merge_apks(apk_set, tmp_path):
+    base, splits = apk_set
+    out = str(tmp_path / "merged.apk")
+    stats = ArscMerger.merge_apks(base, splits, out, skip_prefixes=("assets/",))
+    assert stats["configs"] == 1
+    with zipfile.ZipFile(out) as zf:
+        names = zf.namelist()
+        assert sorted(names) == ["AndroidManifest.xml", "classes.dex", "lib/arm64-v8a/libapp.so",
+                                 "res/drawable-xhdpi-v4/icon.png", "res/drawable/icon.png", "resources.arsc"]
+        assert zf.read("AndroidManifest.xml") == b"base manifest"
+        assert zf.getinfo("resources.arsc").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("lib/arm64-v8a/libapp.so").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("classes.dex").compress_type == zipfile.ZIP_DEFLATED
+        assert len(by_config(ArscMerger(zf.read("resources.arsc")).packages[0], 1)) == 2
+
+
+@pytest.mark.parametrize("dex", ["classes.dex", "classes2.dex"])
+def test_merge_apks_refuses_code_splits(apk_set, tmp_path, dex):
+    base, splits = apk_set
+    feature = write_apk(tmp_path / "split_feature.apk", [
+        ("AndroidManifest.xml", b"feature manifest", False),
+        (dex, b"dex\n035\0feature", False),
+        ("resources.arsc", language_split(), True),
+    ])
+    with pytest.raises(ArscError, match="carries code"):
+        ArscMerger.merge_apks(base, splits + [feature], str(tmp_path / "merged.apk"))
+    with pytest.raises(arsc_merge.ArscMergeError, match="carries code"):
+        arsc_merge.mergeSplitAPKsBinary(base, splits + [feature], str(tmp_path / "merged2.apk"))
+
+
+@pytest.mark.parametrize("utf8", [True, False])
+def test_package_tables_round_trip(utf8):
+    # ArscMerger wraps the package's parser and writer; the dict form must survive a write
+    data = base_table(utf8)
+    parsed = arsc_merge.parseResourceTable(data)
+    assert parsed["packages"] == ArscMerger(data).packages
+    assert arsc_merge.parseResourceTable(arsc_merge.writeResourceTable(parsed)) == parsed
+
+
+def test_package_merge_apks(apk_set, tmp_path):
+    base, splits = apk_set
+    reported = []
+    totals = arsc_merge.mergeSplitAPKsBinary(base, splits, str(tmp_path / "a.apk"),
+                                             report=lambda split, stats: reported.append(split))
+    assert [os.path.basename(s) for s in reported] == ["split_config.xhdpi.apk"]  # the ABI split has no table
+    assert totals == ArscMerger.merge_apks(base, splits, str(tmp_path / "b.apk"))
+    with zipfile.ZipFile(tmp_path / "a.apk") as a, zipfile.ZipFile(tmp_path / "b.apk") as b:
+        assert sorted(a.namelist()) == sorted(b.namelist())
+        assert a.read("resources.arsc") == b.read("resources.arsc")
@@ -0,0 +1,140 @@
+import http.client, json, threading, zipfile
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import BuildWorker as bw
+from BuildWorker import BuildWorker, WorkerPool, WorkerError
+
+
+def fake_rebuild(paths, options, verbose=False):
+    """Stands in for apktool: the "rebuilt" APK is the inputs concatenated."""
+    out = paths[0] + ".rebuilt"
+    with open(out, "wb") as fh:
+        for p in paths:
+            with open(p, "rb") as src:
+                fh.write(src.read())
+    return SimpleNamespace(apk_path=out, cleanup=lambda: None)
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    monkeypatch.delenv("PATCHAPK_WORKER_TOKEN", raising=False)
+    monkeypatch.setattr(BuildWorker, "rebuild", staticmethod(fake_rebuild))
+    started = []
+    for n in range(2):
+        worker = BuildWorker(jobs=1, root=str(tmp_path / f"blobs{n}"))
+        worker.received = []
+        receive = worker._receive
+        worker._receive = lambda sha, *a, w=worker, r=receive: w.received.append(sha) or r(sha, *a)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), bw._WorkerHandler)
+        server.daemon_threads, server.worker = True, worker
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        worker.address = f"127.0.0.1:{server.server_address[1]}"
+        started.append((worker, server))
+    yield [w for w, _ in started]
+    for _, server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def apk(path, payload):
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("classes.dex", payload)
+    return str(path)
+
+
+def expected(paths):
+    return b"".join(open(p, "rb").read() for p in paths)
+
+
+def test_rebuilds_spread_over_workers(workers, tmp_path, monkeypatch):
+    a, b = workers
+    inputs = [apk(tmp_path / "base.apk", b"base"), apk(tmp_path / "split_config.arm64_v8a.apk", b"split")]
+    barrier = threading.Barrier(2, timeout=10)
+
+    def rebuild(paths, options, verbose=False):
+        barrier.wait()  # both jobs at once: only possible on two workers with one slot each
+        return fake_rebuild(paths, options)
+
+    monkeypatch.setattr(BuildWorker, "rebuild", staticmethod(rebuild))
+    pool = WorkerPool([a.address, b.address])
+    threads = [threading.Thread(target=pool.rebuild, args=(inputs, {}, str(tmp_path / f"out{n}.apk")))
+               for n in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for n in range(2):
+        assert (tmp_path / f"out{n}.apk").read_bytes() == expected(inputs)
+    assert len(a.received) == len(b.received) == 2
+
+    monkeypatch.setattr(BuildWorker, "rebuild", staticmethod(fake_rebuild))
+    pool.rebuild(inputs, {}, str(tmp_path / "again.apk"))
+    assert len(a.received) + len(b.received) == 4  # inputs already there: nothing uploaded
+
+
+def test_evicted_input_is_uploaded_again(workers, tmp_path):
+    worker = workers[0]
+    inputs = [apk(tmp_path / "base.apk", b"base")]
+    run_job, calls = worker._run_job, []
+
+    def evict_first(job_inputs, options):
+        if not calls:
+            worker._blob(job_inputs[0]["sha256"]).unlink()
+        calls.append(1)
+        return run_job(job_inputs, options)
+
+    worker._run_job = evict_first
+    WorkerPool([worker.address]).rebuild(inputs, {}, str(tmp_path / "out.apk"))
+    assert len(calls) == 2 and len(worker.received) == 2
+    assert (tmp_path / "out.apk").read_bytes() == expected(inputs)
+
+
+def test_running_job_inputs_are_pinned(workers, tmp_path, monkeypatch):
+    worker = workers[0]
+    inputs = [apk(tmp_path / "base.apk", b"base")]
+    sha = BuildWorker.file_sha256(inputs[0])
+
+    def rebuild(paths, options, verbose=False):
+        worker.max_bytes = 0
+        worker._evict()
+        assert worker._blob(sha).is_file()
+        return fake_rebuild(paths, options)
+
+    monkeypatch.setattr(BuildWorker, "rebuild", staticmethod(rebuild))
+    WorkerPool([worker.address]).rebuild(inputs, {}, str(tmp_path / "out.apk"))
+    worker._evict()
+    assert not worker._blob(sha).exists()
+
+
+def test_corrupt_download_is_rejected(workers, tmp_path):
+    worker = workers[0]
+    run_job = worker._run_job
+
+    def corrupt(job_inputs, options):
+        result = run_job(job_inputs, options)
+        with open(worker._blob(result["output"]), "ab") as fh:
+            fh.write(b"tampered")
+        return result
+
+    worker._run_job = corrupt
+    with pytest.raises(WorkerError, match="corrupt"):
+        WorkerPool([worker.address]).rebuild([apk(tmp_path / "base.apk", b"base")], {}, str(tmp_path / "out.apk"))
+    assert list(tmp_path.glob("out.apk*")) == []
+
+
+@pytest.mark.parametrize("names", [["base.apk", ""], ["base.apk", ".."], ["../../.", "x.apk"],
+                                   ["base.apk", "a/base.apk"], ["base.apk", None]])
+def test_bad_input_names_are_rejected(workers, names):
+    worker = workers[0]
+    worker._run_job = lambda inputs, options: pytest.fail("job ran")
+    inputs = [{"sha256": "0" * 64, "name": name} for name in names]
+    host, port = worker.address.split(":")
+    conn = http.client.HTTPConnection(host, int(port), timeout=5)
+    conn.request("POST", "/jobs", json.dumps({"inputs": inputs}), {"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    assert resp.status == 400
+    assert "name" in json.loads(resp.read())["error"]
+    conn.close()
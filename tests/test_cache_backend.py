@@ -0,0 +1,163 @@
+import os, stat, threading, time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import CacheBackend as cb
+from ApkVerifier import ApkVerifier, ApkVerifyError
+from CacheBackend import CacheBackend, CacheBackendError, CacheServer, HttpCacheBackend
+from ResultCache import ResultCache
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.delenv("PATCHAPK_REMOTE_CACHE_TOKEN", raising=False)
+    monkeypatch.setenv("PATCHAPK_CACHE_DIR", str(tmp_path / "cache"))
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), cb._CacheHandler)
+    srv.daemon_threads = True
+    srv.cache = CacheServer(root=str(tmp_path / "store"))
+    threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def blob(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_round_trip_and_miss(server, tmp_path):
+    remote = HttpCacheBackend(server.url)
+    remote.put("results", "k1", blob(tmp_path, "a", b"result"))
+    assert remote.get("results", "k1", str(tmp_path / "out"))
+    assert (tmp_path / "out").read_bytes() == b"result"
+    assert not remote.get("results", "k2", str(tmp_path / "none"))
+    assert not (tmp_path / "none").exists()
+
+
+def test_upload_must_match_its_digest(server, tmp_path):
+    remote = HttpCacheBackend(server.url)
+    with pytest.raises(CacheBackendError, match="HTTP 400"):
+        remote._put("results", "k1", blob(tmp_path, "a", b"result"), "0" * 64)
+    assert not remote._exists("results", "k1")
+
+
+def test_tampered_object_is_not_used(server, tmp_path):
+    remote = HttpCacheBackend(server.url)
+    remote.put("gadgets", "k1", blob(tmp_path, "a", b"gadget"))
+    (server.cache.store.root / "gadgets" / "k1").write_bytes(b"evil")
+    assert not remote.get("gadgets", "k1", str(tmp_path / "out"))
+    assert not (tmp_path / "out").exists()
+
+
+def test_token_is_enforced(server, tmp_path, monkeypatch):
+    server.cache.token = "secret"
+    assert not HttpCacheBackend(server.url)._exists("results", "k1")
+    with pytest.raises(CacheBackendError, match="HTTP 403"):
+        HttpCacheBackend(server.url).put("results", "k1", blob(tmp_path, "a", b"x"))
+    monkeypatch.setenv("PATCHAPK_REMOTE_CACHE_TOKEN", "secret")
+    HttpCacheBackend(server.url).put("results", "k1", blob(tmp_path, "a", b"x"))
+    assert HttpCacheBackend(server.url)._exists("results", "k1")
+
+
+def test_store_evicts_least_recently_used(server, tmp_path):
+    store = server.cache.store
+    store.max_bytes = 2500
+    remote = HttpCacheBackend(server.url)
+    for age, key in ((200, "old"), (100, "unused")):
+        remote.put("trees", key, blob(tmp_path, key, os.urandom(1000)))
+        os.utime(store.root / "trees" / key, (time.time() - age,) * 2)
+    assert remote.get("trees", "old", str(tmp_path / "hit"))  # a download makes it the newest
+    remote.put("trees", "new", blob(tmp_path, "new", os.urandom(1000)))
+    left = sorted(p.name for p in (store.root / "trees").iterdir())
+    assert left == ["new", "new.sha256", "old", "old.sha256"]
+
+
+def test_result_cache_checks_remote_hits(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCHAPK_REMOTE_CACHE", server.url)
+    HttpCacheBackend(server.url).put("results", "k" * 64, blob(tmp_path, "apk", b"remote apk"))
+    cache = ResultCache(root=str(tmp_path / "results"))
+    dest = str(tmp_path / "final.apk")
+
+    assert not cache.fetch("k" * 64, dest)  # nothing to check it with: the remote isn't asked
+
+    def reject(path):
+        raise ApkVerifyError("not ours")
+
+    assert not cache.fetch("k" * 64, dest, verify_remote=reject)
+    assert not os.path.exists(dest) and not list((tmp_path / "results").iterdir())
+
+    seen = []
+    assert cache.fetch("k" * 64, dest, verify_remote=seen.append)
+    assert open(dest, "rb").read() == b"remote apk" and len(seen) == 1
+    assert cache.fetch("k" * 64, dest)  # now a local entry
+
+
+def fake_apksigner(tmp_path, monkeypatch, output, rc=0):
+    bindir = tmp_path / "bin"
+    bindir.mkdir(exist_ok=True)
+    tool = bindir / "apksigner"
+    tool.write_text(f"#!/bin/sh\ncat <<'EOF'\n{output}\nEOF\nexit {rc}\n")
+    tool.chmod(tool.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.mark.skipif(os.name == "nt", reason="shell script stand-in for apksigner")
+def test_check_signer(tmp_path, monkeypatch):
+    ours, theirs = "ab" * 32, "cd" * 32
+    fake_apksigner(tmp_path, monkeypatch, f"Signer #1 certificate DN: CN=patchapk\n"
+                                          f"Signer #1 certificate SHA-256 digest: {ours}")
+    ApkVerifier.check_signer("app.apk", ours)
+    with pytest.raises(ApkVerifyError, match="not by the local key"):
+        ApkVerifier.check_signer("app.apk", theirs)
+    fake_apksigner(tmp_path, monkeypatch, "DOES NOT VERIFY", rc=1)
+    with pytest.raises(ApkVerifyError, match="failed apksigner verify"):
+        ApkVerifier.check_signer("app.apk", ours)
+
+
+def test_tree_is_archived_on_the_upload_thread(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCHAPK_CACHE_DIR", str(tmp_path / "cache"))
+    from APK import APK
+    from CacheBackend import LocalDirCacheBackend
+    from Materializer import Materializer
+
+    apk = APK.__new__(APK)
+    apk.verbose, apk.workdir = False, str(tmp_path / "work")
+    apk.decoded = os.path.join(apk.workdir, "apk_decoded")
+    os.makedirs(os.path.join(apk.decoded, "smali"))
+    manifest = os.path.join(apk.decoded, "AndroidManifest.xml")
+    with open(manifest, "w") as fh:
+        fh.write("<manifest/>")
+
+    remote = LocalDirCacheBackend(str(tmp_path / "store"))
+    threads = []
+    build = remote.put_async_built
+    monkeypatch.setattr(remote, "put_async_built",
+                        lambda ns, key, fn: build(ns, key, lambda: threads.append(threading.current_thread()) or fn()))
+    apk._publish_tree(remote, "k.tgz")
+    # The job patches its tree right away; the published snapshot keeps the decoded state
+    Materializer.unshare(manifest)
+    with open(manifest, "w") as fh:
+        fh.write("<manifest patched/>")
+    assert remote.drain(10)
+    assert threads and threads[0] is not threading.main_thread()
+    assert not os.path.exists(os.path.join(apk.workdir, ".__tree_publish"))
+
+    restored = APK.__new__(APK)
+    restored.verbose, restored.workdir = False, str(tmp_path / "other")
+    restored.apk_path = "app.apk"
+    restored.decoded = os.path.join(restored.workdir, "apk_decoded")
+    os.makedirs(restored.workdir)
+    assert restored._restore_tree(remote, "k.tgz")
+    with open(os.path.join(restored.decoded, "AndroidManifest.xml")) as fh:
+        assert fh.read() == "<manifest/>"
+
+
+def test_trees_are_not_shared_without_opt_in(monkeypatch):
+    monkeypatch.delenv("PATCHAPK_REMOTE_CACHE_TREES", raising=False)
+    assert not CacheBackend.share_trees()
+    monkeypatch.setenv("PATCHAPK_REMOTE_CACHE_TREES", "1")
+    assert CacheBackend.share_trees()
@@ -0,0 +1,65 @@
+import os, zipfile
+
+import pytest
+
+from APK import APK, APKError
+from test_arsc_merger import base_table, package, table
+
+
+def build_split(path, entries):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+ABI_SPLIT = {
+    "AndroidManifest.xml": b"manifest",
+    "lib/arm64-v8a/libapp.so": b"\x7fELF" + b"\0" * 100,
+    "lib/arm64-v8a/libother.so": b"\x7fELF" + b"\1" * 100,
+    "assets/levels/1.bin": b"level",
+    "META-INF/CERT.RSA": b"signature",
+    "stamp-cert-sha256": b"stamp",
+}
+
+
+@pytest.mark.parametrize("extra,expected", [
+    ({}, True),
+    ({"resources.arsc": table([], [package([], [])])}, True),
+    ({"resources.arsc": base_table()}, False),
+    ({"resources.arsc": b"\0garbage"}, False),
+    ({"res/drawable-xhdpi-v4/icon.png": b"png"}, False),
+    ({"classes.dex": b"dex"}, False),
+])
+def test_is_content_only_split(tmp_path, extra, expected):
+    path = build_split(tmp_path / "split.apk", {**ABI_SPLIT, **extra})
+    assert APK._is_content_only_split(path) == expected
+
+
+def test_needs_content(tmp_path):
+    assert not APK._is_content_only_split(build_split(tmp_path / "empty.apk", {"AndroidManifest.xml": b"m"}))
+    junk = tmp_path / "junk.apk"
+    junk.write_bytes(b"not a zip")
+    assert not APK._is_content_only_split(str(junk))
+    assert not APK._is_content_only_split(str(tmp_path / "missing.apk"))
+
+
+def test_extract_split_content(tmp_path):
+    path = build_split(tmp_path / "split.apk", ABI_SPLIT)
+    dest = tmp_path / "decoded"
+    assert APK._extract_split_content(path, str(dest)) == 3
+    assert (dest / "lib" / "arm64-v8a" / "libapp.so").read_bytes() == ABI_SPLIT["lib/arm64-v8a/libapp.so"]
+    assert (dest / "assets" / "levels" / "1.bin").read_bytes() == b"level"
+    # The manifest and signature stay behind
+    assert sorted(os.listdir(dest)) == ["assets", "lib"]
+
+    skipped = tmp_path / "skipped"
+    assert APK._extract_split_content(path, str(skipped), skip_prefixes=("assets/",)) == 2
+    assert sorted(os.listdir(skipped)) == ["lib"]
+
+
+def test_extract_refuses_to_escape(tmp_path):
+    path = build_split(tmp_path / "evil.apk", {"lib/../../evil.so": b"x"})
+    with pytest.raises(APKError, match="outside"):
+        APK._extract_split_content(path, str(tmp_path / "decoded"))
+    assert not (tmp_path / "evil.so").exists()
@@ -0,0 +1,69 @@
+import subprocess
+from types import SimpleNamespace
+
+from DeviceSnapshot import DeviceSnapshot
+from patch_apk.utils import device_snapshot
+
+OUTPUT = """@@patchapk sdk
+34
+@@patchapk abis
+arm64-v8a,armeabi-v7a
+@@patchapk users
+Users:
+	UserInfo{0:Owner:c13} running
+@@patchapk packages 0
+package:/data/app/~~x==/com.app-1/base.apk=com.app versionCode:42 uid:10123
+package:/system/app/Foo/Foo.apk=com.foo versionCode:1 uid:1000
+@@patchapk dir /data/app/~~x==/com.app-1
+base.apk
+split_config.arm64_v8a.apk
+lib
+@@patchapk dir /data/app/~~y==/com.gone-1
+ls: /data/app/~~y==/com.gone-1: No such file or directory
+"""
+
+
+def test_one_script():
+    assert DeviceSnapshot.SCRIPT is device_snapshot.SNAPSHOT_SCRIPT
+    assert DeviceSnapshot.SCRIPT.endswith("echo @@patchapk end")
+
+
+def test_failed_last_ls_keeps_the_snapshot():
+    snap = DeviceSnapshot.capture(lambda script: OUTPUT + "@@patchapk end\n")
+    assert snap.sdk == 34 and snap.abis == ["arm64-v8a", "armeabi-v7a"] and snap.users == ["0"]
+    assert snap.apk_paths("com.app", "0") == ["/data/app/~~x==/com.app-1/base.apk",
+                                              "/data/app/~~x==/com.app-1/split_config.arm64_v8a.apk"]
+    assert snap.apk_paths("com.foo", "0") == ["/system/app/Foo/Foo.apk"]
+    assert snap.info("com.app", "0")["version_code"] == 42
+
+
+def test_cut_short_output_is_discarded():
+    assert DeviceSnapshot.capture(lambda script: OUTPUT) is None
+
+
+def test_package_snapshot_is_cached_per_serial(monkeypatch):
+    calls = []
+
+    def run(cmd, stdout=None, stderr=None):
+        calls.append(cmd[:-1])
+        # The last ls failed: adb passes its exit status through
+        return SimpleNamespace(returncode=1, stdout=(OUTPUT + "@@patchapk end\n").encode())
+
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(device_snapshot, "_snapshots", {})
+    monkeypatch.delenv("ANDROID_SERIAL", raising=False)
+    first = device_snapshot.getDeviceSnapshot()
+    assert first is not None and first["complete"]
+    assert device_snapshot.getDeviceSnapshot() is first
+    monkeypatch.setenv("ANDROID_SERIAL", "emulator-5556")
+    other = device_snapshot.getDeviceSnapshot()
+    assert other is not first
+    assert device_snapshot.getDeviceSnapshot("emulator-5556") is other
+    assert calls == [["adb", "shell"], ["adb", "-s", "emulator-5556", "shell"]]
+    assert device_snapshot.snapshotAPKPaths(other, "com.app", "0")[0].endswith("base.apk")
+
+
+def test_package_snapshot_cut_short(monkeypatch):
+    monkeypatch.setattr(subprocess, "run", lambda cmd, **kw: SimpleNamespace(returncode=0, stdout=OUTPUT.encode()))
+    monkeypatch.setattr(device_snapshot, "_snapshots", {})
+    assert device_snapshot.getDeviceSnapshot("serial") is None
@@ -0,0 +1,89 @@
+import struct, zipfile
+
+import pytest
+
+from APK import APK
+from BuildWorker import BuildWorker
+from DexIndex import DexIndex, DexError
+
+
+def build_dex(classes, extra_types=()):
+    """A minimal dex: header, string_ids, type_ids and class_defs for the given class names."""
+    descriptors = sorted({DexIndex.descriptor(c) for c in [*classes, *extra_types]})
+    string_ids_off = 0x70
+    type_ids_off = string_ids_off + 4 * len(descriptors)
+    class_defs_off = type_ids_off + 4 * len(descriptors)
+    data_off = class_defs_off + 32 * len(classes)
+
+    string_data, offsets = b"", []
+    for d in descriptors:
+        offsets.append(data_off + len(string_data))
+        string_data += bytes([len(d)]) + d + b"\0"
+    type_idx = {d: i for i, d in enumerate(descriptors)}  # string i is type i
+
+    header = bytearray(b"dex\n035\0" + b"\0" * (0x70 - 8))
+    struct.pack_into("<4I", header, 0x38, len(descriptors), string_ids_off, len(descriptors), type_ids_off)
+    struct.pack_into("<2I", header, 0x60, len(classes), class_defs_off)
+    body = struct.pack(f"<{len(offsets)}I", *offsets)
+    body += struct.pack(f"<{len(descriptors)}I", *range(len(descriptors)))
+    for c in classes:
+        body += struct.pack("<I", type_idx[DexIndex.descriptor(c)]) + b"\0" * 28
+    return bytes(header) + body + string_data
+
+
+@pytest.fixture
+def dexes(tmp_path):
+    (tmp_path / "classes.dex").write_bytes(build_dex(["com.app.Main", "com.app.Util"], ["java.lang.Object"]))
+    # Referenced (a type id) but defined elsewhere
+    (tmp_path / "classes2.dex").write_bytes(build_dex(["com.app.App", "com.lib.Helper"], ["com.app.Main"]))
+    (tmp_path / "classes10.dex").write_bytes(build_dex(["z.Last"]))
+    (tmp_path / "notes.txt").write_text("not a dex")
+    return DexIndex.dex_files(str(tmp_path))
+
+
+def test_dex_files_in_load_order(dexes):
+    assert [p.rsplit("/", 1)[-1] for p in dexes] == ["classes.dex", "classes2.dex", "classes10.dex"]
+
+
+def test_find_class_hit(dexes):
+    assert DexIndex.find_class(dexes, "com.app.App") == dexes[1]
+    assert DexIndex.find_class(dexes, "Lcom/app/Main;") == dexes[0]
+    assert DexIndex.find_class(dexes, "z.Last") == dexes[2]
+
+
+def test_find_class_miss(dexes):
+    assert DexIndex.find_class(dexes, "com.app.Missing") is None
+    # A type id without a class_def is a reference, not a definition
+    assert DexIndex.find_class(dexes, "java.lang.Object") is None
+
+
+def test_truncated_or_corrupt_header(tmp_path):
+    data = build_dex(["com.app.App"])
+    with pytest.raises(DexError, match="not a dex"):
+        DexIndex.defines(data[:0x40], DexIndex.descriptor("com.app.App"))
+    with pytest.raises(DexError, match="not a dex"):
+        DexIndex.defines(b"zip\n" + data[4:], DexIndex.descriptor("com.app.App"))
+    # The header points past the end of the file
+    bad = bytearray(data)
+    struct.pack_into("<I", bad, 0x3C, len(data) + 0x1000)
+    with pytest.raises(DexError, match="truncated"):
+        DexIndex.defines(bytes(bad), DexIndex.descriptor("com.app.App"))
+
+
+def test_no_gadget_skips_baksmali(tmp_path, monkeypatch):
+    src = tmp_path / "app.apk"
+    with zipfile.ZipFile(src, "w") as zf:
+        zf.writestr("classes.dex", build_dex(["com.app.App"]))
+    monkeypatch.setattr(APK, "_apktool", lambda self, args, ok_required=False: None)
+    smalied = []
+    monkeypatch.setattr(APK, "_smali_app_dex", lambda self: smalied.append(self.apk_path))
+
+    APK(str(src), workdir=str(tmp_path / "a"), single_dex=True, smali_app=False).disassemble()
+    assert smalied == []
+    APK(str(src), workdir=str(tmp_path / "b"), single_dex=True).disassemble()
+    assert smalied == [str(src)]
+
+    monkeypatch.setattr(APK, "disassemble", lambda self: smalied.append(self.smali_app))
+    BuildWorker.decode([str(src)], {"frida_gadget": False})
+    BuildWorker.decode([str(src)], {"frida_gadget": True})
+    assert smalied[1:] == [False, True]
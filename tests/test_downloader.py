@@ -0,0 +1,134 @@
+import json, os, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Downloader import Downloader, DownloadError
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def _respond(self, body):
+        srv = self.server
+        data, etag = srv.data, srv.etag
+        srv.log.append((self.command, self.headers.get("Range"), self.headers.get("If-Range")))
+        start, end, status = 0, len(data) - 1, 200
+        m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if m and srv.ranges and self.headers.get("If-Range") in (None, etag):
+            start, status = int(m.group(1)), 206
+            end = int(m.group(2)) if m.group(2) else end
+        chunk = data[start:end + 1]
+        if body and srv.truncate_once and status == 200:
+            srv.truncate_once = False
+            chunk = chunk[:len(chunk) // 3]
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        if srv.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        if body:
+            try:
+                self.wfile.write(chunk)
+            except OSError:
+                pass
+        if len(chunk) != end - start + 1:
+            self.close_connection = True
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.daemon_threads = True
+    srv.data, srv.etag, srv.ranges, srv.truncate_once, srv.log = os.urandom(300 * 1024), '"v1"', True, False, []
+    threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}/app.apk"
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def gets(srv):
+    return [entry for entry in srv.log if entry[0] == "GET"]
+
+
+def test_plain_download(server, tmp_path):
+    dest = tmp_path / "app.apk"
+    assert Downloader().fetch(server.url, str(dest)) == len(server.data)
+    assert dest.read_bytes() == server.data
+    assert not (tmp_path / "app.apk.part").exists()
+
+
+def test_resumes_partial_download(server, tmp_path):
+    dest = tmp_path / "app.apk"
+    (tmp_path / "app.apk.part").write_bytes(server.data[:1000])
+    (tmp_path / "app.apk.part.json").write_text(json.dumps({"validator": '"v1"'}))
+    Downloader().fetch(server.url, str(dest))
+    assert dest.read_bytes() == server.data
+    assert gets(server) == [("GET", "bytes=1000-", '"v1"')]
+
+
+def test_changed_file_restarts_from_zero(server, tmp_path):
+    dest = tmp_path / "app.apk"
+    (tmp_path / "app.apk.part").write_bytes(b"x" * 1000)
+    (tmp_path / "app.apk.part.json").write_text(json.dumps({"validator": '"v0"'}))
+    Downloader().fetch(server.url, str(dest))
+    assert dest.read_bytes() == server.data
+    assert gets(server) == [("GET", None, None)]
+
+
+def test_retries_with_range_after_connection_drop(server, tmp_path):
+    server.truncate_once = True
+    dest = tmp_path / "app.apk"
+    Downloader().fetch(server.url, str(dest))
+    assert dest.read_bytes() == server.data
+    first, second = gets(server)
+    assert first[1] is None and second[1] == f"bytes={len(server.data) // 3}-" and second[2] == '"v1"'
+
+
+def test_drop_without_range_support_fails(server, tmp_path):
+    server.truncate_once, server.ranges = True, False
+    with pytest.raises(DownloadError):
+        Downloader().fetch(server.url, str(tmp_path / "app.apk"))
+
+
+def test_segmented_download(server, tmp_path):
+    dl = Downloader(segments=4)
+    dl.MIN_SEGMENT = 64 * 1024
+    dest = tmp_path / "app.apk"
+    dl.fetch(server.url, str(dest))
+    assert dest.read_bytes() == server.data
+    ranges = sorted(r for _, r, _ in gets(server))
+    assert len(ranges) == 4 and all(r.startswith("bytes=") for r in ranges)
+
+
+def test_cache_revalidates_etag(server, tmp_path):
+    dl = Downloader(cache_dir=str(tmp_path / "cache"))
+    dl.fetch(server.url, str(tmp_path / "a.apk"))
+    dl.fetch(server.url, str(tmp_path / "b.apk"))
+    assert len(gets(server)) == 1
+    assert (tmp_path / "b.apk").read_bytes() == server.data
+
+    server.data, server.etag = os.urandom(200 * 1024), '"v2"'
+    dl.fetch(server.url, str(tmp_path / "c.apk"))
+    assert len(gets(server)) == 2
+    assert (tmp_path / "c.apk").read_bytes() == server.data
+
+
+def test_cache_is_evicted_past_cap(server, tmp_path):
+    cache = tmp_path / "cache"
+    dl = Downloader(cache_dir=str(cache), max_cache_bytes=len(server.data) + 1)
+    dl.fetch(server.url, str(tmp_path / "a.apk"))
+    dl.fetch(server.url + "?other", str(tmp_path / "b.apk"))
+    assert len(list(cache.glob("*.apk"))) == 1 and len(list(cache.glob("*.json"))) == 1
+    assert (tmp_path / "a.apk").read_bytes() == server.data  # evicting never touches outputs
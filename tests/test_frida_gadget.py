@@ -0,0 +1,115 @@
+import hashlib, json
+
+import pytest
+
+from CacheBackend import CacheBackend
+from FridaGadget import FridaGadget
+
+
+def gadget_bytes(url):
+    return b"\x7fELF" + url.encode()
+
+
+def make_gadgets(root, monkeypatch, digests=False):
+    fg = FridaGadget(cache_root=str(root))
+    downloads = []
+
+    def release(version=None):
+        url = f"https://example.invalid/{version}/arm64.so"
+        asset = {"name": f"frida-gadget-{version}-android-arm64.so", "browser_download_url": url}
+        if digests:
+            asset["digest"] = "sha256:" + hashlib.sha256(gadget_bytes(url)).hexdigest()
+        return {"tag_name": version, "assets": [asset]}
+
+    def download(url, dest):
+        downloads.append(url)
+        dest.write_bytes(gadget_bytes(url))
+
+    monkeypatch.setattr(fg, "fetch_release", release)
+    monkeypatch.setattr(fg, "_download_stream", download)
+    fg.downloads = downloads
+    return fg
+
+
+@pytest.fixture
+def gadgets(tmp_path, monkeypatch):
+    monkeypatch.delenv("PATCHAPK_REMOTE_CACHE", raising=False)
+    monkeypatch.setenv("PATCHAPK_GADGET_CACHE_TAGS", "1")
+    return make_gadgets(tmp_path / "gadgets", monkeypatch)
+
+
+def cached_tags(fg):
+    return sorted(d.name for d in fg.cache_root.iterdir() if d.is_dir())
+
+
+def test_pinned_tag_survives_eviction_until_copied(gadgets, tmp_path):
+    with gadgets.obtained("16.0.0") as tag:
+        assert tag == "16.0.0"
+        # Recorded as used before obtained() returned
+        assert "16.0.0" in json.loads((gadgets.cache_root / "index.json").read_text())["tags"]
+        # Another job needs another tag; the cache only keeps one, but 16.0.0 is pinned
+        assert gadgets.obtain_gadgets("16.0.1") == "16.0.1"
+        assert cached_tags(gadgets) == ["16.0.0", "16.0.1"]
+        copied = gadgets.copy_android_gadgets(tmp_path / "apk", version=tag)
+        assert [p.relative_to(tmp_path / "apk").as_posix() for p in copied] == ["lib/arm64-v8a/libfrida-gadget.so"]
+
+    gadgets.obtain_gadgets("16.0.2")
+    assert cached_tags(gadgets) == ["16.0.2"]
+
+
+def test_cached_tag_is_not_downloaded_again(gadgets):
+    gadgets.obtain_gadgets("16.0.0")
+    with gadgets.obtained("16.0.0"):
+        pass
+    assert len(gadgets.downloads) == 1
+
+
+def test_filling_tag_is_not_evicted(gadgets):
+    gadgets.max_tags = 2
+    gadgets.obtain_gadgets("16.0.0")
+    gadgets.obtain_gadgets("16.0.1")
+    gadgets.max_tags = 1
+    with gadgets._locked("16.0.0"):
+        assert gadgets.evict() == ["16.0.1"]
+    assert cached_tags(gadgets) == ["16.0.0"]
+
+
+@pytest.fixture
+def shared_store(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCHAPK_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("PATCHAPK_REMOTE_CACHE", str(tmp_path / "store"))
+    return tmp_path / "store" / "gadgets"
+
+
+def fill(root, monkeypatch, digests=True):
+    fg = make_gadgets(root, monkeypatch, digests=digests)
+    fg.obtain_gadgets("16.0.0")
+    assert CacheBackend.shared().drain(10)
+    return fg
+
+
+def gadget_so(fg):
+    return (fg.cache_root / "16.0.0" / "arm64-v8a" / "libfrida-gadget.so").read_bytes()
+
+
+def test_remote_gadget_matching_release_digest_is_used(shared_store, tmp_path, monkeypatch):
+    fill(tmp_path / "host-a", monkeypatch)
+    host_b = fill(tmp_path / "host-b", monkeypatch)
+    assert host_b.downloads == []
+    assert gadget_so(host_b) == gadget_bytes("https://example.invalid/16.0.0/arm64.so")
+
+
+def test_tampered_remote_gadget_is_ignored(shared_store, tmp_path, monkeypatch):
+    fill(tmp_path / "host-a", monkeypatch)
+    # Whoever can write to the store also writes the backend's digest
+    evil = b"\x7fELF evil"
+    (shared_store / "frida-gadget-16.0.0-android-arm64.so").write_bytes(evil)
+    (shared_store / "frida-gadget-16.0.0-android-arm64.so.sha256").write_text(hashlib.sha256(evil).hexdigest())
+    host_b = fill(tmp_path / "host-b", monkeypatch)
+    assert len(host_b.downloads) == 1
+    assert gadget_so(host_b) == gadget_bytes("https://example.invalid/16.0.0/arm64.so")
+
+
+def test_gadget_without_release_digest_is_not_shared(shared_store, tmp_path, monkeypatch):
+    fill(tmp_path / "host-a", monkeypatch, digests=False)
+    assert not shared_store.exists()
@@ -0,0 +1,26 @@
+import os, subprocess, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Network, TLS, server and download stacks: none of them is needed to print usage
+HEAVY = {"requests", "termcolor", "ssl", "http.client", "http.server", "email.parser", "urllib.request",
+         "concurrent.futures", "xml.etree.ElementTree", "packaging", "progress"}
+
+
+def imported_modules(*args, **env):
+    cp = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=ROOT, capture_output=True, text=True,
+                        env={**os.environ, **env}, timeout=60)
+    assert cp.returncode == 0, cp.stderr
+    assert "usage:" in cp.stdout
+    return {line.rpartition("|")[2].strip() for line in cp.stderr.splitlines() if line.startswith("import time:")}
+
+
+@pytest.mark.parametrize("args, env", [
+    (("patch-apk.py", "--help"), {}),
+    (("-c", "import sys; sys.argv[0] = 'patch-apk'; from patch_apk.main import main; main()", "--help"),
+     {"PYTHONPATH": os.path.join(ROOT, "src")}),
+], ids=["script", "package"])
+def test_help_skips_heavy_imports(args, env):
+    assert imported_modules(*args, **env) & HEAVY == set()
@@ -0,0 +1,92 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from Manifest import Manifest, ManifestError
+from Materializer import Materializer
+
+NS = "{http://schemas.android.com/apk/res/android}"
+
+SOURCE = """<?xml version="1.0" encoding="utf-8" standalone="no"?>
+<manifest xmlns:android="http://schemas.android.com/apk/res/android"
+          xmlns:dist="http://schemas.android.com/apk/distribution"
+          package="com.app" android:isSplitRequired="true" android:requiredSplitTypes="base__abi">
+    <dist:module dist:instant="false"/>
+    <uses-permission android:name="android.permission.CAMERA"/>
+    <application android:label="App" android:isSplitRequired="true" android:testOnly="true">
+        <meta-data android:name="com.android.vending.splits.required" android:value="true"/>
+        <meta-data android:name="com.android.vending.splits" android:resource="@xml/splits0"/>
+        <meta-data android:name="keep.me" android:value="1"/>
+    </application>
+</manifest>
+"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    p = tmp_path / "AndroidManifest.xml"
+    p.write_text(SOURCE)
+    return str(p)
+
+
+def test_edits_are_written_once(path, monkeypatch):
+    writes = []
+    real_write = ET.ElementTree.write
+    monkeypatch.setattr(ET.ElementTree, "write", lambda self, *a, **kw: writes.append(a) or real_write(self, *a, **kw))
+
+    m = Manifest(path)
+    m.remove_split_requirements()
+    assert m.ensure_permission("android.permission.INTERNET")
+    assert not m.ensure_permission("android.permission.CAMERA")
+    m.set_app_attr("extractNativeLibs", "true")
+    m.set_app_attr("name", "patchapk.FridaGadgetLoader")
+    m.remove_app_attr("testOnly")
+    m.remove_app_attr("missing")
+    assert m.get_app_attr("label") == "App"
+    with open(path) as fh:
+        assert fh.read() == SOURCE  # nothing written before flush
+    assert m.flush()
+    assert not m.flush()  # no edits since
+    assert len(writes) == 1
+
+    root = ET.parse(path).getroot()
+    assert not any(k in root.attrib for k in (NS + "isSplitRequired", NS + "requiredSplitTypes"))
+    app = root.find("application")
+    assert app.attrib == {NS + "label": "App", NS + "extractNativeLibs": "true",
+                          NS + "name": "patchapk.FridaGadgetLoader"}
+    assert [md.attrib[NS + "name"] for md in app.findall("meta-data")] == ["keep.me"]
+    assert [p.attrib[NS + "name"] for p in root.findall("uses-permission")] == \
+        ["android.permission.INTERNET", "android.permission.CAMERA"]
+    with open(path) as fh:
+        text = fh.read()
+    # The original prefixes survive the round trip
+    assert 'xmlns:android="http://schemas.android.com/apk/res/android"' in text
+    assert "<dist:module" in text
+
+
+def test_flush_unshares_a_hardlinked_file(path, tmp_path, monkeypatch):
+    sibling = str(tmp_path / "sibling.xml")
+    os.link(path, sibling)
+    unshared = []
+    real_unshare = Materializer.unshare
+    monkeypatch.setattr(Materializer, "unshare", staticmethod(lambda p: unshared.append(p) or real_unshare(p)))
+
+    m = Manifest(path)
+    m.set_app_attr("debuggable", "true")
+    m.flush()
+    assert unshared == [path]
+    assert os.stat(path).st_nlink == 1
+    with open(sibling) as fh:
+        assert fh.read() == SOURCE
+    assert Manifest(path).get_app_attr("debuggable") == "true"
+
+
+def test_no_application(tmp_path):
+    p = tmp_path / "AndroidManifest.xml"
+    p.write_text('<manifest xmlns:android="http://schemas.android.com/apk/res/android" package="x"/>')
+    m = Manifest(str(p))
+    with pytest.raises(ManifestError):
+        m.set_app_attr("debuggable", "true")
+    m.remove_split_requirements()  # nothing to do, and no error
+    assert not m.dirty
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from Materializer import Materializer
+
+
+@pytest.fixture
+def src(tmp_path):
+    p = tmp_path / "src.bin"
+    p.write_bytes(b"payload" * 100)
+    return str(p)
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """Which mechanisms were tried, in order; each one can be made to fail."""
+    tried, failing = [], set()
+    real_reflink, real_link, real_replace = Materializer._reflink.__func__, os.link, os.replace
+
+    def reflink(cls, s, d):
+        tried.append("reflink")
+        return None if "reflink" in failing else real_reflink(cls, s, d) or _fake_reflink(s, d)
+
+    def link(s, d):
+        tried.append("hardlink")
+        if "hardlink" in failing:
+            raise OSError("EXDEV")
+        return real_link(s, d)
+
+    def replace(s, d):
+        if not str(s).endswith(".tmp"):
+            tried.append("rename")
+            if "rename" in failing:
+                raise OSError("EXDEV")
+        return real_replace(s, d)
+
+    monkeypatch.setattr(Materializer, "_reflink", classmethod(reflink))
+    monkeypatch.setattr(os, "link", link)
+    monkeypatch.setattr(os, "replace", replace)
+    return tried, failing
+
+
+def _fake_reflink(s, d):
+    # The test filesystem may not support FICLONE: stand in with a plain copy
+    with open(s, "rb") as fsrc, open(d, "wb") as fdst:
+        fdst.write(fsrc.read())
+    return "reflink"
+
+
+@pytest.mark.parametrize("failing,expected", [
+    (set(), ["reflink"]),
+    ({"reflink"}, ["reflink", "hardlink"]),
+    ({"reflink", "hardlink"}, ["reflink", "hardlink", "copy"]),
+])
+def test_keep_src_order(src, tmp_path, attempts, failing, expected):
+    tried, fail = attempts
+    fail.update(failing)
+    dst = str(tmp_path / "dst.bin")
+    assert Materializer.materialize(src, dst) == expected[-1]
+    assert tried == [m for m in expected if m != "copy"]
+    assert open(dst, "rb").read() == open(src, "rb").read()
+    assert os.path.exists(src)
+    assert (os.stat(dst).st_nlink == 2) == (expected[-1] == "hardlink")
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+
+
+def test_no_hardlink_when_not_allowed(src, tmp_path, attempts):
+    tried, fail = attempts
+    fail.add("reflink")
+    assert Materializer.materialize(src, str(tmp_path / "dst.bin"), allow_link=False) == "copy"
+    assert tried == ["reflink"]
+
+
+@pytest.mark.parametrize("failing,expected", [
+    (set(), ["rename"]),
+    ({"rename"}, ["rename", "reflink"]),
+    ({"rename", "reflink"}, ["rename", "reflink", "copy"]),
+])
+def test_move_order(src, tmp_path, attempts, failing, expected):
+    tried, fail = attempts
+    fail.update(failing)
+    data = open(src, "rb").read()
+    dst = str(tmp_path / "dst.bin")
+    assert Materializer.materialize(src, dst, keep_src=False) == expected[-1]
+    # A move never hardlinks: the source goes away
+    assert tried == [m for m in expected if m != "copy"]
+    assert open(dst, "rb").read() == data
+    assert not os.path.exists(src)
+
+
+def test_into_directory_and_onto_itself(src, tmp_path):
+    (tmp_path / "out").mkdir()
+    Materializer.materialize(src, str(tmp_path / "out"))
+    assert (tmp_path / "out" / "src.bin").read_bytes() == open(src, "rb").read()
+    assert Materializer.materialize(src, src) == "rename"
+
+
+def test_unshare_before_in_place_write(src, tmp_path):
+    other = str(tmp_path / "other.bin")
+    os.link(src, other)
+    assert Materializer.unshare(other)
+    with open(other, "r+b") as fh:
+        fh.write(b"PATCHED")
+    assert open(src, "rb").read().startswith(b"payload")
+    assert open(other, "rb").read().startswith(b"PATCHED")
+    assert os.stat(src).st_nlink == os.stat(other).st_nlink == 1
+    assert not Materializer.unshare(other)
+
+
+def test_stats_count_bytes(src, tmp_path, attempts):
+    before = Materializer.stats()
+    attempts[1].add("reflink")
+    Materializer.materialize(src, str(tmp_path / "a.bin"))
+    after = Materializer.stats()
+    assert after["hardlink"] - before["hardlink"] == os.path.getsize(src)
+    assert "hardlinked" in Materializer.summary()
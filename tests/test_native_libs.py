@@ -0,0 +1,85 @@
+import os, shutil, zipfile
+
+from APK import APK
+from patch_apk.utils import native_libs
+
+
+def build_apk(path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest" * 100)
+        zf.writestr("classes.dex", os.urandom(4096) + b"\0" * 65536)
+        zf.writestr(zipfile.ZipInfo("resources.arsc", (2020, 1, 1, 0, 0, 0)), b"arsc" * 1000,
+                    compress_type=zipfile.ZIP_STORED)
+        zf.writestr("lib/arm64-v8a/libapp.so", b"\x7fELF" + b"\0" * 50000)
+        zf.writestr("lib/x86_64/libapp.so", b"\x7fELF" + b"\2" * 50000)
+        zf.writestr("lib/arm64-v8a/libstored.so", b"\x7fELF" + b"\1" * 100, compress_type=zipfile.ZIP_STORED)
+        zf.writestr("assets/ünïcode.txt", b"text" * 500)
+        zf.writestr("META-INF/CERT.RSA", b"signature")
+    return str(path)
+
+
+def raw_entries(path):
+    """{name: (compress_type, compressed bytes)} read straight from the file."""
+    out = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as fh:
+        for e in zf.infolist():
+            fh.seek(e.header_offset + 26)
+            n, x = int.from_bytes(fh.read(2), "little"), int.from_bytes(fh.read(2), "little")
+            fh.seek(e.header_offset + 30 + n + x)
+            out[e.filename] = (e.compress_type, fh.read(e.compress_size))
+    return out
+
+
+def forbid_compression(monkeypatch):
+    """From here on, only stored entries may be written through zipfile."""
+    real = zipfile._get_compressor
+
+    def guarded(compress_type, compresslevel=None):
+        assert compress_type == zipfile.ZIP_STORED, "an entry was recompressed"
+        return real(compress_type, compresslevel)
+    monkeypatch.setattr(zipfile, "_get_compressor", guarded)
+
+
+LIBS = ("lib/arm64-v8a/libapp.so", "lib/x86_64/libapp.so")
+
+
+def check(before, after, dropped=()):
+    for name, entry in before.items():
+        if name in dropped:
+            assert name not in after
+        elif name in LIBS:
+            assert after[name][0] == zipfile.ZIP_STORED
+        else:
+            assert after[name] == entry, name
+
+
+def test_store_native_libs_uncompressed(tmp_path, monkeypatch):
+    src = build_apk(tmp_path / "app.apk")
+    before = raw_entries(src)
+    forbid_compression(monkeypatch)
+    apk = APK(src, workdir=str(tmp_path / "work"))
+    assert apk.store_native_libs_uncompressed() == 2
+    with zipfile.ZipFile(src) as zf:
+        assert zf.testzip() is None
+        assert zf.read("lib/arm64-v8a/libapp.so") == b"\x7fELF" + b"\0" * 50000
+    after = raw_entries(src)
+    check(before, after)
+    assert apk.store_native_libs_uncompressed() == 0
+
+
+def test_package_store_native_libs_uncompressed(tmp_path, monkeypatch):
+    src = build_apk(tmp_path / "app.apk")
+    before = raw_entries(src)
+    forbid_compression(monkeypatch)
+    commands = []
+
+    def run(cmd):
+        commands.append(cmd[0])
+        if cmd[0] == "zipalign":
+            shutil.copyfile(cmd[-2], cmd[-1])
+    monkeypatch.setattr(native_libs, "assertSubprocessSuccessfulRun", run)
+    assert native_libs.storeNativeLibsUncompressed(src) == 2
+    assert commands == ["zipalign", "objection"]
+    with zipfile.ZipFile(src) as zf:
+        assert zf.testzip() is None
+    check(before, raw_entries(src), dropped=("META-INF/CERT.RSA",))
@@ -0,0 +1,53 @@
+import sys, threading
+
+from OutputRouter import OutputRouter
+from PatchDaemon import PatchDaemon
+
+
+def daemon(runner):
+    d = PatchDaemon(runner, on_error=lambda e: 3, jobs=1, port=1)
+    threading.Thread(target=d._worker, daemon=True).start()
+    return d
+
+
+def test_streamed_job_is_forgotten():
+    d = daemon(lambda argv, cwd: None)
+    job = d.submit(["pkg"], "/")
+    events = list(d._events(job))
+    assert events[-1]["type"] == "done" and events[-1]["exit_code"] == 0
+    assert job["id"] not in d._jobs
+    assert d.status()["ok"] == 1
+
+
+def test_unstreamed_finished_jobs_expire():
+    def fail(argv, cwd):
+        raise RuntimeError("boom")
+
+    d = daemon(fail)
+    job = d.submit(["pkg"], "/")
+    with job["cond"]:
+        job["cond"].wait_for(lambda: job["finished"], timeout=5)
+    d.submit(["other"], "/")
+    assert job["id"] in d._jobs  # still inside FINISHED_TTL
+
+    job["finished"] -= d.FINISHED_TTL + 1
+    d._prune()
+    assert job["id"] not in d._jobs
+    assert d.status()["failed"] >= 1
+
+
+def test_output_of_threads_a_job_starts_reaches_the_job(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from ProcessRunner import ProcessRunner
+    monkeypatch.setattr(sys, "stdout", OutputRouter(sys.stdout))
+
+    def runner(argv, cwd):
+        print("from the job")
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            pool.submit(OutputRouter.carry(print), "from the pool").result()
+        ProcessRunner(verbose=True).run([sys.executable, "-c", "print('I: Building resources...')"], label="apktool")
+
+    d = daemon(runner)
+    output = "".join(e["text"] for e in d._events(d.submit(["pkg"], "/")) if e["type"] == "output")
+    assert "from the job" in output and "from the pool" in output
+    assert "[apktool] Building resources" in output
@@ -0,0 +1,42 @@
+import os
+
+from PullCache import PullCache
+
+
+def _pulled(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_fetch_roundtrip(tmp_path):
+    cache = PullCache(root=str(tmp_path / "cache"))
+    key = PullCache.key("/data/app/x/base.apk", 10, version_code=3)
+    src = _pulled(tmp_path, "base.apk", 10)
+    assert not cache.fetch(key, str(tmp_path / "out.apk"), 10)
+    assert cache.store(key, src)
+    assert not cache.fetch(key, str(tmp_path / "out.apk"), 11)  # size changed: stale entry dropped
+    assert cache.store(key, src)
+    assert cache.fetch(key, str(tmp_path / "out.apk"), 10)
+    assert (tmp_path / "out.apk").read_bytes() == open(src, "rb").read()
+
+
+def test_store_rejects_hash_mismatch(tmp_path):
+    cache = PullCache(root=str(tmp_path / "cache"))
+    assert not cache.store("k", _pulled(tmp_path, "a.apk", 10), sha256="00" * 32)
+    assert not list((tmp_path / "cache").iterdir())
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PullCache(root=str(tmp_path / "cache"), max_bytes=2500)
+    for i, name in enumerate(("a", "b")):
+        cache.store(name, _pulled(tmp_path, name, 1000))
+        os.utime(tmp_path / "cache" / f"{name}.apk", (1000 + i, 1000 + i))
+    assert cache.fetch("a", str(tmp_path / "hit.apk"), 1000)  # a is now the newest
+    cache.store("c", _pulled(tmp_path, "c", 1000))
+    assert sorted(p.name for p in (tmp_path / "cache").glob("*.apk")) == ["a.apk", "c.apk"]
+
+
+def test_size_cap_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATCHAPK_PULL_CACHE_MB", "7")
+    assert PullCache(root=str(tmp_path)).max_bytes == 7 * 1024 * 1024
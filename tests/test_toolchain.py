@@ -0,0 +1,49 @@
+import os
+
+from Toolchain import Toolchain
+
+
+def make_tool(folder, name, version):
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / name
+    path.write_text(f"#!/bin/sh\necho {version}\necho probe >> \"$0.calls\"\n")
+    path.chmod(0o755)
+    return path
+
+
+def calls(path):
+    try:
+        return len(open(f"{path}.calls").read().splitlines())
+    except OSError:
+        return 0
+
+
+def test_version_is_cached_per_binary(tmp_path, monkeypatch):
+    tool = make_tool(tmp_path / "bin", "faketool", "1.2.3")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+    cache = str(tmp_path / "toolchain.json")
+    assert Toolchain(cache).version("faketool") == "1.2.3"
+    assert Toolchain(cache).version("faketool") == "1.2.3"
+    assert calls(tool) == 1
+
+    # Replaced in place: new fingerprint, probed again
+    make_tool(tmp_path / "bin", "faketool", "2.0.0")
+    os.utime(tool, ns=(0, 10 ** 9))
+    assert Toolchain(cache).version("faketool") == "2.0.0"
+
+
+def test_which_sees_tools_installed_later(tmp_path, monkeypatch):
+    make_tool(tmp_path / "late", "faketool", "9.9")
+    make_tool(tmp_path / "early", "other", "1.0")
+    monkeypatch.setenv("PATH", os.pathsep.join([str(tmp_path / "early"), str(tmp_path / "late")]))
+    tc = Toolchain(str(tmp_path / "toolchain.json"))
+    assert tc.which("faketool") == str((tmp_path / "late" / "faketool").resolve())
+    assert tc.version("faketool") == "9.9"
+
+    make_tool(tmp_path / "early", "faketool", "1.0.1")
+    assert tc.which("faketool") == str((tmp_path / "early" / "faketool").resolve())
+    assert tc.version("faketool") == "1.0.1"
+
+    for folder in ("early", "late"):
+        os.remove(tmp_path / folder / "faketool")
+    assert tc.which("faketool") is None and tc.missing(["faketool", "other"]) == ["faketool"]
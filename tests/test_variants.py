@@ -0,0 +1,131 @@
+import argparse, contextlib, importlib.util, os
+
+import pytest
+
+from APK import APK
+from Materializer import Materializer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MANIFEST = ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<manifest xmlns:android="http://schemas.android.com/apk/res/android" package="com.app">'
+            '<application android:label="App"/></manifest>')
+
+
+@pytest.fixture(scope="module")
+def cli():
+    spec = importlib.util.spec_from_file_location("patch_apk_cli", os.path.join(ROOT, "patch-apk.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    # No reflinks on the test filesystem or not: the snapshot must be a hardlink farm
+    monkeypatch.setattr(Materializer, "_reflink", classmethod(lambda cls, src, dst: None))
+    src = tmp_path / "app.apk"
+    src.write_bytes(b"PK")
+    apk = APK(str(src), workdir=str(tmp_path / "work"))
+    apk.decoded = str(tmp_path / "work" / "apk_decoded")
+    os.makedirs(os.path.join(apk.decoded, "res", "values"))
+    with open(os.path.join(apk.decoded, "AndroidManifest.xml"), "w") as fh:
+        fh.write(MANIFEST)
+    with open(os.path.join(apk.decoded, "res", "values", "strings.xml"), "w") as fh:
+        fh.write("<resources><string name=\"a\">Tom &amp Jerry</string></resources>")
+    return apk
+
+
+def read(apk, *rel):
+    with open(os.path.join(apk.decoded, *rel)) as fh:
+        return fh.read()
+
+
+def test_clone_tree_hardlinks_and_unshare(base, tmp_path):
+    os.symlink("values/strings.xml", os.path.join(base.decoded, "res", "link.xml"))
+    dst = str(tmp_path / "clone")
+    assert Materializer.clone_tree(base.decoded, dst) == "hardlink"
+    strings = os.path.join(dst, "res", "values", "strings.xml")
+    assert os.stat(strings).st_nlink == 2
+    assert os.readlink(os.path.join(dst, "res", "link.xml")) == "values/strings.xml"
+
+    assert Materializer.unshare(strings)
+    assert os.stat(strings).st_nlink == 1
+    assert not Materializer.unshare(strings)
+    assert not Materializer.unshare(str(tmp_path / "missing"))
+
+
+def test_variant_writes_stay_in_the_variant(base):
+    base.manifest.set_app_attr("extractNativeLibs", "true")  # pending merge edit
+    a, b = base.snapshot("a"), base.snapshot("b")
+    assert a.decoded != b.decoded != base.decoded
+    assert os.stat(os.path.join(a.decoded, "AndroidManifest.xml")).st_nlink == 3
+
+    a.manifest.set_app_attr("debuggable", "true")
+    a.manifest.flush()
+    a._raw_re_replace(os.path.join(a.decoded, "res", "values", "strings.xml"), r"(&amp)([^;])", r"\1;\2")
+
+    assert 'debuggable="true"' in read(a, "AndroidManifest.xml")
+    assert "&amp; Jerry" in read(a, "res", "values", "strings.xml")
+    for other in (base, b):
+        assert 'extractNativeLibs="true"' in read(other, "AndroidManifest.xml")
+        assert "debuggable" not in read(other, "AndroidManifest.xml")
+        assert "&amp Jerry" in read(other, "res", "values", "strings.xml")
+
+
+def test_variant_spec(cli):
+    assert cli.variant_spec("plain:no-gadget, user-certs") == \
+        ("plain", {"no_gadget": True, "enable_user_certs": True})
+    assert cli.variant_spec("g16:gadget-version=16.7.19") == \
+        ("g16", {"gadget_version": "16.7.19", "no_gadget": False})
+    assert cli.variant_spec("same") == ("same", {})
+
+
+@pytest.mark.parametrize("text", ["x:bogus", "x:gadget-version=", "x:no-gadget,--serial", "bad/name:gadget"])
+def test_variant_spec_rejects(cli, text, capsys):
+    with pytest.raises(argparse.ArgumentTypeError):
+        cli.variant_spec(text)
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(["com.app", "--variant", text])
+    assert "--variant" in capsys.readouterr().err
+
+
+def test_build_variants(cli, tmp_path, monkeypatch):
+    import BuildWorker, FridaGadget
+
+    @contextlib.contextmanager
+    def obtained(self, version=None):
+        yield f"tag-{version}"
+
+    calls = {}
+
+    def rebuild_variants(apk_paths, options, variants, verbose=False):
+        calls.update(paths=apk_paths, options=options, variants=variants)
+        built = {}
+        for name in variants:
+            path = tmp_path / f"built-{name}.apk"
+            path.write_bytes(name.encode())
+            built[name] = argparse.Namespace(apk_path=str(path))
+        return built
+
+    monkeypatch.setattr(FridaGadget.FridaGadget, "obtained", obtained)
+    monkeypatch.setattr(BuildWorker.BuildWorker, "rebuild_variants", staticmethod(rebuild_variants))
+    monkeypatch.setattr(cli.ApkInspector, "inspect_all",
+                        classmethod(lambda cls, paths: [{"path": p, "proguard": False, "andresguard": False}
+                                                        for p in paths]))
+    monkeypatch.setattr(cli, "align_sign_verify", lambda apk, vargs: apk.apk_path)
+    monkeypatch.setattr(cli, "colored", lambda text, color: text)
+
+    args = cli.build_parser().parse_args(["com.app", "--no-result-cache", "--gadget-version", "16.0.0",
+                                          "--variant", "plain:no-gadget", "--variant", "certs:user-certs",
+                                          "--save-apk", str(tmp_path / "out" / "app.apk")])
+    with contextlib.ExitStack() as held:
+        cli.build_variants(args, "com.app", ["base.apk", "split.apk"], str(tmp_path), held)
+
+    assert calls["paths"] == ["base.apk", "split.apk"]
+    assert calls["variants"]["plain"]["frida_gadget"] is False
+    assert calls["variants"]["certs"]["frida_gadget"] is True
+    assert calls["variants"]["certs"]["gadget_version"] == "tag-16.0.0"
+    assert calls["variants"]["certs"]["enable_user_certs"] is True
+    for name in ("plain", "certs"):
+        assert (tmp_path / "out" / f"app-{name}.apk").read_bytes() == name.encode()